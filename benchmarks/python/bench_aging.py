@@ -0,0 +1,81 @@
+#  IntelliSIEM Copyright 2024, Rob Perry
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""
+Measure the cost of scheduling, re-sighting and expiring indicators with the aging engine's timing wheel.
+
+Run from the repository root:
+
+    python -m benchmarks.python.bench_aging [--count 1000000] [--days 30]
+
+Indicators are spread over a month of TTLs and a fifth of them are seen again before they expire.
+Expiry passes run every tick, as the collector daemon does; the time per expiration should not grow
+with the number of indicators tracked.
+"""
+
+import argparse
+import json
+import random
+import time
+
+from src.python.aging import DAY, TimingWheel
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--count', type=int, default=1000000, help="number of indicators")
+    parser.add_argument('--days', type=int, default=30, help="longest TTL in days")
+    parser.add_argument('--tick', type=float, default=60.0, help="expiry resolution in seconds")
+    args = parser.parse_args(argv)
+    rng = random.Random(1)
+    horizon = args.days * DAY
+    deadlines = [rng.uniform(0, horizon) for _ in range(args.count)]
+    wheel = TimingWheel(args.tick, start=0.0)
+
+    started = time.perf_counter()
+    for key, deadline in enumerate(deadlines):
+        wheel.schedule(key, deadline)
+    schedule_seconds = time.perf_counter() - started
+
+    resighted = range(0, args.count, 5)
+    started = time.perf_counter()
+    for key in resighted:
+        wheel.schedule(key, deadlines[key] + horizon / 2)
+    resight_seconds = time.perf_counter() - started
+
+    expired = 0
+    passes = 0
+    now = 0.0
+    started = time.perf_counter()
+    while wheel:
+        now += args.tick
+        expired += len(wheel.advance(now))
+        passes += 1
+    expire_seconds = time.perf_counter() - started
+
+    report = {
+        'indicators': args.count,
+        'schedules_per_second': round(args.count / schedule_seconds),
+        'resightings_per_second': round(len(resighted) / resight_seconds),
+        'expiry_passes': passes,
+        'expired': expired,
+        'expirations_per_second': round(expired / expire_seconds),
+        'microseconds_per_expiration': round(expire_seconds / expired * 1e6, 3),
+    }
+    print(json.dumps(report, indent=2))
+    return report
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,226 @@
+#  IntelliSIEM Copyright 2024, Rob Perry
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+"""
+Load-test the API client and the collector against a local mock OTX/VirusTotal server.
+
+Run from the repository root:
+
+    python -m benchmarks.python.bench_collection [--scenario NAME] [--records 20000] [--latency 0.002]
+        [--payload-bytes 200] [--save-baseline] [--compare] [--tolerance 0.25] [--work-dir DIR]
+
+Scenarios:
+
+- get_data: APIClient.get_data on one page from several threads.
+- fetch_threat_data: the collector's concurrent fetch of every feed, reading the first page of each.
+- iter_threat_data: a streamed, paginated full export of every feed, validated record by record.
+- throttled: iter_threat_data while every fifth request is answered with 429.
+
+Each scenario runs in its own interpreter, so peak RSS is measured per scenario. Reported metrics are
+requests/s, p50/p99 latency until the response headers arrived, indicators/s validated and peak RSS.
+--save-baseline stores the report, --compare checks it against the stored baseline and exits with
+status 1 if a metric regressed by more than the tolerance. --compare refuses to run with other
+--records, --page-size, --requests, --latency or --payload-bytes than the baseline was saved with.
+Log files are written to --work-dir, by default a temporary directory removed after the run.
+"""
+
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline_collection.json')
+
+SCENARIOS = ['get_data', 'fetch_threat_data', 'iter_threat_data', 'throttled']
+
+# Metrics where a larger value is better; for every other metric smaller is better
+HIGHER_IS_BETTER = ('requests_per_second', 'indicators_per_second')
+COMPARED = ('requests_per_second', 'indicators_per_second', 'p50_ms', 'p99_ms', 'peak_rss_mb')
+
+# The command line options a baseline is only comparable under
+OPTIONS = ('records', 'page_size', 'requests', 'latency', 'payload_bytes')
+
+GET_DATA_THREADS = 4
+
+
+def _percentile(values, q):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+
+def _record_latencies(latencies):
+    """
+    Record the time until the response headers arrived for every request sent through requests.
+    """
+    import requests
+
+    send = requests.Session.send
+
+    def timed_send(session, request, **kwargs):
+        response = send(session, request, **kwargs)
+        latencies.append(response.elapsed.total_seconds())
+        return response
+
+    requests.Session.send = timed_send
+
+
+def run_scenario(name, args):
+    """
+    Run one scenario in this interpreter.
+
+    :param name: (str) The scenario.
+    :param args: (argparse.Namespace) The command line options.
+    :return: (dict) The scenario's metrics.
+    """
+    from benchmarks.python.mock_server import MockThreatIntelServer
+    from src.python.api_client import APIClient
+    from src.python.data_collection import ThreatDataCollector
+
+    latencies = []
+    _record_latencies(latencies)
+    server = MockThreatIntelServer(records=args.records, page_size=args.page_size, latency=args.latency,
+                                   payload_bytes=args.payload_bytes, throttle_every=5 if name == 'throttled' else 0,
+                                   retry_after=0.01).start()
+    config = {'api_keys': {'alien_vault': 'key', 'virus_total': 'key'},
+              'feeds': server.feeds(),
+              'logging': {'log_file': os.path.join(args.work_dir, 'bench.log')}}
+    if name == 'throttled':
+        config['rate_limits'] = {source: {'requests_per_minute': 600000, 'burst': 100, 'max_retries': 5}
+                                 for source in ('alien_vault', 'virus_total')}
+    indicators = 0
+    try:
+        started = time.perf_counter()
+        if name == 'get_data':
+            client = APIClient(f"{server.base_url}/otx/api/v1", {'X-OTX-API-KEY': 'key'},
+                               http_config={'pool_maxsize': GET_DATA_THREADS})
+            per_thread = max(args.requests // GET_DATA_THREADS, 1)
+
+            def worker():
+                for _ in range(per_thread):
+                    client.get_data('indicators/export', params={'page': 1})
+
+            threads = [threading.Thread(target=worker) for _ in range(GET_DATA_THREADS)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            client.close()
+        else:
+            collector = ThreatDataCollector(config=config)
+            if name == 'fetch_threat_data':
+                indicators = len(collector.fetch_threat_data())
+            else:
+                for _ in collector.iter_threat_data():
+                    indicators += 1
+            collector.close()
+        elapsed = time.perf_counter() - started
+    finally:
+        server.stop()
+
+    return {
+        'elapsed_s': round(elapsed, 3),
+        'requests': server.requests,
+        'throttled': server.throttled,
+        'requests_per_second': round(server.requests / elapsed, 1),
+        'p50_ms': round(_percentile(latencies, 0.5) * 1000, 2) if latencies else None,
+        'p99_ms': round(_percentile(latencies, 0.99) * 1000, 2) if latencies else None,
+        'indicators': indicators,
+        'indicators_per_second': round(indicators / elapsed, 1) if indicators else None,
+        # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+                             / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1),
+    }
+
+
+def compare(report, baseline, tolerance):
+    """
+    :param report: (dict) Metrics keyed by scenario.
+    :param baseline: (dict) Baseline metrics keyed by scenario.
+    :param tolerance: (float) Allowed relative regression, e.g. 0.25 for 25%.
+    :return: (list) Descriptions of the metrics that regressed beyond the tolerance.
+    """
+    regressions = []
+    for scenario, metrics in report.items():
+        for metric in COMPARED:
+            current, previous = metrics.get(metric), (baseline.get(scenario) or {}).get(metric)
+            if not current or not previous:
+                continue
+            change = (current - previous) / previous
+            metrics.setdefault('change', {})[metric] = round(change, 3)
+            if (-change if metric in HIGHER_IS_BETTER else change) > tolerance:
+                regressions.append(f"{scenario}.{metric}: {previous} -> {current}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--scenario', action='append', choices=SCENARIOS, help="scenario to run (repeatable)")
+    parser.add_argument('--records', type=int, default=20000, help="records in each provider's export")
+    parser.add_argument('--page-size', type=int, default=500, help="records per page")
+    parser.add_argument('--requests', type=int, default=400, help="requests sent by the get_data scenario")
+    parser.add_argument('--latency', type=float, default=0.002, help="server delay per response, in seconds")
+    parser.add_argument('--payload-bytes', type=int, default=200, help="filler bytes per record")
+    parser.add_argument('--save-baseline', action='store_true', help=f"store the report in {BASELINE}")
+    parser.add_argument('--compare', action='store_true', help="compare the report with the stored baseline")
+    parser.add_argument('--tolerance', type=float, default=0.25, help="allowed relative regression")
+    parser.add_argument('--run-one', help=argparse.SUPPRESS)
+    parser.add_argument('--work-dir', help="directory for the scenarios' log files (default: a temporary directory)")
+    args = parser.parse_args(argv)
+
+    if args.run_one:
+        print(json.dumps(run_scenario(args.run_one, args)))
+        return None
+
+    options = {key: getattr(args, key) for key in OPTIONS}
+    baseline = None
+    if args.compare:
+        with open(BASELINE) as file:
+            baseline = json.load(file)
+        saved = baseline.get('options') or {}
+        mismatched = [f"--{key.replace('_', '-')} {saved.get(key)}"
+                      for key in OPTIONS if saved.get(key) != options[key]]
+        if mismatched:
+            parser.error(f"the baseline was saved with other options: {', '.join(mismatched)}")
+
+    report = {}
+    with tempfile.TemporaryDirectory(prefix='bench-collection-') as directory:
+        arguments = [item for key in OPTIONS for item in (f"--{key.replace('_', '-')}", str(options[key]))]
+        arguments += ['--work-dir', args.work_dir or directory]
+        for name in args.scenario or SCENARIOS:
+            output = subprocess.run([sys.executable, '-m', 'benchmarks.python.bench_collection', '--run-one', name]
+                                    + arguments, cwd=ROOT, check=True, capture_output=True, text=True).stdout
+            report[name] = json.loads(output.strip().splitlines()[-1])
+
+    regressions = compare(report, baseline['scenarios'], args.tolerance) if baseline is not None else []
+    print(json.dumps(report, indent=2))
+    for regression in regressions:
+        print(f"REGRESSION {regression}", file=sys.stderr)
+    if args.save_baseline:
+        with open(BASELINE, 'w') as file:
+            json.dump({'python': platform.python_version(), 'machine': platform.machine(), 'cpus': os.cpu_count(),
+                       'options': options, 'scenarios': report}, file, indent=2, sort_keys=True)
+            file.write('\n')
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
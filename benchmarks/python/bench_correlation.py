@@ -0,0 +1,90 @@
+#  IntelliSIEM Copyright 2024, Rob Perry
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""
+Measure how fast the correlation engine merges feed batches and answers top-N queries as it grows.
+
+Run from the repository root:
+
+    python -m benchmarks.python.bench_correlation [--count 1000000] [--batch 1000] [--resighted 0.5]
+
+Indicators are merged in feed-sized batches, with part of every batch re-reporting indicators already
+held so they are rescored. The cost per rescored indicator and per query should stay flat as the
+number of indicators grows.
+"""
+
+import argparse
+import json
+import random
+import time
+
+from src.python.correlation import DAY, CorrelationEngine
+
+SOURCES = ['alien_vault', 'virus_total', 'abuse_ch']
+NOW = 1700000000.0
+
+
+def record(i, rng):
+    return {'id': f"ipv4:10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}", 'type': 'ipv4', 'source': rng.choice(SOURCES),
+            'last_seen': NOW - rng.uniform(0, 30 * DAY), 'confidence': rng.randrange(1, 101)}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--count', type=int, default=1000000, help="number of distinct indicators")
+    parser.add_argument('--batch', type=int, default=1000, help="records per update")
+    parser.add_argument('--resighted', type=float, default=0.5, help="fraction of each batch already held")
+    parser.add_argument('--queries', type=int, default=100, help="top-100 queries per measurement")
+    args = parser.parse_args(argv)
+    rng = random.Random(1)
+    engine = CorrelationEngine({'alien_vault': 0.5, 'virus_total': 0.8}, clock=lambda: NOW)
+
+    checkpoints = []
+    added = 0
+    updates = 0
+    update_seconds = 0.0
+    next_checkpoint = args.count // 10
+    while added < args.count:
+        batch = []
+        for _ in range(args.batch):
+            if added and rng.random() < args.resighted:
+                batch.append(record(rng.randrange(added), rng))
+            else:
+                batch.append(record(added, rng))
+                added += 1
+        started = time.perf_counter()
+        engine.update(batch)
+        update_seconds += time.perf_counter() - started
+        updates += len(batch)
+        if added >= next_checkpoint:
+            started = time.perf_counter()
+            for _ in range(args.queries):
+                engine.top(limit=100)
+            query_seconds = time.perf_counter() - started
+            checkpoints.append({
+                'indicators': len(engine),
+                'records_per_second': round(updates / update_seconds),
+                'top_100_milliseconds': round(query_seconds / args.queries * 1e3, 3),
+            })
+            updates = 0
+            update_seconds = 0.0
+            next_checkpoint += args.count // 10
+
+    report = {'batch': args.batch, 'resighted': args.resighted, 'checkpoints': checkpoints}
+    print(json.dumps(report, indent=2))
+    return report
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+#  IntelliSIEM Copyright 2024, Rob Perry
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+"""
+Measure how long it takes a fresh interpreter to import the collector modules.
+
+Run from the repository root:
+
+    python -m benchmarks.python.bench_import [--runs 20] [--module src.python.data_collection]
+
+Each run starts a new interpreter, so nothing is served from an already-populated sys.modules, and
+times only the import statement itself, not the interpreter's own start-up.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+DEFAULT_MODULES = ['src.python.data_collection', 'src.python.matching', 'src.python.validation']
+
+_TIMER = "import time; t = time.perf_counter(); {statement}; print(time.perf_counter() - t)"
+
+
+def time_statement(statement, runs):
+    """
+    Time a statement in fresh interpreters.
+
+    :param statement: (str) The Python statement to time.
+    :param runs: (int) The number of interpreters to start.
+    :return: (list) The elapsed time of each run, in seconds.
+    """
+    timings = []
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, '-c', _TIMER.format(statement=statement)], cwd=ROOT,
+                                check=True, capture_output=True, text=True).stdout
+        timings.append(float(output.strip().splitlines()[-1]))
+    return timings
+
+
+def summarize(timings):
+    """
+    :param timings: (list) Elapsed times in seconds.
+    :return: (dict) Median, minimum and maximum in milliseconds.
+    """
+    return {
+        'median_ms': round(statistics.median(timings) * 1000, 2),
+        'min_ms': round(min(timings) * 1000, 2),
+        'max_ms': round(max(timings) * 1000, 2),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--runs', type=int, default=20, help="fresh interpreters started per module")
+    parser.add_argument('--module', action='append', dest='modules', help="module to import (repeatable)")
+    args = parser.parse_args(argv)
+
+    report = {}
+    for module in args.modules or DEFAULT_MODULES:
+        report[module] = summarize(time_statement(f"import {module}", args.runs))
+    print(json.dumps(report, indent=2))
+    return report
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+#  IntelliSIEM Copyright 2024, Rob Perry
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+"""
+Compare the memory held by collected indicators as a list of decoded provider records with the
+compact IndicatorSet.
+
+Run from the repository root:
+
+    python -m benchmarks.python.bench_indicator_memory [--count 200000]
+
+Records are synthetic OTX export entries, decoded from JSON like real responses, and memory is
+measured with tracemalloc.
+"""
+
+import argparse
+import gc
+import json
+import tracemalloc
+
+from src.python.indicators import IndicatorSet, PayloadSpool
+
+TYPES = ['IPv4', 'domain', 'hostname', 'URL', 'FileHash-SHA256', 'FileHash-MD5']
+
+
+def otx_record(i):
+    """
+    :param i: (int) The record number.
+    :return: (str) A JSON-encoded OTX export record.
+    """
+    indicator_type = TYPES[i % len(TYPES)]
+    if indicator_type == 'IPv4':
+        value = f"10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}"
+    elif indicator_type.startswith('FileHash'):
+        value = f"{i:064x}"
+    else:
+        value = f"host{i}.example.com"
+    return json.dumps({
+        'id': i * 7919, 'indicator': value, 'type': indicator_type, 'title': '', 'description': '',
+        'content': '', 'created': '2024-05-01T12:00:00', 'modified': '2024-06-01T08:30:00',
+        'expiration': None, 'is_active': 1, 'role': None, 'access_type': 'public', 'access_reason': '',
+        'access_groups': [], 'observations': 3,
+    })
+
+
+def measure(build):
+    """
+    :param build: (callable) Builds and returns the structure to measure.
+    :return: (tuple) Bytes still allocated while the structure is alive, and the peak during the build.
+    """
+    gc.collect()
+    tracemalloc.start()
+    structure = build()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del structure
+    return current, peak
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--count', type=int, default=200000, help="number of indicators")
+    args = parser.parse_args(argv)
+    records = [otx_record(i) for i in range(args.count)]
+
+    def as_dicts():
+        return [json.loads(record) for record in records]
+
+    def as_set(payloads=None):
+        indicators = IndicatorSet(payloads)
+        for start in range(0, len(records), 10000):
+            indicators.upsert_many([json.loads(record) for record in records[start:start + 10000]], 'alien_vault')
+        return indicators
+
+    spool = PayloadSpool()
+    report = {}
+    for name, build in (('list_of_dicts', as_dicts), ('indicator_set', as_set),
+                        ('indicator_set_with_payloads', lambda: as_set(spool))):
+        current, peak = measure(build)
+        report[name] = {'bytes': current, 'bytes_per_indicator': round(current / args.count, 1),
+                        'peak_bytes': peak}
+    spool.close()
+    report['reduction'] = round(report['list_of_dicts']['bytes'] / report['indicator_set']['bytes'], 2)
+    print(json.dumps(report, indent=2))
+    return report
+
+
+if __name__ == '__main__':
+    main()
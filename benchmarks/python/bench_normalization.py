@@ -0,0 +1,86 @@
+#  IntelliSIEM Copyright 2024, Rob Perry
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+"""
+Measure normalization throughput as the number of worker processes grows.
+
+Run from the repository root:
+
+    python -m benchmarks.python.bench_normalization [--count 200000] [--chunk-size 1000]
+
+Records are a synthetic mix of OTX export entries and VirusTotal file objects.
+"""
+
+import argparse
+import json
+import os
+import time
+
+from src.python.normalization import Normalizer
+
+OTX_TYPES = ['IPv4', 'domain', 'hostname', 'URL', 'FileHash-SHA256']
+
+
+def make_record(i):
+    """
+    :param i: (int) The record number.
+    :return: (dict) An OTX export entry or, for every third record, a VirusTotal file object.
+    """
+    if i % 3 == 0:
+        return {'id': f"{i:064X}", 'type': 'file',
+                'attributes': {'tags': ['peexe', 'T1055'], 'first_submission_date': 1700000000 + i,
+                               'last_analysis_stats': {'malicious': i % 7, 'undetected': 60}}}
+    indicator_type = OTX_TYPES[i % len(OTX_TYPES)]
+    if indicator_type == 'IPv4':
+        value = f"10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}"
+    elif indicator_type == 'URL':
+        value = f"HTTP://Host{i}.Example.com/path?id={i}"
+    elif indicator_type.startswith('FileHash'):
+        value = f"{i:064X}"
+    else:
+        value = f"Host{i}.Example.COM."
+    return {'id': i, 'indicator': value, 'type': indicator_type, 'title': 'Loader using T1059.001',
+            'created': '2024-05-01T12:00:00', 'modified': '2024-06-01T08:30:00'}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--count', type=int, default=200000, help="number of records")
+    parser.add_argument('--chunk-size', type=int, default=1000, help="records per worker task")
+    args = parser.parse_args(argv)
+    records = [make_record(i) for i in range(args.count)]
+
+    cpus = os.cpu_count() or 1
+    counts = sorted({1, 2, 4, cpus} & set(range(1, cpus + 1))) if cpus > 1 else [1]
+    report = {'cpus': cpus, 'records': args.count, 'runs': {}}
+    baseline = None
+    for workers in counts:
+        normalizer = Normalizer(workers=workers, chunk_size=args.chunk_size, min_parallel=1)
+        try:
+            # Start the workers before timing
+            normalizer.normalize(records[:workers * args.chunk_size], 'bench')
+            started = time.perf_counter()
+            normalizer.normalize(records, 'bench')
+            elapsed = time.perf_counter() - started
+        finally:
+            normalizer.close()
+        rate = args.count / elapsed
+        baseline = baseline or rate
+        report['runs'][workers] = {'seconds': round(elapsed, 3), 'records_per_second': round(rate),
+                                   'speedup': round(rate / baseline, 2)}
+    print(json.dumps(report, indent=2))
+    return report
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+#  IntelliSIEM Copyright 2024, Rob Perry
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+"""
+Measure the size of an indicator snapshot, the heap a node needs to map it, and lookup rates for
+absent and present observables.
+
+Run from the repository root:
+
+    python -m benchmarks.python.bench_snapshot [--count 200000] [--false-positive-rate 0.01]
+
+Most SIEM events match no indicator, so the absent lookups, answered by the Bloom filter alone,
+are the rate that matters for forwarder nodes.
+"""
+
+import argparse
+import gc
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+
+from benchmarks.python.bench_indicator_memory import TYPES
+from src.python.indicators import Indicator
+from src.python.matching import INDICATOR_CATEGORIES
+from src.python.snapshot import IndicatorSnapshot, write_snapshot
+
+
+def indicator(i):
+    indicator_type = TYPES[i % len(TYPES)]
+    if indicator_type == 'IPv4':
+        value = f"10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}"
+    elif indicator_type.startswith('FileHash'):
+        value = f"{i:064x}"
+    else:
+        value = f"host{i}.example.com"
+    return Indicator(str(i * 7919), indicator_type, value, 'alien_vault', 1714564800.0, 1717230600.0)
+
+
+def rate(lookup, probes):
+    started = time.perf_counter()
+    hits = sum(lookup(category, value) is not None for category, value in probes)
+    return round(len(probes) / (time.perf_counter() - started)), hits
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--count', type=int, default=200000, help="number of indicators")
+    parser.add_argument('--probes', type=int, default=100000, help="lookups per measurement")
+    parser.add_argument('--false-positive-rate', type=float, default=0.01)
+    args = parser.parse_args(argv)
+    indicators = [indicator(i) for i in range(args.count)]
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'indicators.snapshot')
+        started = time.perf_counter()
+        write_snapshot(path, indicators, args.false_positive_rate, fsync=False)
+        build_seconds = time.perf_counter() - started
+
+        gc.collect()
+        tracemalloc.start()
+        snapshot = IndicatorSnapshot(path)
+        heap_bytes = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+
+        present = [(INDICATOR_CATEGORIES[indicators[i].type.lower()], indicators[i].value)
+                   for i in range(0, args.count, max(args.count // args.probes, 1))]
+        absent = [(INDICATOR_CATEGORIES[TYPES[i % len(TYPES)].lower()], indicator(i).value)
+                  for i in range(args.count, args.count + args.probes)]
+        present_rate, _ = rate(snapshot.lookup, present)
+        absent_rate, false_positives = rate(
+            lambda category, value: True if snapshot.might_contain(category, value) else None, absent)
+        report = {
+            'indicators': args.count,
+            'file_bytes': os.path.getsize(path),
+            'bytes_per_indicator': round(os.path.getsize(path) / args.count, 1),
+            'bloom_bytes': snapshot.bloom_bits // 8,
+            'reader_heap_bytes': heap_bytes,
+            'build_seconds': round(build_seconds, 2),
+            'present_lookups_per_second': present_rate,
+            'absent_lookups_per_second': absent_rate,
+            'false_positive_rate': round(false_positives / len(absent), 4),
+        }
+        snapshot.close()
+    print(json.dumps(report, indent=2))
+    return report
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,210 @@
+#  IntelliSIEM Copyright 2024, Rob Perry
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+"""
+A local HTTP server that mimics the OTX indicator export and the VirusTotal files collection.
+
+Run it on its own to point a collector at it:
+
+    python -m benchmarks.python.mock_server [--port 8900] [--records 10000] [--latency 0.05]
+"""
+
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+OTX_PATH = '/otx/api/v1/indicators/export'
+VT_PATH = '/vt/api/v3/files'
+
+OTX_TYPES = ['IPv4', 'domain', 'hostname', 'URL', 'FileHash-SHA256', 'FileHash-MD5']
+
+
+def otx_record(i, padding):
+    indicator_type = OTX_TYPES[i % len(OTX_TYPES)]
+    if indicator_type == 'IPv4':
+        value = f"10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}"
+    elif indicator_type == 'URL':
+        value = f"http://host{i}.example.com/path"
+    elif indicator_type.startswith('FileHash'):
+        value = f"{i:064x}" if indicator_type.endswith('SHA256') else f"{i:032x}"
+    else:
+        value = f"host{i}.example.com"
+    return {'id': i + 1, 'indicator': value, 'type': indicator_type, 'title': '', 'description': padding,
+            'created': '2024-05-01T12:00:00', 'modified': '2024-06-01T08:30:00', 'is_active': 1}
+
+
+def vt_record(i, padding):
+    return {'id': f"{i:064x}", 'type': 'file', 'links': {'self': f"https://www.virustotal.com/api/v3/files/{i:064x}"},
+            'attributes': {'md5': f"{i:032x}", 'sha1': f"{i:040x}", 'tags': ['peexe'], 'meaningful_name': padding,
+                           'first_submission_date': 1700000000, 'last_modification_date': 1720000000,
+                           'last_analysis_stats': {'malicious': i % 20, 'undetected': 50}}}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        server = self.server.mock
+        parts = urlsplit(self.path)
+        query = {key: values[-1] for key, values in parse_qs(parts.query).items()}
+        if parts.path not in (OTX_PATH, VT_PATH):
+            self._reply(404, b'{"detail": "not found"}')
+            return
+        if server.latency:
+            time.sleep(server.latency)
+        if server.should_throttle():
+            self._reply(429, b'{"error": "rate limited"}', {'Retry-After': str(server.retry_after)})
+            return
+
+        page = max(int(query.get('page', query.get('cursor', 1)) or 1), 1)
+        provider = 'otx' if parts.path == OTX_PATH else 'vt'
+        items = server.page(provider, page)
+        has_next = page * server.page_size < server.records
+        next_url = f"{server.base_url}{parts.path}?{'page' if provider == 'otx' else 'cursor'}={page + 1}" \
+            if has_next else None
+        if provider == 'otx':
+            body = b'{"results":' + items + b',"next":' + json.dumps(next_url).encode() + b'}'
+        else:
+            body = b'{"data":' + items + b',"links":{"next":' + json.dumps(next_url).encode() + b'}}'
+        self._reply(200, body)
+
+    def _reply(self, status, body, headers=None):
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class MockThreatIntelServer:
+    """
+    Serves paginated OTX- and VirusTotal-shaped exports from a background thread.
+
+    OTX pages are {"results": [...], "next": url} and VirusTotal pages {"data": [...], "links":
+    {"next": url}}, like the real APIs. Pages are encoded once and cached, so the server's own CPU
+    time stays out of client measurements.
+    """
+
+    def __init__(self, records=1000, page_size=100, latency=0.0, payload_bytes=0, throttle_every=0,
+                 retry_after=0.05, host='127.0.0.1', port=0):
+        """
+        :param records: (int) Records in each provider's export.
+        :param page_size: (int) Records per page.
+        :param latency: (float) Seconds each response is delayed by.
+        :param payload_bytes: (int) Filler bytes added to every record.
+        :param throttle_every: (int) Answer every n-th request with 429, or 0 to never throttle.
+        :param retry_after: (float) The Retry-After of throttled responses, in seconds.
+        :param host: (str) The interface to listen on.
+        :param port: (int) The port to listen on, or 0 for any free port.
+        """
+        self.records = records
+        self.page_size = page_size
+        self.latency = latency
+        self.padding = 'x' * payload_bytes
+        self.throttle_every = throttle_every
+        self.retry_after = retry_after
+        self._httpd = ThreadingHTTPServer((host, port), _Handler)
+        self._httpd.daemon_threads = True
+        self._httpd.mock = self
+        self._thread = None
+        self._lock = threading.Lock()
+        self._pages = {}
+        self.requests = 0
+        self.throttled = 0
+
+    @property
+    def base_url(self):
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def should_throttle(self):
+        with self._lock:
+            self.requests += 1
+            if self.throttle_every and self.requests % self.throttle_every == 0:
+                self.throttled += 1
+                return True
+            return False
+
+    def page(self, provider, page):
+        """
+        :return: (bytes) The JSON-encoded records of a page.
+        """
+        key = (provider, page)
+        encoded = self._pages.get(key)
+        if encoded is None:
+            make = otx_record if provider == 'otx' else vt_record
+            start = (page - 1) * self.page_size
+            stop = min(start + self.page_size, self.records)
+            encoded = self._pages[key] = json.dumps([make(i, self.padding) for i in range(start, stop)]).encode()
+        return encoded
+
+    def feeds(self):
+        """
+        Feed declarations for a collector configuration that read from this server.
+
+        :return: (dict) The 'feeds' section.
+        """
+        return {
+            'alien_vault': {'type': 'rest', 'base_url': f"{self.base_url}/otx/api/v1", 'endpoint': 'indicators/export',
+                            'auth': {'header': 'X-OTX-API-KEY', 'api_key': 'alien_vault'},
+                            'pagination': {'items_key': 'results', 'next_key': 'next'}},
+            'virus_total': {'type': 'rest', 'base_url': f"{self.base_url}/vt/api/v3", 'endpoint': 'files',
+                            'auth': {'header': 'x-apikey', 'api_key': 'virus_total'},
+                            'pagination': {'items_key': 'data', 'next_key': 'links.next'}},
+        }
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name="mock-intel", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve mock OTX and VirusTotal exports.")
+    parser.add_argument('--port', type=int, default=8900)
+    parser.add_argument('--records', type=int, default=10000)
+    parser.add_argument('--page-size', type=int, default=100)
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--payload-bytes', type=int, default=0)
+    parser.add_argument('--throttle-every', type=int, default=0)
+    args = parser.parse_args(argv)
+    server = MockThreatIntelServer(args.records, args.page_size, args.latency, args.payload_bytes, args.throttle_every,
+                                   port=args.port)
+    print(f"Serving {server.base_url}{OTX_PATH} and {server.base_url}{VT_PATH}")
+    server.start()
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,357 @@
+#  IntelliSIEM Copyright 2024, Rob Perry
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import heapq
+import itertools
+import math
+import threading
+import time
+
+from src.python.normalization import PROVIDER_TYPES
+
+DAY = 86400
+
+# Default wheel geometry: 4 levels of 256 slots cover 2**32 ticks; later deadlines wait in an overflow heap
+DEFAULT_TICK = 60.0
+DEFAULT_SLOT_BITS = 8
+DEFAULT_LEVELS = 4
+
+
+class TimingWheel:
+    """
+    A hierarchical timing wheel of keys due at a deadline.
+
+    Level 0 has one slot per tick; each higher level has slots as wide as the whole level below it.
+    A key is filed at the lowest level whose range covers its deadline and moves down a level each
+    time the wheel reaches its slot, so scheduling is O(1) and each key is touched at most once per
+    level before it expires. Deadlines beyond the top level wait in a heap until they come in range.
+
+    A key keeps a single entry while its deadline is pushed back: the entry is refiled at the new
+    deadline when its slot is reached. Cancelling or bringing a deadline forward leaves the old entry
+    behind, recognised as stale and dropped when its slot is reached, like the feed queue of
+    CollectorDaemon. The wheel is not thread-safe.
+    """
+
+    def __init__(self, tick=1.0, start=0.0, slot_bits=DEFAULT_SLOT_BITS, levels=DEFAULT_LEVELS):
+        """
+        :param tick: (float) Seconds per level 0 slot; deadlines are rounded up to whole ticks.
+        :param start: (float) The current time.
+        :param slot_bits: (int) Slots per level, as a power of two.
+        :param levels: (int) The number of levels.
+        """
+        self.tick = tick
+        self.slot_bits = slot_bits
+        self.levels = levels
+        self._mask = (1 << slot_bits) - 1
+        self._span = 1 << (slot_bits * levels)
+        self._current = math.floor(start / tick)
+        self._wheels = self._empty_wheels()
+        self._overflow = []
+        self._sequence = itertools.count()
+        self._due = []
+        # key -> [deadline tick, tick of the key's live entry]
+        self._keys = {}
+
+    def _empty_wheels(self):
+        return [[[] for _ in range(self._mask + 1)] for _ in range(self.levels)]
+
+    def _place(self, key, due):
+        delta = due - self._current
+        if delta <= 0:
+            self._due.append((key, due))
+            return
+        for level in range(self.levels):
+            if delta < 1 << (self.slot_bits * (level + 1)):
+                self._wheels[level][(due >> (self.slot_bits * level)) & self._mask].append((key, due))
+                return
+        heapq.heappush(self._overflow, (due, next(self._sequence), key))
+
+    def schedule(self, key, deadline):
+        """
+        Schedule a key, replacing its previous deadline.
+
+        :param key: The key; any hashable value.
+        :param deadline: (float) The time at which the key is due.
+        """
+        due = math.ceil(deadline / self.tick)
+        state = self._keys.get(key)
+        if state is None:
+            self._keys[key] = [due, due]
+            self._place(key, due)
+        elif due >= state[1]:
+            state[0] = due
+        else:
+            state[0] = state[1] = due
+            self._place(key, due)
+
+    def cancel(self, key):
+        """
+        :param key: The key to unschedule.
+        :return: (bool) Whether the key was scheduled.
+        """
+        return self._keys.pop(key, None) is not None
+
+    def deadline(self, key):
+        """
+        :param key: A key.
+        :return: (float) The time the key is due, rounded up to a tick, or None if it is not scheduled.
+        """
+        state = self._keys.get(key)
+        return None if state is None else state[0] * self.tick
+
+    def _reached(self, entries, expired):
+        # Expire, refile or drop the entries of a slot the wheel has reached
+        keys = self._keys
+        current = self._current
+        for key, filed in entries:
+            state = keys.get(key)
+            if state is None or state[1] != filed:
+                continue
+            if state[0] <= current:
+                del keys[key]
+                expired.append(key)
+            else:
+                state[1] = state[0]
+                self._place(key, state[0])
+
+    def _refill(self, expired):
+        # Move deadlines that came within range of the wheels out of the overflow heap
+        horizon = self._current + self._span
+        entries = []
+        while self._overflow and self._overflow[0][0] < horizon:
+            due, _, key = heapq.heappop(self._overflow)
+            entries.append((key, due))
+        self._reached(entries, expired)
+
+    def advance(self, now):
+        """
+        Move the wheel to the current time.
+
+        :param now: (float) The current time.
+        :return: (list) The keys whose deadline is at or before now, which are no longer scheduled.
+        """
+        target = math.floor(now / self.tick)
+        expired = []
+        entries, self._due = self._due, []
+        self._reached(entries, expired)
+        if not self._keys:
+            # Nothing is scheduled: skip ahead instead of walking every tick, dropping stale entries
+            if target > self._current:
+                self._current = target
+                self._wheels = self._empty_wheels()
+                self._overflow = []
+            return expired
+        bits = self.slot_bits
+        while self._current < target:
+            self._current += 1
+            current = self._current
+            top = 0
+            while top + 1 < self.levels and not current & ((1 << (bits * (top + 1))) - 1):
+                top += 1
+            if top == self.levels - 1:
+                self._refill(expired)
+            # Higher levels first, so their keys can drop all the way down to this tick's slot
+            for level in range(top, -1, -1):
+                wheel = self._wheels[level]
+                index = (current >> (bits * level)) & self._mask
+                if wheel[index]:
+                    entries, wheel[index] = wheel[index], []
+                    self._reached(entries, expired)
+            entries, self._due = self._due, []
+            self._reached(entries, expired)
+        return expired
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __contains__(self, key):
+        return key in self._keys
+
+
+class AgingPolicy:
+    """
+    Time-to-live of indicators by type and by the source that reported them.
+
+    An indicator lives for the TTL of the first of these that is set: its type in the source's 'types',
+    the source's 'ttl', its type in types, and default_ttl. A TTL of None never expires. Indicators
+    reported by several sources live for the longest of their TTLs.
+    """
+
+    def __init__(self, default_ttl=30 * DAY, types=None, sources=None):
+        """
+        :param default_ttl: (float) Seconds an indicator lives after it was last seen, or None to keep it.
+        :param types: (dict) TTLs by indicator type; provider types such as FileHash-SHA256 are normalized.
+        :param sources: (dict) Per-source settings, each with an optional 'ttl' and 'types' mapping.
+        """
+        self.default_ttl = default_ttl
+        self.types = {self.normalize_type(name): ttl for name, ttl in (types or {}).items()}
+        self.sources = {}
+        for source, settings in (sources or {}).items():
+            settings = dict(settings or {})
+            source_types = settings.get('types') or {}
+            settings['types'] = {self.normalize_type(name): ttl for name, ttl in source_types.items()}
+            self.sources[source] = settings
+        self._cache = {}
+
+    @staticmethod
+    def normalize_type(indicator_type):
+        """
+        :param indicator_type: (str) A provider or normalized indicator type.
+        :return: (str) The normalized type, or the lower-cased type if it is unknown.
+        """
+        name = str(indicator_type or '').lower()
+        return PROVIDER_TYPES.get(name) or name
+
+    def _source_ttl(self, indicator_type, source):
+        settings = self.sources.get(source)
+        if settings is not None:
+            if indicator_type in settings['types']:
+                return settings['types'][indicator_type]
+            if 'ttl' in settings:
+                return settings['ttl']
+        return self.types.get(indicator_type, self.default_ttl)
+
+    def ttl(self, indicator_type, sources):
+        """
+        :param indicator_type: (str) The indicator type.
+        :param sources: (str or list) The source, comma-joined sources or a list of sources.
+        :return: (float) Seconds the indicator lives after it was last seen, or None if it does not expire.
+        """
+        if isinstance(sources, str):
+            sources = sources.split(',')
+        key = (indicator_type, tuple(sources))
+        try:
+            return self._cache[key]
+        except KeyError:
+            pass
+        normalized = self.normalize_type(indicator_type)
+        ttls = [self._source_ttl(normalized, source) for source in sources] or [self._source_ttl(normalized, None)]
+        ttl = None if None in ttls else max(ttls)
+        self._cache[key] = ttl
+        return ttl
+
+
+class AgingEngine:
+    """
+    Expires indicators a TTL after they were last seen, and decays their confidence until then.
+
+    Indicator sets and stores given an engine track every indicator they merge and evict the ones it
+    reports expired, so they only hold indicators that are still active. Expiry walks a TimingWheel,
+    never the indicators themselves, so its cost follows the number of expirations. The engine is
+    thread-safe.
+    """
+
+    def __init__(self, policy=None, tick=DEFAULT_TICK, clock=time.time):
+        """
+        :param policy: (AgingPolicy) The TTLs; defaults to 30 days for every indicator.
+        :param tick: (float) Expiry resolution in seconds.
+        :param clock: (callable) Wall-clock time function, replaceable for testing.
+        """
+        self.policy = policy or AgingPolicy()
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._wheel = TimingWheel(tick, start=clock())
+        self.expired = 0
+
+    def track(self, indicator_id, indicator_type, sources, last_seen):
+        """
+        Schedule an indicator's expiry, replacing the previous one.
+
+        :param indicator_id: (str) The indicator id.
+        :param indicator_type: (str) The indicator type.
+        :param sources: (str or list) The source that reported the indicator, or all of its sources.
+        :param last_seen: (float) When the indicator was last seen, in seconds since the epoch.
+        :return: (float) When the indicator expires, or None if it does not.
+        """
+        ttl = self.policy.ttl(indicator_type, sources)
+        with self._lock:
+            if ttl is None:
+                self._wheel.cancel(indicator_id)
+                return None
+            self._wheel.schedule(indicator_id, last_seen + ttl)
+        return last_seen + ttl
+
+    def track_all(self, indicators):
+        """
+        Schedule the expiry of existing indicators, e.g. those of a reopened IndicatorStore.
+
+        :param indicators: (iterable) Indicator or StoredIndicator objects.
+        :return: (int) The number of indicators tracked.
+        """
+        count = 0
+        for indicator in indicators:
+            self.track(indicator.id, indicator.type, indicator.sources, indicator.last_seen)
+            count += 1
+        return count
+
+    def forget(self, indicator_id):
+        """
+        :param indicator_id: (str) An indicator that was removed by other means.
+        """
+        with self._lock:
+            self._wheel.cancel(indicator_id)
+
+    def expires(self, indicator_id):
+        """
+        :param indicator_id: (str) The indicator id.
+        :return: (float) When the indicator expires, or None if it is not tracked or does not expire.
+        """
+        with self._lock:
+            return self._wheel.deadline(indicator_id)
+
+    def expire(self, now=None):
+        """
+        Collect the indicators whose TTL has run out; they are no longer tracked.
+
+        :param now: (float) The current time; defaults to the clock.
+        :return: (list) The ids of the expired indicators.
+        """
+        with self._lock:
+            expired = self._wheel.advance(self._clock() if now is None else now)
+            self.expired += len(expired)
+        return expired
+
+    def confidence(self, indicator, now=None):
+        """
+        Decay an indicator's confidence linearly from when it was last seen to zero when it expires.
+
+        :param indicator: (Indicator) An Indicator or StoredIndicator.
+        :param now: (float) The current time; defaults to the clock.
+        :return: (float) The decayed confidence; an indicator without a confidence counts as 1.0.
+        """
+        return self.decay(getattr(indicator, 'confidence', None), indicator.type, indicator.sources,
+                          indicator.last_seen, now)
+
+    def decay(self, confidence, indicator_type, sources, last_seen, now=None):
+        """
+        Decay a confidence as confidence does, for indicators that are not Indicator objects.
+
+        :param confidence: (float) The reported confidence, or None to count as 1.0.
+        :param indicator_type: (str) The indicator type.
+        :param sources: (str or list) The source that reported the indicator, or all of its sources.
+        :param last_seen: (float) When the indicator was last seen, in seconds since the epoch.
+        :param now: (float) The current time; defaults to the clock.
+        :return: (float) The decayed confidence.
+        """
+        confidence = 1.0 if confidence is None else confidence
+        ttl = self.policy.ttl(indicator_type, sources)
+        if ttl is None:
+            return confidence
+        age = (self._clock() if now is None else now) - last_seen
+        return confidence * min(1.0, max(0.0, 1.0 - age / ttl)) if ttl > 0 else 0.0
+
+    def __len__(self):
+        with self._lock:
+            return len(self._wheel)
+
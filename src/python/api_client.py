@@ -12,50 +12,237 @@
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
 
+import codecs
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import urljoin, urlsplit
+
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+from src.python.config import HTTP_DEFAULTS
+from src.python.error_handling import APIError, DataError, log_error
+from src.python.json_stream import iter_json_items
+from src.python.metrics import HTTP_REQUESTS, STAGE_SECONDS
+
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# Request timeout in seconds for clients without a provider health tracker
+DEFAULT_TIMEOUT = 10
+
+# Marks the end of a page in the record stream produced by APIClient._paginate
+_PAGE_END = object()
+
+# The deadline, in time.monotonic() seconds, bounding the requests of the current thread
+_deadline = threading.local()
+
+
+@contextmanager
+def request_deadline(deadline):
+    """
+    Bound every API request made by the current thread inside the block by a deadline.
+
+    Each request's timeout is capped at the time left, and no request is sent once the deadline has
+    passed, so work that overruns its deadline ends with an APIError instead of carrying on unobserved.
+    A nested deadline never extends the enclosing one.
 
-from src.python.error_handling import APIError, log_error
+    :param deadline: (float) The deadline in time.monotonic() seconds, or None for no limit.
+    """
+    previous = getattr(_deadline, 'value', None)
+    if deadline is None or (previous is not None and previous < deadline):
+        deadline = previous
+    _deadline.value = deadline
+    try:
+        yield
+    finally:
+        _deadline.value = previous
+
+
+def _bounded_timeout(timeout):
+    """
+    :param timeout: (float) The timeout in seconds the request would otherwise use.
+    :return: (float) The timeout, capped at the time left before the current thread's deadline.
+    :raises APIError: If the deadline has already passed.
+    """
+    deadline = getattr(_deadline, 'value', None)
+    if deadline is None:
+        return timeout
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        log_error("API request deadline passed.")
+        raise APIError("API request timed out.")
+    return min(timeout, remaining)
+
+
+class ConnectionStats:
+    """
+    Thread-safe counters for HTTP requests and the connections that served them.
+    """
+
+    def __init__(self, source=None):
+        """
+        :param source: (str) The provider name the connection times are reported under.
+        """
+        self.source = source
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.new_connections = 0
+
+    def record_request(self):
+        with self._lock:
+            self.requests += 1
+
+    def record_connection(self, seconds=None):
+        """
+        :param seconds: (float) How long DNS resolution, the TCP connect and the TLS handshake took.
+        """
+        with self._lock:
+            self.new_connections += 1
+        if seconds is not None:
+            STAGE_SECONDS.observe(seconds, self.source, 'connect')
+
+    @property
+    def reused_connections(self):
+        """
+        :return: (int) The number of requests served over an already-open connection.
+        """
+        with self._lock:
+            return max(self.requests - self.new_connections, 0)
+
+    def as_dict(self):
+        """
+        :return: (dict) A snapshot of the counters.
+        """
+        with self._lock:
+            return {
+                'requests': self.requests,
+                'new_connections': self.new_connections,
+                'reused_connections': max(self.requests - self.new_connections, 0),
+            }
+
+
+def _counting_pool_class(pool_cls, stats):
+    """
+    Derive a connection pool class that records every new TCP/TLS connection it opens.
+
+    :param pool_cls: (type) The urllib3 connection pool class to derive from.
+    :param stats: (ConnectionStats) The counters to update.
+    :return: (type) The derived pool class.
+    """
+    class CountingConnection(pool_cls.ConnectionCls):
+        def connect(self):
+            started = time.perf_counter()
+            try:
+                return super().connect()
+            finally:
+                stats.record_connection(time.perf_counter() - started)
+
+    return type(pool_cls.__name__, (pool_cls,), {'ConnectionCls': CountingConnection})
+
+
+class PooledHTTPAdapter(HTTPAdapter):
+    """
+    An HTTP adapter that keeps connection reuse statistics for its pools.
+    """
+
+    def __init__(self, stats, **kwargs):
+        self.stats = stats
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': _counting_pool_class(HTTPConnectionPool, self.stats),
+            'https': _counting_pool_class(HTTPSConnectionPool, self.stats),
+        }
+
+    def send(self, request, **kwargs):
+        self.stats.record_request()
+        return super().send(request, **kwargs)
 
 
 class APIClient:
     """
     A client for interacting with various threat intelligence APIs.
+
+    Each client owns a long-lived requests session, so connections to the API are kept alive and
+    reused across calls instead of paying a new TCP and TLS handshake on every request.
     """
 
-    def __init__(self, base_url, headers):
+    def __init__(self, base_url, headers, http_config=None, rate_limiter=None, cache=None, health=None, name=None):
         """
         Initialize the API client with the base URL and headers.
 
         :param base_url: (str) The base URL of the API.
         :param headers: (dict) Headers required for API requests.
+        :param http_config: (dict) Optional connection pool settings, see config.get_http_config.
+        :param rate_limiter: (RateLimiter) Optional limiter pacing requests to the provider's quota.
+        :param cache: (ResponseCache) Optional cache for get_data responses; streamed exports are never cached.
+        :param health: (ProviderHealth) Optional circuit breaker, adaptive timeout and retry policy for the provider.
+        :param name: (str) The provider name metrics are reported under; defaults to the API's host name.
         """
+        self.name = name or urlsplit(base_url).hostname or base_url
         self.base_url = base_url
         self.headers = headers
+        self.rate_limiter = rate_limiter
+        self.cache = cache
+        self.health = health
+        self.http_config = dict(HTTP_DEFAULTS, **(http_config or {}))
+        self.stats = ConnectionStats(self.name)
+        self.session = self._create_session()
 
-    def get_data(self, endpoint, params=None):
+    def _create_session(self):
         """
-        Fetch data from the specified endpoint.
+        Create the pooled session used for all requests made by this client.
+
+        :return: (requests.Session) The configured session.
+        """
+        settings = self.http_config
+        session = requests.Session()
+        adapter = PooledHTTPAdapter(self.stats,
+                                    pool_connections=settings['pool_connections'],
+                                    pool_maxsize=settings['pool_maxsize'],
+                                    pool_block=settings['pool_block'])
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        session.headers['Connection'] = 'keep-alive' if settings['keep_alive'] else 'close'
+        if not settings['compression']:
+            session.headers['Accept-Encoding'] = 'identity'
+        return session
+
+    def update_headers(self, headers):
+        """
+        Replace the headers sent with every request, e.g. after an API key was rotated.
+
+        Pooled connections are kept; requests already in flight finish with the previous headers.
+
+        :param headers: (dict) Headers required for API requests.
+        """
+        self.headers = dict(headers)
+
+    def close(self):
+        """
+        Close all pooled connections held by this client.
+        """
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @contextmanager
+    def _translate_errors(self):
+        """
+        Translate request and decoding failures raised inside the block into APIError.
 
-        :param endpoint: (str) The API endpoint to fetch data from.
-        :param params: (dict) Optional query parameters.
-        :return: (dict) JSON response from the API.
         :raises APIError: If there is an error with the API request.
         """
-        url = f"{self.base_url}/{endpoint}"
         try:
-            response = requests.get(url, headers=self.headers, params=params, timeout=10)
-            if response.status_code == 429:
-                retry_after = response.headers.get("Retry-After", "unknown time")
-                log_error(f"Rate limit exceeded. Retry after: {retry_after}.")
-                raise APIError("Rate limit exceeded.")
-            if response.status_code == 401:
-                log_error("Authentication failed: Invalid API key.")
-                raise APIError("Authentication failed.")
-            if response.status_code == 403:
-                log_error("Permission denied: Access to resource is forbidden.")
-                raise APIError("Permission denied.")
-            response.raise_for_status()
-            return response.json()
+            yield
         except requests.exceptions.Timeout:
             log_error("API request timed out.")
             raise APIError("API request timed out.")
@@ -68,3 +255,319 @@ class APIClient:
         except ValueError:
             log_error("Invalid JSON response format from API.")
             raise APIError("Invalid response format.")
+
+    def _check_response(self, response):
+        """
+        Raise an APIError for rate limiting, authentication and other HTTP error responses.
+
+        :param response: (requests.Response) The response to check.
+        :raises APIError: If the response status indicates an error.
+        """
+        if response.status_code == 429:
+            retry_after = response.headers.get("Retry-After", "unknown time")
+            log_error(f"Rate limit exceeded. Retry after: {retry_after}.")
+            raise APIError("Rate limit exceeded.")
+        if response.status_code == 401:
+            log_error("Authentication failed: Invalid API key.")
+            raise APIError("Authentication failed.")
+        if response.status_code == 403:
+            log_error("Permission denied: Access to resource is forbidden.")
+            raise APIError("Permission denied.")
+        response.raise_for_status()
+
+    def _send(self, url, headers, params, timeout, stream):
+        """
+        Send a single GET request, recording its status and duration.
+
+        :return: (requests.Response) The response, whatever its status.
+        """
+        started = time.perf_counter()
+        try:
+            response = self.session.get(url, headers=headers, params=params, timeout=timeout, stream=stream)
+        except requests.exceptions.RequestException:
+            HTTP_REQUESTS.inc(self.name, 'error')
+            raise
+        STAGE_SECONDS.observe(time.perf_counter() - started, self.name, 'request')
+        HTTP_REQUESTS.inc(self.name, str(response.status_code))
+        return response
+
+    def _request(self, url, params, stream=False, extra_headers=None):
+        """
+        Send a GET request, pacing it through the rate limiter and retrying rate limited responses.
+
+        When a rate limiter is configured, a 429 response pushes back every request to the provider
+        until its Retry-After time and the request is retried, up to the limiter's retry budget.
+
+        When a provider health tracker is configured, requests are refused while the provider's circuit
+        is open, the timeout follows the provider's observed latency, and timeouts and connection errors
+        are retried with jittered exponential backoff.
+
+        Inside request_deadline, every attempt's timeout is capped at the time left before the deadline.
+
+        :param url: (str) The URL to request.
+        :param params: (dict) Optional query parameters.
+        :param stream: (bool) Whether to stream the response body.
+        :param extra_headers: (dict) Optional headers sent in addition to the client's headers.
+        :return: (requests.Response) The successful response.
+        :raises APIError: If the response status indicates an error, the provider's circuit is open or
+            the deadline has passed.
+        """
+        limiter = self.rate_limiter
+        health = self.health
+        headers = dict(self.headers, **extra_headers) if extra_headers else self.headers
+        attempt = 0
+        retry = 0
+        while True:
+            if limiter is not None:
+                limiter.acquire()
+            if health is None:
+                response = self._send(url, headers, params, _bounded_timeout(DEFAULT_TIMEOUT), stream)
+            else:
+                health.before_request()
+                timeout = health.timeout()
+                try:
+                    response = self._send(url, headers, params, _bounded_timeout(timeout), stream)
+                except (requests.exceptions.Timeout, requests.exceptions.ConnectionError) as e:
+                    health.record_failure(timeout if isinstance(e, requests.exceptions.Timeout) else None)
+                    if health.backoff(retry):
+                        retry += 1
+                        continue
+                    raise
+                except requests.exceptions.RequestException:
+                    health.record_failure()
+                    raise
+                if response.status_code >= 500:
+                    health.record_failure()
+                else:
+                    health.record_success(response.elapsed.total_seconds())
+            if response.status_code == 429 and limiter is not None and attempt < limiter.max_retries:
+                delay = limiter.retry_delay(response.headers.get("Retry-After"))
+                if delay is not None:
+                    log_error(f"Rate limit exceeded. Retrying in {delay:.1f} seconds.", level="WARNING")
+                    response.close()
+                    limiter.defer(delay)
+                    attempt += 1
+                    continue
+            self._check_response(response)
+            return response
+
+    def get_data(self, endpoint, params=None):
+        """
+        Fetch data from the specified endpoint.
+
+        :param endpoint: (str) The API endpoint to fetch data from, or a complete URL on the API's host such as
+            a next-page link.
+        :param params: (dict) Optional query parameters.
+        :return: (dict) JSON response from the API.
+        :raises APIError: If there is an error with the API request, or the URL is on another host.
+        """
+        url = self._url(endpoint)
+        with self._translate_errors():
+            if self.cache is None:
+                response = self._request(url, params)
+                with STAGE_SECONDS.time(self.name, 'decode'):
+                    return response.json()
+            return self._get_cached(endpoint, url, params)
+
+    def _get_cached(self, endpoint, url, params):
+        """
+        Serve a request through the response cache, revalidating stale entries with a conditional request.
+
+        :param endpoint: (str) The API endpoint, used to look up its TTL.
+        :param url: (str) The request URL.
+        :param params: (dict) Optional query parameters.
+        :return: The decoded JSON response.
+        """
+        cache = self.cache
+        key = cache.key(url, params)
+        entry = cache.get(key)
+        if entry is not None and entry.is_fresh():
+            cache.record_hit()
+            return entry.json()
+
+        ttl = cache.ttl_for(endpoint)
+        response = self._request(url, params, extra_headers=entry.conditional_headers() if entry else None)
+        if response.status_code == 304 and entry is not None:
+            cache.record_revalidation()
+            cache.touch(key, ttl)
+            return entry.json()
+
+        cache.record_miss()
+        with STAGE_SECONDS.time(self.name, 'decode'):
+            data = response.json()
+        cache.put(key, response.content, etag=response.headers.get('ETag'),
+                  last_modified=response.headers.get('Last-Modified'), ttl=ttl)
+        return data
+
+    def _stream_page(self, url, params, items_key):
+        """
+        Stream the records of a single page, parsing the body incrementally as it arrives.
+
+        :param url: (str) The URL of the page.
+        :param params: (dict) Optional query parameters.
+        :param items_key: (str) The response member holding the record array, if the body is an object.
+        :return: (dict) The page's other members, such as pagination cursors.
+        :raises APIError: If there is an error with the API request.
+        """
+        with self._translate_errors():
+            response = self._request(url, params, stream=True)
+            with response:
+                decoder = codecs.getincrementaldecoder(response.encoding or 'utf-8')()
+                chunks = (decoder.decode(chunk) for chunk in response.iter_content(STREAM_CHUNK_SIZE))
+                return (yield from iter_json_items(chunks, items_key))
+
+    def _cached_page(self, target, params, items_key):
+        """
+        Fetch a single page with get_data, so it is served from the response cache when it holds it.
+
+        :param target: (str) The endpoint or URL of the page.
+        :param params: (dict) Optional query parameters.
+        :param items_key: (str) The response member holding the record array, if the body is an object.
+        :return: (generator) The page's records, returning the decoded response.
+        :raises DataError: If the response does not contain a record array.
+        """
+        document = self.get_data(target, params=params or None)
+        items = document.get(items_key) if items_key and isinstance(document, dict) else document
+        if not isinstance(items, list):
+            log_error(f"No record array in the response from {target}: {type(items)}.")
+            raise DataError("Unexpected data type received.")
+        yield from items
+        return document
+
+    def _paginate(self, endpoint, params, next_key, cursor_param, max_pages, read_page, mark_pages=False):
+        """
+        Yield records across the pages of an endpoint, optionally followed by a marker after each page.
+
+        :param read_page: (callable) Called with the endpoint or URL and the params of a page; a generator
+            yielding the page's records and returning the members holding its cursor.
+        """
+        target = endpoint
+        params = dict(params or {})
+        seen = set()
+        pages = 0
+        while True:
+            envelope = yield from read_page(target, params)
+            pages += 1
+            if mark_pages:
+                yield _PAGE_END
+
+            cursor = _lookup(envelope, next_key) if next_key else None
+            if not cursor or (max_pages is not None and pages >= max_pages):
+                return
+            if cursor in seen:
+                log_error(f"Pagination cursor of {endpoint} repeated an earlier page: {cursor}.", level="WARNING")
+                return
+            seen.add(cursor)
+            if cursor_param:
+                params[cursor_param] = cursor
+            else:
+                # The cursor is a link to the next page, including its query string, possibly root-relative
+                link = urljoin(f"{self.base_url}/", str(cursor))
+                if not self._same_origin(link):
+                    log_error(f"Not following the next page link of {endpoint} to another host: {link}.",
+                              level="WARNING")
+                    return
+                target, params = link, None
+                if link.startswith(f"{self.base_url}/"):
+                    target = link[len(self.base_url) + 1:]
+
+    def _stream(self, target, params, items_key):
+        return self._stream_page(self._url(target), params, items_key)
+
+    def _same_origin(self, url):
+        """
+        :param url: (str) An absolute URL.
+        :return: (bool) Whether the URL has the scheme, host and port of base_url, so it may be sent the
+            session's credentials.
+        """
+        parts, base = urlsplit(url), urlsplit(self.base_url)
+        return (parts.scheme.lower(), parts.netloc.lower()) == (base.scheme.lower(), base.netloc.lower())
+
+    def _url(self, target):
+        """
+        :param target: (str) An endpoint, or an absolute URL on the API's host.
+        :return: (str) The URL to request.
+        :raises APIError: If the URL is on another host, which must not be sent the API's credentials.
+        """
+        if not urlsplit(target).scheme:
+            return f"{self.base_url}/{target}"
+        if not self._same_origin(target):
+            log_error(f"Refusing to send the credentials of {self.name} to {target}.")
+            raise APIError("API request failed: URL is not on the API's host.")
+        return target
+
+    def get_all(self, endpoint, params=None, items_key=None, next_key=None, cursor_param=None, max_pages=None):
+        """
+        Fetch the records of the pages of an endpoint, following pagination cursors.
+
+        Unlike iter_data, each page is fetched with get_data, so it is served from the response cache
+        when it holds the page.
+
+        :param endpoint: (str) The API endpoint to fetch data from.
+        :param params: (dict) Optional query parameters for the first page.
+        :param items_key: (str) The response member holding the records, if responses are objects.
+        :param next_key: (str) Dotted path of the next-page cursor in the response, e.g. "links.next".
+        :param cursor_param: (str) Query parameter to send the cursor in; if None the cursor is a full URL.
+        :param max_pages: (int) The largest number of pages fetched, or None for every page.
+        :return: (list) The records, in order.
+        :raises APIError: If there is an error with the API request.
+        :raises DataError: If a response does not contain a record array.
+        """
+        return list(self._paginate(endpoint, params, next_key, cursor_param, max_pages,
+                                   lambda target, page_params: self._cached_page(target, page_params, items_key)))
+
+    def iter_data(self, endpoint, params=None, items_key=None, next_key=None, cursor_param=None, max_pages=None):
+        """
+        Iterate over the records of an endpoint one at a time, following pagination cursors.
+
+        Bodies are parsed incrementally as they are downloaded, so memory use does not grow with the
+        size of the result set.
+
+        :param endpoint: (str) The API endpoint to fetch data from.
+        :param params: (dict) Optional query parameters for the first page.
+        :param items_key: (str) The response member holding the records, if responses are objects.
+        :param next_key: (str) Dotted path of the next-page cursor in the response, e.g. "links.next".
+        :param cursor_param: (str) Query parameter to send the cursor in; if None the cursor is a full URL.
+        :param max_pages: (int) The largest number of pages fetched, or None for every page.
+        :return: (generator) The records, in order.
+        :raises APIError: If there is an error with the API request.
+        :raises DataError: If a response does not contain a record array.
+        """
+        return self._paginate(endpoint, params, next_key, cursor_param, max_pages,
+                              lambda target, page_params: self._stream(target, page_params, items_key))
+
+    def iter_pages(self, endpoint, params=None, items_key=None, next_key=None, cursor_param=None, max_pages=None):
+        """
+        Iterate over the pages of an endpoint, following pagination cursors.
+
+        Takes the same arguments as iter_data; only one page of records is held in memory at a time.
+
+        :return: (generator) A list of records for each page, in order.
+        :raises APIError: If there is an error with the API request.
+        :raises DataError: If a response does not contain a record array.
+        """
+        page = []
+        pages = self._paginate(endpoint, params, next_key, cursor_param, max_pages,
+                               lambda target, page_params: self._stream(target, page_params, items_key),
+                               mark_pages=True)
+        for item in pages:
+            if item is _PAGE_END:
+                yield page
+                page = []
+            else:
+                page.append(item)
+
+
+def _lookup(document, path):
+    """
+    Look up a dotted path such as "links.next" in a decoded JSON object.
+
+    :param document: (dict) The decoded JSON object.
+    :param path: (str) The dotted path to look up.
+    :return: The value at the path, or None if it is missing.
+    """
+    for key in path.split('.'):
+        if not isinstance(document, dict):
+            return None
+        document = document.get(key)
+    return document
@@ -0,0 +1,151 @@
+#  IntelliSIEM Copyright 2024, Rob Perry
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import asyncio
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+from src.python.api_client import APIClient
+from src.python.config import ENRICHMENT_DEFAULTS
+
+# Default number of lookups sent to a provider at the same time, each on its own thread and connection
+DEFAULT_MAX_CONCURRENCY = ENRICHMENT_DEFAULTS['max_concurrency']
+
+
+def _lookup_key(endpoint, params):
+    """
+    :return: (tuple) A hashable key that is equal for identical lookups, whatever the order of their params.
+    """
+    return endpoint, json.dumps(params, sort_keys=True, default=str) if params else None
+
+
+class _LoopState:
+    """
+    The semaphore and in-flight lookups of one event loop; asyncio primitives cannot be shared across loops.
+    """
+
+    __slots__ = ('loop', 'semaphore', 'inflight')
+
+    def __init__(self, loop, max_concurrency):
+        self.loop = loop
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.inflight = {}
+
+
+class AsyncAPIClient:
+    """
+    An asyncio client for looking up many single observables, e.g. VirusTotal files/{hash}, at once.
+
+    The HTTP I/O is not asynchronous: requests are sent by a blocking APIClient from a pool of
+    max_concurrency worker threads, so the event loop never blocks and errors are the APIClient's:
+    APIError for authentication failures, rate limiting, timeouts and invalid JSON. Each lookup in
+    flight holds a worker thread and a pooled connection for its whole duration, including rate
+    limiter waits and retries. max_concurrency is therefore the real limit on both: the connection
+    pool is sized to it and blocks rather than opening extra connections, and lookups beyond it wait
+    in the event loop. Identical lookups made while one is in flight share its response instead of
+    sending another request.
+    """
+
+    def __init__(self, base_url, headers, max_concurrency=DEFAULT_MAX_CONCURRENCY, http_config=None,
+                 rate_limiter=None, cache=None, health=None, name=None):
+        """
+        :param base_url: (str) The base URL of the API.
+        :param headers: (dict) Headers required for API requests.
+        :param max_concurrency: (int) The largest number of requests in flight at the same time, which is
+            also the number of worker threads and pooled connections.
+        :param http_config: (dict) Optional connection pool settings; the pool size is set to max_concurrency.
+        :param rate_limiter: (RateLimiter) Optional limiter pacing requests to the provider's quota.
+        :param cache: (ResponseCache) Optional cache for responses.
+        :param health: (ProviderHealth) Optional circuit breaker, adaptive timeout and retry policy for the provider.
+        :param name: (str) The provider name metrics are reported under; defaults to the API's host name.
+        """
+        http_config = dict(http_config or {})
+        # One connection per worker thread; a blocking pool never opens connections it would not reuse
+        http_config['pool_maxsize'] = max_concurrency
+        http_config['pool_block'] = True
+        self.client = APIClient(base_url, headers, http_config=http_config, rate_limiter=rate_limiter, cache=cache,
+                                health=health, name=name)
+        self.max_concurrency = max_concurrency
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency,
+                                            thread_name_prefix=f"{self.client.name}-lookup")
+        self._state = None
+        self.requests = 0
+        self.coalesced = 0
+
+    def _loop_state(self):
+        loop = asyncio.get_running_loop()
+        if self._state is None or self._state.loop is not loop:
+            self._state = _LoopState(loop, self.max_concurrency)
+        return self._state
+
+    async def _fetch(self, state, endpoint, params):
+        async with state.semaphore:
+            self.requests += 1
+            return await state.loop.run_in_executor(self._executor, self.client.get_data, endpoint, params)
+
+    async def get_data(self, endpoint, params=None):
+        """
+        Fetch data from the specified endpoint.
+
+        :param endpoint: (str) The API endpoint to fetch data from.
+        :param params: (dict) Optional query parameters.
+        :return: (dict) JSON response from the API.
+        :raises APIError: If there is an error with the API request.
+        """
+        state = self._loop_state()
+        key = _lookup_key(endpoint, params)
+        task = state.inflight.get(key)
+        if task is None:
+            task = state.inflight[key] = state.loop.create_task(self._fetch(state, endpoint, params))
+            task.add_done_callback(lambda done: self._finished(state, key, done))
+        else:
+            self.coalesced += 1
+        # Shielded so that a cancelled caller does not cancel the lookup for the others waiting on it
+        return await asyncio.shield(task)
+
+    @staticmethod
+    def _finished(state, key, task):
+        if state.inflight.get(key) is task:
+            del state.inflight[key]
+        if not task.cancelled():
+            # Marks the error as retrieved when every caller waiting for it was cancelled
+            task.exception()
+
+    async def get_many(self, lookups, return_exceptions=False):
+        """
+        Fetch many endpoints concurrently.
+
+        :param lookups: (iterable) Endpoints, or (endpoint, params) pairs.
+        :param return_exceptions: (bool) Return the APIError of a failed lookup in its place instead of raising it.
+        :return: (list) The JSON responses, in the order of the lookups.
+        :raises APIError: If a lookup fails and return_exceptions is False.
+        """
+        calls = []
+        for lookup in lookups:
+            endpoint, params = (lookup, None) if isinstance(lookup, str) else lookup
+            calls.append(self.get_data(endpoint, params))
+        return await asyncio.gather(*calls, return_exceptions=return_exceptions)
+
+    def close(self):
+        """
+        Wait for lookups already sent and close all pooled connections.
+        """
+        self._executor.shutdown(wait=True)
+        self.client.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await asyncio.get_running_loop().run_in_executor(None, self.close)
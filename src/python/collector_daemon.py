@@ -0,0 +1,381 @@
+#  IntelliSIEM Copyright 2024, Rob Perry
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import argparse
+import heapq
+import itertools
+import random
+import signal
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from src.python.config import DEFAULT_CONFIG_FILE, get_aging_config, get_metrics_config, get_scheduler_config
+from src.python.data_collection import ThreatDataCollector
+from src.python.error_handling import ConfigError, log_error
+from src.python.fetch_orchestrator import STATUS_ERROR, STATUS_OK
+from src.python.indicator_store import BufferedStoreWriter, IndicatorStore
+from src.python.metrics import MetricsServer
+
+# Longest time the scheduler sleeps before re-reading the feed list
+SYNC_INTERVAL = 1.0
+
+# How often the scheduler re-checks the store's backlog while holding back new fetches
+BACKPRESSURE_POLL = 0.25
+
+# Default seconds between removals of expired indicators
+DEFAULT_EXPIRE_INTERVAL = 60
+
+
+class FeedSchedule:
+    """
+    The schedule and run history of one feed.
+    """
+
+    def __init__(self, name, interval):
+        """
+        :param name: (str) The name of the feed.
+        :param interval: (float) Seconds between the start of one run and the next, before jitter.
+        """
+        self.name = name
+        self.interval = interval
+        self.next_run = None
+        self.runs = 0
+        self.failures = 0
+        self.last_status = None
+        self.last_elapsed = None
+
+
+class CollectorDaemon:
+    """
+    A resident collector that polls every feed on its own interval.
+
+    Due feeds are kept in a priority queue ordered by their next run time, and each run is rescheduled
+    one jittered interval later, so feeds drift apart instead of firing together. At most
+    max_concurrent feeds are collected at the same time, and a feed never overlaps itself.
+
+    When indicators are written to an IndicatorStore, writes go through a bounded BufferedStoreWriter.
+    Once its backlog reaches high_watermark batches no new runs are started until it falls back to
+    low_watermark, and a full queue blocks the running fetches themselves.
+
+    The feed list and intervals follow the collector's configuration, so feeds can be added, removed or
+    retuned while the daemon runs. Indicators given an AgingEngine are expired every expire_interval.
+    """
+
+    def __init__(self, collector, indicators, state, max_concurrent=4, default_interval=300, jitter=0.1,
+                 write_queue_size=16, high_watermark=12, low_watermark=4, drain_timeout=60,
+                 expire_interval=DEFAULT_EXPIRE_INTERVAL, clock=time.monotonic, rng=random.random):
+        """
+        :param collector: (ThreatDataCollector) The collector whose feeds are polled.
+        :param indicators: (dict or IndicatorStore) The indicator set runs are merged into; an object with
+            upsert_many, flush and pending methods, such as a BufferedStoreWriter, is used as is.
+        :param state: (StateStore) The store holding per-feed watermarks.
+        :param max_concurrent: (int) The largest number of feeds collected at the same time.
+        :param default_interval: (float) Seconds between runs of feeds without an 'interval' setting.
+        :param jitter: (float) Fraction of the interval by which each run is randomly moved, below 1.
+        :param write_queue_size: (int) Batches an IndicatorStore's writer may buffer.
+        :param high_watermark: (int) Buffered batches at which new runs are held back.
+        :param low_watermark: (int) Buffered batches at which held back runs resume.
+        :param drain_timeout: (float) Seconds stop waits for running feeds by default.
+        :param expire_interval: (float) Seconds between removals of expired indicators, if indicators has an
+            AgingEngine.
+        :param clock: (callable) Monotonic clock, replaceable for testing.
+        :param rng: (callable) Returns a float in [0, 1), replaceable for testing.
+        """
+        self.collector = collector
+        self.state = state
+        self.max_concurrent = max_concurrent
+        self.default_interval = default_interval
+        self.jitter = jitter
+        self.high_watermark = high_watermark
+        self.low_watermark = low_watermark
+        self.drain_timeout = drain_timeout
+        self.expire_interval = expire_interval
+        self.indicators = indicators
+        self._clock = clock
+        self._rng = rng
+        self._writer = BufferedStoreWriter(indicators, write_queue_size) \
+            if isinstance(indicators, IndicatorStore) else None
+        self.sink = self._writer or indicators
+        self._cond = threading.Condition()
+        self._queue = []
+        self._sequence = itertools.count()
+        self._feeds = {}
+        self._running = set()
+        self._throttled = False
+        self._stopping = False
+        self._thread = None
+        self._executor = None
+        self.throttle_events = 0
+        self.expired = 0
+        self._next_expiry = None
+
+    def _schedule(self, schedule, now, initial=False):
+        if initial:
+            # Spread the first runs over a jitter's worth of the interval
+            delay = self._rng() * schedule.interval * self.jitter
+        else:
+            delay = schedule.interval * (1 + self.jitter * (2 * self._rng() - 1))
+        schedule.next_run = now + delay
+        heapq.heappush(self._queue, (schedule.next_run, next(self._sequence), schedule.name))
+
+    def _read_feeds(self):
+        """
+        Read the configured feeds, which may reload the configuration file.
+
+        :return: (dict) The interval of every configured feed by name, or None if the list could not be read.
+        """
+        try:
+            registry = self.collector.feeds
+            return {name: registry.feeds[name].get('interval') or self.default_interval for name in registry.names()}
+        except ConfigError as e:
+            log_error(f"Could not read the feed list, keeping the current schedule: {e}")
+            return None
+
+    def _sync_feeds(self, intervals):
+        """
+        Add newly configured feeds, drop removed ones and pick up changed intervals.
+
+        :param intervals: (dict) The interval of every configured feed by name.
+        """
+        now = self._clock()
+        for name, interval in intervals.items():
+            schedule = self._feeds.get(name)
+            if schedule is None:
+                schedule = self._feeds[name] = FeedSchedule(name, interval)
+                self._schedule(schedule, now, initial=True)
+            else:
+                schedule.interval = interval
+        for name in set(self._feeds) - set(intervals):
+            # Its queue entry is discarded when it comes due
+            del self._feeds[name]
+
+    def _backlogged(self):
+        pending = getattr(self.sink, 'pending', None)
+        if pending is None:
+            return False
+        backlog = pending()
+        if self._throttled and backlog <= self.low_watermark:
+            self._throttled = False
+        elif not self._throttled and backlog >= self.high_watermark:
+            self._throttled = True
+            self.throttle_events += 1
+            log_error(f"Indicator store is {backlog} batches behind; holding back new feed runs.", level="WARNING")
+        return self._throttled
+
+    def _dispatch(self):
+        """
+        Start every due feed that the concurrency cap and backpressure allow.
+
+        :return: (float) Seconds until the scheduler should look again, unless woken earlier.
+        """
+        now = self._clock()
+        while self._queue:
+            if len(self._running) >= self.max_concurrent:
+                return SYNC_INTERVAL
+            due, _, name = self._queue[0]
+            if due > now:
+                return min(due - now, SYNC_INTERVAL)
+            if self._backlogged():
+                return BACKPRESSURE_POLL
+            heapq.heappop(self._queue)
+            schedule = self._feeds.get(name)
+            if schedule is None or schedule.next_run != due or name in self._running:
+                continue
+            self._running.add(name)
+            self._executor.submit(self._run, schedule)
+        return SYNC_INTERVAL
+
+    def _expiry_due(self):
+        """
+        :return: (bool) Whether indicators have an AgingEngine and expire_interval has passed since the last pass.
+        """
+        if getattr(self.indicators, 'aging', None) is None:
+            return False
+        now = self._clock()
+        if self._next_expiry is not None and now < self._next_expiry:
+            return False
+        self._next_expiry = now + self.expire_interval
+        return True
+
+    def _expire(self):
+        """
+        Remove the indicators whose TTL has run out.
+        """
+        try:
+            expired = len(self.indicators.expire())
+        except Exception as e:
+            # A failing pass must not end the scheduler
+            log_error(f"Removing expired indicators failed: {e}")
+            return
+        with self._cond:
+            self.expired += expired
+
+    def _loop(self):
+        while True:
+            # Reading the configuration and expiring indicators can be slow, so both run without the lock
+            # and never hold up finishing runs or stats
+            intervals = self._read_feeds()
+            with self._cond:
+                if self._stopping:
+                    return
+                if intervals is not None:
+                    self._sync_feeds(intervals)
+                delay = self._dispatch()
+                expire = self._expiry_due()
+                if not expire:
+                    self._cond.wait(delay)
+            if expire:
+                # Runs that finished during the pass are picked up by the next dispatch
+                self._expire()
+
+    def _run(self, schedule):
+        started = self._clock()
+        status = STATUS_ERROR
+        try:
+            results = self.collector.collect_incremental(self.sink, self.state, feeds=[schedule.name])
+            result = results.get(schedule.name)
+            status = result.status if result is not None else STATUS_OK
+        except Exception as e:
+            # A failing run must not end the feed's schedule
+            log_error(f"Scheduled collection of {schedule.name} failed: {e}")
+        finally:
+            with self._cond:
+                self._running.discard(schedule.name)
+                schedule.runs += 1
+                schedule.failures += status != STATUS_OK
+                schedule.last_status = status
+                schedule.last_elapsed = self._clock() - started
+                if not self._stopping and self._feeds.get(schedule.name) is schedule:
+                    self._schedule(schedule, started)
+                self._cond.notify_all()
+
+    def start(self):
+        """
+        Start scheduling feeds in a background thread.
+        """
+        if self._thread is not None:
+            return
+        self._stopping = False
+        self._executor = ThreadPoolExecutor(max_workers=self.max_concurrent, thread_name_prefix="feed")
+        self._thread = threading.Thread(target=self._loop, name="feed-scheduler", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        """
+        Stop starting new runs, wait for running feeds to finish and write out buffered indicators.
+
+        :param timeout: (float) Seconds to wait for running feeds; defaults to drain_timeout.
+        :return: (bool) True if every running feed finished in time.
+        """
+        if self._thread is None:
+            return True
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        self._thread.join()
+        self._thread = None
+
+        timeout = self.drain_timeout if timeout is None else timeout
+        with self._cond:
+            drained = self._cond.wait_for(lambda: not self._running, timeout)
+            abandoned = sorted(self._running)
+        if not drained:
+            log_error(f"Stopped without waiting for feeds still running: {', '.join(abandoned)}.", level="WARNING")
+        self._executor.shutdown(wait=drained)
+        if self._writer is not None:
+            self._writer.close()
+        self.state.save()
+        return drained
+
+    def serve(self):
+        """
+        Run until SIGINT or SIGTERM, then drain and return; must be called from the main thread.
+
+        :return: (bool) True if every running feed finished before the drain timeout.
+        """
+        stop = threading.Event()
+        previous = {sig: signal.signal(sig, lambda signum, frame: stop.set())
+                    for sig in (signal.SIGINT, signal.SIGTERM)}
+        try:
+            self.start()
+            while not stop.wait(SYNC_INTERVAL):
+                pass
+        finally:
+            for sig, handler in previous.items():
+                signal.signal(sig, handler)
+        return self.stop()
+
+    def stats(self):
+        """
+        :return: (dict) Per-feed run counters and next run times, running feeds, the store backlog and the
+            number of expired indicators removed.
+        """
+        with self._cond:
+            now = self._clock()
+            pending = getattr(self.sink, 'pending', None)
+            feeds = {}
+            for name, schedule in self._feeds.items():
+                feeds[name] = {'interval': schedule.interval, 'runs': schedule.runs, 'failures': schedule.failures,
+                               'last_status': schedule.last_status, 'last_elapsed': schedule.last_elapsed,
+                               'next_run_in': max(schedule.next_run - now, 0.0)}
+            return {
+                'feeds': feeds,
+                'running': sorted(self._running),
+                'pending_writes': pending() if pending is not None else 0,
+                'throttled': self._throttled,
+                'throttle_events': self.throttle_events,
+                'expired': self.expired,
+            }
+
+
+def main(argv=None):
+    """
+    Run the collector daemon with the indicator store and state configured in the configuration file,
+    serving metrics if the 'metrics' section enables them.
+    """
+    parser = argparse.ArgumentParser(description="Poll threat intelligence feeds on their configured intervals.")
+    parser.add_argument('--config', default=DEFAULT_CONFIG_FILE, help="path to the YAML configuration file")
+    args = parser.parse_args(argv)
+
+    collector = ThreatDataCollector(args.config)
+    store = collector.open_indicator_store()
+    metrics = get_metrics_config(collector.config)
+    server = None
+    if metrics['enabled']:
+        server = MetricsServer(host=metrics['host'], port=metrics['port'], profiling=metrics['profiling'],
+                               profile_interval=metrics['profile_interval']).start()
+
+        def follow_profiling(config, previous):
+            # Profiling can be switched on and off by editing the configuration; the address cannot
+            settings = get_metrics_config(config)
+            server.profiling = settings['enabled'] and settings['profiling']
+            server.profile_interval = settings['profile_interval']
+
+        collector.config_manager.subscribe(follow_profiling)
+    try:
+        aging = get_aging_config(collector.config)
+        expire_interval = aging['expire_interval'] if aging is not None else DEFAULT_EXPIRE_INTERVAL
+        daemon = CollectorDaemon(collector, store, collector.load_state(), expire_interval=expire_interval,
+                                 **get_scheduler_config(collector.config))
+        return 0 if daemon.serve() else 1
+    finally:
+        if server is not None:
+            server.stop()
+        store.close()
+        collector.close()
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
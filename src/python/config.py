@@ -12,12 +12,16 @@
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
 
-import yaml
+import os
+import threading
+import time
 
 from src.python.error_handling import log_error, ConfigError
 
+DEFAULT_CONFIG_FILE = 'config/config.yaml'
 
-def load_config(config_file='config/config.yaml'):
+
+def load_config(config_file=DEFAULT_CONFIG_FILE):
     """
     Load configuration from the specified YAML file.
 
@@ -25,6 +29,9 @@ def load_config(config_file='config/config.yaml'):
     :return: dict: Configuration data.
     :raises ConfigError: If there is an error with the configuration file.
     """
+    # Imported here so that modules needing only the config helpers do not pay for the YAML parser
+    import yaml
+
     try:
         with open(config_file, 'r') as file:
             return yaml.safe_load(file)
@@ -40,3 +47,829 @@ def load_config(config_file='config/config.yaml'):
     except OSError as e:
         log_error(f"Disk space issue while loading configuration: {e}.")
         raise ConfigError("Disk space issue while loading configuration.")
+
+
+HTTP_DEFAULTS = {
+    'pool_connections': 10,
+    'pool_maxsize': 10,
+    'pool_block': False,
+    'keep_alive': True,
+    'compression': True,
+}
+
+
+def get_http_config(config):
+    """
+    Return the HTTP connection pool settings from the configuration, filled in with defaults.
+
+    :param config: (dict) Configuration data as returned by load_config.
+    :return: dict: HTTP connection pool settings.
+    :raises ConfigError: If a setting has an invalid value.
+    """
+    settings = dict(HTTP_DEFAULTS)
+    settings.update((config or {}).get('http') or {})
+    for key in ('pool_connections', 'pool_maxsize'):
+        if not isinstance(settings[key], int) or isinstance(settings[key], bool) or settings[key] < 1:
+            log_error(f"Invalid HTTP setting '{key}': {settings[key]}.")
+            raise ConfigError(f"Invalid HTTP setting: {key}.")
+    for key in ('pool_block', 'keep_alive', 'compression'):
+        if not isinstance(settings[key], bool):
+            log_error(f"Invalid HTTP setting '{key}': {settings[key]}.")
+            raise ConfigError(f"Invalid HTTP setting: {key}.")
+    return settings
+
+
+RATE_LIMIT_DEFAULTS = {
+    'burst': 1,
+    'max_retries': 3,
+    'max_retry_after': 300,
+}
+
+
+def get_rate_limit_config(config, source):
+    """
+    Return the rate limit settings for a source, filled in with defaults.
+
+    :param config: (dict) Configuration data as returned by load_config.
+    :param source: (str) The name of the source, e.g. "virus_total".
+    :return: dict: Rate limit settings, or None if the source has no configured quota.
+    :raises ConfigError: If a setting has an invalid value.
+    """
+    settings = ((config or {}).get('rate_limits') or {}).get(source)
+    if settings is None:
+        return None
+    settings = dict(RATE_LIMIT_DEFAULTS, **settings)
+    for key in ('requests_per_minute', 'burst', 'max_retries', 'max_retry_after'):
+        value = settings.get(key)
+        if not isinstance(value, (int, float)) or isinstance(value, bool) or value < 0 \
+                or (value == 0 and key in ('requests_per_minute', 'burst')):
+            log_error(f"Invalid rate limit setting '{key}' for {source}: {value}.")
+            raise ConfigError(f"Invalid rate limit setting: {key}.")
+    return settings
+
+
+CACHE_DEFAULTS = {
+    'path': 'data/response_cache.sqlite3',
+    'max_bytes': 256 * 1024 * 1024,
+    'default_ttl': 0,
+    'ttls': {},
+}
+
+
+def get_cache_config(config):
+    """
+    Return the response cache settings from the configuration, filled in with defaults.
+
+    :param config: (dict) Configuration data as returned by load_config.
+    :return: dict: Response cache settings, or None if caching is not configured.
+    :raises ConfigError: If a setting has an invalid value.
+    """
+    settings = (config or {}).get('cache')
+    if settings is None:
+        return None
+    settings = dict(CACHE_DEFAULTS, **settings)
+    if not isinstance(settings['max_bytes'], int) or settings['max_bytes'] < 1:
+        log_error(f"Invalid cache setting 'max_bytes': {settings['max_bytes']}.")
+        raise ConfigError("Invalid cache setting: max_bytes.")
+    ttls = dict(settings['ttls'] or {}, __default__=settings['default_ttl'])
+    for endpoint, ttl in ttls.items():
+        if not isinstance(ttl, (int, float)) or isinstance(ttl, bool) or ttl < 0:
+            log_error(f"Invalid cache TTL for '{endpoint}': {ttl}.")
+            raise ConfigError("Invalid cache setting: ttls.")
+    return settings
+
+
+LOGGING_DEFAULTS = {
+    'log_file': 'data/error.log',
+    'max_bytes': 1000000,
+    'backup_count': 5,
+    'queue_size': 10000,
+    'batch_size': 256,
+    'flush_interval': 0.5,
+    'overflow': 'drop_newest',
+    'json_format': True,
+    'level': 'ERROR',
+}
+
+LOG_LEVELS = {'DEBUG': 10, 'INFO': 20, 'WARNING': 30, 'ERROR': 40, 'CRITICAL': 50}
+
+
+def get_logging_config(config):
+    """
+    Return the log pipeline settings from the configuration, filled in with defaults.
+
+    :param config: (dict) Configuration data as returned by load_config.
+    :return: dict: Keyword arguments for setup_logging, or None if logging is not configured.
+    :raises ConfigError: If a setting has an invalid value.
+    """
+    settings = (config or {}).get('logging')
+    if settings is None:
+        return None
+    unknown = set(settings) - set(LOGGING_DEFAULTS)
+    if unknown:
+        log_error(f"Unknown logging settings: {sorted(unknown)}.")
+        raise ConfigError(f"Invalid logging setting: {sorted(unknown)[0]}.")
+    settings = dict(LOGGING_DEFAULTS, **settings)
+    for key in ('max_bytes', 'backup_count', 'queue_size', 'batch_size'):
+        if not isinstance(settings[key], int) or isinstance(settings[key], bool) or settings[key] < 0 \
+                or (settings[key] == 0 and key == 'batch_size'):
+            log_error(f"Invalid logging setting '{key}': {settings[key]}.")
+            raise ConfigError(f"Invalid logging setting: {key}.")
+    if not isinstance(settings['flush_interval'], (int, float)) or settings['flush_interval'] <= 0:
+        log_error(f"Invalid logging setting 'flush_interval': {settings['flush_interval']}.")
+        raise ConfigError("Invalid logging setting: flush_interval.")
+    if settings['overflow'] not in ('drop_newest', 'drop_oldest', 'block'):
+        log_error(f"Invalid logging setting 'overflow': {settings['overflow']}.")
+        raise ConfigError("Invalid logging setting: overflow.")
+    level = str(settings['level']).upper()
+    if level not in LOG_LEVELS:
+        log_error(f"Invalid logging setting 'level': {settings['level']}.")
+        raise ConfigError("Invalid logging setting: level.")
+    settings['level'] = LOG_LEVELS[level]
+    return settings
+
+
+HEALTH_DEFAULTS = {
+    'failure_threshold': 5,
+    'recovery_timeout': 30,
+    'half_open_max_calls': 1,
+    'latency_window': 100,
+    'latency_percentile': 0.95,
+    'timeout_multiplier': 3,
+    'min_timeout': 1,
+    'max_timeout': 10,
+    'min_samples': 10,
+    'max_retries': 2,
+    'backoff_base': 0.5,
+    'backoff_max': 8,
+}
+
+_HEALTH_COUNTS = ('failure_threshold', 'half_open_max_calls', 'latency_window', 'min_samples')
+
+
+def get_health_config(config, source):
+    """
+    Return the provider health settings for a source: the shared settings of the 'health' section,
+    overridden by the source's entry under 'health.providers', filled in with defaults.
+
+    :param config: (dict) Configuration data as returned by load_config.
+    :param source: (str) The name of the source, e.g. "virus_total".
+    :return: dict: Provider health settings, or None if health tracking is not configured.
+    :raises ConfigError: If a setting has an invalid value.
+    """
+    section = (config or {}).get('health')
+    if section is None:
+        return None
+    settings = dict(HEALTH_DEFAULTS)
+    settings.update((key, value) for key, value in section.items() if key != 'providers')
+    settings.update((section.get('providers') or {}).get(source) or {})
+    for key, value in settings.items():
+        if key not in HEALTH_DEFAULTS:
+            log_error(f"Unknown provider health setting '{key}' for {source}.")
+            raise ConfigError(f"Invalid provider health setting: {key}.")
+        if not isinstance(value, (int, float)) or isinstance(value, bool) or value < 0 \
+                or (key in _HEALTH_COUNTS and (not isinstance(value, int) or value < 1)) \
+                or (key in ('min_timeout', 'max_timeout') and value == 0) \
+                or (key == 'latency_percentile' and not 0 < value <= 1) \
+                or (key == 'timeout_multiplier' and value < 1) \
+                or (key == 'max_retries' and not isinstance(value, int)):
+            log_error(f"Invalid provider health setting '{key}' for {source}: {value}.")
+            raise ConfigError(f"Invalid provider health setting: {key}.")
+    if settings['min_timeout'] > settings['max_timeout']:
+        log_error(f"Invalid provider health settings for {source}: min_timeout exceeds max_timeout.")
+        raise ConfigError("Invalid provider health setting: min_timeout.")
+    return settings
+
+
+DEFAULT_FEEDS = {
+    'alien_vault': {
+        'type': 'rest',
+        'base_url': 'https://otx.alienvault.com/api/v1',
+        'auth': {'header': 'X-OTX-API-KEY', 'api_key': 'alien_vault'},
+        'endpoint': 'indicators/export',
+        'pagination': {'items_key': 'results', 'next_key': 'next'},
+        'incremental': {'mode': 'timestamp', 'param': 'modified_since'},
+    },
+    'virus_total': {
+        'type': 'rest',
+        'base_url': 'https://www.virustotal.com/api/v3',
+        'auth': {'header': 'x-apikey', 'api_key': 'virus_total'},
+        'endpoint': 'files',
+        'params': {'limit': 10},
+        'pagination': {'items_key': 'data', 'next_key': 'links.next'},
+    },
+}
+
+FEED_DEFAULTS = {
+    'enabled': True,
+    'concurrency': 1,
+    'interval': None,
+    'timeout': None,
+}
+
+# Settings each built-in feed type requires
+FEED_REQUIRED = {
+    'rest': ('base_url', 'endpoint'),
+    'taxii': ('api_root', 'collection'),
+    'csv': ('path',),
+    'stix': ('path',),
+}
+
+
+def get_feeds_config(config):
+    """
+    Return the feed declarations from the 'feeds' section, filled in with defaults.
+
+    Without a 'feeds' section the built-in OTX and VirusTotal feeds are used. Feeds are returned in
+    the order they are declared, which is the order their indicators are merged in.
+
+    :param config: (dict) Configuration data as returned by load_config.
+    :return: dict: Feed settings keyed by feed name.
+    :raises ConfigError: If a feed declaration is invalid.
+    """
+    feeds = (config or {}).get('feeds')
+    if feeds is None:
+        feeds = DEFAULT_FEEDS
+    if not isinstance(feeds, dict):
+        log_error(f"Invalid feeds section: expected a mapping, got {type(feeds)}.")
+        raise ConfigError("Invalid feed setting: feeds.")
+    result = {}
+    for name, declaration in feeds.items():
+        if not isinstance(declaration, dict):
+            log_error(f"Invalid declaration for feed {name}: {declaration!r}.")
+            raise ConfigError(f"Invalid feed setting: {name}.")
+        settings = dict(FEED_DEFAULTS, type='rest')
+        settings.update(declaration)
+        for key in FEED_REQUIRED.get(settings['type'], ()):
+            if not settings.get(key):
+                log_error(f"Feed {name} of type {settings['type']} is missing '{key}'.")
+                raise ConfigError(f"Invalid feed setting: {key}.")
+        if not isinstance(settings['concurrency'], int) or isinstance(settings['concurrency'], bool) \
+                or settings['concurrency'] < 1:
+            log_error(f"Invalid concurrency for feed {name}: {settings['concurrency']}.")
+            raise ConfigError("Invalid feed setting: concurrency.")
+        for key in ('interval', 'timeout'):
+            value = settings[key]
+            if value is not None and (not isinstance(value, (int, float)) or isinstance(value, bool) or value <= 0):
+                log_error(f"Invalid {key} for feed {name}: {value}.")
+                raise ConfigError(f"Invalid feed setting: {key}.")
+        auth = settings.get('auth')
+        if auth is not None and (not isinstance(auth, dict) or not auth.get('api_key')):
+            log_error(f"Invalid auth for feed {name}: {auth!r}.")
+            raise ConfigError("Invalid feed setting: auth.")
+        incremental = settings.get('incremental')
+        if incremental is not None and (not isinstance(incremental, dict)
+                                        or incremental.get('mode') not in ('timestamp', 'field')
+                                        or not incremental.get('param')
+                                        or (incremental['mode'] == 'field' and not incremental.get('field'))):
+            log_error(f"Invalid incremental settings for feed {name}: {incremental!r}.")
+            raise ConfigError("Invalid feed setting: incremental.")
+        result[name] = settings
+    return result
+
+
+SCHEDULER_DEFAULTS = {
+    'max_concurrent': 4,
+    'default_interval': 300,
+    'jitter': 0.1,
+    'write_queue_size': 16,
+    'high_watermark': 12,
+    'low_watermark': 4,
+    'drain_timeout': 60,
+}
+
+
+def get_scheduler_config(config):
+    """
+    Return the collector daemon settings from the optional 'scheduler' section, filled in with defaults.
+
+    :param config: (dict) Configuration data as returned by load_config.
+    :return: dict: Scheduler settings.
+    :raises ConfigError: If a setting has an invalid value.
+    """
+    settings = dict(SCHEDULER_DEFAULTS, **((config or {}).get('scheduler') or {}))
+    for key, value in settings.items():
+        if key not in SCHEDULER_DEFAULTS:
+            log_error(f"Unknown scheduler setting '{key}'.")
+            raise ConfigError(f"Invalid scheduler setting: {key}.")
+        integral = key in ('max_concurrent', 'write_queue_size', 'high_watermark', 'low_watermark')
+        if not isinstance(value, int if integral else (int, float)) or isinstance(value, bool) or value < 0 \
+                or (value == 0 and key in ('max_concurrent', 'default_interval', 'write_queue_size')) \
+                or (key == 'jitter' and value >= 1):
+            log_error(f"Invalid scheduler setting '{key}': {value}.")
+            raise ConfigError(f"Invalid scheduler setting: {key}.")
+    if not settings['low_watermark'] <= settings['high_watermark'] <= settings['write_queue_size']:
+        log_error("Invalid scheduler settings: expected low_watermark <= high_watermark <= write_queue_size.")
+        raise ConfigError("Invalid scheduler setting: high_watermark.")
+    return settings
+
+
+NORMALIZATION_DEFAULTS = {
+    'workers': None,
+    'chunk_size': 1000,
+    'min_parallel': 5000,
+}
+
+
+def get_normalization_config(config):
+    """
+    Return the normalization pipeline settings from the optional 'normalization' section, filled in with defaults.
+
+    :param config: (dict) Configuration data as returned by load_config.
+    :return: dict: Normalization settings; a 'workers' of None means one worker process per CPU.
+    :raises ConfigError: If a setting has an invalid value.
+    """
+    settings = dict(NORMALIZATION_DEFAULTS, **((config or {}).get('normalization') or {}))
+    for key, value in settings.items():
+        if key not in NORMALIZATION_DEFAULTS:
+            log_error(f"Unknown normalization setting '{key}'.")
+            raise ConfigError(f"Invalid normalization setting: {key}.")
+        if value is None and key == 'workers':
+            continue
+        if not isinstance(value, int) or isinstance(value, bool) or value < 1:
+            log_error(f"Invalid normalization setting '{key}': {value}.")
+            raise ConfigError(f"Invalid normalization setting: {key}.")
+    return settings
+
+
+CORRELATION_DEFAULTS = {
+    'source_weights': {},
+    'default_weight': 0.5,
+    'half_life_days': 30,
+}
+
+
+def get_correlation_config(config):
+    """
+    Return the cross-source scoring settings from the optional 'correlation' section, filled in with defaults.
+
+    :param config: (dict) Configuration data as returned by load_config.
+    :return: dict: Correlation settings.
+    :raises ConfigError: If a setting has an invalid value.
+    """
+    settings = dict(CORRELATION_DEFAULTS, **((config or {}).get('correlation') or {}))
+    for key, value in settings.items():
+        if key not in CORRELATION_DEFAULTS:
+            log_error(f"Unknown correlation setting '{key}'.")
+            raise ConfigError(f"Invalid correlation setting: {key}.")
+    weights = settings['source_weights']
+    if not isinstance(weights, dict):
+        log_error(f"Invalid correlation setting 'source_weights': {weights!r}.")
+        raise ConfigError("Invalid correlation setting: source_weights.")
+    checks = [('default_weight', 'default_weight', settings['default_weight'])]
+    checks += [('source_weights', source, weight) for source, weight in weights.items()]
+    for key, name, value in checks:
+        if not isinstance(value, (int, float)) or isinstance(value, bool) or not 0 <= value <= 1:
+            log_error(f"Invalid correlation weight for '{name}': {value}.")
+            raise ConfigError(f"Invalid correlation setting: {key}.")
+    half_life = settings['half_life_days']
+    if not isinstance(half_life, (int, float)) or isinstance(half_life, bool) or half_life <= 0:
+        log_error(f"Invalid correlation setting 'half_life_days': {half_life}.")
+        raise ConfigError("Invalid correlation setting: half_life_days.")
+    return settings
+
+
+EXPORT_DEFAULTS = {
+    'spool_dir': 'data/export_spool',
+    'batch_size': 500,
+    'batch_bytes': 1024 * 1024,
+    'flush_interval': 5,
+    'fsync': True,
+    'sinks': {},
+}
+
+# Settings every export sink of a type must declare
+SINK_REQUIRED = {
+    'http': ('url',),
+    'syslog': ('host',),
+    'file': ('directory',),
+}
+
+
+def get_export_config(config):
+    """
+    Return the SIEM export settings from the optional 'export' section, filled in with defaults.
+
+    :param config: (dict) Configuration data as returned by load_config.
+    :return: dict: Export settings, or None if the section is absent.
+    :raises ConfigError: If a setting has an invalid value.
+    """
+    section = (config or {}).get('export')
+    if section is None:
+        return None
+    settings = dict(EXPORT_DEFAULTS, **section)
+    for key, value in settings.items():
+        if key not in EXPORT_DEFAULTS:
+            log_error(f"Unknown export setting '{key}'.")
+            raise ConfigError(f"Invalid export setting: {key}.")
+        if key in ('batch_size', 'batch_bytes', 'flush_interval') \
+                and (not isinstance(value, (int, float)) or isinstance(value, bool) or value <= 0):
+            log_error(f"Invalid export setting '{key}': {value}.")
+            raise ConfigError(f"Invalid export setting: {key}.")
+    if not isinstance(settings['sinks'], dict):
+        log_error("Invalid export setting 'sinks': expected a mapping of sink names to settings.")
+        raise ConfigError("Invalid export setting: sinks.")
+    for name, sink in settings['sinks'].items():
+        required = SINK_REQUIRED.get(sink.get('type')) if isinstance(sink, dict) else None
+        if required is None or any(not sink.get(key) for key in required):
+            log_error(f"Export sink {name} needs a type of {', '.join(SINK_REQUIRED)} and its required settings.")
+            raise ConfigError(f"Invalid export sink: {name}.")
+    return settings
+
+
+METRICS_DEFAULTS = {
+    'enabled': False,
+    'host': '127.0.0.1',
+    'port': 9108,
+    'profiling': False,
+    'profile_interval': 0.005,
+}
+
+
+def get_metrics_config(config):
+    """
+    Return the metrics endpoint settings from the optional 'metrics' section, filled in with defaults.
+
+    :param config: (dict) Configuration data as returned by load_config.
+    :return: dict: Metrics settings.
+    :raises ConfigError: If a setting has an invalid value.
+    """
+    settings = dict(METRICS_DEFAULTS, **((config or {}).get('metrics') or {}))
+    for key, value in settings.items():
+        if key not in METRICS_DEFAULTS:
+            log_error(f"Unknown metrics setting '{key}'.")
+            raise ConfigError(f"Invalid metrics setting: {key}.")
+        expected = type(METRICS_DEFAULTS[key])
+        valid = isinstance(value, bool) if expected is bool else \
+            isinstance(value, str) if expected is str else \
+            isinstance(value, (int, float)) and not isinstance(value, bool) and value >= 0
+        if not valid or (key == 'profile_interval' and value == 0) or (key == 'port' and value > 65535):
+            log_error(f"Invalid metrics setting '{key}': {value}.")
+            raise ConfigError(f"Invalid metrics setting: {key}.")
+    return settings
+
+
+ENRICHMENT_DEFAULTS = {
+    'max_concurrency': 32,
+}
+
+
+def get_enrichment_config(config):
+    """
+    Return the observable lookup settings from the optional 'enrichment' section, filled in with defaults.
+
+    :param config: (dict) Configuration data as returned by load_config.
+    :return: dict: Enrichment settings.
+    :raises ConfigError: If a setting has an invalid value.
+    """
+    settings = dict(ENRICHMENT_DEFAULTS, **((config or {}).get('enrichment') or {}))
+    for key, value in settings.items():
+        if key not in ENRICHMENT_DEFAULTS:
+            log_error(f"Unknown enrichment setting '{key}'.")
+            raise ConfigError(f"Invalid enrichment setting: {key}.")
+        if not isinstance(value, int) or isinstance(value, bool) or value < 1:
+            log_error(f"Invalid enrichment setting '{key}': {value}.")
+            raise ConfigError(f"Invalid enrichment setting: {key}.")
+    return settings
+
+
+SNAPSHOT_DEFAULTS = {
+    'path': 'data/indicators.snapshot',
+    'false_positive_rate': 0.01,
+}
+
+
+def get_snapshot_config(config):
+    """
+    Return the indicator snapshot settings from the optional 'snapshot' section, filled in with defaults.
+
+    :param config: (dict) Configuration data as returned by load_config.
+    :return: dict: Snapshot settings.
+    :raises ConfigError: If a setting has an invalid value.
+    """
+    settings = dict(SNAPSHOT_DEFAULTS, **((config or {}).get('snapshot') or {}))
+    for key, value in settings.items():
+        if key not in SNAPSHOT_DEFAULTS:
+            log_error(f"Unknown snapshot setting '{key}'.")
+            raise ConfigError(f"Invalid snapshot setting: {key}.")
+        if key == 'path':
+            valid = isinstance(value, str) and value
+        else:
+            valid = isinstance(value, float) and 0 < value < 1
+        if not valid:
+            log_error(f"Invalid snapshot setting '{key}': {value}.")
+            raise ConfigError(f"Invalid snapshot setting: {key}.")
+    return settings
+
+
+QUEUE_DEFAULTS = {
+    'directory': 'data/ingest_queue',
+    'segment_bytes': 64 << 20,
+    'fsync': True,
+    'fsync_interval': 1.0,
+    'retention_bytes': None,
+    'retention_age': None,
+    'keep_unconsumed': True,
+    'consumers': ['indicators'],
+    'batch_records': 1000,
+}
+
+
+def get_queue_config(config):
+    """
+    Return the ingest queue settings from the optional 'queue' section, filled in with defaults.
+
+    :param config: (dict) Configuration data as returned by load_config.
+    :return: dict: Ingest queue settings.
+    :raises ConfigError: If a setting has an invalid value.
+    """
+    settings = dict(QUEUE_DEFAULTS, **((config or {}).get('queue') or {}))
+    for key, value in settings.items():
+        if key not in QUEUE_DEFAULTS:
+            log_error(f"Unknown queue setting '{key}'.")
+            raise ConfigError(f"Invalid queue setting: {key}.")
+        if key == 'directory':
+            valid = isinstance(value, str) and value
+        elif key in ('fsync', 'keep_unconsumed'):
+            valid = isinstance(value, bool)
+        elif key == 'consumers':
+            valid = isinstance(value, list) and all(isinstance(name, str) and name for name in value)
+        elif key in ('retention_bytes', 'retention_age') and value is None:
+            valid = True
+        else:
+            valid = isinstance(value, (int, float)) and not isinstance(value, bool) and value >= 0 \
+                and (value > 0 or key == 'fsync_interval') \
+                and (isinstance(value, int) or key in ('fsync_interval', 'retention_age'))
+        if not valid:
+            log_error(f"Invalid queue setting '{key}': {value}.")
+            raise ConfigError(f"Invalid queue setting: {key}.")
+    return settings
+
+
+AGING_DEFAULTS = {
+    'default_ttl': 30 * 86400,
+    'types': {},
+    'sources': {},
+    'tick': 60,
+    'expire_interval': 60,
+}
+
+# Settings of an 'aging' source entry
+AGING_SOURCE_KEYS = ('ttl', 'types')
+
+
+def _valid_ttl(value):
+    return value is None or isinstance(value, (int, float)) and not isinstance(value, bool) and value > 0
+
+
+def get_aging_config(config):
+    """
+    Return the indicator expiry settings from the optional 'aging' section, filled in with defaults.
+
+    :param config: (dict) Configuration data as returned by load_config.
+    :return: dict: Aging settings, or None if the section is absent.
+    :raises ConfigError: If a setting has an invalid value.
+    """
+    section = (config or {}).get('aging')
+    if section is None:
+        return None
+    settings = dict(AGING_DEFAULTS, **section)
+    for key, value in settings.items():
+        if key not in AGING_DEFAULTS:
+            log_error(f"Unknown aging setting '{key}'.")
+            raise ConfigError(f"Invalid aging setting: {key}.")
+        if key == 'default_ttl':
+            valid = _valid_ttl(value)
+        elif key == 'types':
+            valid = isinstance(value, dict) and all(_valid_ttl(ttl) for ttl in value.values())
+        elif key == 'sources':
+            valid = isinstance(value, dict) and all(
+                isinstance(source, dict) and set(source) <= set(AGING_SOURCE_KEYS)
+                and _valid_ttl(source.get('ttl')) and isinstance(source.get('types', {}), dict)
+                and all(_valid_ttl(ttl) for ttl in source.get('types', {}).values())
+                for source in value.values())
+        else:
+            valid = isinstance(value, (int, float)) and not isinstance(value, bool) and value > 0
+        if not valid:
+            log_error(f"Invalid aging setting '{key}': {value!r}.")
+            raise ConfigError(f"Invalid aging setting: {key}.")
+    return settings
+
+
+def validate_config(config):
+    """
+    Check a whole configuration before it is used, so that a bad edit is rejected as one unit.
+
+    :param config: (dict) Configuration data as returned by load_config.
+    :return: dict: The configuration, unchanged.
+    :raises ConfigError: If the configuration or one of its sections is invalid.
+    """
+    if not isinstance(config, dict):
+        log_error(f"Invalid configuration: expected a mapping, got {type(config)}.")
+        raise ConfigError("Invalid configuration.")
+    api_keys = config.get('api_keys')
+    if api_keys is not None and (not isinstance(api_keys, dict)
+                                 or not all(isinstance(key, str) and key for key in api_keys.values())):
+        log_error("Invalid configuration: api_keys must map provider names to non-empty strings.")
+        raise ConfigError("Invalid configuration setting: api_keys.")
+    get_http_config(config)
+    get_cache_config(config)
+    get_logging_config(config)
+    for source in config.get('rate_limits') or {}:
+        get_rate_limit_config(config, source)
+    get_health_config(config, None)
+    get_feeds_config(config)
+    get_scheduler_config(config)
+    get_normalization_config(config)
+    get_correlation_config(config)
+    get_export_config(config)
+    get_metrics_config(config)
+    get_enrichment_config(config)
+    get_snapshot_config(config)
+    get_queue_config(config)
+    get_aging_config(config)
+    for source in ((config.get('health') or {}).get('providers') or {}):
+        get_health_config(config, source)
+    return config
+
+
+class ConfigManager:
+    """
+    Parses the configuration file once and reloads it when the file changes.
+
+    get() is cheap enough for hot paths: it returns the memoized configuration and at most every
+    check_interval seconds compares the file's inode, modification time and size with those of the
+    last load. A changed file is parsed and validated in full before it replaces the current
+    configuration, so readers only ever see a complete, valid configuration. A rejected edit is
+    logged and the previous configuration stays in use until the file changes again. Subscribers are
+    called with the new and previous configuration after every successful reload.
+
+    Configurations are shared between readers and must not be modified in place.
+    """
+
+    def __init__(self, config_file=DEFAULT_CONFIG_FILE, check_interval=1.0, validator=validate_config,
+                 clock=time.monotonic):
+        """
+        :param config_file: (str) The path to the YAML configuration file, read on first use.
+        :param check_interval: (float) Minimum seconds between checks of the file on get(); 0 checks every time.
+        :param validator: (callable) Raises ConfigError for an invalid configuration.
+        :param clock: (callable) Monotonic time function, replaceable for testing.
+        """
+        self.config_file = config_file
+        self.check_interval = check_interval
+        self.validator = validator
+        self._clock = clock
+        self._lock = threading.RLock()
+        self._config = None
+        self._signature = None
+        self._checked_at = None
+        self._subscribers = []
+        self._watcher = None
+        self._stop = threading.Event()
+        self.reloads = 0
+        self.rejected_reloads = 0
+
+    def _stat(self):
+        try:
+            stat = os.stat(self.config_file)
+        except OSError:
+            return None
+        return stat.st_dev, stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def get(self):
+        """
+        Return the current configuration, loading it on first use and reloading it if the file changed.
+
+        :return: dict: Configuration data.
+        :raises ConfigError: If the configuration cannot be loaded the first time.
+        """
+        config = self._config
+        if config is None:
+            with self._lock:
+                if self._config is None:
+                    self.reload()
+                return self._config
+        checked_at = self._checked_at
+        if checked_at is None or self._clock() - checked_at >= self.check_interval:
+            self.check()
+        return self._config
+
+    def check(self):
+        """
+        Reload the configuration if the file was replaced or modified since the last load.
+
+        :return: (bool) True if a new configuration was swapped in.
+        """
+        # Stat, compare and reload as one step, so concurrent callers do not both see the change
+        with self._lock:
+            self._checked_at = self._clock()
+            if self._config is not None and self._stat() == self._signature:
+                return False
+            swapped, notification = self._load()
+        self._notify(notification)
+        return swapped
+
+    def reload(self):
+        """
+        Parse and validate the configuration file, swap it in and notify subscribers.
+
+        :return: (bool) True if a new configuration was swapped in, False if it was rejected.
+        :raises ConfigError: If the configuration cannot be loaded the first time.
+        """
+        with self._lock:
+            swapped, notification = self._load()
+        self._notify(notification)
+        return swapped
+
+    def _load(self):
+        """
+        Load the file in place of the current configuration; called with the lock held.
+
+        :return: (tuple) Whether a configuration was swapped in, and the subscribers to notify with the new
+            and previous configuration, or None.
+        """
+        # Stat before reading, so a write racing with the read is picked up by the next check
+        signature = self._stat()
+        try:
+            config = load_config(self.config_file)
+            if config is None:
+                config = {}
+            self.validator(config)
+        except (ConfigError, OSError) as e:
+            if self._config is None:
+                raise
+            log_error(f"Rejected reload of {self.config_file}, keeping the previous configuration: {e}",
+                      level="WARNING")
+            self._signature = signature
+            self.rejected_reloads += 1
+            return False, None
+        previous = self._config
+        self._config = config
+        self._signature = signature
+        self._checked_at = self._clock()
+        if previous is None:
+            return True, None
+        self.reloads += 1
+        return True, (list(self._subscribers), config, previous)
+
+    @staticmethod
+    def _notify(notification):
+        # Outside the lock, so subscribers may read the configuration from other threads
+        if notification is None:
+            return
+        subscribers, config, previous = notification
+        for callback in subscribers:
+            try:
+                callback(config, previous)
+            except Exception as e:
+                log_error(f"Configuration subscriber {callback!r} failed: {e}")
+
+    def subscribe(self, callback):
+        """
+        Register a callback for configuration changes.
+
+        :param callback: (callable) Called as callback(new_config, previous_config) after each reload.
+        """
+        with self._lock:
+            self._subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        """
+        Remove a callback registered with subscribe.
+
+        :param callback: (callable) The callback to remove.
+        """
+        with self._lock:
+            if callback in self._subscribers:
+                self._subscribers.remove(callback)
+
+    def start(self, interval=None):
+        """
+        Watch the file from a background thread, so subscribers are notified even when get() is not called.
+
+        :param interval: (float) Seconds between checks; defaults to check_interval.
+        """
+        if self._watcher is not None:
+            return
+        interval = interval if interval is not None else max(self.check_interval, 0.1)
+        self._stop.clear()
+
+        def watch():
+            while not self._stop.wait(interval):
+                try:
+                    self.check()
+                except Exception as e:
+                    log_error(f"Configuration watcher failed: {e}")
+
+        self._watcher = threading.Thread(target=watch, name="config-watcher", daemon=True)
+        self._watcher.start()
+
+    def stop(self):
+        """
+        Stop the background watcher started by start.
+        """
+        if self._watcher is None:
+            return
+        self._stop.set()
+        self._watcher.join()
+        self._watcher = None
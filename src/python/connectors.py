@@ -0,0 +1,392 @@
+#  IntelliSIEM Copyright 2024, Rob Perry
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import abc
+import base64
+import csv
+import glob
+import importlib
+import os
+import threading
+from datetime import datetime, timezone
+
+from src.python.error_handling import ConfigError, DataError, log_error
+from src.python.json_stream import iter_json_items
+
+FILE_CHUNK_SIZE = 64 * 1024
+
+# Pages a full fetch of a REST feed reads unless its pagination sets max_pages
+FETCH_MAX_PAGES = 1
+
+# Built-in connector types, imported on first use. Other types are given as "package.module:ClassName".
+CONNECTOR_TYPES = {
+    'rest': 'src.python.connectors:RestConnector',
+    'taxii': 'src.python.connectors:TAXIIConnector',
+    'csv': 'src.python.connectors:CSVConnector',
+    'stix': 'src.python.connectors:STIXConnector',
+}
+
+_classes = {}
+_classes_lock = threading.Lock()
+
+
+def register_connector(type_name, connector):
+    """
+    Register a connector type so feeds can declare it by name.
+
+    :param type_name: (str) The name used in a feed's 'type' setting.
+    :param connector: (type or str) The connector class, or its "package.module:ClassName" path to import on first use.
+    """
+    with _classes_lock:
+        CONNECTOR_TYPES[type_name] = connector
+        _classes.pop(type_name, None)
+
+
+def connector_class(type_name):
+    """
+    Resolve a feed type to its connector class, importing the class's module on first use.
+
+    :param type_name: (str) A registered type name, or a "package.module:ClassName" path.
+    :return: (type) The connector class.
+    :raises ConfigError: If the type is unknown or cannot be imported.
+    """
+    with _classes_lock:
+        cls = _classes.get(type_name)
+        if cls is not None:
+            return cls
+        target = CONNECTOR_TYPES.get(type_name, type_name)
+        if isinstance(target, str):
+            module_name, _, class_name = target.partition(':')
+            if not class_name:
+                log_error(f"Unknown feed type: {type_name}.")
+                raise ConfigError(f"Unknown feed type: {type_name}.")
+            try:
+                target = getattr(importlib.import_module(module_name), class_name)
+            except (ImportError, AttributeError) as e:
+                log_error(f"Failed to load connector for feed type {type_name}: {e}.")
+                raise ConfigError(f"Unknown feed type: {type_name}.")
+        _classes[type_name] = target
+        return target
+
+
+def _parse_since(value):
+    """
+    Parse an ISO 8601 watermark into a POSIX timestamp.
+    """
+    moment = datetime.fromisoformat(value)
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return moment.timestamp()
+
+
+class FeedConnector(abc.ABC):
+    """
+    Base class for feed connectors.
+
+    A connector exposes the same interface as FetchSource, so feeds of any type can be fetched by the
+    FetchOrchestrator and collected incrementally. Subclasses implement _iter_records, and HTTP
+    connectors also client_spec. At most 'concurrency' reads of a feed run at the same time.
+    """
+
+    def __init__(self, name, settings, client=None):
+        """
+        :param name: (str) The name of the feed.
+        :param settings: (dict) The feed's settings, see config.get_feeds_config.
+        :param client: (APIClient) The feed's client, for connectors with a client_spec.
+        """
+        self.name = name
+        self.settings = settings
+        self.client = client
+        self.params = settings.get('params')
+        self.timeout = settings.get('timeout')
+        self.interval = settings.get('interval')
+        self.incremental = settings.get('incremental')
+        self._slots = threading.BoundedSemaphore(settings.get('concurrency', 1))
+
+    @classmethod
+    def client_spec(cls, settings, api_keys):
+        """
+        Describe the HTTP client a feed needs.
+
+        :param settings: (dict) The feed's settings.
+        :param api_keys: (dict) The configured API keys.
+        :return: (tuple) The base URL and headers of the feed's client, or None if it needs no client.
+        """
+        return None
+
+    @abc.abstractmethod
+    def _iter_records(self, params):
+        """
+        :param params: (dict) The parameters to read the feed with, or None.
+        :return: (iterable) The feed's records.
+        """
+
+    def iter_records(self, params=None):
+        """
+        Stream the feed's records one at a time.
+
+        :param params: (dict) Optional parameters, such as a watermark, to use instead of the feed's own.
+        :return: (generator) The feed's records.
+        """
+        with self._slots:
+            yield from self._iter_records(params if params is not None else self.params)
+
+    def fetch(self):
+        """
+        Read the whole feed.
+
+        :return: (list) The feed's records.
+        """
+        return list(self.iter_records())
+
+    def __repr__(self):
+        return f"{type(self).__name__}(name={self.name!r})"
+
+
+def feed_headers(settings, api_keys, default_headers=None):
+    """
+    Build the request headers of an HTTP feed from its static headers and 'auth' setting.
+
+    The 'auth' setting names an entry of api_keys and either the header carrying the key, or a
+    username to send the key with in HTTP basic authentication.
+
+    :param settings: (dict) The feed's settings.
+    :param api_keys: (dict) The configured API keys.
+    :param default_headers: (dict) Headers the connector type always sends.
+    :return: (dict) The request headers.
+    :raises ConfigError: If the referenced API key is not configured.
+    """
+    headers = dict(default_headers or {}, **(settings.get('headers') or {}))
+    auth = settings.get('auth')
+    if auth:
+        key = (api_keys or {}).get(auth['api_key'])
+        if key is None:
+            log_error(f"API key '{auth['api_key']}' for a feed is not configured.")
+            raise ConfigError(f"Missing API key: {auth['api_key']}.")
+        if auth.get('username') is not None:
+            token = base64.b64encode(f"{auth['username']}:{key}".encode()).decode()
+            headers['Authorization'] = f"Basic {token}"
+        else:
+            headers[auth.get('header', 'Authorization')] = key
+    return headers
+
+
+class RestConnector(FeedConnector):
+    """
+    A paginated JSON REST API, such as the OTX export or the VirusTotal API.
+
+    Settings: base_url, endpoint, params, headers, auth, and pagination with items_key, next_key,
+    cursor_param and max_pages (see APIClient.iter_data). A full fetch reads max_pages pages, by default
+    only the first, so a feed's params such as a limit bound it against the provider's quota; incremental
+    reads follow every page unless max_pages is set.
+    """
+
+    @classmethod
+    def client_spec(cls, settings, api_keys):
+        return settings['base_url'], feed_headers(settings, api_keys)
+
+    def __init__(self, name, settings, client=None):
+        super().__init__(name, settings, client)
+        self.endpoint = settings['endpoint']
+        self.pagination = settings.get('pagination') or {}
+
+    def fetch(self):
+        """
+        Fetch the records of the feed's first max_pages pages through its client, which may serve them
+        from the response cache.
+
+        :return: (list) The records, in order.
+        """
+        pagination = dict(self.pagination)
+        pagination.setdefault('max_pages', FETCH_MAX_PAGES)
+        with self._slots:
+            return self.client.get_all(self.endpoint, params=self.params, **pagination)
+
+    def _iter_records(self, params):
+        return self.client.iter_data(self.endpoint, params=params, **self.pagination)
+
+
+class TAXIIConnector(RestConnector):
+    """
+    A TAXII 2.1 collection, read page by page from its objects endpoint.
+
+    Settings: api_root, collection, object_types (default ["indicator"]), page_size, headers and auth.
+    Incremental collection uses the added_after filter.
+    """
+
+    media_type = 'application/taxii+json;version=2.1'
+
+    @classmethod
+    def client_spec(cls, settings, api_keys):
+        return settings['api_root'].rstrip('/'), feed_headers(settings, api_keys, {'Accept': cls.media_type})
+
+    def __init__(self, name, settings, client=None):
+        settings = dict(settings)
+        settings.setdefault('endpoint', f"collections/{settings['collection']}/objects/")
+        settings.setdefault('pagination', {'items_key': 'objects', 'next_key': 'next', 'cursor_param': 'next'})
+        settings.setdefault('incremental', {'mode': 'timestamp', 'param': 'added_after'})
+        params = dict(settings.get('params') or {})
+        object_types = settings.get('object_types', ['indicator'])
+        if object_types:
+            params['match[type]'] = ','.join(object_types)
+        if settings.get('page_size'):
+            params['limit'] = settings['page_size']
+        settings['params'] = params
+        super().__init__(name, settings, client)
+
+
+class FileConnector(FeedConnector):
+    """
+    Base class for file drops: every file matching the 'path' glob is read in name order.
+
+    Incremental collection with a timestamp watermark skips files not modified since the watermark.
+    """
+
+    def _files(self, params):
+        since = (params or {}).get('modified_since')
+        cutoff = _parse_since(since) if since else None
+        for path in sorted(glob.glob(self.settings['path'])):
+            if cutoff is not None and os.path.getmtime(path) < cutoff:
+                continue
+            yield path
+
+    def _iter_records(self, params):
+        for path in self._files(params):
+            try:
+                yield from self._read(path)
+            except OSError as e:
+                log_error(f"Failed to read {path} for feed {self.name}: {e}.")
+                raise DataError("Failed to read feed file.")
+
+    @abc.abstractmethod
+    def _read(self, path):
+        """
+        :param path: (str) A file of the feed.
+        :return: (iterable) The file's records.
+        """
+
+
+class CSVConnector(FileConnector):
+    """
+    CSV file drops, such as blocklists exported by other tools.
+
+    Settings: path, delimiter (default ","), columns (default: read from the header row), id_column
+    (default "id"), indicator_type to set on every record, and encoding. Rows starting with '#' are
+    skipped.
+    """
+
+    def __init__(self, name, settings, client=None):
+        settings = dict(settings)
+        settings.setdefault('incremental', {'mode': 'timestamp', 'param': 'modified_since'})
+        super().__init__(name, settings, client)
+
+    def _read(self, path):
+        settings = self.settings
+        id_column = settings.get('id_column', 'id')
+        indicator_type = settings.get('indicator_type')
+        with open(path, newline='', encoding=settings.get('encoding', 'utf-8')) as file:
+            lines = (line for line in file if not line.startswith('#'))
+            reader = csv.DictReader(lines, fieldnames=settings.get('columns'),
+                                    delimiter=settings.get('delimiter', ','))
+            for row in reader:
+                record = {key: value for key, value in row.items() if key is not None}
+                if id_column != 'id' and record.get(id_column):
+                    record['id'] = record[id_column]
+                if indicator_type and not record.get('type'):
+                    record['type'] = indicator_type
+                yield record
+
+
+class STIXConnector(FileConnector):
+    """
+    STIX 2.x bundle file drops, parsed incrementally so large bundles are never held in memory.
+
+    Settings: path and object_types (default ["indicator"]; empty for all objects).
+    """
+
+    def __init__(self, name, settings, client=None):
+        settings = dict(settings)
+        settings.setdefault('incremental', {'mode': 'timestamp', 'param': 'modified_since'})
+        super().__init__(name, settings, client)
+        self.object_types = set(settings.get('object_types', ['indicator']) or ())
+
+    def _read(self, path):
+        object_types = self.object_types
+        with open(path, encoding='utf-8') as file:
+            chunks = iter(lambda: file.read(FILE_CHUNK_SIZE), '')
+            try:
+                for item in iter_json_items(chunks, items_key='objects'):
+                    if not object_types or (isinstance(item, dict) and item.get('type') in object_types):
+                        yield item
+            except ValueError as e:
+                log_error(f"Invalid STIX bundle {path} for feed {self.name}: {e}.")
+                raise DataError("Corrupt data received.")
+
+
+class FeedRegistry:
+    """
+    The configured feeds, built into connectors on demand.
+
+    Only the feeds actually requested are built, and a connector's module is imported the first
+    time a feed of its type is built. Connectors are kept, so their concurrency limits hold across
+    runs.
+    """
+
+    def __init__(self, feeds, api_keys=None, client_factory=None):
+        """
+        :param feeds: (dict) Feed settings keyed by name, in merge order, see config.get_feeds_config.
+        :param api_keys: (dict) The configured API keys.
+        :param client_factory: (callable) Called as client_factory(name, base_url, headers) to get a feed's client.
+        """
+        self.feeds = feeds
+        self.api_keys = api_keys or {}
+        self.client_factory = client_factory
+        self._lock = threading.Lock()
+        self._connectors = {}
+
+    def names(self, enabled_only=True):
+        """
+        :param enabled_only: (bool) Whether to leave out feeds with enabled set to false.
+        :return: (list) Feed names in merge order.
+        """
+        return [name for name, settings in self.feeds.items() if settings.get('enabled', True) or not enabled_only]
+
+    def get(self, name):
+        """
+        Return a feed's connector, building it on first use.
+
+        :param name: (str) The name of the feed.
+        :return: (FeedConnector) The connector.
+        :raises ConfigError: If the feed is not configured or its type cannot be loaded.
+        """
+        with self._lock:
+            connector = self._connectors.get(name)
+            if connector is not None:
+                return connector
+            settings = self.feeds.get(name)
+            if settings is None:
+                log_error(f"Feed is not configured: {name}.")
+                raise ConfigError(f"Unknown feed: {name}.")
+            cls = connector_class(settings['type'])
+            spec = cls.client_spec(settings, self.api_keys)
+            client = self.client_factory(name, *spec) if spec is not None else None
+            connector = self._connectors[name] = cls(name, settings, client)
+            return connector
+
+    def connectors(self, names=None):
+        """
+        :param names: (list) The feeds to return, or None for every enabled feed.
+        :return: (list) The connectors, in merge order.
+        """
+        return [self.get(name) for name in (names if names is not None else self.names())]
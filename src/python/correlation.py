@@ -0,0 +1,233 @@
+#  IntelliSIEM Copyright 2024, Rob Perry
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import heapq
+import math
+import threading
+import time
+from datetime import datetime
+
+from src.python.error_handling import DataError, log_error
+
+DAY = 86400.0
+
+
+def _epoch(value):
+    if value is None or isinstance(value, (int, float)):
+        return value
+    return datetime.fromisoformat(value).timestamp()
+
+
+class CorrelatedIndicator:
+    """
+    One observable merged across every source that reported it.
+    """
+
+    __slots__ = ('id', 'type', 'value', 'reports', 'sightings', 'first_seen', 'last_seen', 'tags', 'ttps',
+                 'base_score', 'rank_key')
+
+    def __init__(self, id, type, value):
+        """
+        :param id: (str) The normalized indicator id, e.g. "ipv4:10.0.0.1".
+        :param type: (str) The normalized indicator type.
+        :param value: (str) The canonical observable.
+        """
+        self.id = id
+        self.type = type
+        self.value = value
+        # Per source: the last time it reported the observable and the confidence it gave, in [0, 1]
+        self.reports = {}
+        self.sightings = 0
+        self.first_seen = None
+        self.last_seen = None
+        self.tags = set()
+        self.ttps = set()
+        self.base_score = 0.0
+        self.rank_key = None
+
+    @property
+    def sources(self):
+        """
+        :return: (list) The names of the sources that reported the observable.
+        """
+        return sorted(self.reports)
+
+    def __repr__(self):
+        return f"CorrelatedIndicator(id={self.id!r}, sources={self.sources!r}, base_score={self.base_score:.1f})"
+
+
+class CorrelationEngine:
+    """
+    Deduplicates normalized indicators across sources and ranks them by a composite threat score.
+
+    The score of an observable, between 0 and 100, is the product of:
+
+    - reputation: the chance that at least one reporting source is right, 1 - prod(1 - weight * confidence),
+      from each source's configured weight and the confidence it reported (1 when it reported none);
+    - corroboration: 1 - 0.5 ** sightings, where a sighting is a report newer than the last one
+      received from that source, so re-delivered records do not inflate it;
+    - recency: 0.5 ** (age / half_life), with age measured from the most recent report.
+
+    Every score decays at the same rate, so the ranking only changes when an indicator is updated:
+    indicators are kept in a heap ordered by the time-invariant key log2(base score) + last_seen /
+    half_life, and the decay is applied when a score is read. Rescoring pushes a new entry in
+    O(log n) and leaves the old one behind, recognised as stale and dropped when top reaches it; the
+    heap is rebuilt once stale entries outnumber the indicators.
+    """
+
+    def __init__(self, source_weights=None, default_weight=0.5, half_life_days=30, clock=time.time):
+        """
+        :param source_weights: (dict) Reputation of each source, between 0 and 1, keyed by source name.
+        :param default_weight: (float) Reputation of sources without a weight.
+        :param half_life_days: (float) Days after which an unconfirmed indicator's score halves.
+        :param clock: (callable) Wall-clock time function, replaceable for testing.
+        """
+        self.source_weights = dict(source_weights or {})
+        self.default_weight = default_weight
+        self.half_life = half_life_days * DAY
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._indicators = {}
+        self._ranking = []
+
+    def _rescore(self, indicator):
+        miss = 1.0
+        for source, (_, confidence) in indicator.reports.items():
+            weight = self.source_weights.get(source, self.default_weight)
+            miss *= 1.0 - weight * (1.0 if confidence is None else confidence)
+        indicator.base_score = 100.0 * (1.0 - miss) * (1.0 - 0.5 ** indicator.sightings)
+
+        if indicator.base_score > 0:
+            key = math.log2(indicator.base_score) + indicator.last_seen / self.half_life
+            rank_key = (-key, indicator.id)
+            if rank_key != indicator.rank_key:
+                indicator.rank_key = rank_key
+                heapq.heappush(self._ranking, rank_key)
+        else:
+            indicator.rank_key = None
+
+    def _compact(self):
+        """
+        Rebuild the ranking heap without its stale entries.
+        """
+        self._ranking = [indicator.rank_key for indicator in self._indicators.values()
+                         if indicator.rank_key is not None]
+        heapq.heapify(self._ranking)
+
+    def update(self, indicators):
+        """
+        Merge a batch of normalized indicators and rescore the observables it touches.
+
+        :param indicators: (iterable) Normalized indicators, as produced by normalization.Normalizer.
+        :return: (set) The ids of the observables whose score changed.
+        :raises DataError: If an indicator lacks a required field.
+        """
+        now = self._clock()
+        touched = {}
+        with self._lock:
+            for record in indicators:
+                try:
+                    indicator_id = record['id']
+                    source = record['source']
+                    seen = _epoch(record.get('last_seen')) or _epoch(record.get('first_seen')) or now
+                    first_seen = _epoch(record.get('first_seen')) or seen
+                    confidence = record.get('confidence')
+                    confidence = None if confidence is None else min(max(float(confidence) / 100.0, 0.0), 1.0)
+                except (KeyError, TypeError, ValueError) as e:
+                    log_error(f"Cannot correlate indicator {record!r}: {e}.")
+                    raise DataError("Missing required data keys.")
+
+                indicator = self._indicators.get(indicator_id)
+                if indicator is None:
+                    indicator = self._indicators[indicator_id] = CorrelatedIndicator(
+                        indicator_id, record.get('type'), record.get('value'))
+                previous = indicator.reports.get(source)
+                if previous is not None and seen <= previous[0]:
+                    if confidence is None or confidence == previous[1]:
+                        continue
+                    indicator.reports[source] = (previous[0], confidence)
+                else:
+                    indicator.reports[source] = (seen, confidence)
+                    indicator.sightings += 1
+                indicator.first_seen = first_seen if indicator.first_seen is None \
+                    else min(indicator.first_seen, first_seen)
+                indicator.last_seen = seen if indicator.last_seen is None else max(indicator.last_seen, seen)
+                indicator.tags.update(record.get('tags') or ())
+                indicator.ttps.update(record.get('ttps') or ())
+                touched[indicator_id] = indicator
+
+            for indicator in touched.values():
+                self._rescore(indicator)
+            if len(self._ranking) > 2 * len(self._indicators):
+                self._compact()
+        return set(touched)
+
+    def score(self, indicator, now=None):
+        """
+        :param indicator: (CorrelatedIndicator) An indicator of this engine.
+        :param now: (float) POSIX time to score at; defaults to the clock.
+        :return: (float) The composite threat score at that time, between 0 and 100.
+        """
+        now = self._clock() if now is None else now
+        age = max(now - indicator.last_seen, 0.0)
+        return indicator.base_score * 0.5 ** (age / self.half_life)
+
+    def get(self, indicator_id):
+        """
+        :param indicator_id: (str) A normalized indicator id.
+        :return: (CorrelatedIndicator) The merged indicator, or None.
+        """
+        return self._indicators.get(indicator_id)
+
+    def top(self, limit=100, min_score=0.0, types=None):
+        """
+        Return the highest scoring indicators, best first.
+
+        :param limit: (int) The largest number of indicators returned.
+        :param min_score: (float) The lowest current score returned.
+        :param types: (iterable) Normalized indicator types to return, or None for every type.
+        :return: (list) Tuples of the current score and the CorrelatedIndicator.
+        """
+        types = set(types) if types is not None else None
+        now = self._clock()
+        ranked = []
+        with self._lock:
+            # Pop entries best first and push the live ones back afterwards; stale entries are dropped
+            ranking = self._ranking
+            live = []
+            try:
+                while ranking:
+                    rank_key = heapq.heappop(ranking)
+                    indicator = self._indicators[rank_key[1]]
+                    if indicator.rank_key != rank_key:
+                        continue
+                    live.append(rank_key)
+                    score = self.score(indicator, now)
+                    if score < min_score:
+                        break
+                    if types is not None and indicator.type not in types:
+                        continue
+                    ranked.append((score, indicator))
+                    if len(ranked) >= limit:
+                        break
+            finally:
+                for rank_key in live:
+                    heapq.heappush(ranking, rank_key)
+        return ranked
+
+    def __len__(self):
+        return len(self._indicators)
+
+    def __contains__(self, indicator_id):
+        return indicator_id in self._indicators
@@ -12,11 +12,856 @@
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
 
+import os
+import threading
+from datetime import datetime, timedelta, timezone
+
+from src.python.aging import AgingEngine, AgingPolicy
 from src.python.api_client import APIClient
-from src.python.config import load_config
-from src.python.error_handling import APIError, DataError, log_error
+from src.python.config import (ConfigManager, DEFAULT_CONFIG_FILE, get_aging_config, get_cache_config,
+                               get_correlation_config, get_enrichment_config, get_export_config, get_feeds_config,
+                               get_health_config, get_http_config, get_logging_config, get_normalization_config,
+                               get_queue_config, get_rate_limit_config, get_snapshot_config)
+from src.python.connectors import FeedRegistry, connector_class
+from src.python.correlation import CorrelationEngine
+from src.python.error_handling import APIError, ConfigError, DataError, configure_logging, log_error
+from src.python.export import Exporter, ExportSpool, create_sink
+from src.python.fetch_orchestrator import FetchOrchestrator, SourceResult, STATUS_ERROR, STATUS_OK, STATUS_TIMEOUT
+from src.python.indicator_store import IndicatorStore
+from src.python.indicators import IndicatorSet, PayloadSpool, record_timestamp
+from src.python.ingest_queue import IngestQueue
+from src.python.metrics import RECORDS, STAGE_SECONDS
+from src.python.normalization import Normalizer
+from src.python.provider_health import get_provider_health
+from src.python.rate_limit import get_rate_limiter
+from src.python.response_cache import ResponseCache
+from src.python.snapshot import write_snapshot
+from src.python.state_store import StateStore
+from src.python.validation import Schema
+
+# Declarative schema that every entry must satisfy
+DEFAULT_SCHEMA = {'id': {'required': True, 'types': ['str', 'int']}}
+
+# Share of a page's entries that may be rejected before the whole page is treated as corrupt
+DEFAULT_MAX_REJECT_RATIO = 0.5
+
+# Number of entries merged into the indicator set at a time
+MERGE_BATCH_SIZE = 10000
+
+# Number of streamed entries validated together, as one page, by iter_threat_data and iter_normalized
+STREAM_BATCH_SIZE = 1000
+
+# Ingest queue entries read at a time by process_queue
+QUEUE_POLL_ENTRIES = 100
+
+# Watermark modes for incremental collection
+WATERMARK_TIMESTAMP = 'timestamp'
+WATERMARK_FIELD = 'field'
+
+
+def _advance_watermark(source, watermark, entry):
+    """
+    Return the field watermark after seeing an entry, i.e. the largest value of the configured field.
+    """
+    value = entry.get(source.incremental['field'])
+    if value is None:
+        return watermark
+    try:
+        return value if watermark is None or value > watermark else watermark
+    except TypeError:
+        log_error(f"Incomparable watermark value from {source.name}: {value!r}.", level="WARNING")
+        return watermark
+
+
+class ThreatDataCollector:
+    """
+    Collects threat intelligence from the configured providers.
+
+    Creating a collector does no I/O. The configuration is loaded, and the log pipeline described in
+    its optional 'logging' section attached, on first use; the response cache and the API clients are
+    opened when a collection first needs them. Clients are then kept between runs so their pooled
+    connections stay open across polls.
+
+    A collector reading a configuration file picks up edits to it without a restart: rotated API
+    keys, rate limits and provider health settings are pushed to the existing clients, while changed
+    connection pool or cache settings close them so they are rebuilt on next use.
+    """
+
+    def __init__(self, config_file=DEFAULT_CONFIG_FILE, config=None, check_interval=1.0):
+        """
+        :param config_file: (str) The path to the YAML configuration file, read on first use.
+        :param config: (dict) Fixed configuration data to use instead of reading config_file.
+        :param check_interval: (float) Minimum seconds between checks of config_file for changes.
+        """
+        self.config_file = config_file
+        self.config_manager = ConfigManager(config_file, check_interval) if config is None else None
+        self._config = config
+        self._initialized = False
+        self._lock = threading.RLock()
+        self._schema = None
+        self._feeds = None
+        self._clients = {}
+        self._cache = None
+        self._normalizer = None
+        self._orchestrator = None
+
+    @property
+    def config(self):
+        """
+        :return: (dict) The current configuration, loaded on first access.
+        :raises ConfigError: If there is an error with the configuration file.
+        """
+        if not self._initialized:
+            with self._lock:
+                if not self._initialized:
+                    if self.config_manager is not None:
+                        self._config = self.config_manager.get()
+                        self.config_manager.subscribe(self._on_config_change)
+                    settings = get_logging_config(self._config)
+                    if settings is not None:
+                        configure_logging(**settings)
+                    self._initialized = True
+        if self.config_manager is not None:
+            return self.config_manager.get()
+        return self._config
+
+    def _on_config_change(self, config, previous):
+        """
+        Apply a reloaded configuration to the log pipeline, the schema and the open clients.
+
+        :param config: (dict) The new configuration.
+        :param previous: (dict) The configuration it replaces.
+        """
+        with self._lock:
+            self._config = config
+            self._schema = None
+            self._feeds = None
+            if self._normalizer is not None \
+                    and get_normalization_config(config) != get_normalization_config(previous):
+                self._normalizer.close()
+                self._normalizer = None
+            if self._orchestrator is not None and config.get('collection') != previous.get('collection'):
+                self._orchestrator.close()
+                self._orchestrator = None
+            if config.get('logging') != previous.get('logging'):
+                settings = get_logging_config(config)
+                if settings is not None:
+                    configure_logging(**settings)
+            if get_http_config(config) != get_http_config(previous) \
+                    or get_cache_config(config) != get_cache_config(previous):
+                self._close_clients()
+                return
+            feeds = get_feeds_config(config)
+            for name, client in list(self._clients.items()):
+                settings = feeds.get(name)
+                try:
+                    spec = connector_class(settings['type']).client_spec(settings, config.get('api_keys')) \
+                        if settings is not None and settings['enabled'] else None
+                except ConfigError:
+                    spec = None
+                if spec is None or spec[0] != client.base_url:
+                    # The feed was removed, disabled or moved; its client is rebuilt if it is needed again
+                    client.close()
+                    del self._clients[name]
+                    continue
+                client.update_headers(spec[1])
+                client.rate_limiter = get_rate_limiter(name, get_rate_limit_config(config, name))
+                client.health = get_provider_health(name, get_health_config(config, name))
+
+    @property
+    def normalizer(self):
+        """
+        :return: (Normalizer) The normalization stage configured in the optional 'normalization' section.
+        """
+        with self._lock:
+            if self._normalizer is None:
+                self._normalizer = Normalizer(**get_normalization_config(self.config))
+            return self._normalizer
+
+    @property
+    def schema(self):
+        """
+        :return: (Schema) The compiled schema from the optional 'validation' section.
+        """
+        if self._schema is None:
+            fields = (self.config.get('validation') or {}).get('fields')
+            self._schema = Schema(fields or DEFAULT_SCHEMA)
+        return self._schema
+
+    @property
+    def max_reject_ratio(self):
+        """
+        :return: (float) The share of a page that may be rejected before the page is treated as corrupt.
+        """
+        return (self.config.get('validation') or {}).get('max_reject_ratio', DEFAULT_MAX_REJECT_RATIO)
+
+    def _get_cache(self):
+        """
+        Return the response cache shared by all clients, opening it on first use.
+
+        :return: (ResponseCache) The shared cache, or None if caching is not configured.
+        """
+        with self._lock:
+            settings = get_cache_config(self.config)
+            if self._cache is None and settings is not None:
+                self._cache = ResponseCache(**settings)
+            return self._cache
+
+    def _get_client(self, name, base_url, headers):
+        """
+        Return the long-lived client for a feed, creating it on first use or updating its headers.
+
+        :param name: (str) The name of the feed.
+        :param base_url: (str) The base URL of the feed's API.
+        :param headers: (dict) Headers required for API requests.
+        :return: (APIClient) The feed's client.
+        """
+        config = self.config
+        with self._lock:
+            client = self._clients.get(name)
+            if client is not None and client.base_url != base_url:
+                client.close()
+                client = None
+            if client is None:
+                client = APIClient(base_url, headers, http_config=get_http_config(config),
+                                   rate_limiter=get_rate_limiter(name, get_rate_limit_config(config, name)),
+                                   cache=self._get_cache(),
+                                   health=get_provider_health(name, get_health_config(config, name)), name=name)
+                self._clients[name] = client
+            elif client.headers != headers:
+                client.update_headers(headers)
+            return client
+
+    @property
+    def feeds(self):
+        """
+        :return: (FeedRegistry) The feeds declared in the configuration, built into connectors on demand.
+        """
+        with self._lock:
+            if self._feeds is None:
+                config = self.config
+                self._feeds = FeedRegistry(get_feeds_config(config), config.get('api_keys'), self._get_client)
+            return self._feeds
+
+    def _build_sources(self, feeds=None):
+        """
+        Build the connectors of the configured feeds, in merge order.
+
+        :param feeds: (list) The names of the feeds to build, or None for every enabled feed.
+        :return: (list) FeedConnector objects, usable wherever a FetchSource is.
+        """
+        return self.feeds.connectors(feeds)
+
+    def _build_orchestrator(self):
+        """
+        Return the fetch orchestrator configured in the optional 'collection' section of the configuration,
+        building it on first use so its worker threads are shared by every run.
+
+        :return: (FetchOrchestrator) The configured orchestrator.
+        """
+        with self._lock:
+            if self._orchestrator is None:
+                settings = self.config.get('collection') or {}
+                self._orchestrator = FetchOrchestrator(max_workers=settings.get('max_workers', 4),
+                                                       source_timeout=settings.get('source_timeout'),
+                                                       overall_timeout=settings.get('overall_timeout'))
+            return self._orchestrator
+
+    def validate_entry(self, entry):
+        """
+        Validate a single threat intelligence entry.
+
+        :param entry: (dict) The entry to validate.
+        :return: (dict) The validated entry.
+        :raises DataError: If the entry is corrupt or missing required keys.
+        """
+        rejection = self.schema.check(entry)
+        if rejection is not None:
+            log_error(f"Invalid entry ({rejection.reason}): {entry}.")
+            raise DataError(rejection.error)
+        return entry
+
+    def validate_entries(self, entries, source_name=None):
+        """
+        Validate a page of threat intelligence entries in one pass, dropping the invalid ones.
+
+        Rejected entries are logged with their reasons. Only when the share of rejected entries exceeds
+        the configured max_reject_ratio is the page treated as corrupt and a DataError raised.
+
+        :param entries: (list) The entries to validate.
+        :param source_name: (str) The source the entries came from, for logging.
+        :return: (list) The valid entries, in their original order.
+        :raises DataError: If too many entries are corrupt or missing required keys.
+        """
+        source = source_name or 'unknown'
+        with STAGE_SECONDS.time(source, 'validate'):
+            result = self.schema.validate_batch(entries)
+        RECORDS.inc(source, 'valid', amount=len(result.valid))
+        if result.rejected:
+            RECORDS.inc(source, 'rejected', amount=len(result.rejected))
+            first = result.rejected[0]
+            total = len(result.valid) + len(result.rejected)
+            log_error(f"Rejected {len(result.rejected)} of {total} entries from {source_name or 'unknown source'}; "
+                      f"first rejected entry ({first.reason}): {first.record}.")
+            if result.reject_ratio > self.max_reject_ratio:
+                raise DataError(first.error)
+        return result.valid
+
+    def collect_threat_data(self, allow_partial=True, feeds=None):
+        """
+        Fetch threat data from all configured sources concurrently.
+
+        Sources are fetched at the same time and merged in their configured order. When allow_partial is
+        True, sources that failed or missed their deadline are skipped and reported in the per-source
+        status; otherwise the first failure is raised.
+
+        :param allow_partial: (bool) Whether to return data from the sources that finished in time.
+        :param feeds: (list) The names of the feeds to fetch, or None for every enabled feed.
+        :return: (tuple) The list of validated entries and a dict of SourceResult objects keyed by source name.
+        :raises APIError: If allow_partial is False and a source failed or timed out.
+        :raises DataError: If there is an error with data integrity or structure.
+        """
+        results = self._build_orchestrator().run(self._build_sources(feeds))
+
+        merged = []
+        for result in results.values():
+            if result.elapsed is not None:
+                STAGE_SECONDS.observe(result.elapsed, result.name, 'fetch')
+            if not result.ok:
+                if allow_partial:
+                    continue
+                if result.status == STATUS_TIMEOUT:
+                    raise APIError(f"Source '{result.name}' timed out.")
+                raise result.error
+
+            # Validate that the data is a list
+            if not isinstance(result.data, list):
+                log_error(f"Invalid data type received from {result.name}: {type(result.data)}.")
+                raise DataError("Unexpected data type received.")
+            merged.extend(self.validate_entries(result.data, result.name))
+
+        return merged, results
+
+    def fetch_threat_data(self):
+        """
+        Fetch threat data from various sources and return the combined result.
+
+        :return: (list) A list of threat intelligence data.
+        :raises DataError: If there is an error with data integrity or structure.
+        """
+        try:
+            valid_data, _ = self.collect_threat_data(allow_partial=False)
+            return valid_data
+
+        except APIError as e:
+            log_error(f"Failed to fetch threat data: {e}")
+            return []
+        except (KeyError, TypeError, ValueError) as e:
+            log_error(f"Data error occurred: {e}")
+            raise DataError("Corrupt data received.")
+
+    def iter_threat_data(self, feeds=None):
+        """
+        Stream validated threat data from all configured sources, one indicator at a time.
+
+        Sources are read in their configured order and each provider's export is paginated and parsed
+        incrementally, so peak memory does not depend on the size of the export.
+
+        Entries are validated STREAM_BATCH_SIZE at a time like a fetched page: invalid ones are logged
+        and dropped, and only a chunk with more than max_reject_ratio invalid entries raises.
+
+        :param feeds: (list) The names of the feeds to read, or None for every enabled feed.
+        :return: (generator) Validated threat intelligence entries.
+        :raises APIError: If there is an error with an API request.
+        :raises DataError: If there is an error with data integrity or structure.
+        """
+        for source in self._build_sources(feeds):
+            yield from self._iter_valid(source)
+
+    def _iter_valid(self, source):
+        """
+        :param source: (FeedConnector) The source to read.
+        :return: (generator) The source's valid entries, validated in chunks of STREAM_BATCH_SIZE.
+        :raises DataError: If too many entries of a chunk are invalid.
+        """
+        batch = []
+        for entry in source.iter_records():
+            batch.append(entry)
+            if len(batch) >= STREAM_BATCH_SIZE:
+                yield from self.validate_entries(batch, source.name)
+                batch = []
+        if batch:
+            yield from self.validate_entries(batch, source.name)
+
+    def iter_normalized(self, feeds=None):
+        """
+        Stream threat data from all configured sources converted to the common indicator schema.
+
+        Large exports are normalized in parallel by the collector's worker processes; see Normalizer.
+        Entries are validated as in iter_threat_data.
+
+        :param feeds: (list) The names of the feeds to read, or None for every enabled feed.
+        :return: (generator) Normalized indicators as dicts with the keys of normalization.NORMALIZED_FIELDS.
+        :raises APIError: If there is an error with an API request.
+        :raises DataError: If there is an error with data integrity or structure.
+        """
+        normalizer = self.normalizer
+        for source in self._build_sources(feeds):
+            yield from normalizer.imap(self._iter_valid(source), source.name)
+
+    def enrichment_client(self, name, max_concurrency=None):
+        """
+        Create an AsyncAPIClient for looking up single observables at a feed's API, sharing the feed's
+        credentials, rate limiter, response cache and circuit breaker.
+
+        :param name: (str) The name of the feed.
+        :param max_concurrency: (int) The largest number of lookups in flight; defaults to the 'enrichment' setting.
+        :return: (AsyncAPIClient) A new client, to be closed by the caller.
+        :raises ConfigError: If the feed is not configured or has no HTTP API.
+        """
+        # Imported here so that synchronous callers do not pay for asyncio at import time
+        from src.python.async_api_client import AsyncAPIClient
+
+        client = self.feeds.get(name).client
+        if client is None:
+            log_error(f"Feed {name} has no HTTP API to look up observables in.")
+            raise ConfigError(f"Invalid feed setting: {name}.")
+        if max_concurrency is None:
+            max_concurrency = get_enrichment_config(self.config)['max_concurrency']
+        return AsyncAPIClient(client.base_url, client.headers, max_concurrency, http_config=client.http_config,
+                              rate_limiter=client.rate_limiter, cache=client.cache, health=client.health,
+                              name=client.name)
+
+    def correlation_engine(self):
+        """
+        :return: (CorrelationEngine) An empty engine scored as configured in the optional 'correlation' section.
+        """
+        return CorrelationEngine(**get_correlation_config(self.config))
+
+    def correlate(self, engine, feeds=None):
+        """
+        Merge freshly collected indicators into a correlation engine, rescoring only the observables
+        they touch.
+
+        :param engine: (CorrelationEngine) The engine to update.
+        :param feeds: (list) The names of the feeds to collect, or None for every enabled feed.
+        :return: (set) The ids of the observables whose score changed.
+        :raises APIError: If there is an error with an API request.
+        :raises DataError: If there is an error with data integrity or structure.
+        """
+        changed = set()
+        batch = []
+        for indicator in self.iter_normalized(feeds):
+            batch.append(indicator)
+            if len(batch) >= MERGE_BATCH_SIZE:
+                changed |= engine.update(batch)
+                batch = []
+        changed |= engine.update(batch)
+        return changed
+
+    def open_exporters(self):
+        """
+        Create an Exporter for every sink of the optional 'export' section, each with its own spool
+        under spool_dir. Exporters are returned stopped; batches spooled by a previous run are sent
+        once they are started.
+
+        :return: (list) The exporters, empty if export is not configured.
+        :raises ConfigError: If a sink is misconfigured.
+        :raises DataError: If a spool directory cannot be used.
+        """
+        settings = get_export_config(self.config)
+        if settings is None:
+            return []
+        return [Exporter(name, create_sink(name, sink),
+                         ExportSpool(os.path.join(settings['spool_dir'], name), fsync=settings['fsync']),
+                         batch_size=settings['batch_size'], batch_bytes=settings['batch_bytes'],
+                         flush_interval=settings['flush_interval'])
+                for name, sink in settings['sinks'].items()]
+
+    def export(self, exporters, feeds=None):
+        """
+        Stream normalized indicators from the configured feeds to every exporter.
+
+        If the optional 'aging' section is set, each indicator's confidence is decayed by the time since it
+        was last seen, as AgingEngine.confidence does.
+
+        :param exporters: (list) Exporter objects, e.g. from open_exporters.
+        :param feeds: (list) The names of the feeds to collect, or None for every enabled feed.
+        :return: (int) The number of indicators submitted.
+        :raises APIError: If there is an error with an API request.
+        :raises DataError: If there is an error with data integrity or structure.
+        """
+        aging = self.aging_engine()
+        submitted = 0
+        batch = []
+        for indicator in self.iter_normalized(feeds):
+            if aging is not None:
+                last_seen = record_timestamp(indicator, ('last_seen',))
+                if last_seen is not None:
+                    indicator['confidence'] = aging.decay(indicator['confidence'], indicator['type'],
+                                                          indicator['source'], last_seen)
+            batch.append(indicator)
+            if len(batch) >= MERGE_BATCH_SIZE:
+                for exporter in exporters:
+                    exporter.submit(batch)
+                submitted += len(batch)
+                batch = []
+        for exporter in exporters:
+            exporter.submit(batch)
+            exporter.flush()
+        return submitted + len(batch)
+
+    def fetch_indicators(self, keep_payloads=False, feeds=None):
+        """
+        Collect every configured feed into a compact in-memory IndicatorSet.
+
+        Records are streamed and reduced to their core fields page by page, so the full provider
+        records are never all held at once. If the optional 'aging' section is set, the set expires its
+        indicators, those already past their TTL are left out, and the confidence of the others is decayed
+        by the time since they were last seen, so snapshots built from the set carry it too.
+
+        :param keep_payloads: (bool) Whether to keep the provider records in an off-heap PayloadSpool.
+        :param feeds: (list) The names of the feeds to collect, or None for every enabled feed.
+        :return: (IndicatorSet) The collected indicators.
+        :raises APIError: If there is an error with an API request.
+        :raises DataError: If there is an error with data integrity or structure.
+        """
+        indicators = IndicatorSet(PayloadSpool() if keep_payloads else None, aging=self.aging_engine())
+        for source in self._build_sources(feeds):
+            batch = []
+            for entry in source.iter_records():
+                batch.append(entry)
+                if len(batch) >= MERGE_BATCH_SIZE:
+                    self._merge(indicators, batch, source, None)
+                    batch = []
+            self._merge(indicators, batch, source, None)
+        # Records last seen longer than their TTL ago are already stale
+        indicators.expire()
+        if indicators.aging is not None:
+            for indicator in indicators:
+                indicator.confidence = indicators.aging.confidence(indicator)
+        return indicators
+
+    def build_snapshot(self, path=None, feeds=None):
+        """
+        Collect every configured feed into a snapshot file for SIEM forwarder nodes to map.
+
+        :param path: (str) The snapshot file; defaults to the path of the optional 'snapshot' section.
+        :param feeds: (list) The names of the feeds to collect, or None for every enabled feed.
+        :return: (int) The number of indicators written.
+        :raises APIError: If there is an error with an API request.
+        :raises DataError: If there is an error with data integrity or structure, or the file cannot be written.
+        """
+        settings = get_snapshot_config(self.config)
+        return write_snapshot(path or settings['path'], self.fetch_indicators(feeds=feeds),
+                              settings['false_positive_rate'])
+
+    def load_state(self):
+        """
+        Open the collector state store configured in the optional 'incremental' section.
+
+        :return: (StateStore) The state store holding per-source watermarks.
+        """
+        settings = self.config.get('incremental') or {}
+        return StateStore(settings.get('state_path', 'data/collector_state.json'))
+
+    def aging_engine(self):
+        """
+        :return: (AgingEngine) An engine with the TTLs of the optional 'aging' section, or None if it is absent.
+        """
+        settings = get_aging_config(self.config)
+        if settings is None:
+            return None
+        return AgingEngine(AgingPolicy(settings['default_ttl'], settings['types'], settings['sources']),
+                           tick=settings['tick'])
 
-config = load_config()
+    def open_indicator_store(self):
+        """
+        Open the indicator store configured in the optional 'store' section, expiring indicators as
+        configured in the optional 'aging' section.
+
+        :return: (IndicatorStore) The local indicator store.
+        """
+        settings = self.config.get('store') or {}
+        return IndicatorStore(settings.get('path', 'data/indicators.sqlite3'),
+                              batch_size=settings.get('batch_size', MERGE_BATCH_SIZE), aging=self.aging_engine())
+
+    def _merge(self, indicators, batch, source, watermark):
+        """
+        Validate a batch of raw entries and merge the valid ones into an indicator set, an IndicatorStore or
+        another object with the same upsert_many method, such as a BufferedStoreWriter.
+
+        :return: (tuple) The number of entries merged and the source's watermark advanced over them.
+        """
+        valid = self.validate_entries(batch, source.name)
+        if source.incremental and source.incremental['mode'] == WATERMARK_FIELD:
+            for entry in valid:
+                watermark = _advance_watermark(source, watermark, entry)
+        return self._upsert(indicators, valid, source.name), watermark
+
+    @staticmethod
+    def _upsert(indicators, valid, source_name):
+        if hasattr(indicators, 'upsert_many'):
+            return indicators.upsert_many(valid, source_name)
+        for entry in valid:
+            indicators[entry['id']] = entry
+        return len(valid)
+
+    @staticmethod
+    def _incremental_params(source, state):
+        """
+        :return: (tuple) The source's stored watermark, or None, and the request parameters carrying it.
+        """
+        settings = source.incremental
+        watermark = state.get(source.name) if settings and state is not None else None
+        params = dict(source.params or {})
+        if watermark is not None:
+            params[settings['param']] = watermark
+        return watermark, params
+
+    @staticmethod
+    def _save_watermark(source, state, watermark, started):
+        settings = source.incremental
+        if settings and settings['mode'] == WATERMARK_TIMESTAMP:
+            watermark = (started - timedelta(seconds=settings.get('overlap', 0))).isoformat()
+        if settings and watermark is not None:
+            state.set(source.name, watermark)
+
+    def collect_incremental(self, indicators, state, feeds=None):
+        """
+        Fetch only the indicators that are new or changed since each source's watermark and merge them.
+
+        Each source may declare an 'incremental' setting with the query parameter that carries its
+        watermark and a mode:
+
+        - "timestamp": the watermark is the start time of the last successful run, minus an optional
+          'overlap' in seconds, sent in ISO 8601 format (e.g. OTX's modified_since).
+        - "field": the watermark is the largest value of a record 'field' seen so far, such as a
+          modification time or sequence number.
+
+        Sources without the setting are fully re-pulled on every run. A source's watermark is only
+        advanced once all of its pages were merged, so a failed run is retried from the same point.
+        Watermarks are only meaningful together with the indicator set they were merged into; delete
+        them from the state store to force a full re-pull.
+
+        :param indicators: (dict, IndicatorStore or BufferedStoreWriter) The existing indicator set keyed by
+            'id', updated in place.
+        :param state: (StateStore) The store holding per-source watermarks, saved after the run, also
+            when a later source raises.
+        :param feeds: (list) The names of the feeds to collect, or None for every enabled feed, so that
+            feeds can be scheduled independently of each other.
+        :return: (dict) SourceResult objects keyed by source name; the data of each is the number of
+            indicators merged from that source.
+        :raises DataError: If there is an error with data integrity or structure.
+        """
+        results = {}
+        try:
+            for source in self._build_sources(feeds):
+                started = datetime.now(timezone.utc)
+                watermark, params = self._incremental_params(source, state)
+                merged = 0
+                batch = []
+                try:
+                    for entry in source.iter_records(params):
+                        batch.append(entry)
+                        if len(batch) >= MERGE_BATCH_SIZE:
+                            count, watermark = self._merge(indicators, batch, source, watermark)
+                            merged += count
+                            batch = []
+                    count, watermark = self._merge(indicators, batch, source, watermark)
+                    merged += count
+                except APIError as e:
+                    merged += self._merge(indicators, batch, source, watermark)[0]
+                    log_error(f"Incremental collection from {source.name} failed after {merged} indicators: {e}")
+                    results[source.name] = SourceResult(source.name, STATUS_ERROR, data=merged, error=e)
+                    continue
+
+                # Writes that are still buffered must be durable before the watermark moves past them
+                flush = getattr(indicators, 'flush', None)
+                if flush is not None:
+                    flush(source.name)
+                self._save_watermark(source, state, watermark, started)
+                results[source.name] = SourceResult(source.name, STATUS_OK, data=merged)
+        finally:
+            # Keep the watermarks of the sources that finished, even if a later source raised
+            state.save()
+        return results
+
+    def open_ingest_queue(self):
+        """
+        Open the ingest queue configured in the optional 'queue' section.
+
+        :return: (IngestQueue) The queue.
+        :raises DataError: If the queue directory cannot be used.
+        """
+        settings = get_queue_config(self.config)
+        return IngestQueue(settings['directory'], segment_bytes=settings['segment_bytes'], fsync=settings['fsync'],
+                           fsync_interval=settings['fsync_interval'], retention_bytes=settings['retention_bytes'],
+                           retention_age=settings['retention_age'], keep_unconsumed=settings['keep_unconsumed'],
+                           consumers=settings['consumers'])
+
+    def enqueue(self, queue, state=None, feeds=None):
+        """
+        Fetch the configured feeds into an ingest queue, in batches of the provider's raw records, so
+        they can be processed at a different rate and are not fetched again if processing fails.
+
+        With a state store, sources are fetched incrementally as in collect_incremental; a source's
+        watermark is advanced, here over every fetched record, once its records are synced to disk.
+
+        :param queue: (IngestQueue) The queue to append to.
+        :param state: (StateStore) The store holding per-source watermarks, or None to fetch every feed in full.
+        :param feeds: (list) The names of the feeds to fetch, or None for every enabled feed.
+        :return: (dict) SourceResult objects keyed by source name; the data of each is the number of
+            records enqueued from that source.
+        :raises DataError: If the queue cannot be written.
+        """
+        batch_records = get_queue_config(self.config)['batch_records']
+        results = {}
+        for source in self._build_sources(feeds):
+            started = datetime.now(timezone.utc)
+            watermark, params = self._incremental_params(source, state)
+            track_field = state is not None and source.incremental and source.incremental['mode'] == WATERMARK_FIELD
+            enqueued = 0
+            batch = []
+            try:
+                for entry in source.iter_records(params):
+                    batch.append(entry)
+                    if track_field and isinstance(entry, dict):
+                        watermark = _advance_watermark(source, watermark, entry)
+                    if len(batch) >= batch_records:
+                        queue.append(source.name, batch)
+                        enqueued += len(batch)
+                        batch = []
+            except APIError as e:
+                log_error(f"Fetching {source.name} into the ingest queue failed after {enqueued + len(batch)} "
+                          f"records: {e}")
+                results[source.name] = SourceResult(source.name, STATUS_ERROR, data=enqueued + len(batch), error=e)
+                continue
+            finally:
+                if batch:
+                    queue.append(source.name, batch)
+                    enqueued += len(batch)
+                queue.sync()
+            if state is not None:
+                self._save_watermark(source, state, watermark, started)
+            results[source.name] = SourceResult(source.name, STATUS_OK, data=enqueued)
+
+        if state is not None:
+            state.save()
+        return results
+
+    def process_queue(self, queue, indicators, consumer='indicators', max_entries=None):
+        """
+        Validate the records of an ingest queue and merge them into an indicator set, from where the
+        consumer left off. The consumer's offset is committed after every merged batch of entries, so
+        after a crash processing resumes from the queue rather than from the providers.
+
+        An entry rejected by validation as a whole is logged and skipped, so it cannot block the queue.
+
+        :param queue: (IngestQueue) The queue to read.
+        :param indicators: (dict, IndicatorStore or BufferedStoreWriter) The indicator set, updated in place.
+        :param consumer: (str) The name the consumer's offset is stored under.
+        :param max_entries: (int) The largest number of entries processed, or None for all of them.
+        :return: (int) The number of indicators merged.
+        :raises DataError: If the queue cannot be read or the indicators cannot be written.
+        """
+        merged = processed = 0
+        while max_entries is None or processed < max_entries:
+            limit = QUEUE_POLL_ENTRIES if max_entries is None else min(QUEUE_POLL_ENTRIES, max_entries - processed)
+            entries = queue.poll(consumer, limit)
+            if not entries:
+                break
+            for entry in entries:
+                try:
+                    valid = self.validate_entries(entry.records, entry.source)
+                except DataError as e:
+                    log_error(f"Skipping ingest queue entry {entry.offset} from {entry.source}: {e}")
+                    continue
+                merged += self._upsert(indicators, valid, entry.source)
+            # Buffered writes must be durable before the offset moves past them
+            flush = getattr(indicators, 'flush', None)
+            if flush is not None:
+                flush()
+            queue.commit(consumer, entries[-1].offset + 1)
+            processed += len(entries)
+        return merged
+
+    def _close_clients(self):
+        with self._lock:
+            for client in self._clients.values():
+                client.close()
+            self._clients.clear()
+            if self._cache is not None:
+                self._cache.close()
+                self._cache = None
+
+    def close(self):
+        """
+        Close the API clients, the response cache, the fetch workers and the normalization workers opened by
+        this collector, and stop following configuration changes.
+        """
+        if self.config_manager is not None:
+            self.config_manager.unsubscribe(self._on_config_change)
+            self.config_manager.stop()
+        self._close_clients()
+        if self._orchestrator is not None:
+            self._orchestrator.close()
+            self._orchestrator = None
+        if self._normalizer is not None:
+            self._normalizer.close()
+            self._normalizer = None
+
+
+_default_collector = None
+_default_lock = threading.Lock()
+
+
+def get_collector():
+    """
+    Return the process-wide collector used by the module-level functions, creating it on first use.
+
+    :return: (ThreatDataCollector) The default collector, reading config/config.yaml.
+    """
+    global _default_collector
+    if _default_collector is None:
+        with _default_lock:
+            if _default_collector is None:
+                _default_collector = ThreatDataCollector()
+    return _default_collector
+
+
+def set_collector(collector):
+    """
+    Replace the process-wide collector, closing the previous one.
+
+    :param collector: (ThreatDataCollector) The new default collector, or None to create one on next use.
+    """
+    global _default_collector
+    with _default_lock:
+        previous, _default_collector = _default_collector, collector
+    if previous is not None and previous is not collector:
+        previous.close()
+
+
+def validate_entry(entry):
+    """
+    Validate a single threat intelligence entry with the default collector's schema.
+    """
+    return get_collector().validate_entry(entry)
+
+
+def validate_entries(entries, source_name=None):
+    """
+    Validate a page of threat intelligence entries with the default collector's schema.
+    """
+    return get_collector().validate_entries(entries, source_name)
+
+
+def collect_threat_data(allow_partial=True, feeds=None):
+    """
+    Fetch threat data from all configured sources concurrently; see ThreatDataCollector.collect_threat_data.
+    """
+    return get_collector().collect_threat_data(allow_partial, feeds)
 
 
 def fetch_threat_data():
@@ -26,42 +871,55 @@ def fetch_threat_data():
     :return: (list) A list of threat intelligence data.
     :raises DataError: If there is an error with data integrity or structure.
     """
-    try:
-        alien_vault = APIClient("https://otx.alienvault.com/api/v1",
-                                {"X-OTX-API-KEY": config['api_keys']['alien_vault']})
-        vt = APIClient("https://www.virustotal.com/api/v3", {"x-apikey": config['api_keys']['virus_total']})
-
-        alien_vault_data = alien_vault.get_data("indicators/export")
-        vt_data = vt.get_data("files", params={"limit": 10})
-
-        # Validate that the data is a list
-        if not isinstance(alien_vault_data, list) or not isinstance(vt_data, list):
-            log_error(f"Invalid data type received: {type(alien_vault_data)} or {type(vt_data)}.")
-            raise DataError("Unexpected data type received.")
-
-        # Define the required keys for validation
-        required_keys = ['id']
-
-        # Validate data and raise DataError if required keys are missing or if data is corrupt
-        valid_data = []
-        for entry in alien_vault_data + vt_data:
-            if not isinstance(entry, dict):
-                log_error(f"Unexpected data type in entry: {entry}")
-                raise DataError("Unexpected data type received.")
-            # Check if the 'id' key is present and its value is of expected type
-            if 'id' in entry and not isinstance(entry['id'], (str, int)):
-                log_error(f"Corrupt data in entry: {entry}. 'id' key has invalid type.")
-                raise DataError("Corrupt data received.")
-            if any(key not in entry for key in required_keys):
-                log_error(f"Missing required data keys in entry: {entry}.")
-                raise DataError("Missing required data keys.")
-            valid_data.append(entry)
-
-        return valid_data
-
-    except APIError as e:
-        log_error(f"Failed to fetch threat data: {e}")
-        return []
-    except (KeyError, TypeError, ValueError) as e:
-        log_error(f"Data error occurred: {e}")
-        raise DataError("Corrupt data received.")
+    return get_collector().fetch_threat_data()
+
+
+def iter_threat_data(feeds=None):
+    """
+    Stream validated threat data from all configured sources; see ThreatDataCollector.iter_threat_data.
+    """
+    return get_collector().iter_threat_data(feeds)
+
+
+def iter_normalized(feeds=None):
+    """
+    Stream threat data converted to the common indicator schema; see ThreatDataCollector.iter_normalized.
+    """
+    return get_collector().iter_normalized(feeds)
+
+
+def fetch_indicators(keep_payloads=False, feeds=None):
+    """
+    Collect every configured feed into a compact IndicatorSet; see ThreatDataCollector.fetch_indicators.
+    """
+    return get_collector().fetch_indicators(keep_payloads, feeds)
+
+
+def load_state():
+    """
+    Open the collector state store of the default collector.
+    """
+    return get_collector().load_state()
+
+
+def open_indicator_store():
+    """
+    Open the indicator store of the default collector.
+    """
+    return get_collector().open_indicator_store()
+
+
+def collect_incremental(indicators, state, feeds=None):
+    """
+    Merge new or changed indicators into an indicator set; see ThreatDataCollector.collect_incremental.
+    """
+    return get_collector().collect_incremental(indicators, state, feeds)
+
+
+def __getattr__(name):
+    # The configuration used to be loaded at import time; keep it reachable without doing so
+    if name == 'config':
+        return get_collector().config
+    if name == 'SCHEMA':
+        return get_collector().schema
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
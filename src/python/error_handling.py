@@ -12,16 +12,323 @@
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
 
+import atexit
+import json
 import logging
-from logging.handlers import RotatingFileHandler
+import os
+import queue
+import threading
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, RotatingFileHandler
 
-# Set up rotating file handler
-handler = RotatingFileHandler('data/error.log', maxBytes=1000000, backupCount=5)
-handler.setLevel(logging.ERROR)
-handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s: %(message)s'))
+OVERFLOW_DROP_NEWEST = "drop_newest"
+OVERFLOW_DROP_OLDEST = "drop_oldest"
+OVERFLOW_BLOCK = "block"
 
-# Add the handler to the root logger
-logging.basicConfig(level=logging.ERROR, handlers=[handler])
+# Tells the writer thread to drain what is queued and stop
+_STOP = object()
+
+
+class JSONFormatter(logging.Formatter):
+    """
+    Format log records as single-line JSON objects.
+    """
+
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'thread': record.threadName,
+            'message': record.getMessage(),
+        }
+        context = getattr(record, 'context', None)
+        if context:
+            entry['context'] = context
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class BoundedQueueHandler(QueueHandler):
+    """
+    A logging handler that hands records to a bounded queue instead of writing them itself.
+
+    When the queue is full, the overflow policy decides whether the new record is dropped
+    ("drop_newest"), the oldest queued record is dropped to make room ("drop_oldest"), or the
+    caller waits for space ("block"). Dropped records are counted rather than raised.
+    """
+
+    def __init__(self, log_queue, overflow=OVERFLOW_DROP_NEWEST):
+        """
+        :param log_queue: (queue.Queue) The bounded queue drained by a QueueLogWriter.
+        :param overflow: (str) The overflow policy.
+        """
+        if overflow not in (OVERFLOW_DROP_NEWEST, OVERFLOW_DROP_OLDEST, OVERFLOW_BLOCK):
+            raise ValueError(f"Unknown overflow policy: {overflow}.")
+        super().__init__(log_queue)
+        self.overflow = overflow
+        self._counter_lock = threading.Lock()
+        self.enqueued = 0
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Keep the structured context attached to the record for the writer's formatter
+        context = getattr(record, 'context', None)
+        record = super().prepare(record)
+        if context:
+            record.context = context
+        return record
+
+    def enqueue(self, record):
+        try:
+            if self.overflow == OVERFLOW_BLOCK:
+                self.queue.put(record)
+            else:
+                self.queue.put_nowait(record)
+        except queue.Full:
+            queued = False
+            if self.overflow == OVERFLOW_DROP_OLDEST:
+                try:
+                    self.queue.get_nowait()
+                except queue.Empty:
+                    pass
+                try:
+                    self.queue.put_nowait(record)
+                    queued = True
+                except queue.Full:
+                    pass
+            with self._counter_lock:
+                self.dropped += 1
+                self.enqueued += queued
+            return
+        with self._counter_lock:
+            self.enqueued += 1
+
+
+class QueueLogWriter:
+    """
+    A background thread that drains queued log records and writes them to a rotating log file.
+
+    Records are written in batches with a single flush per batch, and file rotation happens on this
+    thread, so callers of log_error never wait on disk I/O.
+    """
+
+    def __init__(self, log_queue, log_file, max_bytes=1000000, backup_count=5, batch_size=256,
+                 flush_interval=0.5, formatter=None):
+        """
+        :param log_queue: (queue.Queue) The queue filled by a BoundedQueueHandler.
+        :param log_file: (str) The path of the log file; it is opened on the first write.
+        :param max_bytes: (int) The size at which the log file is rotated.
+        :param backup_count: (int) The number of rotated files to keep.
+        :param batch_size: (int) The maximum number of records written per flush.
+        :param flush_interval: (float) Seconds to wait for more records before checking for shutdown.
+        :param formatter: (logging.Formatter) The formatter for records, JSON by default.
+        """
+        self.queue = log_queue
+        self.log_file = log_file
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.formatter = formatter or JSONFormatter()
+        self.handler = None
+        self.written = 0
+        self.batches = 0
+        self.errors = 0
+        self._thread = None
+
+    def start(self):
+        """
+        Start the writer thread.
+        """
+        self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=5.0):
+        """
+        Write everything still queued, then stop the writer thread and close the log file.
+
+        :param timeout: (float) The longest time to wait for the queue to drain.
+        """
+        if self._thread is None:
+            return
+        try:
+            self.queue.put(_STOP, timeout=timeout)
+        except queue.Full:
+            pass
+        self._thread.join(timeout)
+        self._thread = None
+        if self.handler is not None:
+            self.handler.close()
+            self.handler = None
+
+    def _run(self):
+        while True:
+            try:
+                record = self.queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+            batch = []
+            stopping = record is _STOP
+            if not stopping:
+                batch.append(record)
+            while len(batch) < self.batch_size and not stopping:
+                try:
+                    record = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                if record is _STOP:
+                    stopping = True
+                else:
+                    batch.append(record)
+            if batch:
+                self._write(batch)
+            if stopping:
+                # Drain anything that was queued after the stop request
+                remaining = []
+                while True:
+                    try:
+                        record = self.queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if record is not _STOP:
+                        remaining.append(record)
+                if remaining:
+                    self._write(remaining)
+                return
+
+    def _open(self):
+        directory = os.path.dirname(self.log_file)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.handler = RotatingFileHandler(self.log_file, maxBytes=self.max_bytes, backupCount=self.backup_count)
+
+    def _write(self, batch):
+        try:
+            if self.handler is None:
+                self._open()
+            handler = self.handler
+            for record in batch:
+                line = self.formatter.format(record) + "\n"
+                if handler.maxBytes > 0 and handler.stream.tell() + len(line) >= handler.maxBytes:
+                    handler.doRollover()
+                handler.stream.write(line)
+            handler.flush()
+            self.written += len(batch)
+            self.batches += 1
+        except Exception:
+            self.errors += 1
+
+
+class QueuedLogging:
+    """
+    The queue-based logging pipeline: a bounded queue handler on the root logger and its writer thread.
+    """
+
+    def __init__(self, handler, writer):
+        self.handler = handler
+        self.writer = writer
+
+    def stats(self):
+        """
+        :return: (dict) Counters for queued, dropped and written records, batches and write errors.
+        """
+        return {
+            'enqueued': self.handler.enqueued,
+            'dropped': self.handler.dropped,
+            'queued': self.handler.queue.qsize(),
+            'written': self.writer.written,
+            'batches': self.writer.batches,
+            'errors': self.writer.errors,
+        }
+
+    def shutdown(self, timeout=5.0):
+        """
+        Detach the handler from the root logger and drain the queue to disk.
+
+        :param timeout: (float) The longest time to wait for the queue to drain.
+        """
+        logging.getLogger().removeHandler(self.handler)
+        self.writer.stop(timeout)
+
+
+def setup_logging(log_file='data/error.log', max_bytes=1000000, backup_count=5, queue_size=10000,
+                  batch_size=256, flush_interval=0.5, overflow=OVERFLOW_DROP_NEWEST, json_format=True,
+                  level=logging.ERROR):
+    """
+    Attach a non-blocking, queue-based log pipeline to the root logger, in place of the one attached
+    before, which is detached and drained first.
+
+    :param log_file: (str) The path of the log file.
+    :param max_bytes: (int) The size at which the log file is rotated.
+    :param backup_count: (int) The number of rotated files to keep.
+    :param queue_size: (int) The maximum number of records buffered in memory.
+    :param batch_size: (int) The maximum number of records written per flush.
+    :param flush_interval: (float) Seconds the writer waits for more records before checking for shutdown.
+    :param overflow: (str) What to do when the buffer is full: "drop_newest", "drop_oldest" or "block".
+    :param json_format: (bool) Whether to write structured JSON lines instead of plain text.
+    :param level: (int) The root logger level.
+    :return: (QueuedLogging) The pipeline, for statistics and shutdown.
+    """
+    global log_pipeline, _atexit_registered
+    log_queue = queue.Queue(maxsize=queue_size)
+    handler = BoundedQueueHandler(log_queue, overflow=overflow)
+    handler.setLevel(level)
+    formatter = JSONFormatter() if json_format else logging.Formatter('%(asctime)s %(levelname)s: %(message)s')
+    writer = QueueLogWriter(log_queue, log_file, max_bytes=max_bytes, backup_count=backup_count,
+                            batch_size=batch_size, flush_interval=flush_interval, formatter=formatter)
+
+    with _pipeline_lock:
+        if log_pipeline is not None:
+            log_pipeline.shutdown()
+        writer.start()
+        root = logging.getLogger()
+        root.setLevel(level)
+        root.addHandler(handler)
+        log_pipeline = QueuedLogging(handler, writer)
+        if not _atexit_registered:
+            # Once per process; the hook drains whichever pipeline is attached at exit
+            atexit.register(_shutdown_logging)
+            _atexit_registered = True
+        return log_pipeline
+
+
+def _shutdown_logging():
+    """
+    Drain the attached log pipeline at interpreter exit.
+    """
+    with _pipeline_lock:
+        if log_pipeline is not None:
+            log_pipeline.shutdown()
+
+
+# The queued logging pipeline, attached on first use so that importing this module has no side effects
+log_pipeline = None
+_pipeline_lock = threading.RLock()
+_atexit_registered = False
+
+
+def configure_logging(**settings):
+    """
+    Attach the process-wide log pipeline, replacing (and draining) one that is already attached.
+
+    :param settings: Keyword arguments for setup_logging, e.g. log_file or queue_size.
+    :return: (QueuedLogging) The new pipeline.
+    """
+    return setup_logging(**settings)
+
+
+def _ensure_logging():
+    """
+    Attach the default log pipeline if none has been configured yet.
+    """
+    if log_pipeline is None:
+        with _pipeline_lock:
+            if log_pipeline is None:
+                setup_logging()
 
 
 class APIError(Exception):
@@ -39,16 +346,21 @@ class DataError(Exception):
     pass
 
 
-def log_error(message, level="ERROR"):
+def log_error(message, level="ERROR", **context):
     """
     Log error messages to a file with severity level.
 
+    Records are queued and written by a background thread, so this never blocks on disk I/O.
+
     :param message: (str) The error message to log.
     :param level: (str) The severity level (default is "ERROR").
+    :param context: Optional structured fields stored with the record, e.g. source="virus_total".
     """
+    _ensure_logging()
+    kwargs = {'extra': {'context': context}} if context else {}
     if level == "WARNING":
-        logging.warning(message)
+        logging.warning(message, **kwargs)
     elif level == "INFO":
-        logging.info(message)
+        logging.info(message, **kwargs)
     else:
-        logging.error(message)
+        logging.error(message, **kwargs)
@@ -0,0 +1,606 @@
+#  IntelliSIEM Copyright 2024, Rob Perry
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import gzip
+import json
+import os
+import socket
+import tempfile
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from src.python.error_handling import APIError, ConfigError, DataError, log_error
+from src.python.file_io import fsync_directory
+from src.python.provider_health import RetryPolicy
+
+# HTTP statuses after which a batch is retried rather than rejected
+RETRYABLE_STATUSES = (408, 429)
+
+# Backoff between delivery attempts; the retry index is capped so the delay stays at its maximum
+EXPORT_RETRY = {'max_retries': 1 << 30, 'base_delay': 0.5, 'max_delay': 30.0}
+MAX_RETRY_INDEX = 16
+
+
+def _encode(record):
+    return json.dumps(record, separators=(',', ':'), default=str).encode()
+
+
+class ExportSpool:
+    """
+    A write-ahead spool of export batches.
+
+    Each sealed batch is written to its own NDJSON file, fsynced and atomically renamed into place
+    before it is handed to a sink, and only deleted once the sink accepted it. Batches left behind by
+    a crash are delivered in order on the next start. Every batch has an id that stays the same
+    across restarts, which sinks use to recognize a batch they may already have received.
+    """
+
+    def __init__(self, directory, fsync=True):
+        """
+        :param directory: (str) The spool directory, created if needed.
+        :param fsync: (bool) Whether batches are flushed to disk before they are acknowledged.
+        :raises DataError: If the spool directory cannot be used.
+        """
+        self.directory = directory
+        self.fsync = fsync
+        self._lock = threading.Lock()
+        try:
+            os.makedirs(os.path.join(directory, 'rejected'), exist_ok=True)
+            id_path = os.path.join(directory, 'spool.id')
+            if not os.path.exists(id_path):
+                with open(id_path, 'w') as file:
+                    file.write(uuid.uuid4().hex)
+            with open(id_path) as file:
+                self.id = file.read().strip()
+            pending = self.pending()
+        except OSError as e:
+            log_error(f"Cannot open export spool {directory}: {e}.")
+            raise DataError("Failed to open export spool.")
+        self._next = pending[-1] + 1 if pending else 1
+
+    def _path(self, seq):
+        return os.path.join(self.directory, f"{seq:012d}.ndjson")
+
+    def batch_id(self, seq):
+        """
+        :param seq: (int) A batch sequence number.
+        :return: (str) The batch's id, unique across spools.
+        """
+        return f"{self.id}-{seq}"
+
+    def append(self, lines):
+        """
+        Durably write a batch.
+
+        :param lines: (list) JSON-encoded records as bytes.
+        :return: (int) The batch's sequence number.
+        :raises DataError: If the batch cannot be written.
+        """
+        with self._lock:
+            seq = self._next
+            self._next += 1
+        try:
+            fd, temp_path = tempfile.mkstemp(dir=self.directory, prefix='.batch-')
+            try:
+                with os.fdopen(fd, 'wb') as file:
+                    file.write(b'\n'.join(lines) + b'\n')
+                    if self.fsync:
+                        file.flush()
+                        os.fsync(file.fileno())
+                os.replace(temp_path, self._path(seq))
+            except BaseException:
+                os.unlink(temp_path)
+                raise
+            if self.fsync:
+                fsync_directory(self.directory)
+        except OSError as e:
+            log_error(f"Failed to spool export batch {seq}: {e}.")
+            raise DataError("Failed to spool export batch.")
+        return seq
+
+    def pending(self):
+        """
+        :return: (list) Sequence numbers of the batches not yet delivered, oldest first.
+        """
+        return sorted(int(name[:-7]) for name in os.listdir(self.directory)
+                      if name.endswith('.ndjson') and name[:-7].isdigit())
+
+    def read(self, seq):
+        """
+        :param seq: (int) A pending batch.
+        :return: (list) The batch's JSON-encoded records as bytes.
+        """
+        with open(self._path(seq), 'rb') as file:
+            return file.read().splitlines()
+
+    def remove(self, seq):
+        """
+        Delete a delivered batch.
+
+        :param seq: (int) The batch's sequence number.
+        """
+        os.unlink(self._path(seq))
+
+    def reject(self, seq):
+        """
+        Move a batch the sink refused into the 'rejected' directory for inspection.
+
+        :param seq: (int) The batch's sequence number.
+        """
+        os.replace(self._path(seq), os.path.join(self.directory, 'rejected', f"{seq:012d}.ndjson"))
+
+
+class HTTPSink:
+    """
+    Posts batches to an HTTP event collector, such as Splunk HEC, as gzip-compressed NDJSON.
+
+    Each record is wrapped as {"event": record}. Connections are kept alive between batches. Each
+    request carries the batch id in an X-Batch-Id header, so a receiver can drop a batch that was
+    resent after a crash.
+    """
+
+    def __init__(self, url, token=None, auth_scheme='Splunk', headers=None, sourcetype=None, compress=True,
+                 timeout=30, verify=True):
+        """
+        :param url: (str) The collector endpoint, e.g. https://siem:8088/services/collector/event.
+        :param token: (str) The collector token, sent as "Authorization: <auth_scheme> <token>".
+        :param auth_scheme: (str) The authorization scheme for the token.
+        :param headers: (dict) Additional request headers.
+        :param sourcetype: (str) Optional sourcetype added to each event.
+        :param compress: (bool) Whether request bodies are gzip-compressed.
+        :param timeout: (float) Request timeout in seconds.
+        :param verify: (bool or str) TLS verification, or the path of a CA bundle.
+        """
+        self.url = url
+        self.compress = compress
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=1))
+        self.session.mount('http://', HTTPAdapter(pool_connections=1, pool_maxsize=1))
+        self.session.verify = verify
+        self.session.headers.update({'Content-Type': 'application/x-ndjson', 'Connection': 'keep-alive'})
+        if token:
+            self.session.headers['Authorization'] = f"{auth_scheme} {token}"
+        if compress:
+            self.session.headers['Content-Encoding'] = 'gzip'
+        self.session.headers.update(headers or {})
+        self._suffix = b',"sourcetype":' + _encode(sourcetype) + b'}' if sourcetype else b'}'
+
+    def send(self, batch_id, lines):
+        """
+        :param batch_id: (str) The batch's id.
+        :param lines: (list) JSON-encoded records as bytes.
+        :raises APIError: If the batch should be retried.
+        :raises DataError: If the collector refused the batch.
+        """
+        body = b'\n'.join(b'{"event":' + line + self._suffix for line in lines)
+        if self.compress:
+            body = gzip.compress(body, compresslevel=6)
+        try:
+            response = self.session.post(self.url, data=body, headers={'X-Batch-Id': batch_id}, timeout=self.timeout)
+        except requests.exceptions.RequestException as e:
+            log_error(f"Export to {self.url} failed: {e}.", level="WARNING")
+            raise APIError("Export request failed.")
+        if response.status_code >= 500 or response.status_code in RETRYABLE_STATUSES:
+            log_error(f"Export to {self.url} returned {response.status_code}.", level="WARNING")
+            raise APIError("Export request failed.")
+        if response.status_code >= 400:
+            log_error(f"Export to {self.url} refused batch {batch_id}: {response.status_code} {response.text[:200]}.")
+            raise DataError("Export batch rejected.")
+
+    def close(self):
+        self.session.close()
+
+
+def _cef_escape(value, extension=True):
+    value = str(value).replace('\\', '\\\\').replace('\r', ' ').replace('\n', ' ')
+    return value.replace('=', '\\=') if extension else value.replace('|', '\\|')
+
+
+def to_cef(record):
+    """
+    Format an indicator as an ArcSight CEF message.
+
+    :param record: (dict) A normalized indicator, or a correlated one with a 'score'.
+    :return: (str) The CEF message.
+    """
+    score = record.get('score', record.get('confidence'))
+    severity = min(max(int(round(score / 10)), 0), 10) if isinstance(score, (int, float)) else 5
+    extension = {
+        'cs1Label': 'indicatorType', 'cs1': record.get('type'),
+        'cs2Label': 'indicator', 'cs2': record.get('value', record.get('id')),
+        'cs3Label': 'sources', 'cs3': ','.join(record['sources']) if 'sources' in record else record.get('source'),
+        'cs4Label': 'ttps', 'cs4': ','.join(record.get('ttps') or ()),
+        'cn1Label': 'score', 'cn1': score,
+        'externalId': record.get('id'),
+    }
+    fields = ' '.join(f"{key}={_cef_escape(value)}" for key, value in extension.items() if value not in (None, ''))
+    name = _cef_escape(f"Threat indicator: {record.get('type') or 'unknown'}", extension=False)
+    return f"CEF:0|IntelliSIEM|IntelliSIEM|1.0|indicator|{name}|{severity}|{fields}"
+
+
+class SyslogSink:
+    """
+    Streams records to a syslog receiver as RFC 5424 messages carrying CEF or JSON.
+
+    Over TCP, one connection is kept open and messages are framed by octet counting (RFC 6587); it is
+    re-opened after an error. Over UDP, each message is one datagram. Syslog has no acknowledgements,
+    so a batch interrupted by a crash is sent again in full.
+    """
+
+    def __init__(self, host, port=514, protocol='tcp', format='cef', facility=16, app_name='intellisiem',
+                 timeout=10):
+        """
+        :param host: (str) The syslog receiver.
+        :param port: (int) The receiver's port.
+        :param protocol: (str) "tcp" or "udp".
+        :param format: (str) "cef" or "json".
+        :param facility: (int) The syslog facility, 16 being local0.
+        :param app_name: (str) The APP-NAME of each message.
+        :param timeout: (float) Connect and send timeout in seconds.
+        """
+        if protocol not in ('tcp', 'udp') or format not in ('cef', 'json'):
+            log_error(f"Invalid syslog sink protocol or format: {protocol}, {format}.")
+            raise ConfigError("Invalid export sink setting: protocol.")
+        self.address = (host, port)
+        self.protocol = protocol
+        self.format = format
+        self.facility = facility
+        self.app_name = app_name
+        self.timeout = timeout
+        self._hostname = socket.gethostname()
+        self._socket = None
+
+    def _connect(self):
+        if self._socket is None:
+            if self.protocol == 'tcp':
+                self._socket = socket.create_connection(self.address, timeout=self.timeout)
+            else:
+                self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        return self._socket
+
+    def _message(self, line):
+        body = to_cef(json.loads(line)) if self.format == 'cef' else line.decode()
+        timestamp = datetime.now(timezone.utc).isoformat(timespec='milliseconds')
+        # Severity 5 (notice)
+        return f"<{self.facility * 8 + 5}>1 {timestamp} {self._hostname} {self.app_name} - - - {body}".encode()
+
+    def send(self, batch_id, lines):
+        """
+        :param batch_id: (str) The batch's id.
+        :param lines: (list) JSON-encoded records as bytes.
+        :raises APIError: If the batch should be retried.
+        :raises DataError: If a record cannot be formatted, so the batch can never be delivered.
+        """
+        try:
+            messages = [self._message(line) for line in lines]
+        except (ValueError, TypeError, AttributeError, KeyError) as e:
+            log_error(f"Cannot format export batch {batch_id} for syslog: {e}.")
+            raise DataError("Export batch rejected.")
+        try:
+            sock = self._connect()
+            if self.protocol == 'tcp':
+                sock.sendall(b''.join(b'%d %s' % (len(message), message) for message in messages))
+            else:
+                for message in messages:
+                    sock.sendto(message, self.address)
+        except OSError as e:
+            log_error(f"Export to syslog {self.address[0]}:{self.address[1]} failed: {e}.", level="WARNING")
+            self.close()
+            raise APIError("Export request failed.")
+
+    def close(self):
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
+
+
+class FileSink:
+    """
+    Appends batches to rolling NDJSON files, gzip-compressed by default.
+
+    A new file is started when the current one reaches max_bytes or max_age seconds. Before a batch is
+    appended, the file and its size are recorded in a journal; if the same batch is sent again after
+    a crash, the file is first truncated back to that size, so no batch is ever written twice.
+    Compressed batches are written as separate gzip members, which gzip tools read as one stream.
+    """
+
+    def __init__(self, directory, prefix='indicators', compress=True, max_bytes=64 * 1024 * 1024, max_age=3600,
+                 fsync=True, clock=time.time):
+        """
+        :param directory: (str) The directory the files are written to, created if needed.
+        :param prefix: (str) The start of each file name.
+        :param compress: (bool) Whether files are gzip-compressed.
+        :param max_bytes: (int) The size at which a new file is started.
+        :param max_age: (float) Seconds after which a new file is started.
+        :param fsync: (bool) Whether each batch is flushed to disk before it is acknowledged.
+        :param clock: (callable) Wall-clock time function, replaceable for testing.
+        """
+        self.directory = directory
+        self.prefix = prefix
+        self.compress = compress
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.fsync = fsync
+        self._clock = clock
+        self._journal = os.path.join(directory, f".{prefix}.journal")
+        self._current = None
+        self._opened = None
+        os.makedirs(directory, exist_ok=True)
+
+    def _read_journal(self):
+        try:
+            with open(self._journal) as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return None
+
+    def _write_journal(self, entry):
+        temp_path = self._journal + '.tmp'
+        with open(temp_path, 'w') as file:
+            json.dump(entry, file)
+            if self.fsync:
+                file.flush()
+                os.fsync(file.fileno())
+        os.replace(temp_path, self._journal)
+
+    def send(self, batch_id, lines):
+        """
+        :param batch_id: (str) The batch's id.
+        :param lines: (list) JSON-encoded records as bytes.
+        :raises APIError: If the batch could not be written and should be retried.
+        """
+        now = self._clock()
+        data = b'\n'.join(lines) + b'\n'
+        if self.compress:
+            data = gzip.compress(data, compresslevel=6)
+        try:
+            journal = self._read_journal()
+            if journal is not None and journal['batch'] == batch_id:
+                # Resent after a crash: drop whatever part of the batch was written before
+                path, size = journal['file'], journal['size']
+                with open(path, 'ab') as file:
+                    file.truncate(size)
+            else:
+                path = self._current
+                size = os.path.getsize(path) if path and os.path.exists(path) else 0
+                if path is None or size >= self.max_bytes or now - self._opened >= self.max_age:
+                    stamp = datetime.fromtimestamp(now, timezone.utc).strftime('%Y%m%dT%H%M%S')
+                    extension = '.ndjson.gz' if self.compress else '.ndjson'
+                    path = os.path.join(self.directory, f"{self.prefix}-{stamp}-{batch_id}{extension}")
+                    size = 0
+                    self._opened = now
+            self._write_journal({'batch': batch_id, 'file': path, 'size': size})
+            with open(path, 'ab') as file:
+                file.write(data)
+                if self.fsync:
+                    file.flush()
+                    os.fsync(file.fileno())
+            self._current = path
+            if self._opened is None:
+                self._opened = now
+        except OSError as e:
+            log_error(f"Export to {self.directory} failed: {e}.", level="WARNING")
+            raise APIError("Export write failed.")
+
+    def close(self):
+        pass
+
+
+SINK_TYPES = {
+    'http': HTTPSink,
+    'syslog': SyslogSink,
+    'file': FileSink,
+}
+
+
+def create_sink(name, settings):
+    """
+    Build a sink from its configuration.
+
+    :param name: (str) The name of the sink.
+    :param settings: (dict) The sink's settings from the 'export.sinks' section, including its 'type'.
+    :return: The sink.
+    :raises ConfigError: If the sink type or one of its settings is invalid.
+    """
+    settings = dict(settings)
+    sink_cls = SINK_TYPES.get(settings.pop('type', None))
+    if sink_cls is None:
+        log_error(f"Unknown type for export sink {name}.")
+        raise ConfigError(f"Invalid export sink: {name}.")
+    try:
+        return sink_cls(**settings)
+    except TypeError as e:
+        log_error(f"Invalid settings for export sink {name}: {e}.")
+        raise ConfigError(f"Invalid export sink: {name}.")
+
+
+class Exporter:
+    """
+    Batches records for one sink and delivers them from a write-ahead spool.
+
+    submit only encodes records and, whenever a batch reaches batch_size records or batch_bytes, seals
+    it into the spool; a sender thread delivers spooled batches in order, retrying with exponential
+    backoff while the sink is unavailable. A slow or unreachable SIEM therefore fills the spool on
+    disk instead of slowing down collection. Partial batches are sealed after flush_interval seconds.
+    Batches the sink refuses as invalid are moved aside rather than retried forever.
+    """
+
+    def __init__(self, name, sink, spool, batch_size=500, batch_bytes=1024 * 1024, flush_interval=5.0,
+                 retry=None, clock=time.monotonic):
+        """
+        :param name: (str) The name of the sink, for logging.
+        :param sink: (HTTPSink, SyslogSink or FileSink) The destination.
+        :param spool: (ExportSpool) The sink's own spool.
+        :param batch_size: (int) Records per batch.
+        :param batch_bytes: (int) Encoded bytes at which a batch is sealed early.
+        :param flush_interval: (float) Seconds after which a partial batch is sealed.
+        :param retry: (RetryPolicy) Backoff between delivery attempts.
+        :param clock: (callable) Monotonic clock, replaceable for testing.
+        """
+        self.name = name
+        self.sink = sink
+        self.spool = spool
+        self.batch_size = batch_size
+        self.batch_bytes = batch_bytes
+        self.flush_interval = flush_interval
+        self.retry = retry or RetryPolicy(**EXPORT_RETRY)
+        self._clock = clock
+        self._cond = threading.Condition()
+        self._send_lock = threading.Lock()
+        self._buffer = []
+        self._buffer_bytes = 0
+        self._buffer_started = None
+        self._stopping = False
+        self._thread = None
+        self.sent_batches = 0
+        self.sent_records = 0
+        self.rejected_batches = 0
+        self.dropped_records = 0
+        self.retries = 0
+
+    def submit(self, records):
+        """
+        Queue records for export.
+
+        :param records: (iterable) Records as JSON-serializable dicts, e.g. normalized indicators; anything
+            else is dropped, since sinks could never format it.
+        :raises DataError: If a full batch cannot be written to the spool.
+        """
+        with self._cond:
+            for record in records:
+                if not isinstance(record, dict):
+                    log_error(f"Dropped a {type(record).__name__} record submitted for export to {self.name}.",
+                              level="WARNING")
+                    self.dropped_records += 1
+                    continue
+                line = _encode(record)
+                if self._buffer_started is None:
+                    self._buffer_started = self._clock()
+                self._buffer.append(line)
+                self._buffer_bytes += len(line) + 1
+                if len(self._buffer) >= self.batch_size or self._buffer_bytes >= self.batch_bytes:
+                    self._seal()
+
+    def _seal(self):
+        if self._buffer:
+            self.spool.append(self._buffer)
+            self._buffer = []
+            self._buffer_bytes = 0
+            self._buffer_started = None
+            self._cond.notify_all()
+
+    def flush(self):
+        """
+        Seal the partial batch, if any, so that it is delivered without waiting for flush_interval.
+        """
+        with self._cond:
+            self._seal()
+
+    def deliver_pending(self):
+        """
+        Try to deliver every spooled batch once, oldest first.
+
+        :return: (bool) True if the spool is empty, False if a batch must be retried later.
+        """
+        with self._send_lock:
+            for seq in self.spool.pending():
+                lines = self.spool.read(seq)
+                try:
+                    self.sink.send(self.spool.batch_id(seq), lines)
+                except APIError:
+                    return False
+                except DataError:
+                    self.spool.reject(seq)
+                    self.rejected_batches += 1
+                    continue
+                self.spool.remove(seq)
+                self.sent_batches += 1
+                self.sent_records += len(lines)
+            return True
+
+    def _loop(self):
+        attempt = 0
+        while True:
+            with self._cond:
+                if self._buffer_started is not None and self._clock() - self._buffer_started >= self.flush_interval:
+                    self._seal()
+                if self._stopping:
+                    return
+            try:
+                delivered = self.deliver_pending()
+            except Exception as e:
+                # An unexpected failure, such as a broken socket or spool file, must not end the sender thread
+                log_error(f"Export to {self.name} failed: {e}")
+                delivered = False
+            if delivered:
+                attempt = 0
+                delay = self.flush_interval
+            else:
+                delay = self.retry.delay(min(attempt, MAX_RETRY_INDEX))
+                attempt += 1
+                self.retries += 1
+            with self._cond:
+                if not self._stopping:
+                    self._cond.wait(delay)
+
+    def start(self):
+        """
+        Start delivering in a background thread; batches left from a previous run are sent first.
+        """
+        if self._thread is None:
+            self._stopping = False
+            self._thread = threading.Thread(target=self._loop, name=f"export-{self.name}", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=30.0):
+        """
+        Seal the partial batch, stop the sender thread and make a last attempt to deliver the spool.
+
+        Batches that could not be delivered stay spooled for the next start.
+
+        :param timeout: (float) Seconds to wait for the sender thread.
+        :return: (bool) True if every batch was delivered.
+        """
+        with self._cond:
+            self._seal()
+            self._stopping = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        try:
+            drained = self.deliver_pending()
+        except Exception as e:
+            log_error(f"Export to {self.name} failed: {e}")
+            drained = False
+        if not drained:
+            log_error(f"Export to {self.name} stopped with {len(self.spool.pending())} batches spooled.",
+                      level="WARNING")
+        self.sink.close()
+        return drained
+
+    def stats(self):
+        """
+        :return: (dict) Delivered and rejected batches, dropped records, retries and the spool backlog.
+        """
+        return {'sent_batches': self.sent_batches, 'sent_records': self.sent_records,
+                'rejected_batches': self.rejected_batches, 'dropped_records': self.dropped_records,
+                'retries': self.retries,
+                'pending_batches': len(self.spool.pending())}
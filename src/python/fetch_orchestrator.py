@@ -0,0 +1,258 @@
+#  IntelliSIEM Copyright 2024, Rob Perry
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from src.python.api_client import request_deadline
+from src.python.error_handling import log_error
+
+STATUS_OK = "ok"
+STATUS_ERROR = "error"
+STATUS_TIMEOUT = "timeout"
+
+
+class FetchSource:
+    """
+    A single threat intelligence source to be fetched by the orchestrator.
+    """
+
+    def __init__(self, name, client, endpoint, params=None, timeout=None, pagination=None, incremental=None):
+        """
+        Describe a source to fetch.
+
+        :param name: (str) A unique name for the source, used to key results.
+        :param client: (APIClient) The client used to fetch the source.
+        :param endpoint: (str) The API endpoint to fetch data from.
+        :param params: (dict) Optional query parameters.
+        :param timeout: (float) Optional per-source deadline in seconds, measured from the start of the run.
+        :param pagination: (dict) Optional items_key, next_key and cursor_param settings for streaming.
+        :param incremental: (dict) Optional watermark settings for incremental collection, see
+            data_collection.collect_incremental.
+        """
+        self.name = name
+        self.client = client
+        self.endpoint = endpoint
+        self.params = params
+        self.timeout = timeout
+        self.pagination = pagination or {}
+        self.incremental = incremental
+
+    def fetch(self):
+        """
+        Fetch the source's data through its client.
+
+        :return: The decoded API response.
+        """
+        return self.client.get_data(self.endpoint, params=self.params)
+
+    def iter_records(self, params=None):
+        """
+        Stream the source's records one at a time across all pages.
+
+        :param params: (dict) Optional query parameters to use instead of the source's own.
+        :return: (generator) The source's records.
+        """
+        return self.client.iter_data(self.endpoint, params=params if params is not None else self.params,
+                                     **self.pagination)
+
+
+class SourceResult:
+    """
+    The outcome of fetching a single source.
+    """
+
+    def __init__(self, name, status, data=None, error=None, elapsed=None):
+        """
+        Record the outcome of a source fetch.
+
+        :param name: (str) The name of the source.
+        :param status: (str) One of "ok", "error" or "timeout".
+        :param data: The decoded API response, if the fetch succeeded.
+        :param error: (Exception) The exception raised by the fetch, if it failed.
+        :param elapsed: (float) Seconds spent before the fetch completed or was abandoned.
+        """
+        self.name = name
+        self.status = status
+        self.data = data
+        self.error = error
+        self.elapsed = elapsed
+
+    @property
+    def ok(self):
+        """
+        :return: (bool) True if the source was fetched successfully.
+        """
+        return self.status == STATUS_OK
+
+    def __repr__(self):
+        return f"SourceResult(name={self.name!r}, status={self.status!r}, elapsed={self.elapsed!r})"
+
+
+class FetchOrchestrator:
+    """
+    Fetch several sources concurrently, honouring per-source and overall deadlines.
+
+    Sources that have not finished when their deadline passes are reported with a "timeout"
+    status and their late results are discarded, so one slow provider never holds up the others.
+    The deadline also bounds the source's API requests, so an abandoned fetch ends at its next request
+    instead of holding a worker and its connector's concurrency slot into later runs.
+
+    The worker threads are kept between runs; close the orchestrator to stop them.
+    """
+
+    def __init__(self, max_workers=4, source_timeout=None, overall_timeout=None):
+        """
+        Initialize the orchestrator.
+
+        :param max_workers: (int) The maximum number of sources fetched at the same time.
+        :param source_timeout: (float) Default per-source deadline in seconds, or None for no limit.
+        :param overall_timeout: (float) Deadline for the whole run in seconds, or None for no limit.
+        """
+        if max_workers < 1:
+            raise ValueError("max_workers must be at least 1.")
+        self.max_workers = max_workers
+        self.source_timeout = source_timeout
+        self.overall_timeout = overall_timeout
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="fetch")
+            return self._executor
+
+    def close(self):
+        """
+        Stop the worker threads once the fetches already running have ended.
+        """
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @staticmethod
+    def _fetch(source, deadline):
+        with request_deadline(deadline):
+            return source.fetch()
+
+    def _deadline(self, start, timeout):
+        return None if timeout is None else start + timeout
+
+    def _source_deadline(self, start, source, overall_deadline):
+        timeout = source.timeout if source.timeout is not None else self.source_timeout
+        deadline = self._deadline(start, timeout)
+        if overall_deadline is None:
+            return deadline
+        if deadline is None:
+            return overall_deadline
+        return min(deadline, overall_deadline)
+
+    def run(self, sources):
+        """
+        Fetch all sources on the orchestrator's worker threads.
+
+        :param sources: (list) The FetchSource objects to fetch.
+        :return: (dict) SourceResult objects keyed by source name, in the order the sources were given.
+        """
+        if not sources:
+            return {}
+        start = time.monotonic()
+        overall_deadline = self._deadline(start, self.overall_timeout)
+        results = {source.name: None for source in sources}
+
+        executor = self._get_executor()
+        deadlines = {}
+        pending = {}
+        for source in sources:
+            deadline = self._source_deadline(start, source, overall_deadline)
+            future = executor.submit(self._fetch, source, deadline)
+            pending[future] = source
+            deadlines[future] = deadline
+
+        while pending:
+            now = time.monotonic()
+            # Abandon every source whose deadline has already passed; a fetch still running ends at its next request
+            for future in [f for f in pending if deadlines[f] is not None and deadlines[f] <= now]:
+                source = pending.pop(future)
+                future.cancel()
+                log_error(f"Source '{source.name}' did not finish before its deadline.", level="WARNING")
+                results[source.name] = SourceResult(source.name, STATUS_TIMEOUT, elapsed=now - start)
+            if not pending:
+                break
+
+            active = [deadlines[f] for f in pending if deadlines[f] is not None]
+            wait_for = max(min(active) - now, 0) if active else None
+            done, _ = wait(pending, timeout=wait_for, return_when=FIRST_COMPLETED)
+            for future in done:
+                source = pending.pop(future)
+                results[source.name] = self._result_from_future(source, future, time.monotonic() - start)
+
+        return results
+
+    async def run_async(self, sources):
+        """
+        Fetch all sources from within an asyncio event loop.
+
+        Each fetch runs on the orchestrator's worker threads, bounded by a semaphore of max_workers.
+
+        :param sources: (list) The FetchSource objects to fetch.
+        :return: (dict) SourceResult objects keyed by source name, in the order the sources were given.
+        """
+        # Imported here so that synchronous callers do not pay for asyncio at import time
+        import asyncio
+
+        if not sources:
+            return {}
+        loop = asyncio.get_running_loop()
+        start = time.monotonic()
+        overall_deadline = self._deadline(start, self.overall_timeout)
+        semaphore = asyncio.Semaphore(self.max_workers)
+
+        executor = self._get_executor()
+
+        async def bounded_fetch(source, deadline):
+            async with semaphore:
+                return await loop.run_in_executor(executor, self._fetch, source, deadline)
+
+        async def fetch_one(source):
+            deadline = self._source_deadline(start, source, overall_deadline)
+            timeout = None if deadline is None else max(deadline - time.monotonic(), 0)
+            try:
+                data = await asyncio.wait_for(bounded_fetch(source, deadline), timeout)
+            except asyncio.TimeoutError:
+                log_error(f"Source '{source.name}' did not finish before its deadline.", level="WARNING")
+                return SourceResult(source.name, STATUS_TIMEOUT, elapsed=time.monotonic() - start)
+            except Exception as e:
+                log_error(f"Source '{source.name}' failed: {e}")
+                return SourceResult(source.name, STATUS_ERROR, error=e, elapsed=time.monotonic() - start)
+            return SourceResult(source.name, STATUS_OK, data=data, elapsed=time.monotonic() - start)
+
+        outcomes = await asyncio.gather(*(fetch_one(source) for source in sources))
+        return {result.name: result for result in outcomes}
+
+    def _result_from_future(self, source, future, elapsed):
+        error = future.exception()
+        if error is not None:
+            log_error(f"Source '{source.name}' failed: {error}")
+            return SourceResult(source.name, STATUS_ERROR, error=error, elapsed=elapsed)
+        return SourceResult(source.name, STATUS_OK, data=future.result(), elapsed=elapsed)
@@ -0,0 +1,397 @@
+#  IntelliSIEM Copyright 2024, Rob Perry
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+from src.python.error_handling import DataError, log_error
+
+DEFAULT_BATCH_SIZE = 10000
+
+_UPSERT = """
+    INSERT INTO indicators (id, type, value, sources, first_seen, last_seen, data)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT (id) DO UPDATE SET
+        type = COALESCE(excluded.type, indicators.type),
+        value = excluded.value,
+        sources = CASE
+            WHEN instr(',' || indicators.sources || ',', ',' || excluded.sources || ',') > 0
+            THEN indicators.sources
+            ELSE indicators.sources || ',' || excluded.sources
+        END,
+        last_seen = excluded.last_seen,
+        data = excluded.data
+"""
+
+_COLUMNS = "id, type, value, sources, first_seen, last_seen, data"
+
+
+def indicator_type_and_value(entry):
+    """
+    Extract the indicator type and observable value from a provider record.
+
+    OTX export records carry them in 'type' and 'indicator'; VirusTotal objects are identified by
+    their 'id' (e.g. a file hash) and typed by 'type'.
+
+    :param entry: (dict) A validated threat intelligence entry.
+    :return: (tuple) The indicator type (or None) and the observable value.
+    """
+    value = entry.get('indicator', entry.get('value', entry['id']))
+    return entry.get('type'), str(value)
+
+
+class StoredIndicator:
+    """
+    An indicator as stored in the IndicatorStore.
+    """
+
+    def __init__(self, id, type, value, sources, first_seen, last_seen, data):
+        self.id = id
+        self.type = type
+        self.value = value
+        self.sources = sources.split(',') if sources else []
+        self.first_seen = first_seen
+        self.last_seen = last_seen
+        self._data = data
+
+    @property
+    def data(self):
+        """
+        :return: (dict) The most recently stored provider record, decoded on first access.
+        """
+        if isinstance(self._data, str):
+            self._data = json.loads(self._data)
+        return self._data
+
+    def __repr__(self):
+        return f"StoredIndicator(id={self.id!r}, type={self.type!r}, value={self.value!r}, sources={self.sources!r})"
+
+
+class IndicatorStore:
+    """
+    An embedded, indexed and deduplicated store of threat indicators backed by SQLite.
+
+    Indicators are keyed by their 'id', so a record reported again by the same or another source
+    updates the existing row and adds the source to it. Secondary indexes on type and value make
+    point lookups by observable independent of the store's size.
+    """
+
+    def __init__(self, path, batch_size=DEFAULT_BATCH_SIZE, clock=time.time, aging=None):
+        """
+        Open (or create) the indicator store.
+
+        :param path: (str) The path of the SQLite database file, or ":memory:".
+        :param batch_size: (int) The number of rows written per transaction by upsert_many.
+        :param clock: (callable) Wall-clock time function, replaceable for testing.
+        :param aging: (AgingEngine) Optional engine expiring indicators that are no longer reported. Stored
+            indicators are tracked on open; written ones expire a TTL of their type and reporting source after
+            the write.
+        """
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.batch_size = batch_size
+        self.aging = aging
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode = WAL")
+        self._db.execute("PRAGMA synchronous = NORMAL")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS indicators (
+                id TEXT PRIMARY KEY,
+                type TEXT,
+                value TEXT NOT NULL,
+                sources TEXT NOT NULL,
+                first_seen REAL NOT NULL,
+                last_seen REAL NOT NULL,
+                data TEXT NOT NULL
+            ) WITHOUT ROWID""")
+        self._db.execute("CREATE INDEX IF NOT EXISTS indicators_type ON indicators (type)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS indicators_value ON indicators (value, type)")
+        self._db.commit()
+        if aging is not None:
+            aging.track_all(StoredIndicator(indicator_id, indicator_type, None, sources, last_seen, last_seen, None)
+                            for indicator_id, indicator_type, sources, last_seen in self._db.execute(
+                                "SELECT id, type, sources, last_seen FROM indicators"))
+
+    def _rows(self, entries, source, now):
+        for entry in entries:
+            indicator_type, value = indicator_type_and_value(entry)
+            yield (str(entry['id']), indicator_type, value, source, now, now, json.dumps(entry))
+
+    def upsert_many(self, entries, source):
+        """
+        Insert or update indicators in batched transactions.
+
+        :param entries: (iterable) Validated threat intelligence entries; may be a generator.
+        :param source: (str) The name of the source that reported the entries.
+        :return: (int) The number of entries written.
+        :raises DataError: If the entries cannot be written.
+        """
+        now = self._clock()
+        rows = self._rows(entries, source, now)
+        written = 0
+        while True:
+            try:
+                batch = [row for _, row in zip(range(self.batch_size), rows)]
+                if not batch:
+                    return written
+                with self._lock, self._db:
+                    self._db.executemany(_UPSERT, batch)
+                    if self.aging is not None:
+                        for row in batch:
+                            self.aging.track(row[0], row[1], source, now)
+            except (sqlite3.Error, KeyError, TypeError, ValueError) as e:
+                log_error(f"Failed to store indicators from {source}: {e}.")
+                raise DataError("Failed to store indicators.")
+            written += len(batch)
+
+    def upsert(self, entry, source):
+        """
+        Insert or update a single indicator.
+
+        :param entry: (dict) A validated threat intelligence entry.
+        :param source: (str) The name of the source that reported the entry.
+        """
+        self.upsert_many([entry], source)
+
+    def get(self, indicator_id):
+        """
+        Look up an indicator by its id.
+
+        :param indicator_id: (str) The indicator id.
+        :return: (StoredIndicator) The indicator, or None if it is not stored.
+        """
+        with self._lock:
+            row = self._db.execute(f"SELECT {_COLUMNS} FROM indicators WHERE id = ?",
+                                   (str(indicator_id),)).fetchone()
+        return StoredIndicator(*row) if row else None
+
+    def find_by_value(self, value, indicator_type=None):
+        """
+        Look up the indicators for an observable such as a hash, IP address or domain.
+
+        :param value: (str) The observable value.
+        :param indicator_type: (str) Optionally restrict the lookup to one indicator type.
+        :return: (list) The matching StoredIndicator objects.
+        """
+        query = f"SELECT {_COLUMNS} FROM indicators WHERE value = ?"
+        args = (value,)
+        if indicator_type is not None:
+            query += " AND type = ?"
+            args += (indicator_type,)
+        with self._lock:
+            rows = self._db.execute(query, args).fetchall()
+        return [StoredIndicator(*row) for row in rows]
+
+    def contains_value(self, value):
+        """
+        :param value: (str) The observable value.
+        :return: (bool) True if any indicator has this value.
+        """
+        with self._lock:
+            return self._db.execute("SELECT 1 FROM indicators WHERE value = ? LIMIT 1",
+                                    (value,)).fetchone() is not None
+
+    def iter_by_type(self, indicator_type, batch_size=1000):
+        """
+        Iterate over all indicators of a type.
+
+        :param indicator_type: (str) The indicator type, e.g. "IPv4".
+        :param batch_size: (int) The number of rows fetched at a time.
+        :return: (generator) StoredIndicator objects ordered by id.
+        """
+        last_id = ''
+        while True:
+            with self._lock:
+                rows = self._db.execute(
+                    f"SELECT {_COLUMNS} FROM indicators WHERE type = ? AND id > ? ORDER BY id LIMIT ?",
+                    (indicator_type, last_id, batch_size)).fetchall()
+            if not rows:
+                return
+            for row in rows:
+                yield StoredIndicator(*row)
+            last_id = rows[-1][0]
+
+    def iter_all(self, batch_size=1000):
+        """
+        Iterate over every stored indicator.
+
+        :param batch_size: (int) The number of rows fetched at a time.
+        :return: (generator) StoredIndicator objects ordered by id.
+        """
+        last_id = ''
+        while True:
+            with self._lock:
+                rows = self._db.execute(f"SELECT {_COLUMNS} FROM indicators WHERE id > ? ORDER BY id LIMIT ?",
+                                        (last_id, batch_size)).fetchall()
+            if not rows:
+                return
+            for row in rows:
+                yield StoredIndicator(*row)
+            last_id = rows[-1][0]
+
+    def delete(self, indicator_ids):
+        """
+        Remove indicators by id.
+
+        :param indicator_ids: (iterable) The ids to remove.
+        :return: (int) The number of indicators removed.
+        """
+        indicator_ids = [str(indicator_id) for indicator_id in indicator_ids]
+        with self._lock, self._db:
+            cursor = self._db.executemany("DELETE FROM indicators WHERE id = ?",
+                                          ((indicator_id,) for indicator_id in indicator_ids))
+            if self.aging is not None:
+                for indicator_id in indicator_ids:
+                    self.aging.forget(indicator_id)
+            return cursor.rowcount
+
+    def expire(self, now=None):
+        """
+        Remove the indicators whose TTL has run out; without an AgingEngine nothing expires.
+
+        :param now: (float) The current time; defaults to the engine's clock.
+        :return: (list) The ids of the removed indicators.
+        :raises DataError: If the indicators cannot be removed.
+        """
+        if self.aging is None:
+            return []
+        # Under the lock, so an indicator written again in the meantime is not removed
+        try:
+            with self._lock, self._db:
+                expired = self.aging.expire(now)
+                self._db.executemany("DELETE FROM indicators WHERE id = ?",
+                                     ((indicator_id,) for indicator_id in expired))
+        except sqlite3.Error as e:
+            log_error(f"Failed to remove expired indicators: {e}.")
+            raise DataError("Failed to remove expired indicators.")
+        return expired
+
+    def count(self, indicator_type=None):
+        """
+        :param indicator_type: (str) Optionally count only one indicator type.
+        :return: (int) The number of stored indicators.
+        """
+        with self._lock:
+            if indicator_type is None:
+                return self._db.execute("SELECT COUNT(*) FROM indicators").fetchone()[0]
+            return self._db.execute("SELECT COUNT(*) FROM indicators WHERE type = ?",
+                                    (indicator_type,)).fetchone()[0]
+
+    def close(self):
+        """
+        Close the store.
+        """
+        with self._lock:
+            self._db.close()
+
+
+_STOP = object()
+
+
+class BufferedStoreWriter:
+    """
+    Decouples fetching from storage: batches are queued and written to an IndicatorStore by a single
+    writer thread.
+
+    The queue is bounded, so when the store falls behind, producers block in upsert_many instead of
+    buffering without limit, and pending() lets a scheduler hold back new work before that happens.
+    flush waits until everything queued so far is written, so callers can commit watermarks safely.
+    """
+
+    def __init__(self, store, max_pending=16):
+        """
+        Start the writer thread.
+
+        :param store: (IndicatorStore) The store to write to.
+        :param max_pending: (int) The number of batches that may wait to be written.
+        """
+        self.store = store
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._lock = threading.Lock()
+        self._errors = {}
+        self.written = 0
+        self.batches = 0
+        self._thread = threading.Thread(target=self._run, name="store-writer", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is _STOP:
+                    return
+                entries, source = item
+                try:
+                    written = self.store.upsert_many(entries, source)
+                except DataError as e:
+                    with self._lock:
+                        self._errors[source] = e
+                    continue
+                with self._lock:
+                    self.written += written
+                    self.batches += 1
+            finally:
+                self._queue.task_done()
+
+    def upsert_many(self, entries, source):
+        """
+        Queue entries to be written, blocking while the queue is full.
+
+        :param entries: (iterable) Validated threat intelligence entries.
+        :param source: (str) The name of the source that reported the entries.
+        :return: (int) The number of entries queued.
+        """
+        entries = list(entries)
+        if entries:
+            self._queue.put((entries, source))
+        return len(entries)
+
+    def pending(self):
+        """
+        :return: (int) The number of batches waiting to be written.
+        """
+        return self._queue.qsize()
+
+    def flush(self, source=None):
+        """
+        Wait until every batch queued so far has been written.
+
+        :param source: (str) Only report write failures of this source; None reports any failure.
+        :raises DataError: If a queued batch could not be written.
+        """
+        self._queue.join()
+        with self._lock:
+            if source is None:
+                errors, self._errors = list(self._errors.values()), {}
+            else:
+                errors = [self._errors.pop(source)] if source in self._errors else []
+        if errors:
+            raise DataError("Failed to store indicators.")
+
+    def close(self):
+        """
+        Write everything still queued and stop the writer thread; the store itself stays open.
+        """
+        if self._thread is None:
+            return
+        self._queue.put(_STOP)
+        self._thread.join()
+        self._thread = None
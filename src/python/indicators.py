@@ -0,0 +1,275 @@
+#  IntelliSIEM Copyright 2024, Rob Perry
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import json
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+
+from src.python.error_handling import DataError, log_error
+from src.python.indicator_store import indicator_type_and_value
+
+# Provider fields holding when an indicator was first and last reported, in order of preference
+FIRST_SEEN_FIELDS = ('first_seen', 'created', 'first_submission_date')
+LAST_SEEN_FIELDS = ('last_seen', 'modified', 'last_modification_date', 'last_analysis_date')
+
+_intern = sys.intern
+
+
+def record_timestamp(entry, fields):
+    """
+    Read the first present timestamp field of a record, looking inside VirusTotal's 'attributes' too.
+
+    :return: (float) A POSIX timestamp, or None if no field is present or parseable.
+    """
+    attributes = entry.get('attributes')
+    for field in fields:
+        value = entry.get(field)
+        if value is None and isinstance(attributes, dict):
+            value = attributes.get(field)
+        if value is None:
+            continue
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            return float(value)
+        if isinstance(value, str):
+            try:
+                moment = datetime.fromisoformat(value)
+            except ValueError:
+                continue
+            if moment.tzinfo is None:
+                moment = moment.replace(tzinfo=timezone.utc)
+            return moment.timestamp()
+    return None
+
+
+class Indicator:
+    """
+    A compact, normalized indicator.
+
+    Only the core fields are kept, in slots rather than a per-object dict, and the few distinct type
+    and source strings are interned so every indicator shares them. The provider record is dropped,
+    or kept off-heap in a PayloadSpool and referenced by its offset.
+    """
+
+    __slots__ = ('id', 'type', 'value', 'source', 'first_seen', 'last_seen', 'confidence', 'raw_offset')
+
+    def __init__(self, id, type, value, source, first_seen, last_seen, confidence=None, raw_offset=None):
+        """
+        :param id: (str) The indicator id.
+        :param type: (str) The indicator type, e.g. "IPv4", or None.
+        :param value: (str) The observable value.
+        :param source: (str) The comma-separated names of the sources that reported the indicator.
+        :param first_seen: (float) POSIX time the indicator was first reported.
+        :param last_seen: (float) POSIX time the indicator was last reported.
+        :param confidence: (float) The provider's confidence, if it reports one.
+        :param raw_offset: (int) Offset of the provider record in a PayloadSpool, if it was kept.
+        """
+        self.id = id
+        self.type = _intern(type) if type is not None else None
+        self.value = value
+        self.source = _intern(source)
+        self.first_seen = first_seen
+        self.last_seen = last_seen
+        self.confidence = confidence
+        self.raw_offset = raw_offset
+
+    @property
+    def sources(self):
+        """
+        :return: (list) The names of the sources that reported the indicator.
+        """
+        return self.source.split(',')
+
+    def as_dict(self):
+        """
+        :return: (dict) The core fields as a plain dict.
+        """
+        return {name: getattr(self, name) for name in self.__slots__ if name != 'raw_offset'}
+
+    def __eq__(self, other):
+        return isinstance(other, Indicator) and all(getattr(self, a) == getattr(other, a) for a in self.__slots__)
+
+    def __repr__(self):
+        return f"Indicator(id={self.id!r}, type={self.type!r}, value={self.value!r}, source={self.source!r})"
+
+
+class PayloadSpool:
+    """
+    Keeps provider records off the Python heap in an append-only JSON lines file.
+
+    Records are written once and read back by offset on demand; replaced records are not reclaimed.
+    """
+
+    def __init__(self, path=None):
+        """
+        :param path: (str) The file to write to, or None for an anonymous temporary file.
+        """
+        self._file = open(path, 'w+b') if path else tempfile.TemporaryFile()
+        self._lock = threading.Lock()
+        self._end = 0
+
+    def put(self, record):
+        """
+        :param record: (dict) A JSON-serializable record.
+        :return: (int) The record's offset.
+        """
+        line = json.dumps(record, separators=(',', ':')).encode() + b'\n'
+        with self._lock:
+            offset = self._end
+            self._file.seek(offset)
+            self._file.write(line)
+            self._end += len(line)
+        return offset
+
+    def get(self, offset):
+        """
+        :param offset: (int) An offset returned by put.
+        :return: (dict) The record.
+        """
+        with self._lock:
+            self._file.flush()
+            self._file.seek(offset)
+            line = self._file.readline()
+        return json.loads(line)
+
+    def close(self):
+        self._file.close()
+
+
+class IndicatorSet:
+    """
+    An in-memory set of compact indicators keyed by id.
+
+    It has the same upsert_many method as IndicatorStore, so it can be filled by collect_incremental
+    or directly from iter_threat_data without holding the provider records.
+
+    With an AgingEngine, every merged indicator is scheduled to expire a TTL after it was last seen,
+    with the longest TTL of its sources, and expire removes the indicators whose TTL has run out.
+    """
+
+    def __init__(self, payloads=None, clock=time.time, aging=None):
+        """
+        :param payloads: (PayloadSpool) Where to keep provider records, or None to drop them.
+        :param clock: (callable) Wall-clock time function, used when a record carries no timestamps.
+        :param aging: (AgingEngine) Optional engine expiring indicators that are no longer reported.
+        """
+        self.payloads = payloads
+        self.aging = aging
+        self._clock = clock
+        self._indicators = {}
+
+    def upsert_many(self, entries, source):
+        """
+        Add or update indicators from validated provider records.
+
+        :param entries: (iterable) Validated threat intelligence entries.
+        :param source: (str) The name of the source that reported the entries.
+        :return: (int) The number of entries merged.
+        :raises DataError: If an entry has no id.
+        """
+        indicators = self._indicators
+        payloads = self.payloads
+        aging = self.aging
+        source = _intern(source)
+        now = self._clock()
+        count = 0
+        for entry in entries:
+            try:
+                indicator_id = str(entry['id'])
+                indicator_type, value = indicator_type_and_value(entry)
+            except (KeyError, TypeError) as e:
+                log_error(f"Cannot build an indicator from {source} entry {entry!r}: {e}.")
+                raise DataError("Missing required data keys.")
+            first_seen = record_timestamp(entry, FIRST_SEEN_FIELDS)
+            last_seen = record_timestamp(entry, LAST_SEEN_FIELDS) or first_seen or now
+            confidence = entry.get('confidence')
+            if not isinstance(confidence, (int, float)) or isinstance(confidence, bool):
+                confidence = None
+            raw_offset = payloads.put(entry) if payloads is not None else None
+
+            existing = indicators.get(indicator_id)
+            if existing is None:
+                existing = indicators[indicator_id] = Indicator(indicator_id, indicator_type, value, source,
+                                                                first_seen or last_seen, last_seen, confidence,
+                                                                raw_offset)
+            else:
+                if indicator_type is not None:
+                    existing.type = _intern(indicator_type)
+                existing.value = value
+                if source not in existing.source.split(','):
+                    existing.source = _intern(f"{existing.source},{source}")
+                if first_seen is not None and first_seen < existing.first_seen:
+                    existing.first_seen = first_seen
+                existing.last_seen = max(existing.last_seen, last_seen)
+                if confidence is not None:
+                    existing.confidence = confidence
+                if raw_offset is not None:
+                    existing.raw_offset = raw_offset
+            if aging is not None:
+                aging.track(indicator_id, existing.type, existing.source, existing.last_seen)
+            count += 1
+        return count
+
+    def discard(self, indicator_id):
+        """
+        Remove an indicator if it is in the set.
+
+        :param indicator_id: (str) The indicator id.
+        :return: (Indicator) The removed indicator, or None.
+        """
+        indicator = self._indicators.pop(str(indicator_id), None)
+        if indicator is not None and self.aging is not None:
+            self.aging.forget(indicator.id)
+        return indicator
+
+    def expire(self, now=None):
+        """
+        Remove the indicators whose TTL has run out; without an AgingEngine nothing expires.
+
+        :param now: (float) The current time; defaults to the engine's clock.
+        :return: (list) The ids of the removed indicators.
+        """
+        if self.aging is None:
+            return []
+        expired = self.aging.expire(now)
+        for indicator_id in expired:
+            self._indicators.pop(indicator_id, None)
+        return expired
+
+    def get(self, indicator_id):
+        """
+        :param indicator_id: (str) The indicator id.
+        :return: (Indicator) The indicator, or None.
+        """
+        return self._indicators.get(str(indicator_id))
+
+    def raw(self, indicator):
+        """
+        :param indicator: (Indicator) An indicator of this set.
+        :return: (dict) Its most recent provider record, or None if records are not kept.
+        """
+        if self.payloads is None or indicator.raw_offset is None:
+            return None
+        return self.payloads.get(indicator.raw_offset)
+
+    def __len__(self):
+        return len(self._indicators)
+
+    def __iter__(self):
+        return iter(self._indicators.values())
+
+    def __contains__(self, indicator_id):
+        return str(indicator_id) in self._indicators
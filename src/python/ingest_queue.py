@@ -0,0 +1,420 @@
+#  IntelliSIEM Copyright 2024, Rob Perry
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import bisect
+import json
+import os
+import struct
+import threading
+import time
+import zlib
+
+from src.python.error_handling import DataError, log_error
+
+# payload length, CRC32 of the payload, offset, POSIX time of the append
+RECORD_HEADER = struct.Struct('<IIQd')
+
+SEGMENT_SUFFIX = '.log'
+OFFSETS_FILE = 'offsets.json'
+
+# Read positions remembered for sequential reads, e.g. one per consumer
+_MAX_POSITIONS = 64
+
+
+def _segment_name(base_offset):
+    return f"{base_offset:020d}{SEGMENT_SUFFIX}"
+
+
+class QueueEntry:
+    """
+    A batch of raw provider records read from the queue.
+    """
+
+    __slots__ = ('offset', 'timestamp', 'source', 'records')
+
+    def __init__(self, offset, timestamp, source, records):
+        """
+        :param offset: (int) The entry's position in the queue.
+        :param timestamp: (float) POSIX time the entry was appended.
+        :param source: (str) The name of the source the records were fetched from.
+        :param records: (list) The records, as the provider returned them.
+        """
+        self.offset = offset
+        self.timestamp = timestamp
+        self.source = source
+        self.records = records
+
+    def __repr__(self):
+        return f"QueueEntry(offset={self.offset!r}, source={self.source!r}, records={len(self.records)})"
+
+
+class IngestQueue:
+    """
+    A durable, append-only queue of raw provider records between fetching and processing.
+
+    Entries are appended to segment files named after the offset of their first entry, each entry
+    framed with its length and CRC32, and a new segment is started once the current one reaches
+    segment_bytes. Appends are fsynced in groups, at most every fsync_interval seconds or on sync(),
+    so fetches do not wait for the disk on every page; a timer syncs the last appends of a burst once
+    the interval has run out, so they are not left unsynced until the next append. After a crash the
+    last segment is truncated at its last complete entry.
+
+    Consumers track their own progress: poll returns the entries after a consumer's committed offset,
+    and commit moves it forward once they were processed, so an entry may be processed again after a
+    crash but is never skipped. Whole segments are deleted when the queue exceeds retention_bytes or
+    they are older than retention_age, but, with keep_unconsumed, only once every consumer has
+    committed past them. keep_unconsumed protects entries for the consumers declared when the queue
+    is opened, from the first entry until they commit, and for every consumer that has committed an
+    offset; a queue without any such consumer is trimmed by size and age alone.
+    """
+
+    def __init__(self, directory, segment_bytes=64 << 20, fsync=True, fsync_interval=1.0, retention_bytes=None,
+                 retention_age=None, keep_unconsumed=True, consumers=(), clock=time.time):
+        """
+        Open (or create) a queue.
+
+        :param directory: (str) The directory holding the segments and consumer offsets.
+        :param segment_bytes: (int) The size at which a new segment is started.
+        :param fsync: (bool) Whether appends are flushed to disk.
+        :param fsync_interval: (float) Longest time in seconds appends stay unsynced; 0 syncs every append.
+        :param retention_bytes: (int) The size above which the oldest segments are deleted, or None.
+        :param retention_age: (float) Seconds after their last append that segments are deleted, or None.
+        :param keep_unconsumed: (bool) Whether segments are kept until every consumer has committed past them.
+        :param consumers: (iterable) Names of the consumers that will read the queue, whose entries are kept
+            even before they first commit.
+        :param clock: (callable) Wall-clock time function, replaceable for testing.
+        :raises DataError: If the directory cannot be used.
+        """
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.fsync = fsync
+        self.fsync_interval = fsync_interval
+        self.retention_bytes = retention_bytes
+        self.retention_age = retention_age
+        self.keep_unconsumed = keep_unconsumed
+        self.consumers = tuple(consumers)
+        self._clock = clock
+        self._lock = threading.RLock()
+        self._positions = {}
+        self._unsynced = 0
+        self._last_sync = clock()
+        self._sync_timer = None
+        try:
+            os.makedirs(directory, exist_ok=True)
+            self._bases = sorted(int(name[:-len(SEGMENT_SUFFIX)]) for name in os.listdir(directory)
+                                 if name.endswith(SEGMENT_SUFFIX) and name[:-len(SEGMENT_SUFFIX)].isdigit())
+            self._offsets = self._load_offsets()
+            if not self._bases:
+                self._bases.append(0)
+            self.next_offset = self._recover(self._bases[-1])
+            self._file = open(self._path(self._bases[-1]), 'ab')
+            self._apply_retention()
+        except OSError as e:
+            log_error(f"Cannot open ingest queue in {directory}: {e}.")
+            raise DataError("Cannot open ingest queue.")
+
+    def _path(self, base_offset):
+        return os.path.join(self.directory, _segment_name(base_offset))
+
+    def _load_offsets(self):
+        path = os.path.join(self.directory, OFFSETS_FILE)
+        try:
+            with open(path, 'rb') as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return {}
+        except ValueError:
+            log_error(f"Consumer offsets in {path} are unreadable; consumers restart from the oldest entry.",
+                      level="WARNING")
+            return {}
+
+    def _scan(self, file):
+        """
+        Iterate over the entries of a segment file from its current position.
+
+        :return: (generator) (offset, timestamp, payload, end position) tuples of the complete entries.
+        """
+        while True:
+            header = file.read(RECORD_HEADER.size)
+            if len(header) < RECORD_HEADER.size:
+                return
+            length, checksum, offset, timestamp = RECORD_HEADER.unpack(header)
+            payload = file.read(length)
+            if len(payload) < length or zlib.crc32(payload) != checksum:
+                return
+            yield offset, timestamp, payload, file.tell()
+
+    def _recover(self, base_offset):
+        """
+        Drop a torn entry at the end of the last segment, left by a crash during an append.
+
+        :return: (int) The offset the next entry is appended at.
+        """
+        path = self._path(base_offset)
+        next_offset, end = base_offset, 0
+        if os.path.exists(path):
+            with open(path, 'r+b') as file:
+                for offset, _, _, end in self._scan(file):
+                    next_offset = offset + 1
+                if end < os.path.getsize(path):
+                    log_error(f"Truncating incomplete entry at the end of {path}.", level="WARNING")
+                    file.truncate(end)
+        return next_offset
+
+    def append(self, source, records):
+        """
+        Append a batch of records.
+
+        :param source: (str) The name of the source the records were fetched from.
+        :param records: (list) JSON-serializable records.
+        :return: (int) The entry's offset.
+        :raises DataError: If the entry cannot be written.
+        """
+        payload = json.dumps({'source': source, 'records': records}, separators=(',', ':'), default=str).encode()
+        with self._lock:
+            offset = self.next_offset
+            try:
+                if self._file.tell() >= self.segment_bytes:
+                    self._roll()
+                self._file.write(RECORD_HEADER.pack(len(payload), zlib.crc32(payload), offset, self._clock()))
+                self._file.write(payload)
+                self.next_offset += 1
+                self._unsynced += 1
+                if self._clock() - self._last_sync >= self.fsync_interval:
+                    self._sync()
+                elif self._sync_timer is None:
+                    self._sync_timer = threading.Timer(self.fsync_interval, self._sync_later)
+                    self._sync_timer.daemon = True
+                    self._sync_timer.start()
+            except OSError as e:
+                log_error(f"Cannot append to ingest queue in {self.directory}: {e}.")
+                raise DataError("Cannot write to ingest queue.")
+        return offset
+
+    def _roll(self):
+        self._sync()
+        self._file.close()
+        self._bases.append(self.next_offset)
+        self._file = open(self._path(self.next_offset), 'ab')
+        self._apply_retention()
+
+    def _sync(self):
+        self._file.flush()
+        if self.fsync and self._unsynced:
+            os.fsync(self._file.fileno())
+        self._unsynced = 0
+        self._last_sync = self._clock()
+
+    def _sync_later(self):
+        # Sync entries still unsynced once fsync_interval has passed without another append syncing them
+        with self._lock:
+            self._sync_timer = None
+            if self._file.closed or not self._unsynced:
+                return
+            try:
+                self._sync()
+            except OSError as e:
+                log_error(f"Cannot sync ingest queue in {self.directory}: {e}.")
+
+    def sync(self):
+        """
+        Flush every appended entry to disk.
+
+        :raises DataError: If the entries cannot be written.
+        """
+        with self._lock:
+            try:
+                self._sync()
+            except OSError as e:
+                log_error(f"Cannot sync ingest queue in {self.directory}: {e}.")
+                raise DataError("Cannot write to ingest queue.")
+
+    @property
+    def first_offset(self):
+        """
+        :return: (int) The offset of the oldest entry still held.
+        """
+        return self._bases[0]
+
+    def read(self, offset, max_entries=100):
+        """
+        Read entries in order, starting at an offset.
+
+        :param offset: (int) The first offset to read; entries already deleted by retention are skipped.
+        :param max_entries: (int) The largest number of entries returned.
+        :return: (list) QueueEntry objects, empty if there are no entries at or after the offset.
+        :raises DataError: If a segment cannot be read or is corrupt.
+        """
+        with self._lock:
+            self._file.flush()
+            if offset < self._bases[0]:
+                log_error(f"Offset {offset} was deleted by retention; reading from {self._bases[0]}.",
+                          level="WARNING")
+                offset = self._bases[0]
+            end_offset = self.next_offset
+            if offset >= end_offset:
+                return []
+            base = self._bases[bisect.bisect_right(self._bases, offset) - 1]
+            bases = self._bases[self._bases.index(base):]
+            position = self._positions.pop(offset, None)
+            start = position[1] if position is not None and position[0] == base else 0
+
+        entries = []
+        expected = offset
+        try:
+            for base in bases:
+                with open(self._path(base), 'rb') as file:
+                    file.seek(start)
+                    for entry_offset, timestamp, payload, end in self._scan(file):
+                        if entry_offset < expected:
+                            continue
+                        if entry_offset != expected:
+                            break
+                        body = json.loads(payload)
+                        entries.append(QueueEntry(entry_offset, timestamp, body['source'], body['records']))
+                        expected += 1
+                        if len(entries) >= max_entries or expected >= end_offset:
+                            self._remember(expected, base, end)
+                            return entries
+                start = 0
+        except FileNotFoundError:
+            # Deleted by retention while it was read; the caller reads on from the oldest remaining entry
+            return entries
+        except (OSError, ValueError, KeyError) as e:
+            log_error(f"Cannot read ingest queue in {self.directory} at offset {expected}: {e}.")
+            raise DataError("Corrupt ingest queue.")
+        log_error(f"Ingest queue in {self.directory} has no readable entry at offset {expected}.")
+        raise DataError("Corrupt ingest queue.")
+
+    def _remember(self, offset, base, position):
+        with self._lock:
+            if len(self._positions) >= _MAX_POSITIONS:
+                self._positions.clear()
+            self._positions[offset] = (base, position)
+
+    def committed(self, consumer):
+        """
+        :param consumer: (str) The consumer name.
+        :return: (int) The offset the consumer reads next; the oldest held entry for a new consumer.
+        """
+        with self._lock:
+            return max(self._offsets.get(consumer, 0), self._bases[0])
+
+    def poll(self, consumer, max_entries=100):
+        """
+        Read the entries after a consumer's committed offset, without committing them.
+
+        :param consumer: (str) The consumer name.
+        :param max_entries: (int) The largest number of entries returned.
+        :return: (list) QueueEntry objects.
+        :raises DataError: If a segment cannot be read or is corrupt.
+        """
+        return self.read(self.committed(consumer), max_entries)
+
+    def commit(self, consumer, offset):
+        """
+        Record that a consumer has processed every entry before an offset.
+
+        :param consumer: (str) The consumer name.
+        :param offset: (int) The offset the consumer reads next, i.e. the last processed offset plus one.
+        :raises DataError: If the offsets cannot be written.
+        """
+        path = os.path.join(self.directory, OFFSETS_FILE)
+        with self._lock:
+            self._offsets[consumer] = offset
+            try:
+                with open(f"{path}.tmp", 'w') as file:
+                    json.dump(self._offsets, file)
+                os.replace(f"{path}.tmp", path)
+            except OSError as e:
+                log_error(f"Cannot save consumer offsets in {self.directory}: {e}.")
+                raise DataError("Cannot write to ingest queue.")
+
+    def lag(self, consumer):
+        """
+        :param consumer: (str) The consumer name.
+        :return: (int) The number of entries the consumer has not committed yet.
+        """
+        return self.next_offset - self.committed(consumer)
+
+    def _apply_retention(self):
+        now = self._clock()
+        # Declared consumers that have not committed yet still have every entry to read
+        offsets = [self._offsets.get(consumer, 0) for consumer in self.consumers] + list(self._offsets.values())
+        protected = min(offsets) if self.keep_unconsumed and offsets else None
+        sizes = [os.path.getsize(self._path(base)) for base in self._bases]
+        total = sum(sizes)
+        deleted = 0
+        # The active segment is never deleted
+        while len(self._bases) > 1:
+            base, end = self._bases[0], self._bases[1]
+            expired = self.retention_age is not None and os.path.getmtime(self._path(base)) < now - self.retention_age
+            oversize = self.retention_bytes is not None and total > self.retention_bytes
+            if not (expired or oversize) or (protected is not None and end > protected):
+                break
+            os.remove(self._path(base))
+            self._bases.pop(0)
+            total -= sizes.pop(0)
+            deleted += 1
+        if deleted:
+            self._positions.clear()
+        return deleted
+
+    def apply_retention(self):
+        """
+        Delete the oldest segments that are over the retention size or age.
+
+        :return: (int) The number of segments deleted.
+        :raises DataError: If a segment cannot be deleted.
+        """
+        with self._lock:
+            try:
+                return self._apply_retention()
+            except OSError as e:
+                log_error(f"Cannot apply retention to ingest queue in {self.directory}: {e}.")
+                raise DataError("Cannot write to ingest queue.")
+
+    def stats(self):
+        """
+        :return: (dict) Segment count and size, offsets and the lag of every consumer.
+        """
+        with self._lock:
+            self._file.flush()
+            return {
+                'segments': len(self._bases),
+                'bytes': sum(os.path.getsize(self._path(base)) for base in self._bases),
+                'first_offset': self._bases[0],
+                'next_offset': self.next_offset,
+                'unsynced': self._unsynced,
+                'consumers': {consumer: self.next_offset - max(offset, self._bases[0])
+                              for consumer, offset in self._offsets.items()},
+            }
+
+    def close(self):
+        """
+        Flush appended entries to disk and close the current segment.
+        """
+        with self._lock:
+            if self._sync_timer is not None:
+                self._sync_timer.cancel()
+                self._sync_timer = None
+            if not self._file.closed:
+                self._sync()
+                self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,256 @@
+#  IntelliSIEM Copyright 2024, Rob Perry
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import json
+import re
+
+from src.python.error_handling import DataError, log_error
+
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+_STRUCTURE = re.compile(r'["\[\]{}]')
+_STRING_END = re.compile(r'["\\]')
+_SCALAR_END = re.compile(r'[ \t\n\r,:\]}]')
+_decoder = json.JSONDecoder()
+
+# The most characters of a single JSON value held in memory while it is being read
+MAX_BUFFER_SIZE = 64 * 1024 * 1024
+
+
+class _ValueScanner:
+    """
+    Finds where a JSON value ends across chunks without decoding it, by tracking string and nesting state.
+    """
+
+    def __init__(self, first):
+        """
+        :param first: (str) The first character of the value.
+        """
+        self.scalar = first not in '"[{'
+        self.depth = 0
+        self.in_string = False
+        self.escaped = False
+
+    def feed(self, text):
+        """
+        Scan the next piece of the value.
+
+        :param text: (str) The text following the text fed before.
+        :return: (int) The index in text just past the end of the value, or None if the value continues.
+        """
+        if self.scalar:
+            match = _SCALAR_END.search(text)
+            return None if match is None else match.start()
+        pos = 0
+        while True:
+            if self.escaped:
+                if pos >= len(text):
+                    return None
+                self.escaped = False
+                pos += 1
+            if self.in_string:
+                match = _STRING_END.search(text, pos)
+                if match is None:
+                    return None
+                pos = match.end()
+                if match.group() == '\\':
+                    self.escaped = True
+                    continue
+                self.in_string = False
+                if self.depth == 0:
+                    return pos
+                continue
+            match = _STRUCTURE.search(text, pos)
+            if match is None:
+                return None
+            pos = match.end()
+            char = match.group()
+            if char == '"':
+                self.in_string = True
+            elif char in '[{':
+                self.depth += 1
+            else:
+                self.depth -= 1
+                if self.depth <= 0:
+                    return pos
+
+
+class _ChunkBuffer:
+    """
+    A sliding text buffer over an iterable of decoded chunks.
+
+    Only the unconsumed tail of the input is kept, so memory stays bounded by the chunk size plus
+    the largest single value being decoded, which may not exceed max_size characters.
+    """
+
+    def __init__(self, chunks, max_size=MAX_BUFFER_SIZE):
+        self._chunks = iter(chunks)
+        self.max_size = max_size
+        self.text = ''
+        self.pos = 0
+
+    def _read(self):
+        for chunk in self._chunks:
+            if chunk:
+                return chunk
+        return None
+
+    def _check_size(self, size):
+        if size > self.max_size:
+            log_error(f"JSON value of more than {self.max_size} characters in the response.")
+            raise DataError("Response value too large.")
+
+    def fill(self):
+        """
+        Append the next non-empty chunk to the buffer.
+
+        :return: (bool) False if the input is exhausted.
+        :raises DataError: If the buffer would exceed max_size characters.
+        """
+        chunk = self._read()
+        if chunk is None:
+            return False
+        self._check_size(len(self.text) - self.pos + len(chunk))
+        self.text = self.text[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self):
+        """
+        Skip whitespace and return the next character without consuming it.
+
+        :return: (str) The next character, or an empty string at the end of the input.
+        """
+        while True:
+            self.pos = _WHITESPACE.match(self.text, self.pos).end()
+            if self.pos < len(self.text):
+                return self.text[self.pos]
+            if not self.fill():
+                return ''
+
+    def consume(self, expected):
+        """
+        Consume the next character, which must be one of the expected characters.
+
+        :param expected: (str) The characters allowed at this position.
+        :return: (str) The consumed character.
+        :raises ValueError: If the next character is not expected.
+        """
+        char = self.peek()
+        if not char or char not in expected:
+            raise ValueError(f"Expected one of {expected!r} at position {self.pos}, found {char!r}.")
+        self.pos += 1
+        return char
+
+    def value(self):
+        """
+        Decode the next complete JSON value, reading more chunks as needed.
+
+        A value that continues past the buffer is scanned for its end chunk by chunk and decoded once
+        it is complete, so its cost stays linear in its size however many chunks it spans.
+
+        :return: The decoded value.
+        :raises ValueError: If the input is not valid JSON.
+        :raises DataError: If the value exceeds max_size characters.
+        """
+        first = self.peek()
+        try:
+            obj, end = _decoder.raw_decode(self.text, self.pos)
+            # A number that ends exactly at the buffer boundary may continue in the next chunk
+            if end < len(self.text) or first in '"[{':
+                self.pos = end
+                return obj
+        except json.JSONDecodeError:
+            if not first:
+                raise
+
+        scanner = _ValueScanner(first)
+        parts = [self.text[self.pos:]]
+        size = len(parts[0])
+        end = scanner.feed(parts[0])
+        while end is None:
+            chunk = self._read()
+            if chunk is None:
+                break
+            size += len(chunk)
+            self._check_size(size)
+            parts.append(chunk)
+            end = scanner.feed(chunk)
+        # Decoding the complete value, or the truncated one at the end of the input, which raises
+        self.text = ''.join(parts)
+        obj, self.pos = _decoder.raw_decode(self.text, 0)
+        return obj
+
+
+def _iter_array(buffer):
+    """
+    Yield the elements of the JSON array at the current buffer position one at a time.
+    """
+    buffer.consume('[')
+    if buffer.peek() == ']':
+        buffer.consume(']')
+        return
+    while True:
+        yield buffer.value()
+        if buffer.consume(',]') == ']':
+            return
+
+
+def iter_json_items(chunks, items_key=None, max_size=MAX_BUFFER_SIZE):
+    """
+    Incrementally parse a JSON document and yield the items of its record array.
+
+    The document may be a top-level array, or an object whose items_key member holds the array.
+    The other members of such an object (pagination cursors, counts, links) are collected and
+    returned as the generator's return value, so callers can follow the next page with
+    ``envelope = yield from iter_json_items(...)``.
+
+    :param chunks: (iterable) Text chunks of the JSON document.
+    :param items_key: (str) The object member holding the record array, if the document is an object.
+    :param max_size: (int) The most characters a single record or member may span.
+    :return: (dict) The members of the enclosing object other than the record array.
+    :raises ValueError: If the document is not valid JSON.
+    :raises DataError: If the document does not contain a record array, or a value is larger than max_size.
+    """
+    buffer = _ChunkBuffer(chunks, max_size)
+    envelope = {}
+    first = buffer.peek()
+
+    if first == '[':
+        yield from _iter_array(buffer)
+    elif first == '{' and items_key is not None:
+        found = False
+        buffer.consume('{')
+        if buffer.peek() == '}':
+            buffer.consume('}')
+        else:
+            while True:
+                key = buffer.value()
+                buffer.consume(':')
+                if key == items_key and buffer.peek() == '[':
+                    found = True
+                    yield from _iter_array(buffer)
+                else:
+                    envelope[key] = buffer.value()
+                if buffer.consume(',}') == '}':
+                    break
+        if not found:
+            log_error(f"Response object has no '{items_key}' array.")
+            raise DataError("Unexpected data type received.")
+    else:
+        log_error(f"Unexpected JSON document type starting with {first!r}.")
+        raise DataError("Unexpected data type received.")
+
+    if buffer.peek():
+        raise ValueError("Extra data after JSON document.")
+    return envelope
@@ -0,0 +1,417 @@
+#  IntelliSIEM Copyright 2024, Rob Perry
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import ipaddress
+import threading
+from collections import deque
+
+from src.python.error_handling import log_error
+from src.python.indicator_store import indicator_type_and_value
+
+CATEGORY_HASH = 'hash'
+CATEGORY_IP = 'ip'
+CATEGORY_CIDR = 'cidr'
+CATEGORY_DOMAIN = 'domain'
+CATEGORY_URL = 'url'
+
+# Provider indicator types (OTX and VirusTotal), lower-cased, mapped to matching categories
+INDICATOR_CATEGORIES = {
+    'filehash-md5': CATEGORY_HASH,
+    'filehash-sha1': CATEGORY_HASH,
+    'filehash-sha256': CATEGORY_HASH,
+    'file': CATEGORY_HASH,
+    'md5': CATEGORY_HASH,
+    'sha1': CATEGORY_HASH,
+    'sha256': CATEGORY_HASH,
+    'ipv4': CATEGORY_IP,
+    'ipv6': CATEGORY_IP,
+    'ip_address': CATEGORY_IP,
+    'cidr': CATEGORY_CIDR,
+    'domain': CATEGORY_DOMAIN,
+    'hostname': CATEGORY_DOMAIN,
+    'url': CATEGORY_URL,
+    'uri': CATEGORY_URL,
+}
+
+# Event fields checked for each category
+DEFAULT_EVENT_FIELDS = {
+    CATEGORY_HASH: ('md5', 'sha1', 'sha256', 'file_hash'),
+    CATEGORY_IP: ('src_ip', 'dst_ip', 'ip'),
+    CATEGORY_DOMAIN: ('domain', 'host', 'hostname', 'query'),
+    CATEGORY_URL: ('url', 'uri'),
+}
+
+
+class Match:
+    """
+    A single indicator match in an event.
+    """
+
+    __slots__ = ('event_index', 'field', 'value', 'category', 'indicator_id')
+
+    def __init__(self, event_index, field, value, category, indicator_id):
+        """
+        :param event_index: (int) The position of the event in the batch.
+        :param field: (str) The event field that matched.
+        :param value: (str) The matching observable, e.g. the IOC domain or network.
+        :param category: (str) The matching category: hash, ip, cidr, domain or url.
+        :param indicator_id: The id of the matching indicator.
+        """
+        self.event_index = event_index
+        self.field = field
+        self.value = value
+        self.category = category
+        self.indicator_id = indicator_id
+
+    def __eq__(self, other):
+        return isinstance(other, Match) and all(getattr(self, a) == getattr(other, a) for a in self.__slots__)
+
+    def __repr__(self):
+        return (f"Match(event_index={self.event_index!r}, field={self.field!r}, value={self.value!r}, "
+                f"category={self.category!r}, indicator_id={self.indicator_id!r})")
+
+
+class AhoCorasick:
+    """
+    An Aho-Corasick automaton that finds every occurrence of a set of patterns in one pass over a text.
+    """
+
+    def __init__(self, patterns):
+        """
+        Build the automaton.
+
+        :param patterns: (dict) Pattern strings mapped to the value reported when they match.
+        """
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [()]
+        self._patterns = 0
+        for pattern, value in patterns.items():
+            if not pattern:
+                continue
+            self._patterns += 1
+            node = 0
+            for char in pattern:
+                next_node = self._goto[node].get(char)
+                if next_node is None:
+                    next_node = len(self._goto)
+                    self._goto[node][char] = next_node
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._output.append(())
+                node = next_node
+            self._output[node] += ((pattern, value),)
+
+        # Breadth-first construction of failure links; outputs are merged along them
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self._goto[node].items():
+                queue.append(child)
+                fallback = self._fail[node]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[child] = self._goto[fallback].get(char, 0)
+                self._output[child] += self._output[self._fail[child]]
+
+    def __len__(self):
+        return self._patterns
+
+    def search(self, text):
+        """
+        Find every pattern occurring in the text.
+
+        :param text: (str) The text to scan.
+        :return: (list) (pattern, value) tuples, one per occurrence.
+        """
+        goto, fail, output = self._goto, self._fail, self._output
+        found = []
+        node = 0
+        for char in text:
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            if output[node]:
+                found.extend(output[node])
+        return found
+
+
+class PrefixTable:
+    """
+    A longest-prefix lookup table for CIDR ranges.
+
+    Networks are grouped by prefix length into hash tables of their network bits, so a lookup costs
+    one hash probe per distinct prefix length rather than a walk over every range.
+    """
+
+    def __init__(self):
+        self._tables = {4: {}, 6: {}}
+        self._lengths = {4: [], 6: []}
+
+    def add(self, network, value):
+        """
+        :param network: (ipaddress.IPv4Network or IPv6Network) The range to add.
+        :param value: The value reported when an address falls into the range.
+        """
+        bits = network.max_prefixlen - network.prefixlen
+        table = self._tables[network.version].setdefault(network.prefixlen, {})
+        table[int(network.network_address) >> bits] = (str(network), value)
+        self._lengths[network.version] = sorted(self._tables[network.version], reverse=True)
+
+    def __len__(self):
+        return sum(len(table) for tables in self._tables.values() for table in tables.values())
+
+    def lookup(self, version, number):
+        """
+        Find the most specific range containing an address.
+
+        :param version: (int) The IP version, 4 or 6.
+        :param number: (int) The address as an integer.
+        :return: (tuple) The network string and its value, or None.
+        """
+        tables = self._tables[version]
+        max_bits = 32 if version == 4 else 128
+        for length in self._lengths[version]:
+            hit = tables[length].get(number >> (max_bits - length))
+            if hit is not None:
+                return hit
+        return None
+
+
+def _parse_ipv4(value):
+    """
+    Parse a dotted-quad IPv4 address much faster than ipaddress.ip_address.
+
+    :param value: (str) The address.
+    :return: (int) The address as an integer, or None if it is not a canonical IPv4 address.
+    """
+    parts = value.split('.')
+    if len(parts) != 4:
+        return None
+    number = 0
+    for part in parts:
+        if not part.isdigit() or (len(part) > 1 and part[0] == '0'):
+            return None
+        octet = int(part)
+        if octet > 255:
+            return None
+        number = (number << 8) | octet
+    return number
+
+
+def _indicator_fields(indicator):
+    if isinstance(indicator, dict):
+        indicator_type, value = indicator_type_and_value(indicator)
+        return indicator['id'], indicator_type, value
+    return indicator.id, indicator.type, indicator.value
+
+
+def _normalize_domain(value):
+    return value.strip().rstrip('.').lower()
+
+
+class MatchIndex:
+    """
+    An immutable index of indicators optimized for matching event batches.
+
+    Hashes and IP addresses are matched exactly through hash tables, CIDR ranges through a prefix
+    table, domains by probing each parent domain of the event's domain, and URLs by scanning the
+    event's URL fields with an Aho-Corasick automaton.
+    """
+
+    def __init__(self, indicators, event_fields=None):
+        """
+        Build the index.
+
+        :param indicators: (iterable) Validated entries or StoredIndicator objects.
+        :param event_fields: (dict) Event field names checked for each category.
+        """
+        self.event_fields = event_fields or DEFAULT_EVENT_FIELDS
+        self.hashes = {}
+        self.ips = {}
+        self.networks = PrefixTable()
+        self.domains = {}
+        urls = {}
+        self.skipped = 0
+
+        for indicator in indicators:
+            indicator_id, indicator_type, value = _indicator_fields(indicator)
+            category = INDICATOR_CATEGORIES.get((indicator_type or '').lower())
+            if category == CATEGORY_HASH:
+                self.hashes[value.lower()] = indicator_id
+            elif category == CATEGORY_IP or category == CATEGORY_CIDR:
+                try:
+                    network = ipaddress.ip_network(value.strip(), strict=False)
+                except ValueError:
+                    log_error(f"Invalid IP indicator {indicator_id}: {value}.", level="WARNING")
+                    self.skipped += 1
+                    continue
+                if network.num_addresses == 1:
+                    self.ips[str(network.network_address)] = indicator_id
+                else:
+                    self.networks.add(network, indicator_id)
+            elif category == CATEGORY_DOMAIN:
+                self.domains[_normalize_domain(value)] = indicator_id
+            elif category == CATEGORY_URL:
+                urls[value.strip().lower()] = indicator_id
+            else:
+                self.skipped += 1
+        self.urls = AhoCorasick(urls)
+        self._has_networks = len(self.networks) > 0
+
+    def __len__(self):
+        return len(self.hashes) + len(self.ips) + len(self.networks) + len(self.domains) + len(self.urls)
+
+    def _match_ip(self, value):
+        indicator_id = self.ips.get(value)
+        if indicator_id is not None:
+            return value, CATEGORY_IP, indicator_id
+        if not self._has_networks and ':' not in value:
+            # Without ranges, only IPv6 addresses (which have several textual forms) need parsing
+            return None
+        number = _parse_ipv4(value)
+        if number is not None:
+            version = 4
+        else:
+            try:
+                address = ipaddress.ip_address(value.strip())
+            except ValueError:
+                return None
+            version, number = address.version, int(address)
+            canonical = str(address)
+            if canonical != value:
+                indicator_id = self.ips.get(canonical)
+                if indicator_id is not None:
+                    return canonical, CATEGORY_IP, indicator_id
+        hit = self.networks.lookup(version, number)
+        if hit is not None:
+            return hit[0], CATEGORY_CIDR, hit[1]
+        return None
+
+    def _match_domain(self, value):
+        domain = _normalize_domain(value)
+        domains = self.domains
+        while domain:
+            indicator_id = domains.get(domain)
+            if indicator_id is not None:
+                return domain, indicator_id
+            dot = domain.find('.')
+            if dot < 0:
+                return None
+            domain = domain[dot + 1:]
+        return None
+
+    def match_batch(self, events):
+        """
+        Match a batch of events against the index.
+
+        :param events: (list) Events as dicts of field names to values.
+        :return: (list) Match objects, ordered by event.
+        """
+        hash_fields = self.event_fields.get(CATEGORY_HASH, ())
+        ip_fields = self.event_fields.get(CATEGORY_IP, ())
+        domain_fields = self.event_fields.get(CATEGORY_DOMAIN, ())
+        url_fields = self.event_fields.get(CATEGORY_URL, ()) if len(self.urls) else ()
+        hashes = self.hashes
+        check_ips = bool(self.ips) or bool(len(self.networks))
+        matches = []
+        append = matches.append
+
+        for index, event in enumerate(events):
+            for field in hash_fields:
+                value = event.get(field)
+                if isinstance(value, str) and value:
+                    indicator_id = hashes.get(value.lower())
+                    if indicator_id is not None:
+                        append(Match(index, field, value.lower(), CATEGORY_HASH, indicator_id))
+            if check_ips:
+                for field in ip_fields:
+                    value = event.get(field)
+                    if isinstance(value, str) and value:
+                        hit = self._match_ip(value)
+                        if hit is not None:
+                            append(Match(index, field, hit[0], hit[1], hit[2]))
+            if self.domains:
+                for field in domain_fields:
+                    value = event.get(field)
+                    if isinstance(value, str) and value:
+                        hit = self._match_domain(value)
+                        if hit is not None:
+                            append(Match(index, field, hit[0], CATEGORY_DOMAIN, hit[1]))
+            for field in url_fields:
+                value = event.get(field)
+                if isinstance(value, str) and value:
+                    for pattern, indicator_id in self.urls.search(value.lower()):
+                        append(Match(index, field, pattern, CATEGORY_URL, indicator_id))
+        return matches
+
+
+class IOCMatcher:
+    """
+    Matches SIEM event batches against the current indicator set, with atomic hot-swap on refresh.
+
+    A new MatchIndex is built off to the side and swapped in with a single reference assignment, so
+    batches in flight keep matching against the index they started with.
+    """
+
+    def __init__(self, indicators=(), event_fields=None):
+        """
+        :param indicators: (iterable) The initial validated entries or StoredIndicator objects.
+        :param event_fields: (dict) Event field names checked for each category.
+        """
+        self.event_fields = event_fields
+        self._index = MatchIndex(indicators, event_fields)
+        self._reload_lock = threading.Lock()
+        self.generation = 0
+
+    @property
+    def index(self):
+        """
+        :return: (MatchIndex) The index currently used for matching.
+        """
+        return self._index
+
+    def reload(self, indicators):
+        """
+        Build a new index from a refreshed indicator set and swap it in.
+
+        :param indicators: (iterable) Validated entries or StoredIndicator objects.
+        :return: (MatchIndex) The new index.
+        """
+        with self._reload_lock:
+            index = MatchIndex(indicators, self.event_fields)
+            self._index = index
+            self.generation += 1
+        return index
+
+    def swap(self, index):
+        """
+        Swap in a prebuilt index, such as an IndicatorSnapshot mapped from a file shipped by the collector.
+
+        :param index: (MatchIndex or IndicatorSnapshot) The new index.
+        :return: The index.
+        """
+        with self._reload_lock:
+            self._index = index
+            self.generation += 1
+        return index
+
+    def match_batch(self, events):
+        """
+        Match a batch of events against the current indicator set.
+
+        :param events: (list) Events as dicts of field names to values.
+        :return: (list) Match objects, ordered by event.
+        """
+        return self._index.match_batch(events)
@@ -0,0 +1,377 @@
+#  IntelliSIEM Copyright 2024, Rob Perry
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import bisect
+import math
+import sys
+import threading
+import time
+from collections import Counter as _Tally
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from src.python.error_handling import ConfigError, log_error
+
+# Latency histogram bucket bounds in seconds
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra is not None:
+        pairs.append(f'{extra[0]}="{extra[1]}"')
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """
+    A monotonically increasing count per label set.
+    """
+
+    kind = 'counter'
+
+    def __init__(self, name, help, labelnames=()):
+        """
+        :param name: (str) The metric name.
+        :param help: (str) A one-line description.
+        :param labelnames: (tuple) The names of the labels every sample carries.
+        """
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, *labels, amount=1):
+        """
+        :param labels: The label values, in the order of labelnames.
+        :param amount: (float) The increment.
+        """
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels):
+        """
+        :return: (float) The current count for a label set.
+        """
+        return self._values.get(labels, 0)
+
+    def samples(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        for labels, value in values:
+            yield self.name, _format_labels(self.labelnames, labels), value
+
+
+class _Timer:
+    __slots__ = ('histogram', 'labels', 'started')
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.histogram.observe(time.perf_counter() - self.started, *self.labels)
+
+
+class Histogram:
+    """
+    Counts observations, such as latencies, into cumulative buckets per label set.
+    """
+
+    kind = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        """
+        :param name: (str) The metric name.
+        :param help: (str) A one-line description.
+        :param labelnames: (tuple) The names of the labels every sample carries.
+        :param buckets: (tuple) Increasing upper bounds of the buckets; +Inf is implied.
+        """
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._series = {}
+
+    def observe(self, value, *labels):
+        """
+        :param value: (float) The observation.
+        :param labels: The label values, in the order of labelnames.
+        """
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def time(self, *labels):
+        """
+        :param labels: The label values, in the order of labelnames.
+        :return: A context manager that observes the seconds spent inside it.
+        """
+        return _Timer(self, labels)
+
+    def count(self, *labels):
+        """
+        :return: (int) The number of observations for a label set.
+        """
+        series = self._series.get(labels)
+        return series[2] if series else 0
+
+    def samples(self):
+        with self._lock:
+            series = sorted((labels, (list(counts), total, count)) for labels, (counts, total, count)
+                            in self._series.items())
+        for labels, (counts, total, count) in series:
+            cumulative = 0
+            for bound, bucket in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket
+                yield (f"{self.name}_bucket", _format_labels(self.labelnames, labels, ('le', _format_value(bound))),
+                       cumulative)
+            yield f"{self.name}_sum", _format_labels(self.labelnames, labels), total
+            yield f"{self.name}_count", _format_labels(self.labelnames, labels), count
+
+
+class MetricsRegistry:
+    """
+    The set of metrics exposed together, rendered in the Prometheus text exposition format.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}
+
+    def _register(self, cls, name, help, labelnames, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, help, labelnames, **kwargs)
+            elif not isinstance(metric, cls) or metric.labelnames != tuple(labelnames):
+                raise ValueError(f"Metric {name} is already registered with a different type or labels.")
+            return metric
+
+    def counter(self, name, help, labelnames=()):
+        """
+        :return: (Counter) The registered counter, created on first use.
+        """
+        return self._register(Counter, name, help, labelnames)
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        """
+        :return: (Histogram) The registered histogram, created on first use.
+        """
+        return self._register(Histogram, name, help, labelnames, buckets=buckets)
+
+    def render(self):
+        """
+        :return: (str) Every metric in the Prometheus text exposition format.
+        """
+        lines = []
+        with self._lock:
+            metrics = sorted(self._metrics.items())
+        for name, metric in metrics:
+            lines.append(f"# HELP {name} {metric.help}")
+            lines.append(f"# TYPE {name} {metric.kind}")
+            for sample, labels, value in metric.samples():
+                lines.append(f"{sample}{labels} {_format_value(value)}")
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = MetricsRegistry()
+
+# Collection pipeline metrics; stages are connect, request and decode for HTTP, validate for the schema
+# check and fetch for a whole first-page fetch of a source
+HTTP_REQUESTS = REGISTRY.counter('intellisiem_http_requests_total',
+                                 'HTTP requests sent to threat intelligence providers.', ('source', 'status'))
+STAGE_SECONDS = REGISTRY.histogram('intellisiem_stage_seconds',
+                                   'Seconds spent per source and collection stage.', ('source', 'stage'))
+RECORDS = REGISTRY.counter('intellisiem_records_total',
+                           'Provider records validated, by source and outcome.', ('source', 'outcome'))
+
+
+class SamplingProfiler:
+    """
+    A statistical profiler that samples the stack of every thread at a fixed interval.
+
+    Sampling runs in its own thread and only reads sys._current_frames(), so the profiled code is not
+    instrumented and pays nothing while the profiler is off. Results are collapsed stacks, one line
+    per distinct stack with its sample count, as read by flame graph tools.
+    """
+
+    def __init__(self, interval=0.005):
+        """
+        :param interval: (float) Seconds between samples.
+        """
+        self.interval = interval
+        self._stacks = _Tally()
+        self._stop = threading.Event()
+        self._thread = None
+        self.samples = 0
+
+    def _sample(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({code.co_filename}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                self._stacks[';'.join(reversed(stack))] += 1
+            self.samples += 1
+
+    def start(self):
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._sample, name="sampling-profiler", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """
+        :return: (str) The collapsed stacks sampled so far, most frequent first.
+        """
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+        return ''.join(f"{stack} {count}\n" for stack, count in self._stacks.most_common())
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        server = self.server.metrics
+        parts = urlsplit(self.path)
+        if parts.path == '/metrics':
+            self._reply(200, server.registry.render())
+        elif parts.path == '/debug/profile':
+            if not server.profiling:
+                self._reply(403, "Profiling is disabled; set metrics.profiling in the configuration.\n")
+                return
+            try:
+                seconds = float(parse_qs(parts.query).get('seconds', ['10'])[0])
+            except ValueError:
+                seconds = math.nan
+            if not math.isfinite(seconds):
+                self._reply(400, "Invalid seconds.\n")
+                return
+            result = server.profile(seconds)
+            if result is None:
+                self._reply(409, "A profile is already being taken.\n")
+            else:
+                self._reply(200, result)
+        else:
+            self._reply(404, "Not found.\n")
+
+    def _reply(self, status, text):
+        body = text.encode()
+        self.send_response(status)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class MetricsServer:
+    """
+    A local HTTP endpoint serving /metrics in the Prometheus text format and, when profiling is
+    enabled, /debug/profile?seconds=N, which samples every thread for N seconds and returns collapsed
+    stacks. profiling can be switched at runtime, e.g. from a configuration reload.
+    """
+
+    def __init__(self, registry=REGISTRY, host='127.0.0.1', port=9108, profiling=False, profile_interval=0.005,
+                 max_profile_seconds=60):
+        """
+        :param registry: (MetricsRegistry) The metrics to serve.
+        :param host: (str) The interface to listen on.
+        :param port: (int) The port to listen on, or 0 for any free port.
+        :param profiling: (bool) Whether /debug/profile may be used.
+        :param profile_interval: (float) Seconds between profiler samples.
+        :param max_profile_seconds: (float) The longest profile that can be requested.
+        :raises ConfigError: If the endpoint cannot listen on the address.
+        """
+        self.registry = registry
+        self.profiling = profiling
+        self.profile_interval = profile_interval
+        self.max_profile_seconds = max_profile_seconds
+        self._profile_lock = threading.Lock()
+        try:
+            self._httpd = ThreadingHTTPServer((host, port), _MetricsHandler)
+        except OSError as e:
+            log_error(f"Cannot serve metrics on {host}:{port}: {e}.")
+            raise ConfigError("Invalid metrics setting: port.")
+        self._httpd.daemon_threads = True
+        self._httpd.metrics = self
+        self._thread = None
+
+    @property
+    def port(self):
+        return self._httpd.server_address[1]
+
+    def profile(self, seconds):
+        """
+        :param seconds: (float) How long to sample, capped at max_profile_seconds.
+        :return: (str) Collapsed stacks, or None if another profile is running.
+        """
+        if not self._profile_lock.acquire(blocking=False):
+            return None
+        try:
+            profiler = SamplingProfiler(self.profile_interval)
+            profiler.start()
+            try:
+                time.sleep(min(max(seconds, 0.0), self.max_profile_seconds))
+            finally:
+                stacks = profiler.stop()
+            return stacks
+        finally:
+            self._profile_lock.release()
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._httpd.serve_forever, name="metrics", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        if self._thread is not None:
+            self._httpd.shutdown()
+            self._thread = None
+        self._httpd.server_close()
@@ -0,0 +1,332 @@
+#  IntelliSIEM Copyright 2024, Rob Perry
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import ipaddress
+import itertools
+import multiprocessing
+import os
+import re
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timezone
+from urllib.parse import urlsplit, urlunsplit
+
+from src.python.error_handling import DataError, log_error
+from src.python.indicators import FIRST_SEEN_FIELDS, LAST_SEEN_FIELDS, record_timestamp
+
+# Fields of a normalized indicator, in the order workers send them back
+NORMALIZED_FIELDS = ('id', 'type', 'value', 'source', 'source_id', 'first_seen', 'last_seen', 'confidence', 'tags',
+                     'ttps')
+
+TYPE_IPV4 = 'ipv4'
+TYPE_IPV6 = 'ipv6'
+TYPE_CIDR = 'cidr'
+TYPE_DOMAIN = 'domain'
+TYPE_HOSTNAME = 'hostname'
+TYPE_URL = 'url'
+TYPE_EMAIL = 'email'
+TYPE_MD5 = 'md5'
+TYPE_SHA1 = 'sha1'
+TYPE_SHA256 = 'sha256'
+
+# Provider indicator types (OTX and VirusTotal), lower-cased, mapped to normalized types; 'file' and
+# 'ip_address' are resolved from the value. Unknown types are kept lower-cased.
+PROVIDER_TYPES = {
+    'ipv4': TYPE_IPV4,
+    'ipv6': TYPE_IPV6,
+    'ip_address': None,
+    'cidr': TYPE_CIDR,
+    'domain': TYPE_DOMAIN,
+    'hostname': TYPE_HOSTNAME,
+    'url': TYPE_URL,
+    'uri': TYPE_URL,
+    'email': TYPE_EMAIL,
+    'filehash-md5': TYPE_MD5,
+    'filehash-sha1': TYPE_SHA1,
+    'filehash-sha256': TYPE_SHA256,
+    'md5': TYPE_MD5,
+    'sha1': TYPE_SHA1,
+    'sha256': TYPE_SHA256,
+    'file': None,
+}
+
+HASH_TYPES_BY_LENGTH = {32: TYPE_MD5, 40: TYPE_SHA1, 64: TYPE_SHA256}
+
+# MITRE ATT&CK technique ids, e.g. T1059 or T1059.001
+TTP_PATTERN = re.compile(r'\bT\d{4}(?:\.\d{3})?\b')
+HEX_PATTERN = re.compile(r'^[0-9a-f]+$')
+
+# Free-text fields scanned for technique ids
+TEXT_FIELDS = ('title', 'name', 'description')
+
+
+def _canonical_ip(value):
+    address = ipaddress.ip_address(value.strip().strip('[]'))
+    return (TYPE_IPV4 if address.version == 4 else TYPE_IPV6), address.compressed
+
+
+def _canonical_domain(value):
+    value = value.strip().rstrip('.').lower()
+    if not value:
+        raise ValueError("empty domain")
+    try:
+        return value.encode('idna').decode('ascii')
+    except UnicodeError:
+        return value
+
+
+def _canonical_url(value):
+    parts = urlsplit(value.strip())
+    if not parts.scheme or not parts.netloc:
+        return value.strip()
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path or '/', parts.query, ''))
+
+
+def canonicalize(indicator_type, value):
+    """
+    Bring an observable into its canonical form: hashes lower-cased, IP addresses compressed, domains
+    lower-cased and IDNA encoded without a trailing dot, and URL schemes and hosts lower-cased.
+
+    :param indicator_type: (str) A provider indicator type, e.g. "FileHash-SHA256", or None.
+    :param value: (str) The observable as reported.
+    :return: (tuple) The normalized type and canonical value.
+    :raises ValueError: If the value is not valid for its type.
+    """
+    key = (indicator_type or '').lower()
+    normalized = PROVIDER_TYPES.get(key, key or None)
+    value = str(value)
+    if key == 'file' or normalized in (TYPE_MD5, TYPE_SHA1, TYPE_SHA256):
+        value = value.strip().lower()
+        if not HEX_PATTERN.match(value):
+            raise ValueError(f"invalid hash {value!r}")
+        return normalized or HASH_TYPES_BY_LENGTH.get(len(value), 'file'), value
+    if key == 'ip_address' or normalized in (TYPE_IPV4, TYPE_IPV6):
+        return _canonical_ip(value)
+    if normalized == TYPE_CIDR:
+        return TYPE_CIDR, ipaddress.ip_network(value.strip(), strict=False).compressed
+    if normalized in (TYPE_DOMAIN, TYPE_HOSTNAME):
+        return normalized, _canonical_domain(value)
+    if normalized == TYPE_URL:
+        return TYPE_URL, _canonical_url(value)
+    if normalized == TYPE_EMAIL:
+        local, _, domain = value.strip().rpartition('@')
+        if not local:
+            raise ValueError(f"invalid email address {value!r}")
+        return TYPE_EMAIL, f"{local}@{_canonical_domain(domain)}"
+    return normalized, value.strip()
+
+
+def _iso(timestamp):
+    if timestamp is None:
+        return None
+    return datetime.fromtimestamp(timestamp, timezone.utc).isoformat()
+
+
+def _tags(*records):
+    tags = set()
+    for record in records:
+        for tag in record.get('tags') or ():
+            if isinstance(tag, str) and tag.strip():
+                tags.add(tag.strip().lower())
+    return sorted(tags)
+
+
+def _ttps(*records):
+    ttps = set()
+    for record in records:
+        for attack in record.get('attack_ids') or ():
+            attack = attack.get('id') if isinstance(attack, dict) else attack
+            if isinstance(attack, str):
+                ttps.update(TTP_PATTERN.findall(attack.upper()))
+        for tag in record.get('tags') or ():
+            if isinstance(tag, str):
+                ttps.update(TTP_PATTERN.findall(tag.upper()))
+        for field in TEXT_FIELDS:
+            text = record.get(field)
+            if isinstance(text, str):
+                ttps.update(TTP_PATTERN.findall(text))
+    return sorted(ttps)
+
+
+def _confidence(entry, attributes):
+    confidence = entry.get('confidence')
+    if isinstance(confidence, (int, float)) and not isinstance(confidence, bool):
+        return float(confidence)
+    # VirusTotal: the share of engines that flagged the object, as a percentage
+    stats = attributes.get('last_analysis_stats')
+    if isinstance(stats, dict):
+        total = sum(value for value in stats.values() if isinstance(value, int))
+        if total:
+            return round(100.0 * (stats.get('malicious', 0) + stats.get('suspicious', 0)) / total, 1)
+    return None
+
+
+def _normalize_one(entry, source, context):
+    attributes = entry.get('attributes') if isinstance(entry.get('attributes'), dict) else {}
+    if entry.get('type') == 'url' and attributes.get('url'):
+        # VirusTotal identifies URLs by a hash of the URL
+        value = attributes['url']
+    else:
+        value = entry.get('indicator', entry.get('value', entry['id']))
+    indicator_type, value = canonicalize(entry.get('type'), value)
+    first_seen = record_timestamp(entry, FIRST_SEEN_FIELDS)
+    last_seen = record_timestamp(entry, LAST_SEEN_FIELDS)
+    if context is not None:
+        first_seen = first_seen or record_timestamp(context, FIRST_SEEN_FIELDS)
+        last_seen = last_seen or record_timestamp(context, LAST_SEEN_FIELDS)
+    records = (entry, attributes) if context is None else (entry, attributes, context)
+    return (f"{indicator_type}:{value}", indicator_type, value, source, str(entry['id']),
+            _iso(first_seen), _iso(last_seen or first_seen), _confidence(entry, attributes), _tags(*records),
+            _ttps(*records))
+
+
+def normalize_chunk(entries, source):
+    """
+    Normalize a chunk of provider records into rows of NORMALIZED_FIELDS.
+
+    OTX pulses, which carry their indicators in an 'indicators' list, yield one row per indicator that
+    inherits the pulse's tags, ATT&CK ids and timestamps. Records that cannot be normalized are
+    counted rather than logged, so that worker processes do not write to the log.
+
+    :param entries: (list) Validated provider records.
+    :param source: (str) The name of the source that reported them.
+    :return: (tuple) The list of rows and the number of records rejected.
+    """
+    rows = []
+    rejected = 0
+    for entry in entries:
+        try:
+            contained = entry.get('indicators')
+            if isinstance(contained, list):
+                rows.extend(_normalize_one(indicator, source, entry) for indicator in contained)
+            else:
+                rows.append(_normalize_one(entry, source, None))
+        except (KeyError, TypeError, ValueError, AttributeError):
+            rejected += 1
+    return rows, rejected
+
+
+def _worker_context():
+    """
+    :return: (multiprocessing.context.BaseContext) The forkserver start method context, or spawn where
+        forkserver is unavailable.
+    """
+    method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+    return multiprocessing.get_context(method)
+
+
+class Normalizer:
+    """
+    Converts raw provider records into the common indicator schema of NORMALIZED_FIELDS.
+
+    Small batches are normalized in the calling process. Batches of at least min_parallel records are
+    split into chunks of chunk_size and spread over a pool of worker processes; each chunk is pickled
+    once per task and its rows come back as tuples rather than dicts. Streams are normalized with a
+    bounded number of chunks in flight, so memory does not grow with the size of the export; the pool
+    is only started once a stream reaches min_parallel records.
+
+    Workers are started with the forkserver method where available and spawn otherwise, never by
+    forking the calling process, whose threads such as the log writer would not survive the fork.
+    """
+
+    def __init__(self, workers=None, chunk_size=1000, min_parallel=5000, mp_context=None):
+        """
+        :param workers: (int) Worker processes, or None for one per CPU; 1 disables the pool.
+        :param chunk_size: (int) Records per task handed to a worker.
+        :param min_parallel: (int) The smallest batch that is spread over the pool.
+        :param mp_context: (multiprocessing.context.BaseContext) The start method context for workers;
+            defaults to forkserver, or spawn where it is unavailable.
+        """
+        self.workers = workers or os.cpu_count() or 1
+        self.chunk_size = chunk_size
+        self.min_parallel = min_parallel
+        self.mp_context = mp_context
+        self._executor = None
+        self.normalized = 0
+        self.rejected = 0
+
+    def _pool(self):
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                 mp_context=self.mp_context or _worker_context())
+        return self._executor
+
+    def _rows(self, rows, rejected, source):
+        if rejected:
+            log_error(f"Dropped {rejected} {source} records that could not be normalized.", level="WARNING")
+        self.rejected += rejected
+        self.normalized += len(rows)
+        for row in rows:
+            yield dict(zip(NORMALIZED_FIELDS, row))
+
+    def normalize(self, entries, source):
+        """
+        Normalize a batch of records.
+
+        :param entries: (list) Validated provider records.
+        :param source: (str) The name of the source that reported them.
+        :return: (list) Normalized indicators as dicts.
+        :raises DataError: If a worker process failed.
+        """
+        if self.workers <= 1 or len(entries) < self.min_parallel:
+            return list(self._rows(*normalize_chunk(entries, source), source))
+        return list(self.imap(entries, source))
+
+    def imap(self, entries, source):
+        """
+        Normalize a stream of records, in order, with at most two chunks per worker in flight.
+
+        :param entries: (iterable) Validated provider records.
+        :param source: (str) The name of the source that reported them.
+        :return: (generator) Normalized indicators as dicts.
+        :raises DataError: If a worker process failed.
+        """
+        entries = iter(entries)
+        parallel = self.workers > 1
+        if parallel:
+            # Streams that end before min_parallel records are not worth starting the pool for
+            head = list(itertools.islice(entries, self.min_parallel))
+            parallel = len(head) >= self.min_parallel
+            entries = itertools.chain(head, entries)
+        chunks = iter(lambda: list(itertools.islice(entries, self.chunk_size)), [])
+        if not parallel:
+            for chunk in chunks:
+                yield from self._rows(*normalize_chunk(chunk, source), source)
+            return
+
+        pending = deque()
+        try:
+            for chunk in itertools.chain(chunks, [None]):
+                if chunk is not None:
+                    pending.append(self._pool().submit(normalize_chunk, chunk, source))
+                    if len(pending) < 2 * self.workers:
+                        continue
+                while pending and (chunk is None or len(pending) >= 2 * self.workers):
+                    yield from self._rows(*pending.popleft().result(), source)
+        except BrokenProcessPool as e:
+            log_error(f"A normalization worker for {source} died: {e}")
+            self.close()
+            raise DataError("Normalization failed.")
+        finally:
+            for future in pending:
+                future.cancel()
+
+    def close(self):
+        """
+        Shut down the worker processes, if any were started.
+        """
+        if self._executor is not None:
+            self._executor.shutdown(cancel_futures=True)
+            self._executor = None
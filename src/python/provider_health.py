@@ -0,0 +1,310 @@
+#  IntelliSIEM Copyright 2024, Rob Perry
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import random
+import threading
+import time
+from collections import deque
+
+from src.python.error_handling import APIError, log_error
+
+STATE_CLOSED = "closed"
+STATE_OPEN = "open"
+STATE_HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """
+    A thread-safe circuit breaker for one provider.
+
+    While closed, requests flow normally and consecutive failures are counted. Reaching the failure
+    threshold opens the circuit: requests are refused immediately for recovery_timeout seconds. The
+    circuit then turns half-open and lets a limited number of probe requests through; a successful
+    probe closes it again, a failed one re-opens it for another recovery period.
+    """
+
+    def __init__(self, failure_threshold=5, recovery_timeout=30.0, half_open_max_calls=1, clock=time.monotonic):
+        """
+        :param failure_threshold: (int) Consecutive failures that open the circuit.
+        :param recovery_timeout: (float) Seconds the circuit stays open before probes are allowed.
+        :param half_open_max_calls: (int) Probe requests allowed at the same time while half-open.
+        :param clock: (callable) Monotonic clock, replaceable for testing.
+        """
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.half_open_max_calls = half_open_max_calls
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._state = STATE_CLOSED
+        self._failures = 0
+        self._opened_at = None
+        self._probes = 0
+        self.opened = 0
+        self.rejected = 0
+
+    def _current_state(self):
+        if self._state == STATE_OPEN and self._clock() - self._opened_at >= self.recovery_timeout:
+            self._state = STATE_HALF_OPEN
+            self._probes = 0
+        return self._state
+
+    @property
+    def state(self):
+        """
+        :return: (str) "closed", "open" or "half_open".
+        """
+        with self._lock:
+            return self._current_state()
+
+    def retry_in(self):
+        """
+        :return: (float) Seconds until an open circuit allows probe requests, 0 if it is not open.
+        """
+        with self._lock:
+            if self._current_state() != STATE_OPEN:
+                return 0.0
+            return max(self._opened_at + self.recovery_timeout - self._clock(), 0.0)
+
+    def allow(self):
+        """
+        Ask to send a request; every allowed request must be followed by record_success or record_failure.
+
+        :return: (bool) True if the request may be sent.
+        """
+        with self._lock:
+            state = self._current_state()
+            if state == STATE_CLOSED:
+                return True
+            if state == STATE_HALF_OPEN and self._probes < self.half_open_max_calls:
+                self._probes += 1
+                return True
+            self.rejected += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self._state == STATE_HALF_OPEN:
+                self._probes = max(self._probes - 1, 0)
+            self._state = STATE_CLOSED
+            self._failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            state = self._current_state()
+            self._failures += 1
+            if state == STATE_HALF_OPEN or (state == STATE_CLOSED and self._failures >= self.failure_threshold):
+                self._state = STATE_OPEN
+                self._opened_at = self._clock()
+                self._probes = 0
+                self.opened += 1
+
+    def stats(self):
+        """
+        :return: (dict) The current state, consecutive failures, and how often the circuit opened or refused requests.
+        """
+        with self._lock:
+            return {'state': self._current_state(), 'failures': self._failures, 'opened': self.opened,
+                    'rejected': self.rejected}
+
+
+class LatencyTracker:
+    """
+    Derives a request timeout from a provider's recently observed latencies.
+
+    The timeout is a multiple of a high percentile of the last window latencies, clamped between
+    min_timeout and max_timeout. Until min_samples latencies were seen, max_timeout is used.
+    """
+
+    def __init__(self, window=100, percentile=0.95, multiplier=3.0, min_timeout=1.0, max_timeout=10.0,
+                 min_samples=10):
+        """
+        :param window: (int) The number of recent latencies kept.
+        :param percentile: (float) The latency percentile the timeout is based on, between 0 and 1.
+        :param multiplier: (float) Headroom applied to the percentile.
+        :param min_timeout: (float) The shortest timeout in seconds.
+        :param max_timeout: (float) The longest timeout in seconds, also used before enough samples exist.
+        :param min_samples: (int) Latencies needed before the timeout adapts.
+        """
+        self.percentile = percentile
+        self.multiplier = multiplier
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.min_samples = min_samples
+        self._lock = threading.Lock()
+        self._samples = deque(maxlen=window)
+        self._timeout = max_timeout
+
+    def record(self, seconds):
+        """
+        Record the latency of a request; a timed out request should record the timeout it hit.
+
+        :param seconds: (float) The observed latency.
+        """
+        with self._lock:
+            self._samples.append(seconds)
+            if len(self._samples) < self.min_samples:
+                return
+            ordered = sorted(self._samples)
+            value = ordered[min(int(self.percentile * len(ordered)), len(ordered) - 1)]
+            self._timeout = min(max(value * self.multiplier, self.min_timeout), self.max_timeout)
+
+    def quantile(self, q):
+        """
+        :param q: (float) The quantile, between 0 and 1.
+        :return: (float) The latency at that quantile of the window, or None if nothing was recorded.
+        """
+        with self._lock:
+            if not self._samples:
+                return None
+            ordered = sorted(self._samples)
+        return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+    def timeout(self):
+        """
+        :return: (float) The timeout in seconds for the next request.
+        """
+        return self._timeout
+
+
+class RetryPolicy:
+    """
+    Exponential backoff with full jitter: retry n waits a random time up to base_delay * 2**n, capped
+    at max_delay, so clients recovering from the same outage do not retry in lockstep.
+    """
+
+    def __init__(self, max_retries=2, base_delay=0.5, max_delay=8.0, rng=random.random):
+        """
+        :param max_retries: (int) Retries after the first attempt.
+        :param base_delay: (float) The backoff ceiling of the first retry, in seconds.
+        :param max_delay: (float) The largest backoff ceiling, in seconds.
+        :param rng: (callable) Returns a float in [0, 1), replaceable for testing.
+        """
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._rng = rng
+
+    def delay(self, retry):
+        """
+        :param retry: (int) The number of retries already made.
+        :return: (float) Seconds to wait before the next retry, or None if the retry budget is spent.
+        """
+        if retry >= self.max_retries:
+            return None
+        return self._rng() * min(self.max_delay, self.base_delay * 2 ** retry)
+
+
+class ProviderHealth:
+    """
+    The health of one provider: a circuit breaker, an adaptive timeout and a retry policy, shared by
+    every client of the provider so that a degraded feed fails fast everywhere at once.
+    """
+
+    def __init__(self, name, failure_threshold=5, recovery_timeout=30.0, half_open_max_calls=1,
+                 latency_window=100, latency_percentile=0.95, timeout_multiplier=3.0, min_timeout=1.0,
+                 max_timeout=10.0, min_samples=10, max_retries=2, backoff_base=0.5, backoff_max=8.0,
+                 clock=time.monotonic, sleep=time.sleep, rng=random.random):
+        """
+        :param name: (str) The name of the provider, for logging.
+
+        The remaining settings are passed to CircuitBreaker, LatencyTracker and RetryPolicy; see
+        config.get_health_config for their meaning.
+        """
+        self.name = name
+        self.breaker = CircuitBreaker(failure_threshold, recovery_timeout, half_open_max_calls, clock=clock)
+        self.latency = LatencyTracker(latency_window, latency_percentile, timeout_multiplier, min_timeout,
+                                      max_timeout, min_samples)
+        self.retry = RetryPolicy(max_retries, backoff_base, backoff_max, rng=rng)
+        self._sleep = sleep
+        self._lock = threading.Lock()
+        self.retries = 0
+
+    def before_request(self):
+        """
+        Check the circuit before sending a request.
+
+        :raises APIError: If the circuit is open and the request must not be sent.
+        """
+        if not self.breaker.allow():
+            log_error(f"Circuit open for {self.name}; failing fast for another "
+                      f"{self.breaker.retry_in():.1f} seconds.", level="WARNING")
+            raise APIError("Provider unavailable.")
+
+    def timeout(self):
+        """
+        :return: (float) The timeout in seconds for the next request.
+        """
+        return self.latency.timeout()
+
+    def record_success(self, latency):
+        """
+        :param latency: (float) Seconds until the response headers arrived.
+        """
+        self.latency.record(latency)
+        self.breaker.record_success()
+
+    def record_failure(self, latency=None):
+        """
+        :param latency: (float) The timeout the request hit, if it timed out.
+        """
+        if latency is not None:
+            self.latency.record(latency)
+        self.breaker.record_failure()
+
+    def backoff(self, retry):
+        """
+        Wait before retrying a failed request.
+
+        :param retry: (int) The number of retries already made for the request.
+        :return: (bool) True if the request should be retried, False if the retry budget is spent or the
+            circuit opened.
+        """
+        delay = self.retry.delay(retry)
+        if delay is None or self.breaker.state == STATE_OPEN:
+            return False
+        log_error(f"Request to {self.name} failed; retrying in {delay:.2f} seconds.", level="WARNING")
+        with self._lock:
+            self.retries += 1
+        self._sleep(delay)
+        return True
+
+    def stats(self):
+        """
+        :return: (dict) Circuit breaker counters, the current timeout, latency percentiles and retries.
+        """
+        stats = self.breaker.stats()
+        stats.update(timeout=self.timeout(), p50=self.latency.quantile(0.5), p99=self.latency.quantile(0.99),
+                     retries=self.retries)
+        return stats
+
+
+_providers = {}
+_providers_lock = threading.Lock()
+
+
+def get_provider_health(name, settings):
+    """
+    Return the health tracker shared by every client of a provider, creating it on first use.
+
+    :param name: (str) The name of the provider.
+    :param settings: (dict) Keyword arguments for ProviderHealth, or None if health tracking is not configured.
+    :return: (ProviderHealth) The shared health tracker, or None.
+    """
+    if settings is None:
+        return None
+    with _providers_lock:
+        current = _providers.get(name)
+        if current is None or current[0] != settings:
+            current = _providers[name] = (dict(settings), ProviderHealth(name, **settings))
+        return current[1]
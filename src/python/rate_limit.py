@@ -0,0 +1,159 @@
+#  IntelliSIEM Copyright 2024, Rob Perry
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+from src.python.error_handling import log_error
+
+
+def parse_retry_after(value, default=None):
+    """
+    Parse a Retry-After header given either as delay seconds or as an HTTP date.
+
+    :param value: (str) The header value, or None if the header was missing.
+    :param default: (float) The delay to return if the value is missing or invalid.
+    :return: (float) The delay in seconds, never negative.
+    """
+    if value is None:
+        return default
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        log_error(f"Invalid Retry-After header: {value}.", level="WARNING")
+        return default
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max((retry_at - datetime.now(timezone.utc)).total_seconds(), 0.0)
+
+
+class RateLimiter:
+    """
+    A thread-safe token bucket that paces requests to a provider's quota.
+
+    Each caller reserves the next free slot in the bucket and then sleeps until that slot arrives,
+    so queued requests are spread evenly over the quota period instead of bursting when tokens
+    refill. When the provider answers 429, defer pushes every future slot past its Retry-After time.
+    """
+
+    def __init__(self, requests_per_minute, burst=1, max_retries=3, max_retry_after=300.0,
+                 clock=time.monotonic, sleep=time.sleep):
+        """
+        Initialize the rate limiter.
+
+        :param requests_per_minute: (float) The sustained request quota.
+        :param burst: (int) The number of requests that may be sent back to back when the bucket is full.
+        :param max_retries: (int) How many times a rate limited request is retried before failing.
+        :param max_retry_after: (float) The longest Retry-After delay, in seconds, that is waited out.
+        :param clock: (callable) Monotonic clock, replaceable for testing.
+        :param sleep: (callable) Sleep function, replaceable for testing.
+        """
+        if requests_per_minute <= 0 or burst < 1:
+            raise ValueError("requests_per_minute must be positive and burst at least 1.")
+        self.interval = 60.0 / requests_per_minute
+        self.burst = burst
+        self.max_retries = max_retries
+        self.max_retry_after = max_retry_after
+        self._clock = clock
+        self._sleep = sleep
+        self._lock = threading.Lock()
+        # Theoretical arrival time of the next request; the bucket is full when it is in the past
+        self._next_slot = clock()
+        self.acquired = 0
+        self.deferred = 0
+        self.waited = 0.0
+
+    def _reserve(self, timeout):
+        with self._lock:
+            now = self._clock()
+            slot = max(self._next_slot, now)
+            delay = max(slot - (self.burst - 1) * self.interval - now, 0.0)
+            if timeout is not None and delay > timeout:
+                return None
+            self._next_slot = slot + self.interval
+            self.acquired += 1
+            self.waited += delay
+            return delay
+
+    def acquire(self, timeout=None):
+        """
+        Wait for a token, reserving the next free slot.
+
+        :param timeout: (float) The longest time to wait in seconds, or None to wait as long as needed.
+        :return: (bool) True if a token was acquired, False if it would not be available within timeout.
+        """
+        delay = self._reserve(timeout)
+        if delay is None:
+            return False
+        if delay > 0:
+            self._sleep(delay)
+        return True
+
+    def defer(self, delay):
+        """
+        Hold back all requests for the given delay, typically taken from a Retry-After header.
+
+        :param delay: (float) Seconds to wait before the next request may be sent.
+        """
+        with self._lock:
+            now = self._clock()
+            # Leave a single token at the deferred time so requests resume one at a time
+            self._next_slot = max(self._next_slot, now + delay + (self.burst - 1) * self.interval)
+            self.deferred += 1
+
+    def retry_delay(self, retry_after):
+        """
+        Decide how long to wait before retrying a rate limited request.
+
+        :param retry_after: (str) The Retry-After header of the 429 response, or None.
+        :return: (float) The delay in seconds, or None if the request should not be retried.
+        """
+        delay = parse_retry_after(retry_after, default=self.interval)
+        if delay > self.max_retry_after:
+            return None
+        return delay
+
+    def stats(self):
+        """
+        :return: (dict) Counters for acquired tokens, deferrals and total time spent waiting.
+        """
+        with self._lock:
+            return {'acquired': self.acquired, 'deferred': self.deferred, 'waited': self.waited}
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(name, settings):
+    """
+    Return the rate limiter shared by every client of a provider, creating it on first use.
+
+    :param name: (str) The name of the provider.
+    :param settings: (dict) Keyword arguments for RateLimiter, or None if the provider is not rate limited.
+    :return: (RateLimiter) The shared rate limiter, or None.
+    """
+    if settings is None:
+        return None
+    with _limiters_lock:
+        current = _limiters.get(name)
+        if current is None or current[0] != settings:
+            current = _limiters[name] = (dict(settings), RateLimiter(**settings))
+        return current[1]
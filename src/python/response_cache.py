@@ -0,0 +1,240 @@
+#  IntelliSIEM Copyright 2024, Rob Perry
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from fnmatch import fnmatch
+
+from src.python.error_handling import log_error
+
+
+class CacheEntry:
+    """
+    A cached API response and the validators needed to revalidate it.
+    """
+
+    def __init__(self, key, body, etag, last_modified, expires_at):
+        """
+        :param key: (str) The cache key of the response.
+        :param body: (bytes) The raw response body.
+        :param etag: (str) The response's ETag header, if any.
+        :param last_modified: (str) The response's Last-Modified header, if any.
+        :param expires_at: (float) Wall-clock time after which the entry must be revalidated.
+        """
+        self.key = key
+        self.body = body
+        self.etag = etag
+        self.last_modified = last_modified
+        self.expires_at = expires_at
+
+    def is_fresh(self, now=None):
+        """
+        :return: (bool) True if the entry may be used without contacting the API.
+        """
+        return (now if now is not None else time.time()) < self.expires_at
+
+    def conditional_headers(self):
+        """
+        :return: (dict) If-None-Match and If-Modified-Since headers for revalidating the entry.
+        """
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+    def json(self):
+        """
+        :return: The decoded JSON body.
+        """
+        return json.loads(self.body)
+
+
+class ResponseCache:
+    """
+    A disk-backed cache of API responses, keyed on URL and query parameters.
+
+    Fresh entries are served without a request, and stale entries with an ETag or Last-Modified
+    header are revalidated with a conditional request, so unchanged feeds cost a 304 at most.
+    The total size of stored bodies is bounded, evicting the least recently used entries first.
+    """
+
+    def __init__(self, path, max_bytes=256 * 1024 * 1024, default_ttl=0, ttls=None, clock=time.time):
+        """
+        Open (or create) the cache database.
+
+        :param path: (str) The path of the SQLite database file.
+        :param max_bytes: (int) The maximum total size of cached bodies.
+        :param default_ttl: (float) Seconds a response stays fresh when its endpoint has no TTL of its own.
+        :param ttls: (dict) Per-endpoint TTLs in seconds, keyed by endpoint or glob pattern.
+        :param clock: (callable) Wall-clock time function, replaceable for testing.
+        """
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.default_ttl = default_ttl
+        self.ttls = ttls or {}
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                body BLOB NOT NULL,
+                etag TEXT,
+                last_modified TEXT,
+                expires_at REAL NOT NULL,
+                last_access REAL NOT NULL,
+                size INTEGER NOT NULL
+            )""")
+        self._db.execute("CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)")
+        self._db.commit()
+        self._size = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+        self.evictions = 0
+
+    @staticmethod
+    def key(url, params=None):
+        """
+        Build the cache key for a request.
+
+        :param url: (str) The request URL.
+        :param params: (dict) Optional query parameters.
+        :return: (str) A stable key that does not depend on parameter order.
+        """
+        canonical = json.dumps([url, sorted((params or {}).items())], default=str)
+        return hashlib.sha256(canonical.encode()).hexdigest()
+
+    def ttl_for(self, endpoint):
+        """
+        :param endpoint: (str) The API endpoint.
+        :return: (float) The TTL configured for the endpoint, or the default TTL.
+        """
+        if endpoint in self.ttls:
+            return self.ttls[endpoint]
+        for pattern, ttl in self.ttls.items():
+            if fnmatch(endpoint, pattern):
+                return ttl
+        return self.default_ttl
+
+    def get(self, key):
+        """
+        Look up a cached response, marking it as recently used.
+
+        :param key: (str) The cache key.
+        :return: (CacheEntry) The cached entry, or None if it is not cached.
+        """
+        with self._lock:
+            row = self._db.execute(
+                "SELECT body, etag, last_modified, expires_at FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            self._db.execute("UPDATE responses SET last_access = ? WHERE key = ?", (self._clock(), key))
+            self._db.commit()
+        return CacheEntry(key, row[0], row[1], row[2], row[3])
+
+    def put(self, key, body, etag=None, last_modified=None, ttl=0):
+        """
+        Store a response, evicting least recently used entries if the cache grows too large.
+
+        Responses that could neither be served fresh nor revalidated are not stored.
+
+        :param key: (str) The cache key.
+        :param body: (bytes) The raw response body.
+        :param etag: (str) The response's ETag header, if any.
+        :param last_modified: (str) The response's Last-Modified header, if any.
+        :param ttl: (float) Seconds the response stays fresh.
+        """
+        size = len(body)
+        if size > self.max_bytes or (ttl <= 0 and not etag and not last_modified):
+            return
+        now = self._clock()
+        with self._lock:
+            previous = self._db.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, sqlite3.Binary(body), etag, last_modified, now + ttl, now, size))
+            self._size += size - (previous[0] if previous else 0)
+            self._evict()
+            self._db.commit()
+
+    def touch(self, key, ttl):
+        """
+        Extend an entry's freshness after the API confirmed it is unchanged.
+
+        :param key: (str) The cache key.
+        :param ttl: (float) Seconds the response stays fresh.
+        """
+        now = self._clock()
+        with self._lock:
+            self._db.execute("UPDATE responses SET expires_at = ?, last_access = ? WHERE key = ?",
+                             (now + ttl, now, key))
+            self._db.commit()
+
+    def _evict(self):
+        while self._size > self.max_bytes:
+            row = self._db.execute("SELECT key, size FROM responses ORDER BY last_access LIMIT 1").fetchone()
+            if row is None:
+                self._size = 0
+                return
+            self._db.execute("DELETE FROM responses WHERE key = ?", (row[0],))
+            self._size -= row[1]
+            self.evictions += 1
+
+    def record_hit(self):
+        with self._lock:
+            self.hits += 1
+
+    def record_miss(self):
+        with self._lock:
+            self.misses += 1
+
+    def record_revalidation(self):
+        with self._lock:
+            self.revalidations += 1
+
+    def stats(self):
+        """
+        :return: (dict) Hit, miss, revalidation and eviction counters, and the current size in bytes.
+        """
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'revalidations': self.revalidations,
+                    'evictions': self.evictions, 'size': self._size}
+
+    def clear(self):
+        """
+        Remove every cached response.
+        """
+        with self._lock:
+            self._db.execute("DELETE FROM responses")
+            self._db.commit()
+            self._size = 0
+
+    def close(self):
+        """
+        Close the cache database.
+        """
+        with self._lock:
+            try:
+                self._db.close()
+            except sqlite3.Error as e:
+                log_error(f"Failed to close response cache: {e}.", level="WARNING")
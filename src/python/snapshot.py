@@ -0,0 +1,485 @@
+#  IntelliSIEM Copyright 2024, Rob Perry
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+"""
+A compact, memory-mapped snapshot format for shipping indicator sets to SIEM forwarder nodes.
+
+A snapshot file is laid out as follows, all integers little-endian:
+
+    header      64 bytes, see HEADER
+    metadata    JSON: creation time, type, source and CIDR prefix tables, padded to 8 bytes
+    bloom       bloom_bits bits, padded to 8 bytes
+    index       count entries of 48 bytes (see ENTRY), sorted by key hash
+    blob        the key and id bytes the entries point to
+
+Every observable is keyed as "category:canonical value", e.g. "ip:10.0.0.1" or "domain:evil.example",
+using the categories of the matching module. A lookup first checks the key's bits in the Bloom
+filter, which answers "not an indicator" for almost every event without touching the index, and
+only then binary-searches the sorted index and compares the key bytes to confirm.
+
+Readers map the file read-only, so nodes load a snapshot without parsing it and processes on a host
+share its pages through the page cache.
+"""
+
+import argparse
+import bisect
+import hashlib
+import ipaddress
+import json
+import math
+import mmap
+import os
+import struct
+import tempfile
+import time
+import zlib
+
+from src.python.error_handling import DataError, log_error
+from src.python.file_io import fsync_directory
+from src.python.indicators import Indicator
+from src.python.matching import (CATEGORY_CIDR, CATEGORY_DOMAIN, CATEGORY_HASH, CATEGORY_IP, CATEGORY_URL,
+                                 DEFAULT_EVENT_FIELDS, INDICATOR_CATEGORIES, Match)
+
+MAGIC = b'ISNP'
+VERSION = 1
+
+# magic, version, flags, hash_count, metadata_length, count, bloom_bits, bloom_offset, index_offset,
+# blob_offset, checksum of everything after the header
+HEADER = struct.Struct('<4sHHIIQQQQQI4x')
+
+# key hash, blob offset, key length, id length, type index, sources index, first_seen, last_seen,
+# confidence (NaN if unknown)
+ENTRY = struct.Struct('<QQHHHHddd')
+
+# Snapshots are shipped to and read by other processes, unlike the private files of tempfile.mkstemp
+SNAPSHOT_MODE = 0o644
+
+_HASH = struct.Struct('<QQ')
+_U64 = struct.Struct('<Q')
+_CHECKSUM_CHUNK = 1 << 20
+
+
+def _pad(length):
+    return -length % 8
+
+
+def _hashes(key):
+    return _HASH.unpack(hashlib.blake2b(key, digest_size=16).digest())
+
+
+def snapshot_key(category, value):
+    """
+    Build the key an observable is stored and looked up under.
+
+    :param category: (str) A matching category, e.g. "ip", or another lower-cased indicator type.
+    :param value: (str) The observable.
+    :return: (bytes) The key, or None if the value is not valid for its category.
+    """
+    value = str(value).strip()
+    if category == CATEGORY_IP or category == CATEGORY_CIDR:
+        try:
+            network = ipaddress.ip_network(value, strict=False)
+        except ValueError:
+            return None
+        if network.num_addresses == 1:
+            category, value = CATEGORY_IP, str(network.network_address)
+        else:
+            category, value = CATEGORY_CIDR, str(network)
+    elif category == CATEGORY_DOMAIN:
+        value = value.rstrip('.').lower()
+    elif category == CATEGORY_HASH or category == CATEGORY_URL:
+        value = value.lower()
+    return f"{category}:{value}".encode()
+
+
+def _bloom_size(count, false_positive_rate):
+    bits = max(int(math.ceil(-count * math.log(false_positive_rate) / math.log(2) ** 2)), 64)
+    bits += -bits % 64
+    hash_count = max(int(round(bits / max(count, 1) * math.log(2))), 1)
+    return bits, min(hash_count, 32)
+
+
+def write_snapshot(path, indicators, false_positive_rate=0.01, fsync=True, clock=time.time):
+    """
+    Write indicators to a snapshot file, replacing any previous snapshot atomically.
+
+    Indicators with the same key, such as a hash reported by several sources, are merged into one
+    entry carrying the first id, every source, the earliest first_seen and the latest last_seen.
+
+    :param path: (str) The snapshot file.
+    :param indicators: (iterable) Indicator or StoredIndicator objects.
+    :param false_positive_rate: (float) The Bloom filter's false positive rate, between 0 and 1.
+    :param fsync: (bool) Whether the file is flushed to disk before it replaces the previous snapshot.
+    :param clock: (callable) Wall-clock time function, replaceable for testing.
+    :return: (int) The number of entries written.
+    :raises DataError: If the snapshot cannot be written.
+    """
+    merged = {}
+    prefixes = {4: set(), 6: set()}
+    for indicator in indicators:
+        indicator_type = indicator.type or ''
+        category = INDICATOR_CATEGORIES.get(indicator_type.lower(), indicator_type.lower())
+        key = snapshot_key(category, indicator.value)
+        if key is None:
+            log_error(f"Invalid {indicator_type} indicator {indicator.id}: {indicator.value}.", level="WARNING")
+            continue
+        if len(key) > 0xFFFF:
+            log_error(f"Indicator {indicator.id} is too long for a snapshot.", level="WARNING")
+            continue
+        confidence = getattr(indicator, 'confidence', None)
+        existing = merged.get(key)
+        if existing is None:
+            merged[key] = [str(indicator.id), indicator_type, set(indicator.sources), indicator.first_seen,
+                           indicator.last_seen, confidence]
+            if key.startswith(b'cidr:'):
+                network = ipaddress.ip_network(key[5:].decode())
+                prefixes[network.version].add(network.prefixlen)
+        else:
+            existing[2].update(indicator.sources)
+            existing[3] = min(existing[3], indicator.first_seen)
+            existing[4] = max(existing[4], indicator.last_seen)
+            if confidence is not None:
+                existing[5] = confidence if existing[5] is None else max(existing[5], confidence)
+
+    types, sources = {}, {}
+    entries = []
+    for key, (indicator_id, indicator_type, names, first_seen, last_seen, confidence) in merged.items():
+        type_index = types.setdefault(indicator_type, len(types))
+        source_index = sources.setdefault(','.join(sorted(names)), len(sources))
+        entries.append((_hashes(key), key, indicator_id.encode(), type_index, source_index, first_seen,
+                        last_seen, math.nan if confidence is None else confidence))
+    if len(types) > 0xFFFF or len(sources) > 0xFFFF:
+        log_error(f"Too many distinct types or source combinations for a snapshot: {len(types)}, {len(sources)}.")
+        raise DataError("Cannot write snapshot.")
+    entries.sort(key=lambda entry: (entry[0][0], entry[1]))
+
+    bloom_bits, hash_count = _bloom_size(len(entries), false_positive_rate)
+    bloom = bytearray(bloom_bits // 8)
+    index = bytearray(len(entries) * ENTRY.size)
+    blob = bytearray()
+    for position, ((h1, h2), key, indicator_id, type_index, source_index, first_seen, last_seen,
+                   confidence) in enumerate(entries):
+        for i in range(hash_count):
+            bit = (h1 + i * h2) % bloom_bits
+            bloom[bit >> 3] |= 1 << (bit & 7)
+        indicator_id = indicator_id[:0xFFFF]
+        ENTRY.pack_into(index, position * ENTRY.size, h1, len(blob), len(key), len(indicator_id), type_index,
+                        source_index, first_seen, last_seen, confidence)
+        blob += key
+        blob += indicator_id
+
+    metadata = json.dumps({'created': clock(), 'false_positive_rate': false_positive_rate,
+                           'types': list(types), 'sources': list(sources),
+                           'prefixes': {str(version): sorted(lengths, reverse=True)
+                                        for version, lengths in prefixes.items()}}).encode()
+    metadata += b' ' * _pad(len(metadata))
+    bloom_offset = HEADER.size + len(metadata)
+    index_offset = bloom_offset + len(bloom)
+    blob_offset = index_offset + len(index)
+    checksum = zlib.crc32(blob, zlib.crc32(index, zlib.crc32(bloom, zlib.crc32(metadata))))
+    header = HEADER.pack(MAGIC, VERSION, 0, hash_count, len(metadata), len(entries), bloom_bits, bloom_offset,
+                         index_offset, blob_offset, checksum)
+
+    directory = os.path.dirname(os.path.abspath(path))
+    try:
+        os.makedirs(directory, exist_ok=True)
+        # A temporary file of its own, so concurrent builders of the same snapshot never share one
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix=f".{os.path.basename(path)}-")
+        try:
+            with os.fdopen(fd, 'wb') as file:
+                if hasattr(os, 'fchmod'):
+                    os.fchmod(file.fileno(), SNAPSHOT_MODE)
+                for section in (header, metadata, bloom, index, blob):
+                    file.write(section)
+                if fsync:
+                    file.flush()
+                    os.fsync(file.fileno())
+            os.replace(temp_path, path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+        if fsync:
+            fsync_directory(directory)
+    except OSError as e:
+        log_error(f"Cannot write snapshot {path}: {e}.")
+        raise DataError("Cannot write snapshot.")
+    return len(entries)
+
+
+class _HashColumn:
+    """
+    The key hashes of a snapshot's index as a read-only sequence, for bisect.
+    """
+
+    __slots__ = ('_map', '_offset', '_count')
+
+    def __init__(self, mapped, offset, count):
+        self._map = mapped
+        self._offset = offset
+        self._count = count
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, position):
+        return _U64.unpack_from(self._map, self._offset + position * ENTRY.size)[0]
+
+
+class IndicatorSnapshot:
+    """
+    A read-only indicator set backed by a memory-mapped snapshot file.
+
+    It has the same match_batch method as MatchIndex, so it can be swapped into an IOCMatcher, except
+    that URLs are matched exactly rather than as substrings of the event's URL.
+    """
+
+    def __init__(self, path, verify=True, event_fields=None):
+        """
+        Map a snapshot file.
+
+        :param path: (str) The snapshot file.
+        :param verify: (bool) Whether to check the file's checksum, which reads it once in full.
+        :param event_fields: (dict) Event field names checked for each category by match_batch.
+        :raises DataError: If the file cannot be read, is not a snapshot or is of an unsupported version.
+        """
+        self.path = path
+        self.event_fields = event_fields or DEFAULT_EVENT_FIELDS
+        try:
+            with open(path, 'rb') as file:
+                self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError) as e:
+            log_error(f"Cannot open snapshot {path}: {e}.")
+            raise DataError("Cannot read snapshot.")
+        try:
+            self._load(verify)
+        except DataError:
+            self._map.close()
+            raise
+
+    def _load(self, verify):
+        mapped = self._map
+        if len(mapped) < HEADER.size or mapped[:4] != MAGIC:
+            log_error(f"{self.path} is not an indicator snapshot.")
+            raise DataError("Invalid snapshot file.")
+        (_, version, _, self.hash_count, metadata_length, self.count, self.bloom_bits, self._bloom_offset,
+         self._index_offset, self._blob_offset, checksum) = HEADER.unpack_from(mapped)
+        if version != VERSION:
+            log_error(f"Snapshot {self.path} has version {version}; version {VERSION} is supported.")
+            raise DataError("Unsupported snapshot version.")
+        if verify:
+            computed = 0
+            for start in range(HEADER.size, len(mapped), _CHECKSUM_CHUNK):
+                computed = zlib.crc32(mapped[start:start + _CHECKSUM_CHUNK], computed)
+            if computed != checksum:
+                log_error(f"Snapshot {self.path} is corrupt: checksum mismatch.")
+                raise DataError("Invalid snapshot file.")
+        try:
+            self.metadata = json.loads(mapped[HEADER.size:HEADER.size + metadata_length])
+        except ValueError:
+            log_error(f"Snapshot {self.path} has unreadable metadata.")
+            raise DataError("Invalid snapshot file.")
+        self._types = self.metadata['types']
+        self._sources = self.metadata['sources']
+        self._prefixes = {int(version): lengths for version, lengths in self.metadata['prefixes'].items()}
+        self._hash_column = _HashColumn(mapped, self._index_offset, self.count)
+
+    @property
+    def created(self):
+        """
+        :return: (float) POSIX time the snapshot was written.
+        """
+        return self.metadata['created']
+
+    def close(self):
+        self._map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __len__(self):
+        return self.count
+
+    def _maybe(self, h1, h2):
+        mapped, offset, bits = self._map, self._bloom_offset, self.bloom_bits
+        for i in range(self.hash_count):
+            bit = (h1 + i * h2) % bits
+            if not mapped[offset + (bit >> 3)] & (1 << (bit & 7)):
+                return False
+        return True
+
+    def _entry(self, position):
+        mapped = self._map
+        (_, blob, key_length, id_length, type_index, source_index, first_seen, last_seen,
+         confidence) = ENTRY.unpack_from(mapped, self._index_offset + position * ENTRY.size)
+        start = self._blob_offset + blob + key_length
+        key = mapped[self._blob_offset + blob:start]
+        indicator = Indicator(mapped[start:start + id_length].decode(), self._types[type_index] or None,
+                              key[key.index(b':') + 1:].decode(), self._sources[source_index], first_seen,
+                              last_seen, None if math.isnan(confidence) else confidence)
+        return key, indicator
+
+    def _find(self, key):
+        h1, h2 = _hashes(key)
+        if not self._maybe(h1, h2):
+            return None
+        position = bisect.bisect_left(self._hash_column, h1)
+        mapped = self._map
+        while position < self.count:
+            entry_hash, blob, key_length = struct.unpack_from(
+                '<QQH', mapped, self._index_offset + position * ENTRY.size)
+            if entry_hash != h1:
+                return None
+            start = self._blob_offset + blob
+            if mapped[start:start + key_length] == key:
+                return self._entry(position)[1]
+            position += 1
+        return None
+
+    def might_contain(self, category, value):
+        """
+        Check an observable against the Bloom filter only.
+
+        :param category: (str) A matching category, e.g. "hash".
+        :param value: (str) The observable.
+        :return: (bool) False if the observable is certainly not in the snapshot.
+        """
+        key = snapshot_key(category, value)
+        return key is not None and self._maybe(*_hashes(key))
+
+    def lookup(self, category, value):
+        """
+        Look up an observable exactly.
+
+        :param category: (str) A matching category, e.g. "hash", or another lower-cased indicator type.
+        :param value: (str) The observable.
+        :return: (Indicator) The indicator, or None.
+        """
+        key = snapshot_key(category, value)
+        return self._find(key) if key is not None else None
+
+    def __iter__(self):
+        for position in range(self.count):
+            yield self._entry(position)[1]
+
+    def _match_ip(self, value):
+        try:
+            address = ipaddress.ip_address(value.strip())
+        except ValueError:
+            return None
+        canonical = str(address)
+        indicator = self._find(f"{CATEGORY_IP}:{canonical}".encode())
+        if indicator is not None:
+            return canonical, CATEGORY_IP, indicator.id
+        number = int(address)
+        for length in self._prefixes.get(address.version, ()):
+            bits = address.max_prefixlen - length
+            network = f"{type(address)(number >> bits << bits)}/{length}"
+            indicator = self._find(f"{CATEGORY_CIDR}:{network}".encode())
+            if indicator is not None:
+                return network, CATEGORY_CIDR, indicator.id
+        return None
+
+    def _match_domain(self, value):
+        domain = value.strip().rstrip('.').lower()
+        while domain:
+            indicator = self._find(f"{CATEGORY_DOMAIN}:{domain}".encode())
+            if indicator is not None:
+                return domain, indicator.id
+            dot = domain.find('.')
+            if dot < 0:
+                return None
+            domain = domain[dot + 1:]
+        return None
+
+    def match_batch(self, events):
+        """
+        Match a batch of events against the snapshot.
+
+        :param events: (list) Events as dicts of field names to values.
+        :return: (list) Match objects, ordered by event.
+        """
+        hash_fields = self.event_fields.get(CATEGORY_HASH, ())
+        ip_fields = self.event_fields.get(CATEGORY_IP, ())
+        domain_fields = self.event_fields.get(CATEGORY_DOMAIN, ())
+        url_fields = self.event_fields.get(CATEGORY_URL, ())
+        matches = []
+        append = matches.append
+        for index, event in enumerate(events):
+            for field in hash_fields:
+                value = event.get(field)
+                if isinstance(value, str) and value:
+                    indicator = self.lookup(CATEGORY_HASH, value)
+                    if indicator is not None:
+                        append(Match(index, field, indicator.value, CATEGORY_HASH, indicator.id))
+            for field in ip_fields:
+                value = event.get(field)
+                if isinstance(value, str) and value:
+                    hit = self._match_ip(value)
+                    if hit is not None:
+                        append(Match(index, field, hit[0], hit[1], hit[2]))
+            for field in domain_fields:
+                value = event.get(field)
+                if isinstance(value, str) and value:
+                    hit = self._match_domain(value)
+                    if hit is not None:
+                        append(Match(index, field, hit[0], CATEGORY_DOMAIN, hit[1]))
+            for field in url_fields:
+                value = event.get(field)
+                if isinstance(value, str) and value:
+                    indicator = self.lookup(CATEGORY_URL, value)
+                    if indicator is not None:
+                        append(Match(index, field, indicator.value, CATEGORY_URL, indicator.id))
+        return matches
+
+
+def main(argv=None):
+    """
+    Write a snapshot of the configured feeds, or look up observables in a snapshot.
+    """
+    parser = argparse.ArgumentParser(description="Write or query indicator snapshots.")
+    commands = parser.add_subparsers(dest='command', required=True)
+    build = commands.add_parser('build', help="collect the configured feeds into a snapshot")
+    build.add_argument('--config', help="path to the YAML configuration file")
+    build.add_argument('--output', help="the snapshot file; defaults to snapshot.path of the configuration")
+    query = commands.add_parser('lookup', help="look up observables in a snapshot")
+    query.add_argument('snapshot')
+    query.add_argument('category', help="hash, ip, cidr, domain, url or another indicator type")
+    query.add_argument('values', nargs='+')
+    args = parser.parse_args(argv)
+
+    if args.command == 'build':
+        # Imported here so that nodes only reading snapshots do not load the collector
+        from src.python.config import DEFAULT_CONFIG_FILE
+        from src.python.data_collection import ThreatDataCollector
+
+        collector = ThreatDataCollector(args.config or DEFAULT_CONFIG_FILE)
+        try:
+            count = collector.build_snapshot(args.output)
+        finally:
+            collector.close()
+        print(f"Wrote {count} indicators.")
+        return 0
+    with IndicatorSnapshot(args.snapshot) as snapshot:
+        found = False
+        for value in args.values:
+            indicator = snapshot.lookup(args.category, value)
+            found |= indicator is not None
+            print(json.dumps({'value': value, 'indicator': indicator.as_dict() if indicator else None}))
+    return 0 if found else 1
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,107 @@
+#  IntelliSIEM Copyright 2024, Rob Perry
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import json
+import os
+import tempfile
+import threading
+
+from src.python.error_handling import DataError, log_error
+
+
+class StateStore:
+    """
+    A small persistent key-value store for collector state, such as per-source watermarks.
+
+    State is kept in memory and written to a JSON file on save. Saves replace the file atomically,
+    so a crash mid-write never leaves a truncated state file behind, and one at a time, so an older
+    snapshot never replaces a newer one.
+    """
+
+    def __init__(self, path):
+        """
+        Load the state file, starting empty if it does not exist yet.
+
+        :param path: (str) The path of the JSON state file.
+        :raises DataError: If the state file exists but cannot be read.
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        self._state = {}
+        try:
+            with open(path, 'r') as file:
+                self._state = json.load(file)
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            log_error(f"Failed to load collector state from {path}: {e}.")
+            raise DataError("Corrupt collector state.")
+        if not isinstance(self._state, dict):
+            log_error(f"Unexpected collector state in {path}: {type(self._state)}.")
+            raise DataError("Corrupt collector state.")
+
+    def get(self, key, default=None):
+        """
+        :param key: (str) The state key, e.g. a source name.
+        :param default: The value to return if the key is not set.
+        :return: The stored value.
+        """
+        with self._lock:
+            return self._state.get(key, default)
+
+    def set(self, key, value):
+        """
+        Set a value in memory; call save to persist it.
+
+        :param key: (str) The state key.
+        :param value: A JSON-serializable value.
+        """
+        with self._lock:
+            self._state[key] = value
+
+    def delete(self, key):
+        """
+        Remove a key, e.g. to force a full re-pull of a source on the next run.
+
+        :param key: (str) The state key.
+        """
+        with self._lock:
+            self._state.pop(key, None)
+
+    def save(self):
+        """
+        Atomically write the state to disk.
+
+        :raises DataError: If the state cannot be written.
+        """
+        with self._save_lock:
+            with self._lock:
+                snapshot = json.dumps(self._state, indent=2, sort_keys=True)
+            directory = os.path.dirname(self.path) or '.'
+            try:
+                os.makedirs(directory, exist_ok=True)
+                fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.state-')
+                try:
+                    with os.fdopen(fd, 'w') as file:
+                        file.write(snapshot)
+                        file.flush()
+                        os.fsync(file.fileno())
+                    os.replace(temp_path, self.path)
+                except BaseException:
+                    os.unlink(temp_path)
+                    raise
+            except OSError as e:
+                log_error(f"Failed to save collector state to {self.path}: {e}.")
+                raise DataError("Failed to save collector state.")
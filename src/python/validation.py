@@ -0,0 +1,164 @@
+#  IntelliSIEM Copyright 2024, Rob Perry
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+from src.python.error_handling import ConfigError, log_error
+
+# Error categories, matching the DataError messages raised for each kind of invalid record
+UNEXPECTED_TYPE = "Unexpected data type received."
+CORRUPT_DATA = "Corrupt data received."
+MISSING_KEYS = "Missing required data keys."
+
+# Type names usable in a declarative schema
+TYPE_NAMES = {
+    'str': str,
+    'int': int,
+    'float': float,
+    'bool': bool,
+    'list': list,
+    'dict': dict,
+}
+
+_MISSING = object()
+
+
+class Rejection:
+    """
+    A record that failed validation, with the reason it was rejected.
+    """
+
+    __slots__ = ('record', 'error', 'reason')
+
+    def __init__(self, record, error, reason):
+        """
+        :param record: The rejected record.
+        :param error: (str) The error category, e.g. "Missing required data keys."
+        :param reason: (str) A description of the specific problem.
+        """
+        self.record = record
+        self.error = error
+        self.reason = reason
+
+    def __repr__(self):
+        return f"Rejection(error={self.error!r}, reason={self.reason!r})"
+
+
+class ValidationResult:
+    """
+    The outcome of validating a batch of records.
+    """
+
+    def __init__(self, valid, rejected):
+        """
+        :param valid: (list) The records that passed validation, in their original order.
+        :param rejected: (list) Rejection objects for the records that failed.
+        """
+        self.valid = valid
+        self.rejected = rejected
+
+    @property
+    def reject_ratio(self):
+        """
+        :return: (float) The fraction of the batch that was rejected.
+        """
+        total = len(self.valid) + len(self.rejected)
+        return len(self.rejected) / total if total else 0.0
+
+
+class Schema:
+    """
+    A declarative record schema, compiled once into a flat list of field checks.
+
+    The declaration maps field names to rules::
+
+        {'id': {'required': True, 'types': ['str', 'int']}}
+
+    Records must be dicts. A present field must have one of the declared types, and a required
+    field must be present.
+    """
+
+    def __init__(self, fields):
+        """
+        Compile the schema.
+
+        :param fields: (dict) Field names mapped to rules with optional 'required' and 'types' keys.
+        :raises ConfigError: If the declaration uses an unknown type name.
+        """
+        checks = []
+        for name, rule in fields.items():
+            rule = rule or {}
+            types = None
+            if rule.get('types'):
+                try:
+                    types = tuple(TYPE_NAMES[t] if isinstance(t, str) else t for t in rule['types'])
+                except KeyError as e:
+                    log_error(f"Unknown type {e} in validation schema for field '{name}'.")
+                    raise ConfigError("Invalid validation schema.")
+            checks.append((name, bool(rule.get('required', False)), types))
+        self.fields = fields
+        # Type checks run before presence checks, so a corrupt record is reported as corrupt
+        self._type_checks = tuple((name, types) for name, _, types in checks if types)
+        self._required = tuple(name for name, required, _ in checks if required)
+
+    def check(self, record):
+        """
+        Validate a single record.
+
+        :param record: The record to validate.
+        :return: (Rejection) The reason the record is invalid, or None if it is valid.
+        """
+        if not isinstance(record, dict):
+            return Rejection(record, UNEXPECTED_TYPE, f"record is a {type(record).__name__}, not an object")
+        for name, types in self._type_checks:
+            value = record.get(name, _MISSING)
+            if value is not _MISSING and not isinstance(value, types):
+                return Rejection(record, CORRUPT_DATA, f"'{name}' has invalid type {type(value).__name__}")
+        for name in self._required:
+            if name not in record:
+                return Rejection(record, MISSING_KEYS, f"missing required key '{name}'")
+        return None
+
+    def validate_batch(self, records):
+        """
+        Validate a whole page of records in one pass.
+
+        Valid records are returned in order; invalid ones are collected with their reasons instead
+        of aborting the batch.
+
+        :param records: (iterable) The records to validate.
+        :return: (ValidationResult) The valid and rejected records.
+        """
+        valid = []
+        rejected = []
+        keep = valid.append
+        reject = rejected.append
+        type_checks = self._type_checks
+        required = self._required
+
+        for record in records:
+            if type(record) is not dict and not isinstance(record, dict):
+                reject(Rejection(record, UNEXPECTED_TYPE, f"record is a {type(record).__name__}, not an object"))
+                continue
+            for name, types in type_checks:
+                value = record.get(name, _MISSING)
+                if value is not _MISSING and not isinstance(value, types):
+                    reject(Rejection(record, CORRUPT_DATA, f"'{name}' has invalid type {type(value).__name__}"))
+                    break
+            else:
+                for name in required:
+                    if name not in record:
+                        reject(Rejection(record, MISSING_KEYS, f"missing required key '{name}'"))
+                        break
+                else:
+                    keep(record)
+        return ValidationResult(valid, rejected)
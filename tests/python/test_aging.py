@@ -0,0 +1,232 @@
+#  IntelliSIEM Copyright 2024, Rob Perry
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import math
+import random
+import time
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from src.python.aging import AgingEngine, AgingPolicy, DAY, TimingWheel
+from src.python.collector_daemon import CollectorDaemon
+from src.python.data_collection import ThreatDataCollector
+from src.python.indicator_store import IndicatorStore
+from src.python.indicators import Indicator, IndicatorSet
+from src.python.state_store import StateStore
+
+
+class EmptyRegistry:
+    feeds = {}
+
+    def names(self):
+        return []
+
+
+class IdleCollector:
+    feeds = EmptyRegistry()
+
+
+def test_wheel_expires_keys_at_their_deadline():
+    """
+    Test that keys expire at the first advance past their deadline, across cascading levels and the
+    overflow heap of a small wheel.
+    """
+    rng = random.Random(7)
+    # 2 levels of 4 slots cover 16 ticks; later deadlines go through the overflow heap
+    wheel = TimingWheel(tick=1.0, start=0.0, slot_bits=2, levels=2)
+    deadlines = {key: rng.uniform(0, 100) for key in range(500)}
+    for key, deadline in deadlines.items():
+        wheel.schedule(key, deadline)
+    assert len(wheel) == 500
+
+    now = 0.0
+    seen = set()
+    while now < 110:
+        now += rng.uniform(0.1, 7)
+        expired = wheel.advance(now)
+        assert all(deadlines[key] <= now for key in expired)
+        seen.update(expired)
+        assert {key for key, deadline in deadlines.items() if deadline <= math.floor(now)} <= seen
+    assert seen == set(deadlines)
+    assert len(wheel) == 0
+
+
+def test_wheel_reschedules_and_cancels():
+    """
+    Test that a key expires at its latest deadline, whether pushed back or brought forward, and a
+    cancelled key never does.
+    """
+    wheel = TimingWheel(tick=1.0, start=0.0, slot_bits=2, levels=2)
+    wheel.schedule('later', 5)
+    wheel.schedule('later', 30)
+    wheel.schedule('sooner', 30)
+    wheel.schedule('sooner', 3)
+    wheel.schedule('cancelled', 4)
+    assert wheel.cancel('cancelled')
+    assert wheel.deadline('later') == 30
+    assert 'cancelled' not in wheel
+
+    assert wheel.advance(10) == ['sooner']
+    assert wheel.advance(29) == []
+    assert wheel.advance(30) == ['later']
+    wheel.schedule('past', 12)
+    assert wheel.advance(30) == ['past']
+    # An empty wheel skips ahead instead of walking every tick
+    assert wheel.advance(1e9) == []
+    wheel.schedule('new', 1e9 + 2)
+    assert wheel.advance(1e9 + 2) == ['new']
+
+
+def test_policy_ttls():
+    """
+    Test that TTLs are looked up by source and type, with provider types normalized and the longest
+    TTL of several sources.
+    """
+    policy = AgingPolicy(default_ttl=30 * DAY, types={'ipv4': 7 * DAY, 'sha256': None},
+                         sources={'otx': {'ttl': 14 * DAY, 'types': {'IPv4': 3 * DAY}}, 'vt': {}})
+    assert policy.ttl('IPv4', 'vt') == 7 * DAY
+    assert policy.ttl('ipv4', 'otx') == 3 * DAY
+    assert policy.ttl('domain', 'otx') == 14 * DAY
+    assert policy.ttl('domain', 'other') == 30 * DAY
+    assert policy.ttl('IPv4', 'otx,vt') == 7 * DAY
+    assert policy.ttl('IPv4', ['otx', 'feed']) == 7 * DAY
+    assert policy.ttl('FileHash-SHA256', 'vt') is None
+    assert policy.ttl('FileHash-SHA256', 'otx') == 14 * DAY
+    assert policy.ttl('FileHash-SHA256', 'otx,vt') is None
+
+
+def test_confidence_decays_until_expiry(clock):
+    """
+    Test that confidence decays linearly from the last sighting to zero at expiry.
+    """
+    clock.now = 0.0
+    engine = AgingEngine(AgingPolicy(default_ttl=100, types={'md5': None}), tick=1.0, clock=clock)
+    indicator = Indicator('a', 'IPv4', '192.0.2.1', 'otx', 0.0, 0.0, 0.8)
+    assert engine.confidence(indicator) == 0.8
+    assert engine.confidence(indicator, now=25) == pytest.approx(0.6)
+    assert engine.confidence(indicator, now=150) == 0.0
+    assert engine.confidence(Indicator('b', 'FileHash-MD5', 'ab' * 16, 'otx', 0.0, 0.0), now=1e6) == 1.0
+
+
+def test_indicator_set_evicts_expired_indicators(clock):
+    """
+    Test that an IndicatorSet with an AgingEngine drops indicators not seen again within their TTL and
+    keeps those that were.
+    """
+    clock.now = 10000.0
+    engine = AgingEngine(AgingPolicy(default_ttl=1000, types={'domain': 5000}), tick=10, clock=clock)
+    indicators = IndicatorSet(aging=engine)
+    indicators.upsert_many([{'id': 'ip', 'type': 'IPv4', 'indicator': '192.0.2.1', 'modified': 10000},
+                            {'id': 'again', 'type': 'IPv4', 'indicator': '192.0.2.2', 'modified': 10000},
+                            {'id': 'domain', 'type': 'domain', 'indicator': 'evil.example', 'modified': 10000},
+                            {'id': 'stale', 'type': 'IPv4', 'indicator': '192.0.2.3', 'modified': 100}], 'otx')
+    assert indicators.expire() == ['stale']
+
+    clock.now = 10800.0
+    indicators.upsert_many([{'id': 'again', 'type': 'IPv4', 'indicator': '192.0.2.2', 'modified': 10800}], 'otx')
+    clock.now = 11500.0
+    assert indicators.expire() == ['ip']
+    assert sorted(indicator.id for indicator in indicators) == ['again', 'domain']
+    assert indicators.discard('again').id == 'again'
+    assert len(engine) == 1
+    clock.now = 20000.0
+    assert indicators.expire() == ['domain']
+    assert len(indicators) == 0 and engine.expired == 3
+
+
+def test_store_expires_indicators_and_tracks_them_on_open(tmp_path, clock):
+    """
+    Test that an IndicatorStore removes indicators once their TTL after the last write has run out,
+    also for indicators written before it was reopened.
+    """
+    path = str(tmp_path / "indicators.sqlite3")
+    clock.now = 10000.0
+    policy = AgingPolicy(default_ttl=1000, sources={'vt': {'ttl': 3000}})
+    store = IndicatorStore(path, clock=clock, aging=AgingEngine(policy, tick=10, clock=clock))
+    store.upsert_many([{'id': 'a', 'type': 'IPv4', 'indicator': '192.0.2.1'},
+                       {'id': 'b', 'type': 'IPv4', 'indicator': '192.0.2.2'}], 'otx')
+    store.upsert({'id': 'b', 'type': 'IPv4', 'indicator': '192.0.2.2'}, 'vt')
+    store.close()
+
+    clock.now = 11500.0
+    store = IndicatorStore(path, clock=clock, aging=AgingEngine(policy, tick=10, clock=clock))
+    assert store.expire() == ['a']
+    assert store.get('a') is None and store.get('b') is not None
+    assert store.delete(['b']) == 1
+    assert len(store.aging) == 0
+    store.close()
+
+
+def test_daemon_expires_store_indicators(tmp_path, clock):
+    """
+    Test that the collector daemon removes expired indicators from an aging store.
+    """
+    clock.now = 10000.0
+    store = IndicatorStore(str(tmp_path / "indicators.sqlite3"), clock=clock,
+                           aging=AgingEngine(AgingPolicy(default_ttl=100), tick=1, clock=clock))
+    store.upsert({'id': 'a', 'type': 'IPv4', 'indicator': '192.0.2.1'}, 'otx')
+    clock.now = 10200.0
+    daemon = CollectorDaemon(IdleCollector(), store, StateStore(str(tmp_path / "state.json")), clock=clock)
+    daemon.start()
+    try:
+        deadline = time.monotonic() + 5
+        while store.get('a') is not None:
+            assert time.monotonic() < deadline, "indicator not expired in time"
+            time.sleep(0.01)
+    finally:
+        assert daemon.stop()
+    assert daemon.stats()['expired'] == 1
+    store.close()
+
+
+def test_collector_leaves_out_stale_indicators(tmp_path):
+    """
+    Test that fetch_indicators drops indicators last seen longer than their configured TTL ago.
+    """
+    feed = tmp_path / "blocklist.csv"
+    feed.write_text("id,type,indicator,modified\n1,IPv4,192.0.2.1,2000-01-01T00:00:00Z\n"
+                    "2,domain,evil.example,2000-01-01T00:00:00Z\n")
+    config = {'feeds': {'blocklist': {'type': 'csv', 'path': str(feed)}},
+              'aging': {'default_ttl': 30 * DAY, 'types': {'domain': None}}}
+    collector = ThreatDataCollector(config=config)
+    indicators = collector.fetch_indicators()
+    assert [indicator.id for indicator in indicators] == ['2']
+    assert indicators.aging.policy.ttl('IPv4', 'blocklist') == 30 * DAY
+    assert ThreatDataCollector(config={}).aging_engine() is None
+    collector.close()
+
+
+def test_collector_decays_confidence_of_indicators_it_hands_out(mocker, tmp_path):
+    """
+    Test that indicators leaving the collector through fetch_indicators and export carry a confidence
+    decayed by the time since they were last seen.
+    """
+    seen = (datetime.now(timezone.utc) - timedelta(days=15)).isoformat()
+    feed = tmp_path / "blocklist.csv"
+    feed.write_text(f"id,type,indicator,modified\n1,IPv4,192.0.2.1,{seen}\n2,domain,evil.example,{seen}\n")
+    config = {'feeds': {'blocklist': {'type': 'csv', 'path': str(feed)}}, 'normalization': {'workers': 1},
+              'aging': {'default_ttl': 30 * DAY, 'types': {'domain': None}}}
+    collector = ThreatDataCollector(config=config)
+
+    confidences = {indicator.id: indicator.confidence for indicator in collector.fetch_indicators()}
+    assert confidences['1'] == pytest.approx(0.5, abs=0.01)
+    assert confidences['2'] == 1.0
+
+    exporter = mocker.Mock()
+    assert collector.export([exporter]) == 2
+    exported = {record['type']: record['confidence'] for record in exporter.submit.call_args.args[0]}
+    assert exported['ipv4'] == pytest.approx(0.5, abs=0.01)
+    assert exported['domain'] == 1.0
+    collector.close()
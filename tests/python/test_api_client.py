@@ -12,10 +12,78 @@
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
 
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
 import pytest
 import requests
 
-from src.python.api_client import APIClient, APIError
+from src.python.api_client import APIClient, APIError, request_deadline
+from src.python.metrics import HTTP_REQUESTS, STAGE_SECONDS
+from src.python.provider_health import ProviderHealth
+from src.python.rate_limit import RateLimiter
+from src.python.response_cache import ResponseCache
+
+
+class JSONHandler(BaseHTTPRequestHandler):
+    """
+    A minimal HTTP/1.1 handler that answers every GET with a small JSON list.
+    """
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == "/etag":
+            # A resource that never changes, supporting conditional requests
+            if self.headers.get("If-None-Match") == '"v1"':
+                self.send_response(304)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            document = [{'id': 'cached'}]
+        elif url.path == "/pages":
+            # Three pages of two records each, linked through a 'cursor' query parameter
+            page = int(parse_qs(url.query).get("cursor", ["0"])[0])
+            document = {'data': [{'id': page * 2}, {'id': page * 2 + 1}],
+                        'meta': {'cursor': str(page + 1) if page < 2 else None}}
+        elif url.path == "/links":
+            # Two pages of records in a 'results' member, linked through complete 'next' URLs
+            page = int(parse_qs(url.query).get("page", ["0"])[0])
+            link = f"http://{self.headers['Host']}/links?page={page + 1}"
+            document = {'results': [{'id': page}], 'next': link if page < 1 else None}
+        elif url.path in ("/relative", "/offsite"):
+            # Two pages linked through a root-relative link, or a first page linking to another host
+            page = int(parse_qs(url.query).get("page", ["0"])[0])
+            link = f"{url.path}?page=1" if url.path == "/relative" else "http://evil.example/collect?page=1"
+            document = {'results': [{'id': page}], 'next': link if page < 1 else None}
+        else:
+            document = [{'id': self.path}]
+        body = json.dumps(document).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("ETag", '"v1"')
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def local_server():
+    """
+    Run a local keep-alive HTTP server for the duration of a test.
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", 0), JSONHandler)
+    thread = threading.Thread(target=server.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+    server.server_close()
 
 
 def test_api_client_success(mocker):
@@ -24,7 +92,7 @@ def test_api_client_success(mocker):
     This ensures that valid data is returned when the API call is successful.
     """
     mock_response = [{'id': 'test_data'}]
-    mocker.patch('requests.get',
+    mocker.patch('requests.Session.get',
                  return_value=mocker.Mock(status_code=200, json=mocker.Mock(return_value=mock_response)))
     client = APIClient("https://example.com/api", {"Authorization": "Bearer token"})
     result = client.get_data("endpoint")
@@ -36,19 +104,41 @@ def test_api_client_timeout(mocker):
     Test API client handling of a timeout error.
     This ensures that the appropriate exception and message are raised and logged.
     """
-    mocker.patch('requests.get', side_effect=requests.exceptions.Timeout)
+    mocker.patch('requests.Session.get', side_effect=requests.exceptions.Timeout)
     client = APIClient("https://example.com/api", {"Authorization": "Bearer token"})
     with pytest.raises(APIError, match="API request timed out."):
         client.get_data("endpoint")
 
 
+def test_api_client_request_deadline(mocker):
+    """
+    Test that a request deadline caps each request's timeout and refuses requests once it has passed.
+    """
+    response = mocker.Mock(status_code=200, json=mocker.Mock(return_value=[{'id': 'ok'}]))
+    get = mocker.patch('requests.Session.get', return_value=response)
+    client = APIClient("https://example.com/api", {})
+
+    with request_deadline(time.monotonic() + 2):
+        assert client.get_data("endpoint") == [{'id': 'ok'}]
+    assert 0 < get.call_args.kwargs['timeout'] <= 2
+
+    with request_deadline(time.monotonic() - 1):
+        with request_deadline(time.monotonic() + 60):  # A nested deadline never extends the outer one
+            with pytest.raises(APIError, match="API request timed out."):
+                client.get_data("endpoint")
+    assert get.call_count == 1
+
+    client.get_data("endpoint")
+    assert get.call_args.kwargs['timeout'] == 10
+
+
 def test_api_client_rate_limit(mocker):
     """
     Test API client handling of rate limiting.
     This ensures that the APIError exception is raised when the rate limit is exceeded.
     """
     mock_response = mocker.Mock(status_code=429, headers={"Retry-After": "5"})
-    mocker.patch('requests.get', return_value=mock_response)
+    mocker.patch('requests.Session.get', return_value=mock_response)
     client = APIClient("https://example.com/api", {"Authorization": "Bearer token"})
     with pytest.raises(APIError, match="Rate limit exceeded."):
         client.get_data("endpoint")
@@ -60,7 +150,7 @@ def test_api_client_invalid_json(mocker):
     This test simulates a ValueError when the JSON response is not valid.
     """
     mock_response = mocker.Mock(status_code=200, json=mocker.Mock(side_effect=ValueError))
-    mocker.patch('requests.get', return_value=mock_response)
+    mocker.patch('requests.Session.get', return_value=mock_response)
     client = APIClient("https://example.com/api", {"Authorization": "Bearer token"})
     with pytest.raises(APIError, match="Invalid response format."):
         client.get_data("endpoint")
@@ -71,7 +161,7 @@ def test_api_client_connection_error(mocker):
     Test API client handling of a connection error.
     This ensures that connection issues are properly caught and logged.
     """
-    mocker.patch('requests.get', side_effect=requests.ConnectionError)
+    mocker.patch('requests.Session.get', side_effect=requests.ConnectionError)
     client = APIClient("https://example.com/api", {"Authorization": "Bearer token"})
     with pytest.raises(APIError, match="Connection error occurred."):
         client.get_data("endpoint")
@@ -83,7 +173,7 @@ def test_api_client_authentication_error(mocker):
     This simulates an authentication failure with a 401 status code.
     """
     mock_response = mocker.Mock(status_code=401)
-    mocker.patch('requests.get', return_value=mock_response)
+    mocker.patch('requests.Session.get', return_value=mock_response)
     client = APIClient("https://example.com/api", {"Authorization": "Invalid token"})
     with pytest.raises(APIError, match="Authentication failed."):
         client.get_data("endpoint")
@@ -95,7 +185,218 @@ def test_api_client_permission_error(mocker):
     This simulates a permission failure with a 403 status code.
     """
     mock_response = mocker.Mock(status_code=403)
-    mocker.patch('requests.get', return_value=mock_response)
+    mocker.patch('requests.Session.get', return_value=mock_response)
     client = APIClient("https://example.com/api", {"Authorization": "Bearer token"})
     with pytest.raises(APIError, match="Permission denied."):
         client.get_data("endpoint")
+
+
+def test_api_client_reuses_connections(local_server):
+    """
+    Test that sustained polling through one client reuses a single pooled connection.
+    """
+    with APIClient(local_server, {}) as client:
+        for _ in range(5):
+            assert client.get_data("endpoint") == [{'id': '/endpoint'}]
+        assert client.stats.as_dict() == {'requests': 5, 'new_connections': 1, 'reused_connections': 4}
+
+
+def test_api_client_keep_alive_disabled(local_server):
+    """
+    Test that disabling keep-alive opens a new connection for every request.
+    """
+    with APIClient(local_server, {}, http_config={'keep_alive': False}) as client:
+        for _ in range(3):
+            client.get_data("endpoint")
+        assert client.stats.new_connections == 3
+        assert client.stats.reused_connections == 0
+
+
+def test_api_client_session_settings():
+    """
+    Test that pool size and compression settings are applied to the client's session.
+    """
+    client = APIClient("https://example.com/api", {},
+                       http_config={'pool_connections': 2, 'pool_maxsize': 7, 'compression': False})
+    adapter = client.session.get_adapter("https://example.com/api")
+    assert adapter._pool_connections == 2
+    assert adapter._pool_maxsize == 7
+    assert client.session.headers['Accept-Encoding'] == 'identity'
+    client.close()
+
+
+def test_api_client_iter_data_follows_cursor(local_server):
+    """
+    Test that iter_data streams records across all pages by following the pagination cursor.
+    """
+    with APIClient(local_server, {}) as client:
+        records = client.iter_data("pages", items_key='data', next_key='meta.cursor', cursor_param='cursor')
+        assert [record['id'] for record in records] == [0, 1, 2, 3, 4, 5]
+
+
+def test_api_client_iter_pages(local_server):
+    """
+    Test that iter_pages yields one list of records per page.
+    """
+    with APIClient(local_server, {}) as client:
+        pages = list(client.iter_pages("pages", items_key='data', next_key='meta.cursor', cursor_param='cursor'))
+        assert pages == [[{'id': 0}, {'id': 1}], [{'id': 2}, {'id': 3}], [{'id': 4}, {'id': 5}]]
+
+
+def test_api_client_get_all_follows_cursors(local_server, tmp_path):
+    """
+    Test that get_all collects the records of every page, following cursor parameters and next-page links,
+    and serves pages from the response cache.
+    """
+    cache = ResponseCache(str(tmp_path / "cache.sqlite3"), ttls={'links*': 60})
+    with APIClient(local_server, {}, cache=cache) as client:
+        records = client.get_all("pages", items_key='data', next_key='meta.cursor', cursor_param='cursor')
+        assert [record['id'] for record in records] == [0, 1, 2, 3, 4, 5]
+        assert client.get_all("links", items_key='results', next_key='next') == [{'id': 0}, {'id': 1}]
+        requests_made = client.stats.requests
+        assert client.get_all("links", items_key='results', next_key='next') == [{'id': 0}, {'id': 1}]
+        assert client.stats.requests == requests_made
+        assert client.get_all("endpoint", items_key='results') == [{'id': '/endpoint'}]
+    cache.close()
+
+
+def test_api_client_follows_next_page_links_on_its_host_only(local_server, mocker):
+    """
+    Test that root-relative next-page links are followed and links to another host are not, so the
+    API's credentials never leave its host.
+    """
+    request = mocker.spy(requests.Session, 'request')
+    with APIClient(local_server, {'x-apikey': 'secret'}) as client:
+        assert list(client.iter_data("relative", items_key='results', next_key='next')) == [{'id': 0}, {'id': 1}]
+        assert client.get_all("relative", items_key='results', next_key='next') == [{'id': 0}, {'id': 1}]
+        assert list(client.iter_data("offsite", items_key='results', next_key='next')) == [{'id': 0}]
+        assert client.get_all("offsite", items_key='results', next_key='next') == [{'id': 0}]
+        with pytest.raises(APIError):
+            client.get_data("http://evil.example/collect")
+    assert request.call_count == 6
+    assert all(call.args[2].startswith(local_server) for call in request.call_args_list)
+
+
+def test_api_client_iter_data_top_level_list(local_server):
+    """
+    Test that an unpaginated top-level array is streamed as-is.
+    """
+    with APIClient(local_server, {}) as client:
+        assert list(client.iter_data("endpoint")) == [{'id': '/endpoint'}]
+
+
+def test_api_client_iter_data_rate_limit(mocker):
+    """
+    Test that streaming requests use the same error handling as get_data.
+    """
+    mock_response = mocker.MagicMock(status_code=429, headers={"Retry-After": "5"})
+    mocker.patch('requests.Session.get', return_value=mock_response)
+    client = APIClient("https://example.com/api", {"Authorization": "Bearer token"})
+    with pytest.raises(APIError, match="Rate limit exceeded."):
+        list(client.iter_data("endpoint"))
+
+
+def test_api_client_rate_limit_retry(mocker):
+    """
+    Test that a rate limited request is retried after its Retry-After delay when a limiter is set.
+    """
+    rate_limited = mocker.Mock(status_code=429, headers={"Retry-After": "5"})
+    success = mocker.Mock(status_code=200, json=mocker.Mock(return_value=[{'id': 'test_data'}]))
+    mocker.patch('requests.Session.get', side_effect=[rate_limited, success])
+    sleep = mocker.Mock()
+    limiter = RateLimiter(requests_per_minute=600, sleep=sleep)
+    client = APIClient("https://example.com/api", {"Authorization": "Bearer token"}, rate_limiter=limiter)
+
+    assert client.get_data("endpoint") == [{'id': 'test_data'}]
+    assert limiter.stats()['deferred'] == 1
+    assert sum(call.args[0] for call in sleep.call_args_list) == pytest.approx(5, abs=0.1)
+
+
+def test_api_client_rate_limit_retries_exhausted(mocker):
+    """
+    Test that a request still fails once the limiter's retry budget is used up.
+    """
+    rate_limited = mocker.Mock(status_code=429, headers={"Retry-After": "1"})
+    session_get = mocker.patch('requests.Session.get', return_value=rate_limited)
+    limiter = RateLimiter(requests_per_minute=600, max_retries=2, sleep=mocker.Mock())
+    client = APIClient("https://example.com/api", {"Authorization": "Bearer token"}, rate_limiter=limiter)
+
+    with pytest.raises(APIError, match="Rate limit exceeded."):
+        client.get_data("endpoint")
+    assert session_get.call_count == 3
+
+
+def test_api_client_cache_revalidation(local_server, tmp_path):
+    """
+    Test that a stale cached response is revalidated with a conditional request and reused on 304.
+    """
+    cache = ResponseCache(str(tmp_path / "cache.sqlite3"))
+    with APIClient(local_server, {}, cache=cache) as client:
+        assert client.get_data("etag") == [{'id': 'cached'}]
+        assert client.get_data("etag") == [{'id': 'cached'}]
+        assert client.stats.requests == 2
+    assert cache.stats()['misses'] == 1
+    assert cache.stats()['revalidations'] == 1
+    cache.close()
+
+
+def test_api_client_cache_hit(local_server, tmp_path):
+    """
+    Test that a fresh cached response is served without contacting the API.
+    """
+    cache = ResponseCache(str(tmp_path / "cache.sqlite3"), ttls={'etag': 60})
+    with APIClient(local_server, {}, cache=cache) as client:
+        client.get_data("etag")
+        assert client.get_data("etag") == [{'id': 'cached'}]
+        assert client.stats.requests == 1
+    assert cache.stats()['hits'] == 1
+    cache.close()
+
+
+def test_api_client_retries_connection_errors(mocker):
+    """
+    Test that connection errors are retried with backoff when provider health tracking is enabled.
+    """
+    sleeps = []
+    health = ProviderHealth("test", max_retries=2, sleep=sleeps.append, rng=lambda: 1.0)
+    response = mocker.Mock(status_code=200, json=mocker.Mock(return_value=[{'id': 'ok'}]))
+    response.elapsed.total_seconds.return_value = 0.2
+    get = mocker.patch('requests.Session.get', side_effect=[requests.exceptions.ConnectionError, response])
+    client = APIClient("https://example.com/api", {}, health=health)
+
+    assert client.get_data("endpoint") == [{'id': 'ok'}]
+    assert get.call_count == 2
+    assert sleeps == [0.5]
+    assert get.call_args.kwargs['timeout'] == 10
+
+
+def test_api_client_circuit_opens_and_fails_fast(mocker):
+    """
+    Test that a down provider opens the circuit so later calls fail without a request.
+    """
+    health = ProviderHealth("test", failure_threshold=2, max_retries=5, sleep=lambda seconds: None)
+    get = mocker.patch('requests.Session.get', side_effect=requests.exceptions.Timeout)
+    client = APIClient("https://example.com/api", {}, health=health)
+
+    with pytest.raises(APIError, match="API request timed out."):
+        client.get_data("endpoint")
+    assert get.call_count == 2
+
+    with pytest.raises(APIError, match="Provider unavailable."):
+        client.get_data("endpoint")
+    assert get.call_count == 2
+
+
+def test_api_client_reports_stages(local_server):
+    """
+    Test that requests, connections and decoding are timed per source.
+    """
+    before = HTTP_REQUESTS.value('metrics-test', '200')
+    with APIClient(local_server, {}, name='metrics-test') as client:
+        client.get_data('a')
+        client.get_data('b')
+
+    assert HTTP_REQUESTS.value('metrics-test', '200') - before == 2
+    assert STAGE_SECONDS.count('metrics-test', 'connect') >= 1
+    assert STAGE_SECONDS.count('metrics-test', 'request') >= 2
+    assert STAGE_SECONDS.count('metrics-test', 'decode') >= 2
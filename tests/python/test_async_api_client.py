@@ -0,0 +1,212 @@
+#  IntelliSIEM Copyright 2024, Rob Perry
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+import pytest
+
+from src.python.async_api_client import AsyncAPIClient
+from src.python.data_collection import ThreatDataCollector
+from src.python.error_handling import APIError, ConfigError
+
+LATENCY = 0.1
+
+
+class LookupHandler(BaseHTTPRequestHandler):
+    """
+    Answers lookups after a fixed latency, counting the requests and the most that were in flight at once.
+    """
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.requests += 1
+            server.active += 1
+            server.peak = max(server.peak, server.active)
+        time.sleep(LATENCY)
+        with server.lock:
+            server.active -= 1
+        path = urlparse(self.path).path
+        if path == "/denied":
+            status, body = 401, b'{"error": "invalid key"}'
+        elif path == "/broken":
+            status, body = 200, b'not json'
+        else:
+            status, body = 200, json.dumps({'id': path.rsplit('/', 1)[-1], 'query': self.path}).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def lookup_server():
+    """
+    Run a local lookup server for the duration of a test.
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", 0), LookupHandler)
+    server.daemon_threads = True
+    server.lock = threading.Lock()
+    server.requests = server.active = server.peak = 0
+    thread = threading.Thread(target=server.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def base_url(server):
+    return f"http://127.0.0.1:{server.server_port}"
+
+
+def test_get_many_runs_lookups_concurrently(lookup_server):
+    """
+    Test that a batch of lookups costs about one round trip and returns the responses in order.
+    """
+    async def run():
+        async with AsyncAPIClient(base_url(lookup_server), {}, max_concurrency=20) as client:
+            started = time.monotonic()
+            results = await client.get_many(f"files/{i}" for i in range(20))
+            return results, time.monotonic() - started
+
+    results, elapsed = asyncio.run(run())
+    assert [result['id'] for result in results] == [str(i) for i in range(20)]
+    assert elapsed < LATENCY * 5
+    assert lookup_server.requests == 20
+
+
+def test_concurrency_is_bounded(lookup_server):
+    """
+    Test that no more than max_concurrency lookups are in flight at the same time.
+    """
+    async def run():
+        async with AsyncAPIClient(base_url(lookup_server), {}, max_concurrency=3) as client:
+            return await client.get_many(f"files/{i}" for i in range(9))
+
+    asyncio.run(run())
+    assert lookup_server.requests == 9
+    assert lookup_server.peak == 3
+
+
+def test_identical_lookups_are_coalesced(lookup_server):
+    """
+    Test that identical lookups made while one is in flight share a single request, whatever the order of
+    their params, while different params are fetched separately.
+    """
+    async def run():
+        async with AsyncAPIClient(base_url(lookup_server), {}) as client:
+            results = await client.get_many([("ip/1.2.3.4", {'a': 1, 'b': 2}), ("ip/1.2.3.4", {'b': 2, 'a': 1}),
+                                             ("ip/1.2.3.4", {'a': 1, 'b': 2}), ("ip/1.2.3.4", {'a': 2})])
+            return client, results
+
+    client, results = asyncio.run(run())
+    assert results[0] == results[1] == results[2]
+    assert results[3] != results[0]
+    assert lookup_server.requests == 2
+    assert client.requests == 2
+    assert client.coalesced == 2
+
+
+def test_completed_lookups_are_not_coalesced(lookup_server):
+    """
+    Test that a lookup repeated after the first one finished is sent again.
+    """
+    async def run():
+        async with AsyncAPIClient(base_url(lookup_server), {}) as client:
+            await client.get_data("files/1")
+            await client.get_data("files/1")
+
+    asyncio.run(run())
+    assert lookup_server.requests == 2
+
+
+def test_errors_are_api_errors(lookup_server):
+    """
+    Test that failed lookups raise the same APIError as the synchronous client, or are returned in place
+    with return_exceptions.
+    """
+    async def run():
+        async with AsyncAPIClient(base_url(lookup_server), {}) as client:
+            with pytest.raises(APIError, match="Authentication failed."):
+                await client.get_data("denied")
+            with pytest.raises(APIError):
+                await client.get_data("broken")
+            return await client.get_many(["files/1", "denied"], return_exceptions=True)
+
+    results = asyncio.run(run())
+    assert results[0]['id'] == '1'
+    assert isinstance(results[1], APIError)
+
+
+def test_cancelled_caller_does_not_cancel_shared_lookup(lookup_server):
+    """
+    Test that cancelling one of two callers waiting on the same lookup leaves the other its response.
+    """
+    async def run():
+        async with AsyncAPIClient(base_url(lookup_server), {}) as client:
+            first = asyncio.ensure_future(client.get_data("files/7"))
+            second = asyncio.ensure_future(client.get_data("files/7"))
+            await asyncio.sleep(0)
+            first.cancel()
+            return await second
+
+    assert asyncio.run(run())['id'] == '7'
+    assert lookup_server.requests == 1
+
+
+def test_client_can_be_used_from_several_event_loops(lookup_server):
+    """
+    Test that a client outlives the event loop it was first used in.
+    """
+    client = AsyncAPIClient(base_url(lookup_server), {})
+    try:
+        assert asyncio.run(client.get_data("files/1"))['id'] == '1'
+        assert asyncio.run(client.get_data("files/2"))['id'] == '2'
+    finally:
+        client.close()
+
+
+def test_collector_enrichment_client(lookup_server):
+    """
+    Test that the collector builds lookup clients from a feed's settings and rejects unknown feeds.
+    """
+    config = {'api_keys': {'lookup': 'secret'},
+              'enrichment': {'max_concurrency': 5},
+              'feeds': {'lookup': {'type': 'rest', 'base_url': base_url(lookup_server), 'endpoint': 'files',
+                                   'auth': {'header': 'x-apikey', 'api_key': 'lookup'}}}}
+    collector = ThreatDataCollector(config=config)
+    try:
+        client = collector.enrichment_client('lookup')
+        assert client.max_concurrency == 5
+        assert client.client.headers == {'x-apikey': 'secret'}
+        # Every worker thread has a pooled connection and no lookup opens one beyond the pool
+        assert client.client.http_config['pool_maxsize'] == client._executor._max_workers == 5
+        assert client.client.http_config['pool_block'] is True
+        assert client.client.name == 'lookup'
+        assert asyncio.run(client.get_data("files/abc"))['id'] == 'abc'
+        client.close()
+        with pytest.raises(ConfigError):
+            collector.enrichment_client('missing')
+    finally:
+        collector.close()
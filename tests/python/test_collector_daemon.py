@@ -0,0 +1,186 @@
+#  IntelliSIEM Copyright 2024, Rob Perry
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import threading
+import time
+
+from src.python.collector_daemon import CollectorDaemon
+from src.python.data_collection import ThreatDataCollector
+from src.python.error_handling import APIError
+from src.python.fetch_orchestrator import SourceResult, STATUS_OK
+from src.python.indicator_store import BufferedStoreWriter, IndicatorStore
+from src.python.state_store import StateStore
+
+
+class FakeRegistry:
+    def __init__(self, feeds):
+        self.feeds = feeds
+
+    def names(self):
+        return list(self.feeds)
+
+
+class FakeCollector:
+    """
+    A collector whose runs take a fixed time and are recorded, with the peak number running at once.
+    """
+
+    def __init__(self, intervals, duration=0.0, fail=()):
+        self.feeds = FakeRegistry({name: {'interval': interval} for name, interval in intervals.items()})
+        self.duration = duration
+        self.fail = set(fail)
+        self.runs = []
+        self.running = 0
+        self.peak = 0
+        self._lock = threading.Lock()
+
+    def collect_incremental(self, indicators, state, feeds=None):
+        name = feeds[0]
+        with self._lock:
+            self.running += 1
+            self.peak = max(self.peak, self.running)
+            self.runs.append(name)
+        try:
+            time.sleep(self.duration)
+            if name in self.fail:
+                raise APIError("Connection error occurred.")
+            return {name: SourceResult(name, STATUS_OK, data=0)}
+        finally:
+            with self._lock:
+                self.running -= 1
+
+
+def wait_until(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "condition not met in time"
+        time.sleep(0.01)
+
+
+def test_daemon_runs_feeds_on_their_intervals(tmp_path):
+    """
+    Test that each feed runs on its own interval, so a fast feed runs more often than a slow one.
+    """
+    collector = FakeCollector({'fast': 0.05, 'slow': 10})
+    daemon = CollectorDaemon(collector, {}, StateStore(str(tmp_path / "state.json")), jitter=0)
+    daemon.start()
+    try:
+        wait_until(lambda: collector.runs.count('fast') >= 4)
+    finally:
+        assert daemon.stop()
+    assert collector.runs.count('slow') == 1
+    stats = daemon.stats()
+    assert stats['feeds']['slow']['runs'] == 1
+    assert stats['feeds']['slow']['next_run_in'] > 5
+
+
+def test_daemon_caps_concurrency_and_survives_failures(tmp_path):
+    """
+    Test that no more than max_concurrent feeds run at once and failing feeds stay scheduled.
+    """
+    collector = FakeCollector({f"feed{i}": 0.01 for i in range(6)}, duration=0.05, fail={'feed0'})
+    daemon = CollectorDaemon(collector, {}, StateStore(str(tmp_path / "state.json")), max_concurrent=2, jitter=0)
+    daemon.start()
+    try:
+        wait_until(lambda: collector.runs.count('feed0') >= 2)
+    finally:
+        daemon.stop()
+    assert collector.peak == 2
+    assert daemon.stats()['feeds']['feed0']['failures'] >= 2
+
+
+def test_daemon_holds_back_runs_under_backpressure(tmp_path, mocker):
+    """
+    Test that no new runs start while the store's backlog is above the high watermark.
+    """
+    sink = mocker.Mock(spec=BufferedStoreWriter)
+    sink.pending.return_value = 10
+    collector = FakeCollector({'feed': 0.01})
+    daemon = CollectorDaemon(collector, sink, StateStore(str(tmp_path / "state.json")),
+                             high_watermark=8, low_watermark=2, jitter=0)
+    daemon.start()
+    try:
+        time.sleep(0.3)
+        assert collector.runs == []
+        assert daemon.stats()['throttled']
+
+        sink.pending.return_value = 2
+        wait_until(lambda: collector.runs)
+    finally:
+        daemon.stop()
+    assert daemon.throttle_events == 1
+
+
+def test_daemon_drains_on_stop(tmp_path):
+    """
+    Test that stop waits for running feeds and writes out their indicators before returning.
+    """
+    (tmp_path / "drop.csv").write_text("id\na\nb\n")
+    collector = ThreatDataCollector(config={'feeds': {'drop': {'type': 'csv', 'path': str(tmp_path / "*.csv"),
+                                                               'interval': 60}}})
+    store = IndicatorStore(str(tmp_path / "indicators.sqlite3"))
+    state = StateStore(str(tmp_path / "state.json"))
+    daemon = CollectorDaemon(collector, store, state, jitter=0)
+    daemon.start()
+    wait_until(lambda: daemon.stats()['feeds'].get('drop', {}).get('runs'))
+
+    assert daemon.stop()
+    assert store.count() == 2
+    assert StateStore(str(tmp_path / "state.json")).get('drop') is not None
+    store.close()
+
+
+def test_daemon_stop_times_out_on_stuck_feed(tmp_path):
+    """
+    Test that stop gives up on feeds that do not finish within the drain timeout.
+    """
+    collector = FakeCollector({'stuck': 60}, duration=0.5)
+    daemon = CollectorDaemon(collector, {}, StateStore(str(tmp_path / "state.json")), jitter=0)
+    daemon.start()
+    wait_until(lambda: collector.running)
+    assert not daemon.stop(timeout=0.05)
+
+
+class SlowExpiringIndicators:
+    """
+    Indicators with an aging engine whose expiry passes block until released.
+    """
+    aging = object()
+
+    def __init__(self):
+        self.expiring = threading.Event()
+        self.release = threading.Event()
+
+    def expire(self):
+        self.expiring.set()
+        self.release.wait(5)
+        return ['a']
+
+
+def test_daemon_expires_without_holding_the_scheduler(tmp_path):
+    """
+    Test that running feeds finish and stats are served while an expiry pass is in progress.
+    """
+    collector = FakeCollector({'feed': 60}, duration=0.1)
+    indicators = SlowExpiringIndicators()
+    daemon = CollectorDaemon(collector, indicators, StateStore(str(tmp_path / "state.json")), jitter=0)
+    daemon.start()
+    try:
+        wait_until(indicators.expiring.is_set)
+        wait_until(lambda: daemon.stats()['feeds'].get('feed', {}).get('runs') == 1)
+        assert daemon.stats()['expired'] == 0
+    finally:
+        indicators.release.set()
+        assert daemon.stop()
+    assert daemon.stats()['expired'] == 1
@@ -12,9 +12,17 @@
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
 
+import threading
+import time
+
 import pytest
 
-from src.python.config import load_config, ConfigError
+from src.python import config as config_module
+from src.python.config import (ConfigManager, get_aging_config, get_cache_config, get_correlation_config,
+                               get_enrichment_config, get_export_config, get_feeds_config, get_health_config,
+                               get_http_config, get_logging_config, get_metrics_config, get_normalization_config,
+                               get_queue_config, get_rate_limit_config, get_scheduler_config, get_snapshot_config,
+                               load_config, validate_config, ConfigError)
 
 
 def test_load_config_success(mocker):
@@ -76,3 +84,323 @@ def test_load_config_disk_space_error(mocker):
     mock_open.side_effect = OSError("No space left on device")
     with pytest.raises(ConfigError, match="Disk space issue while loading configuration."):
         load_config()
+
+
+def test_get_http_config_defaults():
+    """
+    Test that missing HTTP settings fall back to the defaults.
+    """
+    settings = get_http_config({'http': {'pool_maxsize': 20}})
+    assert settings['pool_maxsize'] == 20
+    assert settings['pool_connections'] == 10
+    assert settings['keep_alive'] is True
+
+
+def test_get_http_config_invalid_value():
+    """
+    Test that an invalid HTTP setting raises a ConfigError.
+    """
+    with pytest.raises(ConfigError, match="Invalid HTTP setting: pool_maxsize."):
+        get_http_config({'http': {'pool_maxsize': 0}})
+
+
+def test_get_rate_limit_config():
+    """
+    Test that rate limit settings are returned with defaults, or None for unlimited sources.
+    """
+    config = {'rate_limits': {'virus_total': {'requests_per_minute': 4}}}
+    settings = get_rate_limit_config(config, 'virus_total')
+    assert settings['requests_per_minute'] == 4
+    assert settings['max_retries'] == 3
+    assert get_rate_limit_config(config, 'alien_vault') is None
+
+
+def test_get_rate_limit_config_invalid_value():
+    """
+    Test that an invalid rate limit setting raises a ConfigError.
+    """
+    with pytest.raises(ConfigError, match="Invalid rate limit setting: requests_per_minute."):
+        get_rate_limit_config({'rate_limits': {'virus_total': {'requests_per_minute': 0}}}, 'virus_total')
+
+
+def test_get_cache_config():
+    """
+    Test that cache settings are returned with defaults, or None when caching is not configured.
+    """
+    settings = get_cache_config({'cache': {'ttls': {'files': 60}}})
+    assert settings['ttls'] == {'files': 60}
+    assert settings['path'] == 'data/response_cache.sqlite3'
+    assert get_cache_config({}) is None
+
+
+def test_get_cache_config_invalid_ttl():
+    """
+    Test that a negative cache TTL raises a ConfigError.
+    """
+    with pytest.raises(ConfigError, match="Invalid cache setting: ttls."):
+        get_cache_config({'cache': {'ttls': {'files': -1}}})
+
+
+def test_get_logging_config():
+    """
+    Test that logging settings are filled in with defaults and the level name is resolved.
+    """
+    settings = get_logging_config({'logging': {'log_file': 'logs/app.log', 'level': 'warning'}})
+    assert settings['log_file'] == 'logs/app.log'
+    assert settings['level'] == 30
+    assert settings['queue_size'] == 10000
+    assert get_logging_config({}) is None
+
+
+def test_get_logging_config_invalid_value():
+    """
+    Test that unknown keys and invalid values raise a ConfigError.
+    """
+    with pytest.raises(ConfigError, match="Invalid logging setting: overflow."):
+        get_logging_config({'logging': {'overflow': 'discard'}})
+    with pytest.raises(ConfigError, match="Invalid logging setting: logfile."):
+        get_logging_config({'logging': {'logfile': 'error.log'}})
+
+
+def test_validate_config_rejects_invalid_sections():
+    """
+    Test that a configuration is rejected as a whole when any section is invalid.
+    """
+    assert validate_config({'api_keys': {'virus_total': 'key'}}) == {'api_keys': {'virus_total': 'key'}}
+    with pytest.raises(ConfigError, match="Invalid configuration setting: api_keys."):
+        validate_config({'api_keys': {'virus_total': ''}})
+    with pytest.raises(ConfigError, match="Invalid HTTP setting: pool_maxsize."):
+        validate_config({'http': {'pool_maxsize': 0}})
+    with pytest.raises(ConfigError, match="Invalid configuration."):
+        validate_config(['not', 'a', 'mapping'])
+
+
+def test_config_manager_memoizes_and_reloads(tmp_path, mocker):
+    """
+    Test that the file is parsed once, and parsed again only after it changes.
+    """
+    path = tmp_path / "config.yaml"
+    path.write_text("api_keys:\n  virus_total: old\n")
+    manager = ConfigManager(str(path), check_interval=0)
+    load = mocker.spy(config_module, 'load_config')
+    changes = []
+    manager.subscribe(lambda new, old: changes.append((old['api_keys'], new['api_keys'])))
+
+    assert manager.get()['api_keys'] == {'virus_total': 'old'}
+    assert manager.get() is manager.get()
+    assert load.call_count == 1
+
+    path.write_text("api_keys:\n  virus_total: rotated\n")
+    assert manager.get()['api_keys'] == {'virus_total': 'rotated'}
+    assert load.call_count == 2
+    assert changes == [({'virus_total': 'old'}, {'virus_total': 'rotated'})]
+    assert manager.reloads == 1
+
+
+def test_config_manager_keeps_previous_config_on_invalid_edit(tmp_path):
+    """
+    Test that an invalid edit is rejected and the previous configuration stays in use.
+    """
+    path = tmp_path / "config.yaml"
+    path.write_text("http:\n  pool_maxsize: 10\n")
+    manager = ConfigManager(str(path), check_interval=0)
+    subscriber = []
+    manager.subscribe(lambda new, old: subscriber.append(new))
+    original = manager.get()
+
+    path.write_text("http:\n  pool_maxsize: -1\n")
+    assert manager.get() is original
+    path.unlink()
+    assert manager.get() is original
+    assert manager.rejected_reloads == 2
+    assert subscriber == []
+
+
+def test_config_manager_reloads_once_for_concurrent_readers(tmp_path, mocker):
+    """
+    Test that readers racing on a changed file reload it and notify subscribers only once.
+    """
+    path = tmp_path / "config.yaml"
+    path.write_text("api_keys:\n  virus_total: old\n")
+    manager = ConfigManager(str(path), check_interval=0)
+    manager.get()
+    changes = []
+    manager.subscribe(lambda new, old: changes.append(new))
+    load_config = config_module.load_config
+
+    def slow_load(config_file):
+        time.sleep(0.05)
+        return load_config(config_file)
+
+    mocker.patch.object(config_module, 'load_config', side_effect=slow_load)
+    path.write_text("api_keys:\n  virus_total: rotated\n")
+    readers = [threading.Thread(target=manager.get) for _ in range(8)]
+    for reader in readers:
+        reader.start()
+    for reader in readers:
+        reader.join()
+    assert manager.reloads == 1
+    assert len(changes) == 1
+    assert manager.get()['api_keys']['virus_total'] == 'rotated'
+
+
+def test_config_manager_check_interval(tmp_path):
+    """
+    Test that the file is only checked for changes once per check_interval.
+    """
+    now = [0.0]
+    path = tmp_path / "config.yaml"
+    path.write_text("api_keys:\n  virus_total: old\n")
+    manager = ConfigManager(str(path), check_interval=5.0, clock=lambda: now[0])
+    manager.get()
+
+    path.write_text("api_keys:\n  virus_total: rotated\n")
+    now[0] = 4.0
+    assert manager.get()['api_keys']['virus_total'] == 'old'
+    now[0] = 5.0
+    assert manager.get()['api_keys']['virus_total'] == 'rotated'
+
+
+def test_get_health_config():
+    """
+    Test that per-provider health settings override the shared ones, which override the defaults.
+    """
+    config = {'health': {'max_timeout': 15, 'providers': {'virus_total': {'max_timeout': 30}}}}
+    assert get_health_config(config, 'alien_vault')['max_timeout'] == 15
+    assert get_health_config(config, 'virus_total')['max_timeout'] == 30
+    assert get_health_config(config, 'virus_total')['failure_threshold'] == 5
+    assert get_health_config({}, 'virus_total') is None
+
+
+def test_get_health_config_invalid_value():
+    """
+    Test that invalid provider health settings raise a ConfigError.
+    """
+    with pytest.raises(ConfigError, match="Invalid provider health setting: latency_percentile."):
+        get_health_config({'health': {'latency_percentile': 2}}, 'virus_total')
+    with pytest.raises(ConfigError, match="Invalid provider health setting: min_timeout."):
+        get_health_config({'health': {'min_timeout': 20, 'max_timeout': 10}}, 'virus_total')
+
+
+def test_get_feeds_config_defaults():
+    """
+    Test that the built-in feeds are used without a 'feeds' section, and declared feeds get defaults.
+    """
+    assert list(get_feeds_config({})) == ['alien_vault', 'virus_total']
+    feeds = get_feeds_config({'feeds': {'drop': {'type': 'csv', 'path': 'data/feeds/*.csv', 'interval': 60}}})
+    assert feeds['drop']['interval'] == 60
+    assert feeds['drop']['concurrency'] == 1
+    assert feeds['drop']['enabled'] is True
+
+
+def test_get_feeds_config_invalid():
+    """
+    Test that incomplete or invalid feed declarations raise a ConfigError.
+    """
+    with pytest.raises(ConfigError, match="Invalid feed setting: collection."):
+        get_feeds_config({'feeds': {'taxii': {'type': 'taxii', 'api_root': 'https://taxii.example/api1'}}})
+    with pytest.raises(ConfigError, match="Invalid feed setting: concurrency."):
+        get_feeds_config({'feeds': {'drop': {'type': 'csv', 'path': 'x.csv', 'concurrency': 0}}})
+    with pytest.raises(ConfigError, match="Invalid feed setting: incremental."):
+        get_feeds_config({'feeds': {'drop': {'type': 'csv', 'path': 'x.csv', 'incremental': {'mode': 'field'}}}})
+
+
+def test_get_scheduler_config():
+    """
+    Test scheduler defaults and that inconsistent backpressure watermarks are rejected.
+    """
+    assert get_scheduler_config({})['max_concurrent'] == 4
+    assert get_scheduler_config({'scheduler': {'jitter': 0.2}})['jitter'] == 0.2
+    with pytest.raises(ConfigError, match="Invalid scheduler setting: high_watermark."):
+        get_scheduler_config({'scheduler': {'high_watermark': 20, 'write_queue_size': 16}})
+    with pytest.raises(ConfigError, match="Invalid scheduler setting: jitter."):
+        get_scheduler_config({'scheduler': {'jitter': 1.5}})
+
+
+def test_get_normalization_config():
+    """
+    Test normalization defaults and that worker and chunk counts must be positive integers.
+    """
+    assert get_normalization_config({})['workers'] is None
+    assert get_normalization_config({'normalization': {'workers': 2}})['workers'] == 2
+    with pytest.raises(ConfigError, match="Invalid normalization setting: chunk_size."):
+        get_normalization_config({'normalization': {'chunk_size': 0}})
+
+
+def test_get_correlation_config():
+    """
+    Test correlation defaults and that source weights must lie between 0 and 1.
+    """
+    assert get_correlation_config({})['half_life_days'] == 30
+    assert get_correlation_config({'correlation': {'source_weights': {'otx': 1}}})['source_weights'] == {'otx': 1}
+    with pytest.raises(ConfigError, match="Invalid correlation setting: source_weights."):
+        get_correlation_config({'correlation': {'source_weights': {'otx': 2}}})
+    with pytest.raises(ConfigError, match="Invalid correlation setting: half_life_days."):
+        get_correlation_config({'correlation': {'half_life_days': 0}})
+
+
+def test_get_export_config():
+    """
+    Test that export is off without its section and that sinks must declare their required settings.
+    """
+    assert get_export_config({}) is None
+    settings = get_export_config({'export': {'sinks': {'archive': {'type': 'file', 'directory': 'out'}}}})
+    assert settings['batch_size'] == 500
+    with pytest.raises(ConfigError, match="Invalid export sink: hec."):
+        get_export_config({'export': {'sinks': {'hec': {'type': 'http'}}}})
+
+
+def test_get_metrics_config():
+    """
+    Test that metrics are off by default and that settings are type-checked.
+    """
+    assert get_metrics_config({})['enabled'] is False
+    assert get_metrics_config({'metrics': {'enabled': True, 'port': 9200}})['port'] == 9200
+    with pytest.raises(ConfigError, match="Invalid metrics setting: profiling."):
+        get_metrics_config({'metrics': {'profiling': 'yes'}})
+
+
+def test_get_enrichment_config():
+    """
+    Test the default lookup concurrency and that it must be a positive integer.
+    """
+    assert get_enrichment_config({}) == {'max_concurrency': 32}
+    assert get_enrichment_config({'enrichment': {'max_concurrency': 200}})['max_concurrency'] == 200
+    with pytest.raises(ConfigError, match="Invalid enrichment setting: max_concurrency."):
+        get_enrichment_config({'enrichment': {'max_concurrency': 0}})
+
+
+def test_get_queue_config():
+    """
+    Test that the indicators consumer is declared by default and consumers must be a list of names.
+    """
+    assert get_queue_config({})['consumers'] == ['indicators']
+    assert get_queue_config({'queue': {'consumers': ['indicators', 'export']}})['consumers'] == ['indicators', 'export']
+    with pytest.raises(ConfigError, match="Invalid queue setting: consumers."):
+        get_queue_config({'queue': {'consumers': 'indicators'}})
+
+
+def test_get_snapshot_config():
+    """
+    Test the default snapshot settings and that the false positive rate must lie between 0 and 1.
+    """
+    assert get_snapshot_config({}) == {'path': 'data/indicators.snapshot', 'false_positive_rate': 0.01}
+    assert get_snapshot_config({'snapshot': {'path': 'out.snapshot'}})['path'] == 'out.snapshot'
+    with pytest.raises(ConfigError, match="Invalid snapshot setting: false_positive_rate."):
+        get_snapshot_config({'snapshot': {'false_positive_rate': 1.0}})
+
+
+def test_get_aging_config():
+    """
+    Test that aging is off without its section, and that TTLs must be positive or null.
+    """
+    assert get_aging_config({}) is None
+    settings = get_aging_config({'aging': {'types': {'ipv4': 604800, 'sha256': None}}})
+    assert settings['default_ttl'] == 2592000 and settings['types']['sha256'] is None
+    assert get_aging_config({'aging': {'sources': {'otx': {'ttl': None, 'types': {'url': 60}}}}})
+    with pytest.raises(ConfigError, match="Invalid aging setting: types."):
+        get_aging_config({'aging': {'types': {'ipv4': 0}}})
+    with pytest.raises(ConfigError, match="Invalid aging setting: sources."):
+        get_aging_config({'aging': {'sources': {'otx': {'max_age': 60}}}})
+    with pytest.raises(ConfigError, match="Invalid aging setting: tick."):
+        get_aging_config({'aging': {'tick': None}})
@@ -0,0 +1,202 @@
+#  IntelliSIEM Copyright 2024, Rob Perry
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import json
+import os
+
+import pytest
+
+from src.python.api_client import APIClient
+from src.python.config import get_feeds_config
+from src.python.connectors import (CSVConnector, FeedConnector, FeedRegistry, FileConnector, RestConnector,
+                                   STIXConnector, TAXIIConnector, connector_class, feed_headers, register_connector)
+from src.python.error_handling import ConfigError, DataError
+
+
+class StaticConnector(FeedConnector):
+    """
+    A connector yielding records given in its settings, for registry tests.
+    """
+
+    def _iter_records(self, params):
+        return iter(self.settings['records'])
+
+
+def test_incomplete_connectors_cannot_be_built():
+    """
+    Test that a connector missing its record reader fails when it is built, not during a fetch.
+    """
+    class NoReader(FileConnector):
+        pass
+
+    with pytest.raises(TypeError):
+        NoReader('drop', {'path': '/nonexistent/*.csv'})
+    with pytest.raises(TypeError):
+        FeedConnector('feed', {})
+
+
+def test_registry_builds_feeds_lazily(mocker):
+    """
+    Test that only requested, enabled feeds are built, and HTTP feeds get a client from the factory.
+    """
+    feeds = get_feeds_config({'feeds': {
+        'otx': {'base_url': 'https://otx.example/api', 'endpoint': 'export', 'auth': {'api_key': 'otx'}},
+        'drop': {'type': 'csv', 'path': '/nonexistent/*.csv'},
+        'off': {'type': 'csv', 'path': '/nonexistent/*.csv', 'enabled': False},
+    }})
+    factory = mocker.Mock()
+    registry = FeedRegistry(feeds, {'otx': 'secret'}, factory)
+
+    assert registry.names() == ['otx', 'drop']
+    drop = registry.get('drop')
+    assert isinstance(drop, CSVConnector)
+    factory.assert_not_called()
+
+    otx = registry.get('otx')
+    factory.assert_called_once_with('otx', 'https://otx.example/api', {'Authorization': 'secret'})
+    assert otx.client is factory.return_value
+    assert registry.connectors() == [otx, drop]
+    assert registry.get('otx') is otx
+
+
+def test_registry_unknown_feed_and_type():
+    """
+    Test that unknown feeds and feed types raise a ConfigError.
+    """
+    registry = FeedRegistry({'odd': {'type': 'gopher'}})
+    with pytest.raises(ConfigError, match="Unknown feed: missing."):
+        registry.get('missing')
+    with pytest.raises(ConfigError, match="Unknown feed type: gopher."):
+        registry.get('odd')
+    with pytest.raises(ConfigError, match="Unknown feed type: no.such.module:Connector."):
+        connector_class('no.such.module:Connector')
+
+
+def test_custom_connector_type():
+    """
+    Test that connector types can be declared by import path or registered by name.
+    """
+    path = f"{__name__}:StaticConnector"
+    assert connector_class(path) is StaticConnector
+
+    register_connector('static', StaticConnector)
+    registry = FeedRegistry({'fixed': {'type': 'static', 'records': [{'id': 1}]}})
+    assert registry.get('fixed').fetch() == [{'id': 1}]
+
+
+def test_feed_headers_auth():
+    """
+    Test header and HTTP basic authentication built from the configured API keys.
+    """
+    settings = {'headers': {'User-Agent': 'intellisiem'}, 'auth': {'header': 'x-apikey', 'api_key': 'vt'}}
+    assert feed_headers(settings, {'vt': 'k'}) == {'User-Agent': 'intellisiem', 'x-apikey': 'k'}
+    basic = feed_headers({'auth': {'username': 'user', 'api_key': 'taxii'}}, {'taxii': 'pass'})
+    assert basic == {'Authorization': 'Basic dXNlcjpwYXNz'}
+    with pytest.raises(ConfigError, match="Missing API key: vt."):
+        feed_headers(settings, {})
+
+
+def test_rest_connector_fetches_pages_up_to_max_pages(mocker):
+    """
+    Test that a REST feed returns the records of its first max_pages pages, taken out of their response
+    envelope, reading only the first page by default and stopping when the cursors go round in a cycle.
+    """
+    pages = {
+        'export': {'results': [{'id': 1}, {'id': 2}], 'next': 'https://otx.example/api/v1/export?page=2'},
+        'export?page=2': {'results': [{'id': 3}], 'next': 'https://otx.example/api/v1/export?page=3'},
+        'export?page=3': {'results': [{'id': 4}], 'next': 'https://otx.example/api/v1/export?page=2'},
+    }
+    get_data = mocker.patch('src.python.api_client.APIClient.get_data',
+                            side_effect=lambda endpoint, params=None: pages[endpoint])
+    settings = {'base_url': 'https://otx.example/api/v1', 'endpoint': 'export',
+                'pagination': {'items_key': 'results', 'next_key': 'next'}}
+    with APIClient(*RestConnector.client_spec(settings, {})) as client:
+        assert RestConnector('otx', settings, client).fetch() == [{'id': 1}, {'id': 2}]
+        assert get_data.call_count == 1
+
+        settings['pagination']['max_pages'] = 2
+        assert RestConnector('otx', settings, client).fetch() == [{'id': 1}, {'id': 2}, {'id': 3}]
+
+        settings['pagination']['max_pages'] = None
+        assert RestConnector('otx', settings, client).fetch() == [{'id': 1}, {'id': 2}, {'id': 3}, {'id': 4}]
+        assert get_data.call_count == 6
+
+
+def test_taxii_connector_pages_through_collection(mocker):
+    """
+    Test that a TAXII feed reads its collection's objects endpoint with type filtering and pagination.
+    """
+    client = mocker.Mock()
+    client.iter_data.return_value = iter([{'id': 'indicator--1', 'type': 'indicator'}])
+    settings = {'api_root': 'https://taxii.example/api1/', 'collection': 'abc', 'page_size': 500}
+    assert TAXIIConnector.client_spec(settings, {}) == (
+        'https://taxii.example/api1', {'Accept': 'application/taxii+json;version=2.1'})
+
+    connector = TAXIIConnector('taxii', settings, client)
+    assert list(connector.iter_records()) == [{'id': 'indicator--1', 'type': 'indicator'}]
+    client.iter_data.assert_called_once_with('collections/abc/objects/',
+                                             params={'match[type]': 'indicator', 'limit': 500},
+                                             items_key='objects', next_key='next', cursor_param='next')
+    client.get_all.return_value = [{'id': 'indicator--1', 'type': 'indicator'}]
+    assert connector.fetch() == [{'id': 'indicator--1', 'type': 'indicator'}]
+    client.get_all.assert_called_once_with('collections/abc/objects/',
+                                           params={'match[type]': 'indicator', 'limit': 500},
+                                           items_key='objects', next_key='next', cursor_param='next', max_pages=1)
+    assert connector.incremental == {'mode': 'timestamp', 'param': 'added_after'}
+
+
+def test_csv_connector(tmp_path):
+    """
+    Test reading CSV drops with explicit columns, comments and an indicator type.
+    """
+    (tmp_path / "a.csv").write_text("# blocklist\n1.2.3.4;scanner\n5.6.7.8;c2\n")
+    connector = CSVConnector('drop', {'path': str(tmp_path / "*.csv"), 'delimiter': ';',
+                                      'columns': ['indicator', 'description'], 'id_column': 'indicator',
+                                      'indicator_type': 'IPv4'})
+    assert connector.fetch() == [
+        {'indicator': '1.2.3.4', 'description': 'scanner', 'id': '1.2.3.4', 'type': 'IPv4'},
+        {'indicator': '5.6.7.8', 'description': 'c2', 'id': '5.6.7.8', 'type': 'IPv4'},
+    ]
+
+
+def test_file_connector_skips_unmodified_files(tmp_path):
+    """
+    Test that a timestamp watermark skips files not modified since the last run.
+    """
+    old = tmp_path / "old.csv"
+    new = tmp_path / "new.csv"
+    old.write_text("id\nold\n")
+    new.write_text("id\nnew\n")
+    os.utime(old, (1000000000, 1000000000))
+    connector = CSVConnector('drop', {'path': str(tmp_path / "*.csv")})
+
+    assert [r['id'] for r in connector.iter_records({'modified_since': '2020-01-01T00:00:00+00:00'})] == ['new']
+    assert [r['id'] for r in connector.iter_records()] == ['new', 'old']
+
+
+def test_stix_connector_filters_object_types(tmp_path):
+    """
+    Test that STIX bundles are streamed and filtered by object type.
+    """
+    bundle = {'type': 'bundle', 'id': 'bundle--1', 'objects': [
+        {'type': 'indicator', 'id': 'indicator--1', 'pattern': "[ipv4-addr:value = '1.2.3.4']"},
+        {'type': 'malware', 'id': 'malware--1'},
+    ]}
+    (tmp_path / "bundle.json").write_text(json.dumps(bundle))
+    connector = STIXConnector('stix', {'path': str(tmp_path / "*.json")})
+    assert [o['id'] for o in connector.fetch()] == ['indicator--1']
+
+    (tmp_path / "broken.json").write_text('{"objects": [{"id": ')
+    with pytest.raises(DataError, match="Corrupt data received."):
+        connector.fetch()
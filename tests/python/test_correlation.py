@@ -0,0 +1,124 @@
+#  IntelliSIEM Copyright 2024, Rob Perry
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import random
+
+import pytest
+
+from src.python.correlation import DAY, CorrelationEngine
+from src.python.data_collection import ThreatDataCollector
+from src.python.error_handling import DataError
+
+NOW = 1700000000.0
+
+
+def indicator(id, source, last_seen=NOW, confidence=None, **fields):
+    return dict({'id': id, 'type': id.split(':')[0], 'value': id.split(':')[1], 'source': source,
+                 'last_seen': last_seen, 'confidence': confidence}, **fields)
+
+
+@pytest.fixture
+def engine():
+    return CorrelationEngine({'alien_vault': 0.5, 'virus_total': 0.8}, half_life_days=10, clock=lambda: NOW)
+
+
+def test_merges_sources_into_one_observable(engine):
+    """
+    Test that reports from two sources are merged and score higher than either alone.
+    """
+    engine.update([indicator('ipv4:10.0.0.1', 'alien_vault', tags=['c2'])])
+    single = engine.score(engine.get('ipv4:10.0.0.1'))
+    engine.update([indicator('ipv4:10.0.0.1', 'virus_total', ttps=['T1071'])])
+    merged = engine.get('ipv4:10.0.0.1')
+
+    assert len(engine) == 1
+    assert merged.sources == ['alien_vault', 'virus_total']
+    assert merged.tags == {'c2'} and merged.ttps == {'T1071'}
+    assert single == pytest.approx(100 * 0.5 * 0.5)
+    assert engine.score(merged) == pytest.approx(100 * (1 - 0.5 * 0.2) * 0.75)
+
+
+def test_redelivered_reports_are_not_sightings(engine):
+    """
+    Test that the same report received again does not change the score.
+    """
+    assert engine.update([indicator('domain:a.example', 'alien_vault')]) == {'domain:a.example'}
+    assert engine.update([indicator('domain:a.example', 'alien_vault')]) == set()
+    assert engine.get('domain:a.example').sightings == 1
+
+
+def test_confidence_and_recency(engine):
+    """
+    Test that reported confidence scales the reputation and scores halve every half-life.
+    """
+    engine.update([indicator('md5:aa', 'virus_total', confidence=50)])
+    hit = engine.get('md5:aa')
+    assert engine.score(hit) == pytest.approx(100 * 0.4 * 0.5)
+    assert engine.score(hit, NOW + 10 * DAY) == pytest.approx(100 * 0.4 * 0.5 / 2)
+
+
+def test_top_ranks_by_current_score(engine):
+    """
+    Test that the ranking accounts for recency and follows incremental updates.
+    """
+    engine.update([indicator('ipv4:10.0.0.1', 'virus_total', last_seen=NOW - 20 * DAY),
+                   indicator('ipv4:10.0.0.2', 'alien_vault'),
+                   indicator('domain:b.example', 'alien_vault', last_seen=NOW - DAY)])
+    assert [hit.id for _, hit in engine.top()] == ['ipv4:10.0.0.2', 'domain:b.example', 'ipv4:10.0.0.1']
+
+    engine.update([indicator('ipv4:10.0.0.1', 'virus_total')])
+    assert [hit.id for _, hit in engine.top(limit=1)] == ['ipv4:10.0.0.1']
+    assert [hit.id for _, hit in engine.top(types=['domain'])] == ['domain:b.example']
+    assert [hit.id for _, hit in engine.top(min_score=30)] == ['ipv4:10.0.0.1']
+
+
+def test_top_follows_repeated_rescoring(engine):
+    """
+    Test that the ranking stays exact while indicators are rescored many times over.
+    """
+    rng = random.Random(3)
+    sources = ['alien_vault', 'virus_total', 'other']
+    for _ in range(50):
+        engine.update([indicator(f"ipv4:10.0.0.{rng.randrange(40)}", rng.choice(sources),
+                                 last_seen=NOW - rng.uniform(0, 30) * DAY, confidence=rng.randrange(1, 101))
+                       for _ in range(10)])
+        expected = sorted(((engine.score(hit), hit.id) for hit in engine._indicators.values()), reverse=True)
+        assert [(score, hit.id) for score, hit in engine.top(limit=1000)] == expected
+        assert len(engine._ranking) <= 2 * len(engine)
+
+
+def test_update_missing_source(engine):
+    """
+    Test that an indicator without a source raises DataError.
+    """
+    with pytest.raises(DataError, match="Missing required data keys."):
+        engine.update([{'id': 'ipv4:10.0.0.1'}])
+
+
+def test_collector_correlates_feeds(mocker):
+    """
+    Test that an indicator reported by both providers is merged into one scored observable.
+    """
+    digest = 'd41d8cd98f00b204e9800998ecf8427e'
+    mocker.patch('src.python.api_client.APIClient.iter_data',
+                 side_effect=[iter([{'id': 1, 'type': 'FileHash-MD5', 'indicator': digest.upper()}]),
+                              iter([{'id': digest, 'type': 'file'}])])
+    collector = ThreatDataCollector(config={'api_keys': {'alien_vault': 'a', 'virus_total': 'v'},
+                                            'normalization': {'workers': 1}})
+    engine = collector.correlation_engine()
+    changed = collector.correlate(engine)
+    collector.close()
+
+    assert changed == {f"md5:{digest}"}
+    assert engine.get(f"md5:{digest}").sources == ['alien_vault', 'virus_total']
@@ -13,9 +13,27 @@
 #  limitations under the License.
 # tests/test_data_collection.py
 
+import os
+import subprocess
+import sys
+
 import pytest
 
-from src.python.data_collection import fetch_threat_data, DataError
+from src.python import data_collection
+from src.python.data_collection import (collect_incremental, collect_threat_data, fetch_threat_data, iter_threat_data,
+                                        APIError, DataError, ThreatDataCollector)
+from src.python.indicator_store import IndicatorStore
+from src.python.state_store import StateStore
+
+
+@pytest.fixture(autouse=True)
+def reset_collector():
+    """
+    Drop the default collector so each test builds (or patches) its own API clients.
+    """
+    data_collection.set_collector(None)
+    yield
+    data_collection.set_collector(None)
 
 
 def test_fetch_threat_data_success(mocker):
@@ -28,19 +46,19 @@ def test_fetch_threat_data_success(mocker):
 
     # Create separate mock instances for each APIClient
     mock_alien_vault_client = mocker.Mock()
-    mock_alien_vault_client.get_data.return_value = mock_data_alien
+    mock_alien_vault_client.get_all.return_value = mock_data_alien
 
     mock_virus_total_client = mocker.Mock()
-    mock_virus_total_client.get_data.return_value = mock_data_virus
+    mock_virus_total_client.get_all.return_value = mock_data_virus
 
     # Patch the APIClient constructor to return the respective mock instances
-    mocker.patch('src.data_collection.APIClient', side_effect=[mock_alien_vault_client, mock_virus_total_client])
+    mocker.patch('src.python.data_collection.APIClient', side_effect=[mock_alien_vault_client, mock_virus_total_client])
 
     threats = fetch_threat_data()
 
     # Verify that the mock was called only once per client
-    mock_alien_vault_client.get_data.assert_called_once()
-    mock_virus_total_client.get_data.assert_called_once()
+    mock_alien_vault_client.get_all.assert_called_once()
+    mock_virus_total_client.get_all.assert_called_once()
 
     assert len(threats) == 2  # Expecting two entries: one from each mock data list
     assert threats == [{'id': 'test1'}, {'id': 'test2'}]
@@ -52,7 +70,7 @@ def test_fetch_threat_data_missing_keys(mocker):
     This ensures that missing keys in the data trigger the appropriate exception.
     """
     # Mock get_data to return an entry missing the required 'id' key
-    mocker.patch('src.api_client.APIClient.get_data', return_value=[{'missing_key': 'value'}])
+    mocker.patch('src.python.api_client.APIClient.get_data', return_value=[{'missing_key': 'value'}])
     with pytest.raises(DataError, match="Missing required data keys."):
         fetch_threat_data()
 
@@ -63,7 +81,7 @@ def test_fetch_threat_data_corrupt_data(mocker):
     This ensures that corrupt data is caught and triggers the DataError exception.
     """
     # Mock get_data to return structurally corrupt data with an unexpected type for 'id'
-    mocker.patch('src.api_client.APIClient.get_data',
+    mocker.patch('src.python.api_client.APIClient.get_data',
                  return_value=[{'id': {'unexpected': 'dict'}, 'nested_data': ['unexpected_list']}])
 
     # Expect DataError to be raised for corrupt data
@@ -76,7 +94,7 @@ def test_fetch_threat_data_empty_response(mocker):
     Test fetching threat data with an empty response.
     This ensures that the function handles empty responses gracefully.
     """
-    mocker.patch('src.api_client.APIClient.get_data', return_value=[])
+    mocker.patch('src.python.api_client.APIClient.get_data', return_value=[])
     threats = fetch_threat_data()
     assert threats == []  # Expecting an empty list when no data is returned
 
@@ -87,6 +105,238 @@ def test_fetch_threat_data_invalid_data_type(mocker):
     This simulates an unexpected data type from the API response.
     """
     # Mock get_data to return a non-list data type, such as a string
-    mocker.patch('src.api_client.APIClient.get_data', return_value="invalid_data")
+    mocker.patch('src.python.api_client.APIClient.get_data', return_value="invalid_data")
     with pytest.raises(DataError, match="Unexpected data type received."):
         fetch_threat_data()
+
+
+def test_collect_threat_data_partial(mocker):
+    """
+    Test that partial collection keeps data from healthy sources and reports the failed one.
+    """
+    mock_alien_vault_client = mocker.Mock()
+    mock_alien_vault_client.get_all.side_effect = APIError("Rate limit exceeded.")
+    mock_virus_total_client = mocker.Mock()
+    mock_virus_total_client.get_all.return_value = [{'id': 'test2'}]
+    mocker.patch('src.python.data_collection.APIClient',
+                 side_effect=[mock_alien_vault_client, mock_virus_total_client])
+
+    threats, results = collect_threat_data()
+
+    assert threats == [{'id': 'test2'}]
+    assert results['alien_vault'].status == "error"
+    assert results['virus_total'].ok
+
+
+def test_fetch_threat_data_source_failure(mocker):
+    """
+    Test that fetch_threat_data still returns an empty list when any source fails.
+    """
+    mocker.patch('src.python.api_client.APIClient.get_data', side_effect=APIError("Connection error occurred."))
+    assert fetch_threat_data() == []
+
+
+def test_iter_threat_data(mocker):
+    """
+    Test that the streaming variant yields validated indicators from each source in order.
+    """
+    mocker.patch('src.python.api_client.APIClient.iter_data',
+                 side_effect=[iter([{'id': 'test1'}]), iter([{'id': 'test2'}, {'id': 'test3'}])])
+    assert list(iter_threat_data()) == [{'id': 'test1'}, {'id': 'test2'}, {'id': 'test3'}]
+
+
+def test_iter_threat_data_corrupt_entry(mocker):
+    """
+    Test that the streaming variant raises DataError when it reaches a corrupt entry.
+    """
+    mocker.patch('src.python.api_client.APIClient.iter_data', return_value=iter([{'id': ['bad']}]))
+    threats = iter_threat_data()
+    with pytest.raises(DataError, match="Corrupt data received."):
+        next(threats)
+
+
+def test_streaming_drops_isolated_bad_entries(mocker, tmp_path):
+    """
+    Test that a malformed record in the middle of a streamed feed is dropped without aborting the feed,
+    for raw, normalized and collected indicators alike.
+    """
+    records = [{'id': str(i), 'type': 'IPv4', 'indicator': f"192.0.2.{i}"} for i in range(5)]
+    records[2] = {'id': ['bad'], 'type': 'IPv4', 'indicator': '192.0.2.2'}
+    mocker.patch('src.python.connectors.CSVConnector.iter_records', side_effect=lambda: iter(records))
+    collector = ThreatDataCollector(config={'feeds': {'blocklist': {'type': 'csv',
+                                                                     'path': str(tmp_path / "feed.csv")}}})
+
+    assert [entry['id'] for entry in collector.iter_threat_data()] == ['0', '1', '3', '4']
+    assert [indicator['value'] for indicator in collector.iter_normalized()] == \
+        ['192.0.2.0', '192.0.2.1', '192.0.2.3', '192.0.2.4']
+    assert sorted(indicator.id for indicator in collector.fetch_indicators()) == ['0', '1', '3', '4']
+    collector.close()
+
+
+def test_collect_incremental_uses_watermarks(mocker, tmp_path):
+    """
+    Test that incremental collection merges deltas and sends the persisted watermark on the next run.
+    """
+    calls = []
+
+    def iter_data(endpoint, params=None, **pagination):
+        calls.append((endpoint, dict(params or {})))
+        return iter([{'id': f'{endpoint}-{len(calls)}'}])
+
+    mocker.patch('src.python.api_client.APIClient.iter_data', side_effect=iter_data)
+    state_path = str(tmp_path / "state.json")
+    indicators = {}
+
+    results = collect_incremental(indicators, StateStore(state_path))
+    assert results['alien_vault'].data == 1
+    assert 'modified_since' not in calls[0][1]
+    watermark = StateStore(state_path).get('alien_vault')
+    assert watermark is not None
+
+    collect_incremental(indicators, StateStore(state_path))
+    assert calls[2] == ('indicators/export', {'modified_since': watermark})
+    assert calls[3] == ('files', {'limit': 10})  # VirusTotal has no watermark and is fully re-pulled
+    assert sorted(indicators) == ['files-2', 'files-4', 'indicators/export-1', 'indicators/export-3']
+
+
+def test_collect_incremental_failure_keeps_watermark(mocker, tmp_path):
+    """
+    Test that a failed source keeps its previous watermark so the next run retries from it.
+    """
+    state = StateStore(str(tmp_path / "state.json"))
+    state.set('alien_vault', '2024-01-01T00:00:00+00:00')
+    mocker.patch('src.python.api_client.APIClient.iter_data', side_effect=APIError("Connection error occurred."))
+
+    results = collect_incremental({}, state)
+
+    assert results['alien_vault'].status == "error"
+    assert StateStore(str(tmp_path / "state.json")).get('alien_vault') == '2024-01-01T00:00:00+00:00'
+
+
+def test_collect_incremental_saves_watermarks_before_a_failure(mocker, tmp_path):
+    """
+    Test that the watermarks of sources that finished are saved even when a later source raises.
+    """
+    mocker.patch('src.python.api_client.APIClient.iter_data',
+                 side_effect=[iter([{'id': 'a1'}]), DataError("Corrupt data received.")])
+    state_path = str(tmp_path / "state.json")
+
+    with pytest.raises(DataError):
+        collect_incremental({}, StateStore(state_path))
+
+    assert StateStore(state_path).get('alien_vault') is not None
+
+
+def test_advance_watermark_field_mode(mocker):
+    """
+    Test that a field watermark tracks the largest value seen and ignores missing values.
+    """
+    source = mocker.Mock(incremental={'mode': 'field', 'field': 'modified', 'param': 'after'})
+    watermark = None
+    for entry in [{'modified': '2024-01-02'}, {'modified': '2024-01-05'}, {}, {'modified': '2024-01-03'}]:
+        watermark = data_collection._advance_watermark(source, watermark, entry)
+    assert watermark == '2024-01-05'
+
+
+def test_collect_incremental_into_indicator_store(mocker, tmp_path):
+    """
+    Test that incremental collection can merge directly into an IndicatorStore.
+    """
+    mocker.patch('src.python.api_client.APIClient.iter_data',
+                 side_effect=[iter([{'id': 'h1', 'type': 'file'}]), iter([{'id': 'h1', 'type': 'file'}])])
+    store = IndicatorStore(str(tmp_path / "indicators.sqlite3"))
+
+    collect_incremental(store, StateStore(str(tmp_path / "state.json")))
+
+    assert store.count() == 1
+    assert store.get('h1').sources == ['alien_vault', 'virus_total']
+    store.close()
+
+
+def test_fetch_threat_data_drops_isolated_bad_entries(mocker):
+    """
+    Test that a few invalid entries are dropped without discarding the rest of the export.
+    """
+    mocker.patch('src.python.api_client.APIClient.get_data',
+                 side_effect=[[{'id': 'a'}, {'id': 'b'}, {'id': ['bad']}], [{'id': 'c'}]])
+    assert fetch_threat_data() == [{'id': 'a'}, {'id': 'b'}, {'id': 'c'}]
+
+
+def test_import_is_lazy(tmp_path):
+    """
+    Test that importing the module reads no configuration, opens no log file and skips heavy imports.
+    """
+    root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    script = ("import sys; import src.python.data_collection; "
+              "print(sorted(m for m in ('yaml', 'asyncio') if m in sys.modules))")
+    output = subprocess.run([sys.executable, '-c', script], cwd=tmp_path, env=dict(os.environ, PYTHONPATH=root),
+                            check=True, capture_output=True, text=True).stdout
+    assert output.strip() == "[]"
+    assert os.listdir(tmp_path) == []
+
+
+def test_collector_loads_config_on_first_use(mocker):
+    """
+    Test that a collector reads its configuration file only when it is first needed.
+    """
+    load = mocker.patch('src.python.config.load_config',
+                        return_value={'api_keys': {'alien_vault': 'a', 'virus_total': 'v'},
+                                      'validation': {'fields': {'sha256': {'required': True}}}})
+    collector = ThreatDataCollector('custom.yaml')
+    load.assert_not_called()
+
+    assert collector.validate_entry({'sha256': 'abc'}) == {'sha256': 'abc'}
+    with pytest.raises(DataError, match="Missing required data keys."):
+        collector.validate_entry({'id': 'abc'})
+    load.assert_called_once_with('custom.yaml')
+
+
+def test_collector_configures_logging(mocker):
+    """
+    Test that the optional 'logging' section attaches the log pipeline when the configuration is loaded.
+    """
+    configure = mocker.patch('src.python.data_collection.configure_logging')
+    collector = ThreatDataCollector(config={'logging': {'log_file': 'logs/collector.log'}})
+    configure.assert_not_called()
+
+    assert collector.config['logging']['log_file'] == 'logs/collector.log'
+    configure.assert_called_once()
+    assert configure.call_args.kwargs['log_file'] == 'logs/collector.log'
+
+
+def test_collector_applies_rotated_api_key(mocker, tmp_path):
+    """
+    Test that a rotated API key is pushed to the existing client without rebuilding it.
+    """
+    path = tmp_path / "config.yaml"
+    path.write_text("api_keys:\n  alien_vault: otx-old\n  virus_total: vt-old\n")
+    client = mocker.Mock(headers={'x-apikey': 'vt-old'}, base_url='https://www.virustotal.com/api/v3')
+    constructor = mocker.patch('src.python.data_collection.APIClient', return_value=client)
+    collector = ThreatDataCollector(str(path), check_interval=0)
+
+    collector.feeds.get('virus_total')
+    path.write_text("api_keys:\n  alien_vault: otx-old\n  virus_total: vt-rotated\n")
+    assert collector.config['api_keys']['virus_total'] == 'vt-rotated'
+
+    client.update_headers.assert_called_with({'x-apikey': 'vt-rotated'})
+    assert collector.feeds.get('virus_total').client is client
+    constructor.assert_called_once()
+    collector.close()
+
+
+def test_collect_declared_feed_independently(tmp_path):
+    """
+    Test that a feed declared in the configuration is collected on its own, without the other feeds.
+    """
+    (tmp_path / "drop.csv").write_text("id,type\nbad.example,domain\n")
+    collector = ThreatDataCollector(config={'feeds': {
+        'otx': {'base_url': 'https://otx.example/api', 'endpoint': 'export'},
+        'drop': {'type': 'csv', 'path': str(tmp_path / "*.csv")},
+    }})
+    indicators = {}
+
+    results = collector.collect_incremental(indicators, StateStore(str(tmp_path / "state.json")), feeds=['drop'])
+
+    assert list(results) == ['drop']
+    assert indicators == {'bad.example': {'id': 'bad.example', 'type': 'domain'}}
+    assert 'otx' not in collector._clients
@@ -12,11 +12,17 @@
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
 
+import json
 import logging
+import os
+import queue
 
 import pytest
 
-from src.python.error_handling import APIError, ConfigError, DataError, log_error
+from src.python import error_handling
+from src.python.error_handling import (APIError, BoundedQueueHandler, ConfigError, DataError, JSONFormatter,
+                                       OVERFLOW_DROP_NEWEST, OVERFLOW_DROP_OLDEST, QueueLogWriter, configure_logging,
+                                       log_error, setup_logging)
 
 
 def test_api_error():
@@ -68,3 +74,128 @@ def test_log_info(mocker):
     mocker.patch('logging.info')
     log_error("Test info message.", level="INFO")
     logging.info.assert_called_once_with("Test info message.")
+
+
+def make_record(message):
+    """
+    Build an ERROR log record with the given message.
+    """
+    return logging.LogRecord("test", logging.ERROR, __file__, 1, message, None, None)
+
+
+def test_log_error_with_context(mocker):
+    """
+    Test that structured context is passed to the logger as an extra field.
+    """
+    mocker.patch('logging.error')
+    log_error("Source failed.", source="virus_total")
+    logging.error.assert_called_once_with("Source failed.", extra={'context': {'source': "virus_total"}})
+
+
+def test_json_formatter():
+    """
+    Test that records are formatted as single-line JSON with their context.
+    """
+    record = make_record("Rate limit exceeded.")
+    record.context = {'source': 'virus_total'}
+    entry = json.loads(JSONFormatter().format(record))
+    assert entry['level'] == "ERROR"
+    assert entry['message'] == "Rate limit exceeded."
+    assert entry['context'] == {'source': 'virus_total'}
+
+
+@pytest.mark.parametrize("overflow, expected", [
+    (OVERFLOW_DROP_NEWEST, ["first", "second"]),
+    (OVERFLOW_DROP_OLDEST, ["second", "third"]),
+])
+def test_bounded_queue_handler_overflow(overflow, expected):
+    """
+    Test that a full queue drops records according to the overflow policy and counts them.
+    """
+    handler = BoundedQueueHandler(queue.Queue(maxsize=2), overflow=overflow)
+    for message in ["first", "second", "third"]:
+        handler.handle(make_record(message))
+
+    assert [handler.queue.get_nowait().getMessage() for _ in range(2)] == expected
+    assert handler.dropped == 1
+
+
+def test_bounded_queue_handler_invalid_policy():
+    """
+    Test that an unknown overflow policy is rejected.
+    """
+    with pytest.raises(ValueError):
+        BoundedQueueHandler(queue.Queue(), overflow="explode")
+
+
+def test_queue_log_writer_batches_and_rotates(tmp_path):
+    """
+    Test that the writer thread writes queued records in batches and rotates the file.
+    """
+    log_file = str(tmp_path / "logs" / "error.log")
+    log_queue = queue.Queue()
+    for i in range(50):
+        log_queue.put(make_record(f"Record {i} padded to fill up the log file quickly."))
+    writer = QueueLogWriter(log_queue, log_file, max_bytes=1000, backup_count=5, batch_size=20,
+                            flush_interval=0.01)
+    writer.start()
+    writer.stop()
+
+    assert writer.written == 50
+    assert writer.batches >= 3
+    assert os.path.exists(f"{log_file}.1")
+    with open(log_file) as file:
+        assert json.loads(file.readlines()[-1])['message'].startswith("Record 49")
+
+
+def test_setup_logging_pipeline(tmp_path):
+    """
+    Test that the pipeline attached by setup_logging writes records from the root logger.
+    """
+    log_file = str(tmp_path / "error.log")
+    pipeline = setup_logging(log_file=log_file, flush_interval=0.01)
+    try:
+        logging.getLogger().error("Pipeline test message.")
+    finally:
+        pipeline.shutdown()
+
+    stats = pipeline.stats()
+    assert stats['dropped'] == 0
+    assert stats['written'] >= 1
+    with open(log_file) as file:
+        assert any(json.loads(line)['message'] == "Pipeline test message." for line in file)
+
+
+def test_configure_logging_replaces_pipeline(tmp_path, mocker):
+    """
+    Test that configure_logging drains the previous pipeline before attaching a new one.
+    """
+    mocker.patch('src.python.error_handling.log_pipeline', None)
+    first = configure_logging(log_file=str(tmp_path / "first.log"), flush_interval=0.01)
+    shutdown = mocker.spy(first, 'shutdown')
+    second = configure_logging(log_file=str(tmp_path / "second.log"), flush_interval=0.01)
+    try:
+        shutdown.assert_called_once()
+        assert error_handling.log_pipeline is second
+        assert first.handler not in logging.getLogger().handlers
+    finally:
+        second.shutdown()
+
+
+def test_reconfiguring_keeps_one_pipeline(tmp_path, mocker):
+    """
+    Test that repeated setup leaves a single handler on the root logger, stops the previous writers and
+    registers the exit hook only once.
+    """
+    mocker.patch('src.python.error_handling.log_pipeline', None)
+    mocker.patch('src.python.error_handling._atexit_registered', False)
+    register = mocker.patch('src.python.error_handling.atexit.register')
+    pipelines = [setup_logging(log_file=str(tmp_path / f"{i}.log"), flush_interval=0.01) for i in range(3)]
+    try:
+        handlers = [handler for handler in logging.getLogger().handlers
+                    if handler in [pipeline.handler for pipeline in pipelines]]
+        assert handlers == [pipelines[-1].handler]
+        assert all(pipeline.writer._thread is None for pipeline in pipelines[:-1])
+        assert register.call_count == 1
+    finally:
+        pipelines[-1].shutdown()
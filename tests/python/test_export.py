@@ -0,0 +1,274 @@
+#  IntelliSIEM Copyright 2024, Rob Perry
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import gzip
+import json
+import os
+import socket
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from src.python.data_collection import ThreatDataCollector
+from src.python.error_handling import ConfigError
+from src.python.export import Exporter, ExportSpool, FileSink, HTTPSink, SyslogSink, create_sink, to_cef
+from src.python.provider_health import RetryPolicy
+
+
+class CollectorStandIn(BaseHTTPRequestHandler):
+    """
+    A local HTTP event collector that drops resent batches and can be told to fail.
+    """
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        server = self.server
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        server.connections.add(self.client_address)
+        status = server.statuses.pop(0) if server.statuses else 200
+        if status == 200 and self.headers['X-Batch-Id'] not in server.batches:
+            server.batches.append(self.headers['X-Batch-Id'])
+            data = gzip.decompress(body) if self.headers.get('Content-Encoding') == 'gzip' else body
+            server.events.extend(json.loads(line)['event'] for line in data.splitlines())
+        self.send_response(status)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def collector_server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), CollectorStandIn)
+    server.statuses, server.batches, server.events, server.connections = [], [], [], set()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def records(count, start=0):
+    return [{'id': f"ipv4:10.0.0.{i}", 'type': 'ipv4', 'value': f"10.0.0.{i}", 'source': 'alien_vault'}
+            for i in range(start, start + count)]
+
+
+def test_spool_survives_restart(tmp_path):
+    """
+    Test that spooled batches and their ids outlive the spool object, and new batches continue the sequence.
+    """
+    spool = ExportSpool(str(tmp_path))
+    first = spool.append([b'{"a":1}', b'{"a":2}'])
+    batch_id = spool.batch_id(first)
+
+    reopened = ExportSpool(str(tmp_path))
+    assert reopened.pending() == [first]
+    assert reopened.batch_id(first) == batch_id
+    assert reopened.read(first) == [b'{"a":1}', b'{"a":2}']
+    assert reopened.append([b'{}']) == first + 1
+
+
+def test_exporter_batches_by_size_and_time(tmp_path):
+    """
+    Test that full batches are sealed immediately and partial ones after flush_interval.
+    """
+    now = [0.0]
+    sink = FileSink(str(tmp_path / "out"), compress=False)
+    exporter = Exporter('archive', sink, ExportSpool(str(tmp_path / "spool")), batch_size=3, flush_interval=5,
+                        clock=lambda: now[0])
+    exporter.submit(records(4))
+    assert len(exporter.spool.pending()) == 1
+
+    now[0] = 6.0
+    exporter.start()
+    assert exporter.stop() is True
+    assert exporter.stats()['sent_batches'] == 2
+    [written] = [name for name in os.listdir(tmp_path / "out") if name.endswith('.ndjson')]
+    assert len((tmp_path / "out" / written).read_bytes().splitlines()) == 4
+
+
+def test_http_sink_retries_and_deduplicates(tmp_path, collector_server):
+    """
+    Test gzip delivery over one kept-alive connection, retry after a 503 and that a resent batch is not duplicated.
+    """
+    collector_server.statuses = [503]
+    url = f"http://127.0.0.1:{collector_server.server_port}/services/collector/event"
+    exporter = Exporter('hec', HTTPSink(url, token='t'), ExportSpool(str(tmp_path)), batch_size=2)
+    exporter.submit(records(4))
+
+    assert exporter.deliver_pending() is False
+    assert exporter.deliver_pending() is True
+    assert [event['value'] for event in collector_server.events] == ['10.0.0.0', '10.0.0.1', '10.0.0.2', '10.0.0.3']
+    assert len(collector_server.connections) == 1
+
+    # A crash between delivery and removal from the spool resends the batch under the same id
+    batch_id = exporter.spool.batch_id(1)
+    exporter.sink.send(batch_id, [json.dumps(record).encode() for record in records(2)])
+    assert len(collector_server.events) == 4
+    exporter.sink.close()
+
+
+def test_http_sink_rejected_batch_is_set_aside(tmp_path, collector_server):
+    """
+    Test that a batch refused with a 4xx status is moved aside and later batches still go out.
+    """
+    collector_server.statuses = [400]
+    exporter = Exporter('hec', HTTPSink(f"http://127.0.0.1:{collector_server.server_port}/"),
+                        ExportSpool(str(tmp_path)), batch_size=1)
+    exporter.submit(records(2))
+
+    assert exporter.deliver_pending() is True
+    assert exporter.rejected_batches == 1
+    assert os.listdir(tmp_path / "rejected") == ['000000000001.ndjson']
+    assert len(collector_server.events) == 1
+    exporter.sink.close()
+
+
+class FlakySink:
+    """
+    A sink whose first delivery fails with an error the exporter does not expect.
+    """
+
+    def __init__(self):
+        self.batches = []
+        self.delivered = threading.Event()
+
+    def send(self, batch_id, lines):
+        if not self.batches:
+            self.batches.append(None)
+            raise OSError("Connection reset by peer")
+        self.batches.append(batch_id)
+        self.delivered.set()
+
+    def close(self):
+        pass
+
+
+def test_exporter_retries_after_unexpected_sink_error(tmp_path):
+    """
+    Test that the sender thread survives an unexpected exception from the sink and retries the batch.
+    """
+    sink = FlakySink()
+    exporter = Exporter('flaky', sink, ExportSpool(str(tmp_path)), batch_size=2,
+                        retry=RetryPolicy(base_delay=0.01, max_delay=0.01))
+    exporter.submit(records(2))
+    exporter.start()
+    try:
+        assert sink.delivered.wait(5)
+    finally:
+        assert exporter.stop() is True
+    assert sink.batches == [None, exporter.spool.batch_id(1)]
+    assert exporter.retries == 1 and exporter.sent_batches == 1
+
+
+def test_file_sink_resend_after_crash_is_not_duplicated(tmp_path):
+    """
+    Test that a batch partially written before a crash is rewritten rather than appended twice.
+    """
+    sink = FileSink(str(tmp_path), prefix='iocs')
+    sink.send('s-1', [b'{"n":1}'])
+    # Simulate a crash midway through appending batch 2
+    path = sink._current
+    size = os.path.getsize(path)
+    sink._write_journal({'batch': 's-2', 'file': path, 'size': size})
+    with open(path, 'ab') as file:
+        file.write(b'\x1f\x8b partial')
+
+    restarted = FileSink(str(tmp_path), prefix='iocs')
+    restarted.send('s-2', [b'{"n":2}'])
+    restarted.send('s-3', [b'{"n":3}'])
+    with gzip.open(path) as file:
+        assert file.read().splitlines() == [b'{"n":1}', b'{"n":2}', b'{"n":3}']
+
+
+def test_syslog_sink_sends_octet_counted_cef():
+    """
+    Test that records are streamed over TCP as octet-counted RFC 5424 messages carrying CEF.
+    """
+    server = socket.create_server(('127.0.0.1', 0))
+    sink = SyslogSink('127.0.0.1', server.getsockname()[1])
+    sink.send('s-1', [json.dumps(record).encode() for record in records(2)])
+    connection, _ = server.accept()
+    data = b''
+    while data.count(b'CEF:0') < 2:
+        data += connection.recv(65536)
+    sink.close()
+    connection.close()
+    server.close()
+
+    length, _, rest = data.partition(b' ')
+    message = rest[:int(length)].decode()
+    assert message.startswith('<133>1 ')
+    assert 'CEF:0|IntelliSIEM|IntelliSIEM|1.0|indicator|Threat indicator: ipv4|5|' in message
+    assert 'cs2=10.0.0.0' in message
+
+
+def test_unformattable_records_do_not_block_later_batches(tmp_path):
+    """
+    Test that non-dict records are dropped on submit and a spooled batch the sink cannot format is set
+    aside instead of being retried forever.
+    """
+    sink = SyslogSink('127.0.0.1', 9, protocol='udp')
+    exporter = Exporter('syslog', sink, ExportSpool(str(tmp_path)), batch_size=1)
+    exporter.submit(['not-a-dict'])
+    assert exporter.spool.pending() == [] and exporter.dropped_records == 1
+
+    exporter.spool.append([b'"not-a-dict"'])
+    exporter.submit(records(1))
+    assert exporter.deliver_pending() is True
+    assert exporter.spool.pending() == []
+    assert exporter.stats()['rejected_batches'] == 1 and exporter.sent_batches == 1
+    exporter.stop()
+
+
+def test_to_cef_escapes_values():
+    """
+    Test CEF escaping of extension values and severity from the score.
+    """
+    message = to_cef({'id': 'url:x', 'type': 'url', 'value': 'http://a/?q=1\\2', 'sources': ['a', 'b'], 'score': 87})
+    assert '|9|' in message
+    assert 'cs2=http://a/?q\\=1\\\\2' in message
+    assert 'cs3=a,b' in message
+
+
+def test_create_sink_rejects_unknown_settings():
+    """
+    Test that an unknown sink type or setting raises ConfigError.
+    """
+    with pytest.raises(ConfigError, match="Invalid export sink: a."):
+        create_sink('a', {'type': 'kafka'})
+    with pytest.raises(ConfigError, match="Invalid export sink: b."):
+        create_sink('b', {'type': 'file', 'directory': 'x', 'colour': 'red'})
+
+
+def test_collector_exports_feeds(mocker, tmp_path):
+    """
+    Test that the collector builds exporters from its configuration and streams normalized indicators to them.
+    """
+    mocker.patch('src.python.api_client.APIClient.iter_data',
+                 side_effect=[iter([{'id': 1, 'type': 'IPv4', 'indicator': '10.0.0.1'}]), iter([])])
+    collector = ThreatDataCollector(config={
+        'api_keys': {'alien_vault': 'a', 'virus_total': 'v'}, 'normalization': {'workers': 1},
+        'export': {'spool_dir': str(tmp_path / "spool"),
+                   'sinks': {'archive': {'type': 'file', 'directory': str(tmp_path / "out"), 'compress': False}}}})
+    [exporter] = collector.open_exporters()
+
+    assert collector.export([exporter]) == 1
+    assert exporter.stop() is True
+    collector.close()
+    [written] = [name for name in os.listdir(tmp_path / "out") if name.endswith('.ndjson')]
+    assert json.loads((tmp_path / "out" / written).read_text())['id'] == 'ipv4:10.0.0.1'
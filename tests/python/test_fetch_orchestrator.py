@@ -0,0 +1,167 @@
+#  IntelliSIEM Copyright 2024, Rob Perry
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import asyncio
+import threading
+import time
+
+import pytest
+import requests
+
+from src.python.api_client import APIClient
+from src.python.error_handling import APIError
+from src.python.fetch_orchestrator import FetchOrchestrator, FetchSource
+
+
+def make_source(mocker, name, data=None, error=None, delay=0, timeout=None):
+    """
+    Build a FetchSource whose client returns data (or raises error) after an optional delay.
+    """
+    def get_data(endpoint, params=None):
+        time.sleep(delay)
+        if error is not None:
+            raise error
+        return data
+
+    client = mocker.Mock()
+    client.get_data.side_effect = get_data
+    return FetchSource(name, client, "endpoint", timeout=timeout)
+
+
+def test_run_fetches_sources_concurrently(mocker):
+    """
+    Test that sources are fetched at the same time rather than one after the other.
+    """
+    barrier = threading.Barrier(2, timeout=2)
+
+    def get_data(endpoint, params=None):
+        barrier.wait()  # Only passes if both sources are in flight together
+        return [{'id': endpoint}]
+
+    clients = [mocker.Mock(), mocker.Mock()]
+    for client in clients:
+        client.get_data.side_effect = get_data
+    sources = [FetchSource("a", clients[0], "one"), FetchSource("b", clients[1], "two")]
+
+    results = FetchOrchestrator(max_workers=2).run(sources)
+
+    assert list(results) == ["a", "b"]
+    assert results["a"].data == [{'id': 'one'}]
+    assert results["b"].data == [{'id': 'two'}]
+
+
+def test_run_reports_per_source_status(mocker):
+    """
+    Test that a failing source is reported without affecting the others.
+    """
+    sources = [make_source(mocker, "good", data=[{'id': 1}]),
+               make_source(mocker, "bad", error=APIError("Permission denied."))]
+
+    results = FetchOrchestrator().run(sources)
+
+    assert results["good"].ok
+    assert results["bad"].status == "error"
+    assert isinstance(results["bad"].error, APIError)
+
+
+def test_run_source_deadline(mocker):
+    """
+    Test that a slow source is abandoned at its own deadline while fast sources complete.
+    """
+    sources = [make_source(mocker, "fast", data=[{'id': 1}]),
+               make_source(mocker, "slow", data=[{'id': 2}], delay=1, timeout=0.05)]
+
+    begin = time.monotonic()
+    results = FetchOrchestrator().run(sources)
+
+    assert time.monotonic() - begin < 0.5
+    assert results["fast"].ok
+    assert results["slow"].status == "timeout"
+
+
+def test_run_overall_deadline(mocker):
+    """
+    Test that the overall deadline bounds the run even without per-source deadlines.
+    """
+    sources = [make_source(mocker, "slow", delay=1)]
+
+    results = FetchOrchestrator(overall_timeout=0.05).run(sources)
+
+    assert results["slow"].status == "timeout"
+
+
+def test_run_reuses_worker_threads(mocker):
+    """
+    Test that runs share the orchestrator's worker threads until it is closed.
+    """
+    threads = []
+
+    def get_data(endpoint, params=None):
+        threads.append(threading.current_thread())
+        return []
+
+    client = mocker.Mock()
+    client.get_data.side_effect = get_data
+    with FetchOrchestrator(max_workers=1) as orchestrator:
+        orchestrator.run([FetchSource("a", client, "one")])
+        orchestrator.run([FetchSource("a", client, "one")])
+
+    assert len(threads) == 2
+    assert threads[0] is threads[1]
+    threads[0].join(timeout=1)
+    assert not threads[0].is_alive()
+
+
+def test_abandoned_fetch_ends_at_its_deadline(mocker):
+    """
+    Test that the deadline bounds the source's API requests, so a fetch abandoned after its deadline
+    ends and frees its worker instead of holding it into the next run.
+    """
+    timeouts = []
+
+    def get(url, timeout=None, **kwargs):
+        timeouts.append(timeout)
+        time.sleep(timeout + 0.05)  # A provider that never answers
+        raise requests.exceptions.Timeout
+
+    mocker.patch('requests.Session.get', side_effect=get)
+    slow = FetchSource("slow", APIClient("https://example.com/api", {}), "endpoint", timeout=0.1)
+    with FetchOrchestrator(max_workers=1) as orchestrator:
+        begin = time.monotonic()
+        assert orchestrator.run([slow])["slow"].status == "timeout"
+        assert orchestrator.run([make_source(mocker, "next", data=[{'id': 1}], timeout=1)])["next"].ok
+
+    assert time.monotonic() - begin < 1
+    assert timeouts and all(timeout <= 0.1 for timeout in timeouts)
+
+
+def test_invalid_max_workers():
+    """
+    Test that the orchestrator rejects a pool without workers.
+    """
+    with pytest.raises(ValueError):
+        FetchOrchestrator(max_workers=0)
+
+
+def test_run_async(mocker):
+    """
+    Test the asyncio mode, including per-source deadlines.
+    """
+    sources = [make_source(mocker, "fast", data=[{'id': 1}]),
+               make_source(mocker, "slow", delay=0.3, timeout=0.05)]
+
+    results = asyncio.run(FetchOrchestrator().run_async(sources))
+
+    assert results["fast"].data == [{'id': 1}]
+    assert results["slow"].status == "timeout"
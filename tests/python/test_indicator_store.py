@@ -0,0 +1,142 @@
+#  IntelliSIEM Copyright 2024, Rob Perry
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import time
+
+import pytest
+
+from src.python.error_handling import DataError
+from src.python.indicator_store import BufferedStoreWriter, IndicatorStore, indicator_type_and_value
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = IndicatorStore(str(tmp_path / "indicators.sqlite3"), batch_size=3)
+    yield store
+    store.close()
+
+
+def test_indicator_type_and_value():
+    """
+    Test extracting the type and observable from OTX- and VirusTotal-shaped records.
+    """
+    assert indicator_type_and_value({'id': 1, 'type': 'IPv4', 'indicator': '10.0.0.1'}) == ('IPv4', '10.0.0.1')
+    assert indicator_type_and_value({'id': 'abc123', 'type': 'file'}) == ('file', 'abc123')
+
+
+def test_upsert_deduplicates_across_sources(store):
+    """
+    Test that the same indicator reported by two sources is stored once with both sources.
+    """
+    store.upsert({'id': 'h1', 'type': 'file', 'score': 1}, 'alien_vault')
+    store.upsert({'id': 'h1', 'type': 'file', 'score': 2}, 'virus_total')
+    store.upsert({'id': 'h1', 'type': 'file', 'score': 3}, 'virus_total')
+
+    indicator = store.get('h1')
+    assert store.count() == 1
+    assert indicator.sources == ['alien_vault', 'virus_total']
+    assert indicator.data == {'id': 'h1', 'type': 'file', 'score': 3}
+    assert indicator.first_seen <= indicator.last_seen
+
+
+def test_upsert_many_in_batches(store):
+    """
+    Test that a generator of entries is written across several batches.
+    """
+    entries = ({'id': i, 'type': 'IPv4', 'indicator': f'10.0.0.{i}'} for i in range(10))
+    assert store.upsert_many(entries, 'alien_vault') == 10
+    assert store.count() == 10
+    assert store.count('IPv4') == 10
+
+
+def test_find_by_value(store):
+    """
+    Test point lookups by observable, optionally restricted by type.
+    """
+    store.upsert_many([{'id': 1, 'type': 'domain', 'indicator': 'evil.example'},
+                       {'id': 2, 'type': 'hostname', 'indicator': 'evil.example'},
+                       {'id': 3, 'type': 'domain', 'indicator': 'good.example'}], 'alien_vault')
+    assert sorted(i.id for i in store.find_by_value('evil.example')) == ['1', '2']
+    assert [i.id for i in store.find_by_value('evil.example', 'domain')] == ['1']
+    assert store.contains_value('good.example')
+    assert not store.contains_value('unknown.example')
+
+
+def test_iter_by_type_and_delete(store):
+    """
+    Test iterating over one indicator type and deleting indicators.
+    """
+    store.upsert_many([{'id': f'd{i}', 'type': 'domain', 'indicator': f'{i}.example'} for i in range(5)]
+                      + [{'id': 'f1', 'type': 'file'}], 'alien_vault')
+    assert [i.id for i in store.iter_by_type('domain', batch_size=2)] == ['d0', 'd1', 'd2', 'd3', 'd4']
+    assert store.delete(['d0', 'd1', 'missing']) == 2
+    assert store.count('domain') == 3
+    assert len(list(store.iter_all())) == 4
+
+
+def test_upsert_invalid_entry(store):
+    """
+    Test that an entry that cannot be stored raises a DataError.
+    """
+    with pytest.raises(DataError, match="Failed to store indicators."):
+        store.upsert({'id': 'x', 'value': object()}, 'alien_vault')
+
+
+def test_point_lookup_is_fast(tmp_path):
+    """
+    Test that point lookups by id and by value stay well under a millisecond.
+    """
+    store = IndicatorStore(str(tmp_path / "large.sqlite3"))
+    store.upsert_many(({'id': f'{i:064x}', 'type': 'file', 'indicator': f'{i:064x}'} for i in range(50000)),
+                      'virus_total')
+    lookups = [f'{i:064x}' for i in range(0, 50000, 50)]
+    begin = time.perf_counter()
+    for value in lookups:
+        assert store.get(value) is not None
+        assert store.contains_value(value)
+    per_lookup = (time.perf_counter() - begin) / (2 * len(lookups))
+    store.close()
+    assert per_lookup < 0.001
+
+
+def test_buffered_writer_flushes_queued_batches(tmp_path):
+    """
+    Test that batches queued on a BufferedStoreWriter are all written once flush returns.
+    """
+    store = IndicatorStore(str(tmp_path / "indicators.sqlite3"))
+    writer = BufferedStoreWriter(store, max_pending=2)
+    for start in range(0, 50, 10):
+        assert writer.upsert_many(({'id': str(i)} for i in range(start, start + 10)), 'otx') == 10
+    writer.flush('otx')
+
+    assert store.count() == 50
+    assert writer.pending() == 0
+    writer.close()
+    store.close()
+
+
+def test_buffered_writer_reports_failures_on_flush(tmp_path):
+    """
+    Test that a failed background write is raised from the failing source's flush.
+    """
+    store = IndicatorStore(str(tmp_path / "indicators.sqlite3"))
+    writer = BufferedStoreWriter(store)
+    writer.upsert_many([{'no_id': 1}], 'broken')
+    writer.upsert_many([{'id': 'ok'}], 'otx')
+
+    writer.flush('otx')
+    with pytest.raises(DataError, match="Failed to store indicators."):
+        writer.flush('broken')
+    writer.close()
+    store.close()
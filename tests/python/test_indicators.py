@@ -0,0 +1,116 @@
+#  IntelliSIEM Copyright 2024, Rob Perry
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import pytest
+
+from src.python.data_collection import ThreatDataCollector
+from src.python.error_handling import DataError
+from src.python.indicators import Indicator, IndicatorSet, PayloadSpool
+from src.python.matching import MatchIndex
+
+
+def test_indicator_has_no_instance_dict():
+    """
+    Test that indicators keep their fields in slots and share interned type and source strings.
+    """
+    indicators = IndicatorSet()
+    indicators.upsert_many([{'id': 1, 'type': ''.join(['IP', 'v4']), 'indicator': '10.0.0.1'},
+                            {'id': 2, 'type': ''.join(['IPv', '4']), 'indicator': '10.0.0.2'}], 'alien_vault')
+    first, second = indicators.get(1), indicators.get(2)
+
+    assert not hasattr(first, '__dict__')
+    assert first.type is second.type
+    assert first.source is second.source
+
+
+def test_upsert_merges_sources_and_timestamps():
+    """
+    Test that an indicator reported twice keeps both sources, the earliest first_seen and the latest last_seen.
+    """
+    indicators = IndicatorSet()
+    indicators.upsert_many([{'id': 'h1', 'type': 'file', 'created': '2024-05-01T00:00:00',
+                             'modified': '2024-05-02T00:00:00'}], 'alien_vault')
+    indicators.upsert_many([{'id': 'h1', 'type': 'file', 'attributes': {'first_submission_date': 1700000000,
+                                                                        'last_modification_date': 1720000000},
+                             'confidence': 80}], 'virus_total')
+    indicator = indicators.get('h1')
+
+    assert len(indicators) == 1
+    assert indicator.sources == ['alien_vault', 'virus_total']
+    assert indicator.first_seen == 1700000000
+    assert indicator.last_seen == 1720000000
+    assert indicator.confidence == 80
+    assert indicator.as_dict()['value'] == 'h1'
+
+
+def test_upsert_without_timestamps_uses_clock():
+    """
+    Test that records without timestamps are dated by the clock.
+    """
+    indicators = IndicatorSet(clock=lambda: 1000.0)
+    indicators.upsert_many([{'id': 'h1'}], 'alien_vault')
+    assert indicators.get('h1').first_seen == indicators.get('h1').last_seen == 1000.0
+
+
+def test_upsert_missing_id():
+    """
+    Test that a record without an id raises DataError.
+    """
+    with pytest.raises(DataError, match="Missing required data keys."):
+        IndicatorSet().upsert_many([{'type': 'IPv4'}], 'alien_vault')
+
+
+def test_payloads_are_optional_and_off_heap(tmp_path):
+    """
+    Test that provider records are only kept when a PayloadSpool is given, and read back from it.
+    """
+    entry = {'id': 'h1', 'type': 'file', 'attributes': {'tags': ['apt']}}
+
+    without = IndicatorSet()
+    without.upsert_many([entry], 'virus_total')
+    assert without.raw(without.get('h1')) is None
+
+    spool = PayloadSpool(str(tmp_path / "payloads.jsonl"))
+    indicators = IndicatorSet(spool)
+    indicators.upsert_many([entry, {'id': 'h2'}], 'virus_total')
+    assert indicators.raw(indicators.get('h1')) == entry
+    assert indicators.raw(indicators.get('h2')) == {'id': 'h2'}
+    spool.close()
+
+
+def test_indicator_set_feeds_match_index():
+    """
+    Test that compact indicators can be matched against events.
+    """
+    indicators = IndicatorSet()
+    indicators.upsert_many([{'id': 'i1', 'type': 'IPv4', 'indicator': '10.0.0.1'}], 'alien_vault')
+    assert isinstance(next(iter(indicators)), Indicator)
+
+    index = MatchIndex(indicators)
+    assert index.ips == {'10.0.0.1': 'i1'}
+
+
+def test_fetch_indicators(mocker):
+    """
+    Test that every feed is streamed into one compact IndicatorSet.
+    """
+    mocker.patch('src.python.api_client.APIClient.iter_data',
+                 side_effect=[iter([{'id': 'h1', 'type': 'file'}]), iter([{'id': 'h1', 'type': 'file'}, {'id': 'h2'}])])
+    collector = ThreatDataCollector()
+    indicators = collector.fetch_indicators()
+    collector.close()
+
+    assert len(indicators) == 2
+    assert 'h2' in indicators
+    assert indicators.get('h1').sources == ['alien_vault', 'virus_total']
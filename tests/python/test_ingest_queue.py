@@ -0,0 +1,289 @@
+#  IntelliSIEM Copyright 2024, Rob Perry
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import os
+import time
+
+import pytest
+
+from src.python.data_collection import ThreatDataCollector
+from src.python.error_handling import DataError
+from src.python.ingest_queue import IngestQueue
+from src.python.state_store import StateStore
+
+
+def segments(directory):
+    return sorted(name for name in os.listdir(directory) if name.endswith('.log'))
+
+
+def test_append_and_read(tmp_path):
+    """
+    Test that entries are read back in order with their offsets, source and records, also after reopening.
+    """
+    with IngestQueue(str(tmp_path)) as queue:
+        assert [queue.append('otx', [{'id': i}]) for i in range(5)] == [0, 1, 2, 3, 4]
+        entries = queue.read(1, max_entries=2)
+        assert [(entry.offset, entry.source, entry.records) for entry in entries] == \
+            [(1, 'otx', [{'id': 1}]), (2, 'otx', [{'id': 2}])]
+        assert queue.read(5) == []
+
+    with IngestQueue(str(tmp_path)) as queue:
+        assert queue.next_offset == 5
+        assert queue.append('vt', [{'id': 'x'}]) == 5
+        assert [entry.offset for entry in queue.read(0)] == [0, 1, 2, 3, 4, 5]
+
+
+def test_segments_roll_and_reads_cross_them(tmp_path):
+    """
+    Test that a new segment is started at segment_bytes and that sequential reads continue across segments.
+    """
+    with IngestQueue(str(tmp_path), segment_bytes=200) as queue:
+        for i in range(20):
+            queue.append('otx', [{'id': i, 'padding': 'x' * 40}])
+        assert len(segments(tmp_path)) > 3
+        assert segments(tmp_path)[0] == '00000000000000000000.log'
+
+        offsets = []
+        offset = 0
+        while True:
+            entries = queue.read(offset, max_entries=3)
+            if not entries:
+                break
+            offsets.extend(entry.offset for entry in entries)
+            offset = entries[-1].offset + 1
+        assert offsets == list(range(20))
+        assert [entry.records[0]['id'] for entry in queue.read(7, max_entries=2)] == [7, 8]
+
+
+def test_consumer_offsets(tmp_path):
+    """
+    Test that consumers poll from their own committed offsets, which survive a restart.
+    """
+    with IngestQueue(str(tmp_path)) as queue:
+        for i in range(4):
+            queue.append('otx', [{'id': i}])
+        assert queue.committed('store') == 0
+        entries = queue.poll('store', max_entries=3)
+        queue.commit('store', entries[-1].offset + 1)
+        assert queue.lag('store') == 1
+        assert queue.lag('export') == 4
+
+    with IngestQueue(str(tmp_path)) as queue:
+        assert [entry.offset for entry in queue.poll('store')] == [3]
+        assert queue.stats()['consumers'] == {'store': 1}
+
+
+def test_torn_entry_is_truncated_on_open(tmp_path):
+    """
+    Test that an entry cut short by a crash is dropped and appends continue after the last complete one.
+    """
+    with IngestQueue(str(tmp_path)) as queue:
+        queue.append('otx', [{'id': 1}])
+        queue.append('otx', [{'id': 2}])
+    path = tmp_path / segments(tmp_path)[-1]
+    data = path.read_bytes()
+    path.write_bytes(data[:-5])
+
+    with IngestQueue(str(tmp_path)) as queue:
+        assert queue.next_offset == 1
+        assert queue.append('otx', [{'id': 3}]) == 1
+        assert [entry.records for entry in queue.read(0)] == [[{'id': 1}], [{'id': 3}]]
+
+
+def test_damaged_last_segment_is_truncated_on_open(tmp_path):
+    """
+    Test that damage in the last segment, indistinguishable from a torn write, is cut off on open.
+    """
+    with IngestQueue(str(tmp_path)) as queue:
+        for i in range(3):
+            queue.append('otx', [{'id': i, 'value': 'abcdef'}])
+    path = tmp_path / segments(tmp_path)[0]
+    data = bytearray(path.read_bytes())
+    data[len(data) // 2] ^= 0xFF
+    path.write_bytes(bytes(data))
+
+    with IngestQueue(str(tmp_path)) as queue:
+        assert queue.next_offset == 1
+        assert [entry.offset for entry in queue.read(0)] == [0]
+
+
+def test_corrupt_closed_segment_raises(tmp_path):
+    """
+    Test that a damaged entry in a closed segment raises DataError on read.
+    """
+    with IngestQueue(str(tmp_path), segment_bytes=100) as queue:
+        for i in range(6):
+            queue.append('otx', [{'id': i, 'value': 'abcdef' * 5}])
+        path = tmp_path / segments(tmp_path)[0]
+        data = bytearray(path.read_bytes())
+        data[-3] ^= 0xFF
+        path.write_bytes(bytes(data))
+        with pytest.raises(DataError, match="Corrupt ingest queue."):
+            queue.read(0, max_entries=10)
+
+
+def test_appends_are_fsynced_in_batches(tmp_path, mocker, clock):
+    """
+    Test that appends are synced at most every fsync_interval seconds, or on sync and close.
+    """
+    fsync = mocker.patch('src.python.ingest_queue.os.fsync')
+    queue = IngestQueue(str(tmp_path), fsync_interval=1.0, clock=clock)
+    for i in range(10):
+        queue.append('otx', [{'id': i}])
+    assert fsync.call_count == 0
+    assert queue.stats()['unsynced'] == 10
+    clock.now += 1.0
+    queue.append('otx', [{'id': 10}])
+    assert fsync.call_count == 1
+    queue.append('otx', [{'id': 11}])
+    queue.sync()
+    assert fsync.call_count == 2
+    queue.sync()
+    assert fsync.call_count == 2
+    queue.close()
+
+    every = IngestQueue(str(tmp_path / 'every'), fsync_interval=0, clock=clock)
+    every.append('otx', [])
+    every.append('otx', [])
+    assert fsync.call_count == 4
+    every.close()
+
+
+def test_idle_appends_are_synced_by_timer(tmp_path, mocker):
+    """
+    Test that the last appends of a burst are synced once fsync_interval has passed without another append.
+    """
+    fsync = mocker.patch('src.python.ingest_queue.os.fsync')
+    queue = IngestQueue(str(tmp_path), fsync_interval=0.05)
+    queue.append('otx', [{'id': 0}])
+    queue.append('otx', [{'id': 1}])
+    deadline = time.monotonic() + 5
+    while queue.stats()['unsynced']:
+        assert time.monotonic() < deadline, "appends not synced in time"
+        time.sleep(0.01)
+    assert fsync.call_count == 1
+    queue.close()
+
+
+def test_retention_by_size_keeps_unconsumed_segments(tmp_path):
+    """
+    Test that segments over retention_bytes are deleted only once every consumer has committed past them.
+    """
+    queue = IngestQueue(str(tmp_path), segment_bytes=100, retention_bytes=250)
+    queue.commit('store', 0)
+    for i in range(10):
+        queue.append('otx', [{'id': i, 'value': 'abcdef' * 5}])
+    assert queue.first_offset == 0
+    count = len(segments(tmp_path))
+
+    queue.commit('store', 8)
+    assert queue.apply_retention() > 0
+    assert len(segments(tmp_path)) < count
+    assert 0 < queue.first_offset <= 8
+    assert queue.poll('store')[0].offset == 8
+    assert queue.read(0)[0].offset == queue.first_offset
+    queue.close()
+
+
+def test_retention_keeps_entries_of_declared_consumers(tmp_path):
+    """
+    Test that keep_unconsumed protects every entry for a declared consumer that has not committed yet,
+    and a queue without declared or committed consumers is trimmed by size alone.
+    """
+    declared = IngestQueue(str(tmp_path / 'declared'), segment_bytes=100, retention_bytes=250,
+                           consumers=['indicators'])
+    for i in range(10):
+        declared.append('otx', [{'id': i, 'value': 'abcdef' * 5}])
+    assert declared.apply_retention() == 0
+    assert declared.poll('indicators')[0].offset == 0
+    declared.commit('indicators', 8)
+    assert declared.apply_retention() > 0
+    assert 0 < declared.first_offset <= 8
+    declared.close()
+
+    undeclared = IngestQueue(str(tmp_path / 'undeclared'), segment_bytes=100, retention_bytes=250)
+    for i in range(10):
+        undeclared.append('otx', [{'id': i, 'value': 'abcdef' * 5}])
+    undeclared.apply_retention()
+    assert sum(os.path.getsize(tmp_path / 'undeclared' / name) for name in segments(tmp_path / 'undeclared')[:-1]) \
+        <= 250
+    assert undeclared.first_offset > 0
+    undeclared.close()
+
+
+def test_retention_by_age(tmp_path, clock):
+    """
+    Test that segments are deleted once their last append is older than retention_age.
+    """
+    clock.now = 10000.0
+    queue = IngestQueue(str(tmp_path), segment_bytes=100, retention_age=3600, keep_unconsumed=False, clock=clock)
+    for i in range(6):
+        queue.append('otx', [{'id': i, 'value': 'abcdef' * 5}])
+    count = len(segments(tmp_path))
+    assert queue.apply_retention() == 0
+    for name in segments(tmp_path):
+        os.utime(tmp_path / name, (5000, 5000))
+    assert queue.apply_retention() == count - 1
+    assert segments(tmp_path) == [f"{queue.first_offset:020d}.log"]
+    assert queue.read(queue.first_offset)[-1].offset == 5
+    queue.close()
+
+
+def test_collector_enqueues_and_processes(tmp_path):
+    """
+    Test that feeds are fetched into the queue and merged from it, resuming after a restart without
+    fetching again.
+    """
+    feed = tmp_path / "blocklist.csv"
+    feed.write_text("id,type,indicator\n" + "".join(f"{i},IPv4,192.0.2.{i}\n" for i in range(5)))
+    config = {'feeds': {'blocklist': {'type': 'csv', 'path': str(feed)}},
+              'queue': {'directory': str(tmp_path / 'queue'), 'batch_records': 2}}
+    collector = ThreatDataCollector(config=config)
+    state = StateStore(str(tmp_path / 'state.json'))
+    queue = collector.open_ingest_queue()
+    results = collector.enqueue(queue, state)
+    assert results['blocklist'].data == 5
+    assert queue.next_offset == 3
+    assert state.get('blocklist') is not None
+
+    indicators = {}
+    assert collector.process_queue(queue, indicators, max_entries=2) == 4
+    queue.close()
+
+    # A restarted processor resumes from its committed offset
+    queue = collector.open_ingest_queue()
+    assert collector.process_queue(queue, indicators) == 1
+    assert sorted(indicators) == ['0', '1', '2', '3', '4']
+    assert collector.process_queue(queue, indicators) == 0
+    assert queue.lag('indicators') == 0
+
+    # The watermark skips the unchanged file on the next fetch
+    assert collector.enqueue(queue, state)['blocklist'].data == 0
+    queue.close()
+    collector.close()
+
+
+def test_rejected_entry_is_skipped(tmp_path):
+    """
+    Test that an entry failing validation as a whole does not block the consumer.
+    """
+    collector = ThreatDataCollector(config={})
+    queue = IngestQueue(str(tmp_path))
+    queue.append('otx', [{'no_id': 1}, {'no_id': 2}])
+    queue.append('otx', [{'id': 'a'}])
+    indicators = {}
+    assert collector.process_queue(queue, indicators) == 1
+    assert list(indicators) == ['a']
+    assert queue.lag('indicators') == 0
+    queue.close()
@@ -0,0 +1,132 @@
+#  IntelliSIEM Copyright 2024, Rob Perry
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import json
+
+import pytest
+
+from src.python import json_stream
+from src.python.error_handling import DataError
+from src.python.json_stream import iter_json_items
+
+
+def chunked(text, size):
+    """
+    Split text into fixed-size chunks, as a streamed response body would arrive.
+    """
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+def collect(generator):
+    """
+    Drain a generator, returning its items and its return value.
+    """
+    items = []
+    while True:
+        try:
+            items.append(next(generator))
+        except StopIteration as stop:
+            return items, stop.value
+
+
+@pytest.mark.parametrize("size", [1, 3, 7, 1024])
+def test_iter_json_items_array(size):
+    """
+    Test that a top-level array is parsed correctly regardless of chunk boundaries.
+    """
+    records = [{'id': 1, 'value': 'a b'}, {'id': 'two', 'nested': [1, {'x': None}]}, 12345, "str"]
+    items, envelope = collect(iter_json_items(chunked(json.dumps(records), size)))
+    assert items == records
+    assert envelope == {}
+
+
+@pytest.mark.parametrize("size", [1, 5, 1024])
+def test_iter_json_items_envelope(size):
+    """
+    Test that records are streamed from an object member and the other members are returned.
+    """
+    document = {'count': 2, 'results': [{'id': 1}, {'id': 2}], 'next': 'https://example.com/page2'}
+    items, envelope = collect(iter_json_items(chunked(json.dumps(document), size), items_key='results'))
+    assert items == [{'id': 1}, {'id': 2}]
+    assert envelope == {'count': 2, 'next': 'https://example.com/page2'}
+
+
+def test_iter_json_items_empty():
+    """
+    Test that empty arrays and whitespace are handled.
+    """
+    assert collect(iter_json_items([' [ ', ' ] '])) == ([], {})
+    assert collect(iter_json_items(['{"data": []}'], items_key='data')) == ([], {})
+
+
+def test_iter_json_items_missing_array():
+    """
+    Test that a document without a record array raises a DataError.
+    """
+    with pytest.raises(DataError, match="Unexpected data type received."):
+        collect(iter_json_items(['{"error": "oops"}'], items_key='data'))
+    with pytest.raises(DataError, match="Unexpected data type received."):
+        collect(iter_json_items(['"invalid_data"']))
+
+
+def test_iter_json_items_invalid_json():
+    """
+    Test that truncated or malformed JSON raises a ValueError.
+    """
+    with pytest.raises(ValueError):
+        collect(iter_json_items(['[{"id": 1}, {"id"']))
+    with pytest.raises(ValueError):
+        collect(iter_json_items(['[1 2]']))
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 64])
+def test_iter_json_items_values_spanning_chunks(size):
+    """
+    Test that values with escapes, brackets in strings and numbers split across chunks are read intact.
+    """
+    records = [{'text': 'a \\"quoted\\" ] } [ { \\\\', 'n': [1.25e10, -3, True, None]}, "x\\\"]", 1234567890, {}]
+    document = {'results': records, 'next': None}
+    items, envelope = collect(iter_json_items(chunked(json.dumps(document), size), items_key='results'))
+    assert items == records
+    assert envelope == {'next': None}
+
+
+def test_iter_json_items_decodes_a_large_value_once(mocker):
+    """
+    Test that a value spanning many chunks is decoded once it is complete, not again on every chunk.
+    """
+    record = {'id': 1, 'padding': 'x' * 100000}
+    decode = mocker.spy(json_stream._decoder, 'raw_decode')
+
+    items, _ = collect(iter_json_items(chunked(json.dumps([record]), 1000)))
+
+    assert items == [record]
+    assert decode.call_count <= 3
+
+
+def test_iter_json_items_limits_the_buffer():
+    """
+    Test that a value larger than max_size raises a DataError without reading the rest of the input.
+    """
+    read = []
+
+    def chunks():
+        yield '[{"id": "'
+        while True:
+            read.append(1)
+            yield 'x' * 100
+
+    with pytest.raises(DataError, match="Response value too large."):
+        collect(iter_json_items(chunks(), max_size=1000))
+    assert len(read) <= 11
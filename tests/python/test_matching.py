@@ -0,0 +1,131 @@
+#  IntelliSIEM Copyright 2024, Rob Perry
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import pytest
+
+from src.python.indicator_store import IndicatorStore
+from src.python.matching import AhoCorasick, IOCMatcher, Match
+
+INDICATORS = [
+    {'id': 'h1', 'type': 'FileHash-SHA256', 'indicator': 'AB' * 32},
+    {'id': 'vt1', 'type': 'file'},
+    {'id': 'ip1', 'type': 'IPv4', 'indicator': '203.0.113.7'},
+    {'id': 'ip6', 'type': 'IPv6', 'indicator': '2001:db8::1'},
+    {'id': 'net1', 'type': 'CIDR', 'indicator': '198.51.100.0/24'},
+    {'id': 'net2', 'type': 'CIDR', 'indicator': '198.51.0.0/16'},
+    {'id': 'd1', 'type': 'domain', 'indicator': 'evil.example'},
+    {'id': 'u1', 'type': 'URL', 'indicator': 'http://bad.example/payload'},
+    {'id': 'e1', 'type': 'email', 'indicator': 'x@example.com'},
+]
+
+
+@pytest.fixture
+def matcher():
+    return IOCMatcher(INDICATORS)
+
+
+def test_aho_corasick_finds_overlapping_patterns():
+    """
+    Test that the automaton reports every pattern, including overlapping and nested ones.
+    """
+    automaton = AhoCorasick({'he': 1, 'she': 2, 'his': 3, 'hers': 4})
+    assert sorted(automaton.search('ushers')) == [('he', 1), ('hers', 4), ('she', 2)]
+    assert automaton.search('nothing') == []
+
+
+def test_match_hashes(matcher):
+    """
+    Test case-insensitive exact hash matching, including VirusTotal file ids.
+    """
+    matches = matcher.match_batch([{'sha256': 'ab' * 32}, {'file_hash': 'vt1'}, {'md5': 'ff' * 16}])
+    assert [(m.event_index, m.indicator_id) for m in matches] == [(0, 'h1'), (1, 'vt1')]
+
+
+def test_match_ips_and_ranges(matcher):
+    """
+    Test exact IP matching, IPv6 canonicalization and most-specific CIDR matching.
+    """
+    matches = matcher.match_batch([
+        {'src_ip': '203.0.113.7'},
+        {'dst_ip': '2001:0db8:0000::0001'},
+        {'src_ip': '198.51.100.20'},
+        {'src_ip': '198.51.7.1'},
+        {'src_ip': '192.0.2.1', 'dst_ip': 'not-an-ip'},
+    ])
+    assert matches == [
+        Match(0, 'src_ip', '203.0.113.7', 'ip', 'ip1'),
+        Match(1, 'dst_ip', '2001:db8::1', 'ip', 'ip6'),
+        Match(2, 'src_ip', '198.51.100.0/24', 'cidr', 'net1'),
+        Match(3, 'src_ip', '198.51.0.0/16', 'cidr', 'net2'),
+    ]
+
+
+def test_match_domains(matcher):
+    """
+    Test that subdomains of an IOC domain match, but look-alike domains do not.
+    """
+    matches = matcher.match_batch([{'domain': 'evil.example'}, {'host': 'cdn.a.EVIL.example.'},
+                                   {'domain': 'notevil.example'}, {'query': 'example'}])
+    assert [(m.event_index, m.value) for m in matches] == [(0, 'evil.example'), (1, 'evil.example')]
+
+
+def test_match_urls(matcher):
+    """
+    Test that URL indicators are found anywhere within an event's URL.
+    """
+    matches = matcher.match_batch([{'url': 'HTTP://bad.example/payload?x=1'}, {'url': 'http://bad.example/'}])
+    assert matches == [Match(0, 'url', 'http://bad.example/payload', 'url', 'u1')]
+
+
+def test_non_string_fields_are_skipped(matcher):
+    """
+    Test that event fields holding numbers, lists or other non-string values are ignored without
+    failing the batch.
+    """
+    matches = matcher.match_batch([{'sha256': 12345, 'src_ip': 3405803783, 'domain': ['evil.example'],
+                                    'url': {'href': 'http://bad.example/payload'}},
+                                   {'src_ip': '203.0.113.7'}])
+    assert [(m.event_index, m.indicator_id) for m in matches] == [(1, 'ip1')]
+
+
+def test_unsupported_types_are_skipped(matcher):
+    """
+    Test that indicator types without a matching category are counted and skipped.
+    """
+    assert matcher.index.skipped == 1
+    assert len(matcher.index) == 8
+
+
+def test_hot_swap(matcher):
+    """
+    Test that reloading swaps in a new index without affecting a reference to the old one.
+    """
+    old_index = matcher.index
+    matcher.reload([{'id': 'ip2', 'type': 'IPv4', 'indicator': '192.0.2.1'}])
+
+    assert matcher.generation == 1
+    assert matcher.match_batch([{'src_ip': '203.0.113.7'}]) == []
+    assert [m.indicator_id for m in matcher.match_batch([{'src_ip': '192.0.2.1'}])] == ['ip2']
+    assert [m.indicator_id for m in old_index.match_batch([{'src_ip': '203.0.113.7'}])] == ['ip1']
+
+
+def test_build_from_indicator_store(tmp_path):
+    """
+    Test building a matcher from the indicators held in an IndicatorStore.
+    """
+    store = IndicatorStore(str(tmp_path / "indicators.sqlite3"))
+    store.upsert_many(INDICATORS, 'alien_vault')
+    matcher = IOCMatcher(store.iter_all())
+    store.close()
+    assert [m.indicator_id for m in matcher.match_batch([{'domain': 'www.evil.example'}])] == ['d1']
@@ -0,0 +1,123 @@
+#  IntelliSIEM Copyright 2024, Rob Perry
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import threading
+import time
+
+import pytest
+import requests
+
+from src.python.metrics import MetricsRegistry, MetricsServer, SamplingProfiler
+
+
+def test_registry_renders_prometheus_text():
+    """
+    Test the exposition format of counters and cumulative histogram buckets.
+    """
+    registry = MetricsRegistry()
+    requests_total = registry.counter('app_requests_total', 'Requests.', ('source',))
+    latency = registry.histogram('app_seconds', 'Latency.', ('source',), buckets=(0.1, 1.0))
+    requests_total.inc('otx')
+    requests_total.inc('otx', amount=2)
+    latency.observe(0.05, 'otx')
+    latency.observe(0.5, 'otx')
+
+    assert registry.render().splitlines() == [
+        '# HELP app_requests_total Requests.',
+        '# TYPE app_requests_total counter',
+        'app_requests_total{source="otx"} 3',
+        '# HELP app_seconds Latency.',
+        '# TYPE app_seconds histogram',
+        'app_seconds_bucket{source="otx",le="0.1"} 1',
+        'app_seconds_bucket{source="otx",le="1.0"} 2',
+        'app_seconds_bucket{source="otx",le="+Inf"} 2',
+        'app_seconds_sum{source="otx"} 0.55',
+        'app_seconds_count{source="otx"} 2',
+    ]
+    assert registry.counter('app_requests_total', 'Requests.', ('source',)) is requests_total
+    with pytest.raises(ValueError):
+        registry.histogram('app_requests_total', 'Requests.', ('source',))
+
+
+def test_histogram_timer():
+    """
+    Test that the timer context manager observes the time spent inside it.
+    """
+    histogram = MetricsRegistry().histogram('work_seconds', 'Work.', ('stage',))
+    with histogram.time('decode'):
+        time.sleep(0.01)
+    assert histogram.count('decode') == 1
+    assert histogram._series[('decode',)][1] >= 0.01
+
+
+def busy_loop(stop):
+    while not stop.is_set():
+        sum(range(1000))
+
+
+def test_sampling_profiler_sees_busy_thread():
+    """
+    Test that the profiler attributes samples to the function a thread is running.
+    """
+    stop = threading.Event()
+    worker = threading.Thread(target=busy_loop, args=(stop,))
+    worker.start()
+    profiler = SamplingProfiler(interval=0.001)
+    profiler.start()
+    time.sleep(0.05)
+    stacks = profiler.stop()
+    stop.set()
+    worker.join()
+
+    assert profiler.samples > 0
+    assert 'busy_loop' in stacks
+
+
+def test_metrics_server_endpoints():
+    """
+    Test /metrics and that /debug/profile only works while profiling is enabled.
+    """
+    server = MetricsServer(port=0, profile_interval=0.001).start()
+    base = f"http://127.0.0.1:{server.port}"
+    try:
+        response = requests.get(f"{base}/metrics", timeout=5)
+        assert response.status_code == 200
+        assert '# TYPE intellisiem_stage_seconds histogram' in response.text
+
+        assert requests.get(f"{base}/debug/profile?seconds=0.01", timeout=5).status_code == 403
+        server.profiling = True
+        response = requests.get(f"{base}/debug/profile?seconds=0.05", timeout=5)
+        assert response.status_code == 200
+        assert 'serve_forever' in response.text
+        for seconds in ('nan', 'inf', '-inf', 'soon'):
+            assert requests.get(f"{base}/debug/profile?seconds={seconds}", timeout=5).status_code == 400
+        assert requests.get(f"{base}/debug/profile?seconds=0.01", timeout=5).status_code == 200
+    finally:
+        server.stop()
+
+
+def test_profile_stops_profiler_on_error(mocker):
+    """
+    Test that the profiler is stopped and another profile can be taken when sampling is interrupted.
+    """
+    server = MetricsServer(port=0, profile_interval=0.001)
+    mocker.patch('src.python.metrics.time.sleep', side_effect=KeyboardInterrupt)
+    try:
+        with pytest.raises(KeyboardInterrupt):
+            server.profile(1)
+        assert not any(thread.name == 'sampling-profiler' for thread in threading.enumerate())
+        mocker.stopall()
+        assert server.profile(0.01) is not None
+    finally:
+        server.stop()
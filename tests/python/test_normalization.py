@@ -0,0 +1,133 @@
+#  IntelliSIEM Copyright 2024, Rob Perry
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+from concurrent.futures import Future
+
+import pytest
+
+from src.python.data_collection import ThreatDataCollector
+from src.python.normalization import Normalizer, canonicalize, normalize_chunk
+
+
+def test_canonicalize():
+    """
+    Test canonical forms of hashes, IP addresses, networks, domains, URLs and email addresses.
+    """
+    assert canonicalize('FileHash-SHA256', ' ABCDEF0123 ') == ('sha256', 'abcdef0123')
+    assert canonicalize('file', 'D41D8CD98F00B204E9800998ECF8427E') == ('md5', 'd41d8cd98f00b204e9800998ecf8427e')
+    assert canonicalize('ip_address', '2001:0db8:0000::0001') == ('ipv6', '2001:db8::1')
+    assert canonicalize('IPv4', '10.0.0.1') == ('ipv4', '10.0.0.1')
+    assert canonicalize('CIDR', '10.0.0.7/24') == ('cidr', '10.0.0.0/24')
+    assert canonicalize('hostname', 'WWW.Example.COM.') == ('hostname', 'www.example.com')
+    assert canonicalize('domain', 'bücher.de') == ('domain', 'xn--bcher-kva.de')
+    assert canonicalize('URL', 'HTTP://Example.com/Path?q=1#frag') == ('url', 'http://example.com/Path?q=1')
+    assert canonicalize('email', 'Bob@Example.COM') == ('email', 'Bob@example.com')
+    assert canonicalize('Mutex', 'Global\\x') == ('mutex', 'Global\\x')
+    with pytest.raises(ValueError):
+        canonicalize('IPv4', 'not an ip')
+    with pytest.raises(ValueError):
+        canonicalize('FileHash-MD5', 'xyz')
+
+
+def test_normalize_otx_pulse_and_vt_file():
+    """
+    Test that OTX pulses are flattened and VirusTotal file objects mapped into the common schema.
+    """
+    pulse = {'id': 'p1', 'name': 'Campaign using T1566.001', 'tags': ['Phishing'], 'attack_ids': [{'id': 'T1059'}],
+             'created': '2024-05-01T00:00:00', 'modified': '2024-05-03T00:00:00',
+             'indicators': [{'id': 11, 'type': 'domain', 'indicator': 'Evil.example.'},
+                            {'id': 12, 'type': 'IPv4', 'indicator': '10.0.0.300'}]}
+    vt_file = {'id': 'AA' * 32, 'type': 'file',
+               'attributes': {'tags': ['peexe'], 'first_submission_date': 1700000000,
+                              'last_analysis_stats': {'malicious': 3, 'suspicious': 1, 'undetected': 4}}}
+
+    rows, rejected = normalize_chunk([pulse], 'alien_vault')
+    assert rejected == 1
+    assert rows == [('domain:evil.example', 'domain', 'evil.example', 'alien_vault', '11',
+                     '2024-05-01T00:00:00+00:00', '2024-05-03T00:00:00+00:00', None, ['phishing'],
+                     ['T1059', 'T1566.001'])]
+
+    rows, rejected = normalize_chunk([vt_file], 'virus_total')
+    assert rejected == 0
+    assert rows[0][:3] == (f"sha256:{'aa' * 32}", 'sha256', 'aa' * 32)
+    assert rows[0][5] == rows[0][6] == '2023-11-14T22:13:20+00:00'
+    assert rows[0][7] == 50.0
+    assert rows[0][8] == ['peexe']
+
+
+def test_normalizer_in_process():
+    """
+    Test that small batches are normalized in-process into dicts and rejects are counted.
+    """
+    normalizer = Normalizer(workers=4, min_parallel=100)
+    indicators = normalizer.normalize([{'id': 1, 'type': 'IPv4', 'indicator': '10.0.0.1'}, {'type': 'IPv4'}],
+                                      'alien_vault')
+
+    assert [indicator['id'] for indicator in indicators] == ['ipv4:10.0.0.1']
+    assert indicators[0]['source'] == 'alien_vault'
+    assert normalizer._executor is None
+    assert (normalizer.normalized, normalizer.rejected) == (1, 1)
+
+
+def test_normalizer_process_pool_preserves_order():
+    """
+    Test that a batch spread over worker processes comes back complete and in order.
+    """
+    entries = [{'id': i, 'type': 'IPv4', 'indicator': f"10.0.{i // 256}.{i % 256}"} for i in range(500)]
+    normalizer = Normalizer(workers=2, chunk_size=50, min_parallel=100)
+    try:
+        indicators = normalizer.normalize(entries, 'alien_vault')
+    finally:
+        normalizer.close()
+
+    assert [indicator['source_id'] for indicator in indicators] == [str(i) for i in range(500)]
+    assert normalizer.normalized == 500
+
+
+def test_normalizer_streams_small_feeds_in_process(mocker):
+    """
+    Test that a stream ending before min_parallel records never starts the worker pool, and a longer one
+    starts it with a start method other than fork.
+    """
+    def run_inline(function, *args):
+        future = Future()
+        future.set_result(function(*args))
+        return future
+
+    pool = mocker.patch('src.python.normalization.ProcessPoolExecutor')
+    pool.return_value.submit.side_effect = run_inline
+    entries = [{'id': i, 'type': 'IPv4', 'indicator': f"10.0.0.{i}"} for i in range(99)]
+    normalizer = Normalizer(workers=4, chunk_size=10, min_parallel=100)
+
+    indicators = list(normalizer.imap(iter(entries), 'alien_vault'))
+
+    assert [indicator['source_id'] for indicator in indicators] == [str(i) for i in range(99)]
+    pool.assert_not_called()
+    list(normalizer.imap(iter(entries + [{'id': 99, 'type': 'IPv4', 'indicator': '10.0.1.1'}]), 'alien_vault'))
+    assert pool.call_args.kwargs['mp_context'].get_start_method() in ('forkserver', 'spawn')
+
+
+def test_iter_normalized(mocker):
+    """
+    Test that the collector streams every feed through its normalizer.
+    """
+    mocker.patch('src.python.api_client.APIClient.iter_data',
+                 side_effect=[iter([{'id': 1, 'type': 'hostname', 'indicator': 'A.example'}]),
+                              iter([{'id': 'AB' * 20, 'type': 'file'}])])
+    collector = ThreatDataCollector(config={'api_keys': {'alien_vault': 'a', 'virus_total': 'v'},
+                                            'normalization': {'workers': 1}})
+    indicators = list(collector.iter_normalized())
+    collector.close()
+
+    assert [indicator['id'] for indicator in indicators] == ['hostname:a.example', f"sha1:{'ab' * 20}"]
@@ -0,0 +1,113 @@
+#  IntelliSIEM Copyright 2024, Rob Perry
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import pytest
+
+from src.python.error_handling import APIError
+from src.python.provider_health import (CircuitBreaker, LatencyTracker, ProviderHealth, RetryPolicy,
+                                        STATE_CLOSED, STATE_HALF_OPEN, STATE_OPEN, get_provider_health)
+
+
+def test_circuit_breaker_opens_after_threshold(clock):
+    """
+    Test that consecutive failures open the circuit and requests are then refused.
+    """
+    breaker = CircuitBreaker(failure_threshold=3, recovery_timeout=30, clock=clock)
+    breaker.record_failure()
+    breaker.record_success()
+    for _ in range(2):
+        breaker.record_failure()
+    assert breaker.state == STATE_CLOSED
+
+    breaker.record_failure()
+    assert breaker.state == STATE_OPEN
+    assert not breaker.allow()
+    assert breaker.retry_in() == 30
+    assert breaker.stats()['rejected'] == 1
+
+
+def test_circuit_breaker_half_open_probe(clock):
+    """
+    Test that an open circuit lets a single probe through after the recovery timeout.
+    """
+    breaker = CircuitBreaker(failure_threshold=1, recovery_timeout=30, clock=clock)
+    breaker.record_failure()
+    clock.now += 30
+    assert breaker.state == STATE_HALF_OPEN
+    assert breaker.allow()
+    assert not breaker.allow()
+
+    # A failed probe re-opens the circuit for another recovery period
+    breaker.record_failure()
+    assert breaker.state == STATE_OPEN
+    clock.now += 30
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == STATE_CLOSED
+    assert breaker.stats()['opened'] == 2
+
+
+def test_latency_tracker_adapts_timeout():
+    """
+    Test that the timeout follows the latency percentile, clamped to its bounds.
+    """
+    tracker = LatencyTracker(window=10, percentile=0.9, multiplier=2, min_timeout=0.5, max_timeout=10, min_samples=5)
+    for _ in range(4):
+        tracker.record(0.1)
+    assert tracker.timeout() == 10
+
+    tracker.record(0.2)
+    assert tracker.timeout() == 0.5
+    for _ in range(10):
+        tracker.record(1.5)
+    assert tracker.timeout() == 3.0
+    for _ in range(10):
+        tracker.record(30)
+    assert tracker.timeout() == 10
+
+
+def test_retry_policy_jittered_backoff():
+    """
+    Test that retry delays grow exponentially, are capped and stop after the retry budget.
+    """
+    policy = RetryPolicy(max_retries=4, base_delay=1, max_delay=5, rng=lambda: 0.5)
+    assert [policy.delay(retry) for retry in range(5)] == [0.5, 1.0, 2.0, 2.5, None]
+
+
+def test_provider_health_fails_fast_when_open(clock):
+    """
+    Test that requests are refused with an APIError while the circuit is open.
+    """
+    health = ProviderHealth("virus_total", failure_threshold=2, max_retries=5, clock=clock, sleep=clock.sleep,
+                            rng=lambda: 1.0)
+    health.before_request()
+    health.record_failure(10)
+    assert health.backoff(0)
+    health.record_failure(10)
+    assert not health.backoff(1)
+
+    with pytest.raises(APIError, match="Provider unavailable."):
+        health.before_request()
+    assert clock.sleeps == [0.5]
+    assert health.stats()['retries'] == 1
+
+
+def test_get_provider_health_is_shared():
+    """
+    Test that clients of the same provider share one health tracker.
+    """
+    first = get_provider_health("test_health_shared", {'failure_threshold': 2})
+    assert get_provider_health("test_health_shared", {'failure_threshold': 2}) is first
+    assert get_provider_health("test_health_shared", {'failure_threshold': 3}) is not first
+    assert get_provider_health("test_health_shared", None) is None
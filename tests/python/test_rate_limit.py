@@ -0,0 +1,146 @@
+#  IntelliSIEM Copyright 2024, Rob Perry
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import threading
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+
+import pytest
+
+from src.python.rate_limit import RateLimiter, get_rate_limiter, parse_retry_after
+
+
+def test_parse_retry_after_seconds():
+    """
+    Test parsing a Retry-After header given in seconds.
+    """
+    assert parse_retry_after("5") == 5.0
+    assert parse_retry_after("-3") == 0.0
+    assert parse_retry_after(None, default=2.0) == 2.0
+
+
+def test_parse_retry_after_http_date():
+    """
+    Test parsing a Retry-After header given as an HTTP date.
+    """
+    header = format_datetime(datetime.now(timezone.utc) + timedelta(seconds=30), usegmt=True)
+    assert 28 <= parse_retry_after(header) <= 30
+
+
+def test_parse_retry_after_invalid():
+    """
+    Test that an invalid Retry-After header falls back to the default.
+    """
+    assert parse_retry_after("soon", default=7.0) == 7.0
+
+
+def test_rate_limiter_spreads_requests(clock):
+    """
+    Test that requests beyond the burst are spaced evenly at the quota rate.
+    """
+    limiter = RateLimiter(requests_per_minute=60, burst=2, clock=clock, sleep=clock.sleep)
+
+    for _ in range(5):
+        limiter.acquire()
+
+    # The first two requests use the burst, then one request per second
+    assert clock.sleeps == [1.0, 1.0, 1.0]
+    assert limiter.stats()['acquired'] == 5
+
+
+def test_rate_limiter_refills_when_idle(clock):
+    """
+    Test that the bucket refills up to its burst size while idle.
+    """
+    limiter = RateLimiter(requests_per_minute=60, burst=3, clock=clock, sleep=clock.sleep)
+    for _ in range(3):
+        limiter.acquire()
+    clock.now += 10
+    for _ in range(3):
+        limiter.acquire()
+    assert clock.sleeps == []
+
+
+def test_rate_limiter_acquire_timeout(clock):
+    """
+    Test that acquire gives up without reserving a slot if the wait would exceed the timeout.
+    """
+    limiter = RateLimiter(requests_per_minute=6, clock=clock, sleep=clock.sleep)
+    assert limiter.acquire(timeout=0)
+    assert not limiter.acquire(timeout=5)
+    assert limiter.acquire(timeout=10)
+    assert clock.sleeps == [10.0]
+
+
+def test_rate_limiter_defer(clock):
+    """
+    Test that deferring holds back the next request until the Retry-After time.
+    """
+    limiter = RateLimiter(requests_per_minute=600, burst=5, clock=clock, sleep=clock.sleep)
+    limiter.defer(30)
+    limiter.acquire()
+    limiter.acquire()
+    # Requests resume at the quota rate rather than as a burst
+    assert clock.sleeps == pytest.approx([30.0, 0.1])
+    assert limiter.stats()['deferred'] == 1
+
+
+def test_rate_limiter_retry_delay():
+    """
+    Test that Retry-After delays beyond the configured maximum are not waited out.
+    """
+    limiter = RateLimiter(requests_per_minute=4, max_retry_after=60)
+    assert limiter.retry_delay("10") == 10.0
+    assert limiter.retry_delay(None) == 15.0
+    assert limiter.retry_delay("600") is None
+
+
+def test_rate_limiter_shared_across_threads(clock):
+    """
+    Test that concurrent callers each reserve a distinct slot.
+    """
+    lock = threading.Lock()
+    limiter = RateLimiter(requests_per_minute=60, clock=clock, sleep=lambda seconds: None)
+    delays = []
+
+    def worker():
+        delay = limiter._reserve(None)
+        with lock:
+            delays.append(delay)
+
+    threads = [threading.Thread(target=worker) for _ in range(10)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(delays) == [float(i) for i in range(10)]
+
+
+def test_get_rate_limiter():
+    """
+    Test that clients of the same provider share a limiter, and changed settings replace it.
+    """
+    settings = {'requests_per_minute': 4}
+    limiter = get_rate_limiter('test_provider', settings)
+    assert get_rate_limiter('test_provider', dict(settings)) is limiter
+    assert get_rate_limiter('test_provider', {'requests_per_minute': 8}) is not limiter
+    assert get_rate_limiter('test_provider', None) is None
+
+
+def test_rate_limiter_invalid_quota():
+    """
+    Test that a non-positive quota is rejected.
+    """
+    with pytest.raises(ValueError):
+        RateLimiter(requests_per_minute=0)
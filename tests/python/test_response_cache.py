@@ -0,0 +1,119 @@
+#  IntelliSIEM Copyright 2024, Rob Perry
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import pytest
+
+from src.python.response_cache import ResponseCache
+
+
+@pytest.fixture
+def cache(tmp_path, clock):
+    cache = ResponseCache(str(tmp_path / "cache.sqlite3"), max_bytes=100, clock=clock)
+    yield cache
+    cache.close()
+
+
+def test_key_ignores_parameter_order():
+    """
+    Test that cache keys depend on URL and parameters, but not on parameter order.
+    """
+    assert ResponseCache.key("https://a/x", {'a': 1, 'b': 2}) == ResponseCache.key("https://a/x", {'b': 2, 'a': 1})
+    assert ResponseCache.key("https://a/x", {'a': 1}) != ResponseCache.key("https://a/x", {'a': 2})
+    assert ResponseCache.key("https://a/x") != ResponseCache.key("https://a/y")
+
+
+def test_ttl_for(tmp_path):
+    """
+    Test per-endpoint TTL lookup, including glob patterns and the default.
+    """
+    cache = ResponseCache(str(tmp_path / "cache.sqlite3"), default_ttl=5,
+                          ttls={'indicators/export': 300, 'files*': 60})
+    assert cache.ttl_for('indicators/export') == 300
+    assert cache.ttl_for('files/abc') == 60
+    assert cache.ttl_for('other') == 5
+    cache.close()
+
+
+def test_put_and_get(cache, clock):
+    """
+    Test that a stored response is returned and is fresh until its TTL passes.
+    """
+    cache.put("k", b'[{"id": 1}]', etag='"v1"', ttl=10)
+    entry = cache.get("k")
+    assert entry.json() == [{'id': 1}]
+    assert entry.is_fresh(clock())
+    assert entry.conditional_headers() == {'If-None-Match': '"v1"'}
+    clock.now += 11
+    assert not cache.get("k").is_fresh(clock())
+
+
+def test_touch_extends_freshness(cache, clock):
+    """
+    Test that touching an entry after a 304 makes it fresh again.
+    """
+    cache.put("k", b'[]', last_modified="Wed, 21 Oct 2015 07:28:00 GMT", ttl=0)
+    assert not cache.get("k").is_fresh(clock())
+    cache.touch("k", 30)
+    assert cache.get("k").is_fresh(clock())
+
+
+def test_put_skips_unrevalidatable_responses(cache):
+    """
+    Test that responses with neither a TTL nor validators are not stored.
+    """
+    cache.put("k", b'[]')
+    assert cache.get("k") is None
+
+
+def test_lru_eviction(cache, clock):
+    """
+    Test that the least recently used entries are evicted once the size limit is exceeded.
+    """
+    body = b'x' * 40
+    cache.put("a", body, ttl=60)
+    clock.now += 1
+    cache.put("b", body, ttl=60)
+    clock.now += 1
+    cache.get("a")  # "a" is now more recently used than "b"
+    clock.now += 1
+    cache.put("c", body, ttl=60)
+
+    assert cache.get("b") is None
+    assert cache.get("a") is not None
+    assert cache.get("c") is not None
+    assert cache.stats()['evictions'] == 1
+    assert cache.stats()['size'] == 80
+
+
+def test_oversized_response_not_stored(cache):
+    """
+    Test that a body larger than the whole cache is not stored.
+    """
+    cache.put("big", b'x' * 101, ttl=60)
+    assert cache.get("big") is None
+
+
+def test_cache_persists_across_instances(tmp_path, clock):
+    """
+    Test that cached responses survive reopening the cache.
+    """
+    path = str(tmp_path / "cache.sqlite3")
+    cache = ResponseCache(path, clock=clock)
+    cache.put("k", b'[1]', etag='"v1"')
+    cache.close()
+
+    reopened = ResponseCache(path, clock=clock)
+    assert reopened.get("k").json() == [1]
+    assert reopened.stats()['size'] == 3
+    reopened.close()
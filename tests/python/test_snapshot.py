@@ -0,0 +1,222 @@
+#  IntelliSIEM Copyright 2024, Rob Perry
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import json
+import os
+import struct
+
+import pytest
+
+from src.python.data_collection import ThreatDataCollector
+from src.python.error_handling import DataError
+from src.python.indicator_store import IndicatorStore
+from src.python.indicators import Indicator, IndicatorSet
+from src.python.matching import IOCMatcher, MatchIndex
+from src.python.snapshot import HEADER, IndicatorSnapshot, main, write_snapshot
+
+INDICATORS = [
+    {'id': 'h1', 'type': 'FileHash-SHA256', 'indicator': 'AB' * 32},
+    {'id': 'vt1', 'type': 'file'},
+    {'id': 'ip1', 'type': 'IPv4', 'indicator': '203.0.113.7'},
+    {'id': 'ip6', 'type': 'IPv6', 'indicator': '2001:db8::1'},
+    {'id': 'net1', 'type': 'CIDR', 'indicator': '198.51.100.0/24'},
+    {'id': 'net2', 'type': 'CIDR', 'indicator': '198.51.0.0/16'},
+    {'id': 'd1', 'type': 'domain', 'indicator': 'evil.example'},
+    {'id': 'u1', 'type': 'URL', 'indicator': 'http://bad.example/payload'},
+    {'id': 'e1', 'type': 'email', 'indicator': 'x@example.com'},
+]
+
+EVENTS = [
+    {'sha256': 'ab' * 32, 'src_ip': '10.0.0.1'},
+    {'file_hash': 'vt1', 'dst_ip': '2001:DB8:0:0::1'},
+    {'src_ip': '198.51.100.9', 'dst_ip': '198.51.7.1', 'ip': '203.0.113.7'},
+    {'domain': 'www.Evil.Example.', 'host': 'good.example'},
+    {'url': 'http://bad.example/payload'},
+    {'md5': 'ff' * 16, 'query': 'example'},
+    {'sha256': 12345, 'src_ip': 3405803783, 'domain': ['evil.example'], 'url': None},
+]
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = IndicatorStore(str(tmp_path / "indicators.sqlite3"))
+    store.upsert_many(INDICATORS, 'alien_vault')
+    yield store
+    store.close()
+
+
+def test_snapshot_matches_like_match_index(tmp_path, store):
+    """
+    Test that a snapshot written from an IndicatorStore finds the same matches as a MatchIndex.
+    """
+    path = str(tmp_path / "indicators.snapshot")
+    assert write_snapshot(path, store.iter_all()) == len(INDICATORS)
+    with IndicatorSnapshot(path) as snapshot:
+        assert len(snapshot) == len(INDICATORS)
+        assert snapshot.match_batch(EVENTS) == MatchIndex(store.iter_all()).match_batch(EVENTS)
+
+
+def test_lookup_canonicalizes_observables(tmp_path, store):
+    """
+    Test that lookups find observables whatever their case or textual form, and return the indicator.
+    """
+    path = str(tmp_path / "indicators.snapshot")
+    write_snapshot(path, store.iter_all(), clock=lambda: 1000.0)
+    with IndicatorSnapshot(path) as snapshot:
+        indicator = snapshot.lookup('hash', 'AB' * 32)
+        assert (indicator.id, indicator.type, indicator.value) == ('h1', 'FileHash-SHA256', 'ab' * 32)
+        assert indicator.sources == ['alien_vault']
+        assert snapshot.lookup('ip', '2001:0db8::0001').id == 'ip6'
+        assert snapshot.lookup('domain', 'EVIL.example.').id == 'd1'
+        assert snapshot.lookup('email', 'x@example.com').id == 'e1'
+        assert snapshot.lookup('ip', '203.0.113.8') is None
+        assert snapshot.lookup('ip', 'not an address') is None
+        assert snapshot.created == 1000.0
+        assert sorted(indicator.id for indicator in snapshot) == sorted(entry['id'] for entry in INDICATORS)
+
+
+def test_duplicate_observables_are_merged(tmp_path):
+    """
+    Test that an observable reported by several sources is written once with every source.
+    """
+    indicators = IndicatorSet()
+    indicators.upsert_many([{'id': 'a', 'type': 'IPv4', 'indicator': '192.0.2.1', 'created': 100,
+                             'modified': 200, 'confidence': 0.25}], 'alien_vault')
+    indicators.upsert_many([{'id': 'b', 'type': 'ipv4', 'indicator': '192.0.2.1', 'created': 50,
+                             'modified': 150, 'confidence': 0.75}], 'virus_total')
+    path = str(tmp_path / "indicators.snapshot")
+    assert write_snapshot(path, indicators) == 1
+    with IndicatorSnapshot(path) as snapshot:
+        indicator = snapshot.lookup('ip', '192.0.2.1')
+        assert indicator == Indicator('a', 'IPv4', '192.0.2.1', 'alien_vault,virus_total', 50.0, 200.0, 0.75)
+
+
+def test_bloom_filter_rejects_most_absent_observables(tmp_path):
+    """
+    Test that the Bloom filter keeps its false positive rate and never rejects a present observable.
+    """
+    indicators = [Indicator(str(i), 'FileHash-MD5', f"{i:032x}", 'otx', 1.0, 1.0) for i in range(5000)]
+    path = str(tmp_path / "indicators.snapshot")
+    write_snapshot(path, indicators, false_positive_rate=0.01)
+    with IndicatorSnapshot(path) as snapshot:
+        assert all(snapshot.might_contain('hash', f"{i:032x}") for i in range(5000))
+        false_positives = sum(snapshot.might_contain('hash', f"{i:032x}") for i in range(5000, 25000))
+        assert false_positives < 20000 * 0.02
+        assert snapshot.lookup('hash', f"{4999:032x}").id == '4999'
+
+
+def test_empty_snapshot(tmp_path):
+    """
+    Test that a snapshot without indicators can be written and read.
+    """
+    path = str(tmp_path / "indicators.snapshot")
+    assert write_snapshot(path, []) == 0
+    with IndicatorSnapshot(path) as snapshot:
+        assert len(snapshot) == 0
+        assert snapshot.lookup('ip', '192.0.2.1') is None
+        assert snapshot.match_batch(EVENTS) == []
+
+
+def test_failed_write_leaves_no_temporary_file(tmp_path, mocker):
+    """
+    Test that a snapshot is written through a temporary file of its own that is removed if the write fails.
+    """
+    path = str(tmp_path / "indicators.snapshot")
+    write_snapshot(path, [])
+    assert os.listdir(tmp_path) == ["indicators.snapshot"]
+    assert os.stat(path).st_mode & 0o777 == 0o644
+
+    mocker.patch('src.python.snapshot.os.replace', side_effect=OSError("No space left on device"))
+    with pytest.raises(DataError, match="Cannot write snapshot."):
+        write_snapshot(path, [])
+    assert os.listdir(tmp_path) == ["indicators.snapshot"]
+
+
+def test_invalid_snapshots_are_rejected(tmp_path, store):
+    """
+    Test that missing, foreign, corrupt and newer snapshot files raise DataError.
+    """
+    path = tmp_path / "indicators.snapshot"
+    with pytest.raises(DataError, match="Cannot read snapshot."):
+        IndicatorSnapshot(str(path))
+    path.write_bytes(b'{"not": "a snapshot"}')
+    with pytest.raises(DataError, match="Invalid snapshot file."):
+        IndicatorSnapshot(str(path))
+
+    write_snapshot(str(path), store.iter_all())
+    data = bytearray(path.read_bytes())
+    data[-1] ^= 0xFF
+    path.write_bytes(bytes(data))
+    with pytest.raises(DataError, match="Invalid snapshot file."):
+        IndicatorSnapshot(str(path))
+    IndicatorSnapshot(str(path), verify=False).close()
+
+    struct.pack_into('<H', data, 4, 2)
+    path.write_bytes(bytes(data))
+    with pytest.raises(DataError, match="Unsupported snapshot version."):
+        IndicatorSnapshot(str(path))
+
+
+def test_readers_keep_their_snapshot_when_it_is_replaced(tmp_path, store):
+    """
+    Test that a new snapshot replaces the file atomically while mapped readers keep the previous one,
+    and that an IOCMatcher can swap between them.
+    """
+    path = str(tmp_path / "indicators.snapshot")
+    write_snapshot(path, store.iter_all())
+    matcher = IOCMatcher()
+    old = matcher.swap(IndicatorSnapshot(path))
+    write_snapshot(path, [Indicator('ip2', 'IPv4', '192.0.2.1', 'otx', 1.0, 1.0)])
+    assert not (tmp_path / "indicators.snapshot.tmp").exists()
+
+    assert [m.indicator_id for m in old.match_batch([{'src_ip': '203.0.113.7'}])] == ['ip1']
+    matcher.swap(IndicatorSnapshot(path))
+    assert matcher.generation == 2
+    assert matcher.match_batch([{'src_ip': '203.0.113.7'}]) == []
+    assert [m.indicator_id for m in matcher.match_batch([{'src_ip': '192.0.2.1'}])] == ['ip2']
+    old.close()
+    matcher.index.close()
+
+
+def test_header_layout(tmp_path):
+    """
+    Test that the header is a fixed 64 bytes and sections are 8-byte aligned.
+    """
+    path = tmp_path / "indicators.snapshot"
+    write_snapshot(str(path), [Indicator('d', 'domain', 'evil.example', 'otx', 1.0, 1.0)])
+    fields = HEADER.unpack_from(path.read_bytes())
+    assert HEADER.size == 64
+    assert fields[0] == b'ISNP' and fields[1] == 1 and fields[5] == 1
+    assert all(offset % 8 == 0 for offset in fields[7:10])
+
+
+def test_collector_builds_snapshot(tmp_path, mocker, capsys):
+    """
+    Test that the collector writes the collected indicators to the configured snapshot path, and that the
+    command line looks them up.
+    """
+    path = str(tmp_path / "indicators.snapshot")
+    collector = ThreatDataCollector(config={'snapshot': {'path': path, 'false_positive_rate': 0.001}})
+    indicators = IndicatorSet()
+    indicators.upsert_many(INDICATORS, 'alien_vault')
+    mocker.patch.object(collector, 'fetch_indicators', return_value=indicators)
+    assert collector.build_snapshot() == len(INDICATORS)
+    with IndicatorSnapshot(path) as snapshot:
+        assert snapshot.metadata['false_positive_rate'] == 0.001
+
+    assert main(['lookup', path, 'domain', 'evil.example', 'good.example']) == 0
+    lines = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert lines[0]['indicator']['id'] == 'd1'
+    assert lines[1]['indicator'] is None
+    assert main(['lookup', path, 'ip', '192.0.2.1']) == 1
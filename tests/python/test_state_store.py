@@ -0,0 +1,106 @@
+#  IntelliSIEM Copyright 2024, Rob Perry
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import os
+import threading
+import time
+
+import pytest
+
+from src.python.error_handling import DataError
+from src.python.state_store import StateStore
+
+
+def test_state_store_round_trip(tmp_path):
+    """
+    Test that saved state is loaded back by a new store.
+    """
+    path = str(tmp_path / "state" / "collector_state.json")
+    state = StateStore(path)
+    state.set("alien_vault", "2024-01-01T00:00:00+00:00")
+    state.set("virus_total", 42)
+    state.save()
+
+    reloaded = StateStore(path)
+    assert reloaded.get("alien_vault") == "2024-01-01T00:00:00+00:00"
+    assert reloaded.get("virus_total") == 42
+
+
+def test_state_store_missing_file(tmp_path):
+    """
+    Test that a missing state file starts an empty store.
+    """
+    state = StateStore(str(tmp_path / "missing.json"))
+    assert state.get("alien_vault") is None
+    assert state.get("alien_vault", "default") == "default"
+
+
+def test_state_store_delete(tmp_path):
+    """
+    Test that deleting a key removes it from the saved state.
+    """
+    path = str(tmp_path / "state.json")
+    state = StateStore(path)
+    state.set("alien_vault", 1)
+    state.delete("alien_vault")
+    state.save()
+    assert StateStore(path).get("alien_vault") is None
+
+
+def test_state_store_corrupt_file(tmp_path):
+    """
+    Test that a corrupt state file raises a DataError.
+    """
+    path = tmp_path / "state.json"
+    path.write_text("{not json")
+    with pytest.raises(DataError, match="Corrupt collector state."):
+        StateStore(str(path))
+
+
+def test_state_store_save_leaves_no_temporary_files(tmp_path):
+    """
+    Test that saving replaces the state file without leaving temporary files behind.
+    """
+    path = str(tmp_path / "state.json")
+    state = StateStore(path)
+    for i in range(3):
+        state.set("count", i)
+        state.save()
+    assert os.listdir(tmp_path) == ["state.json"]
+
+
+def test_state_store_saves_in_order(mocker, tmp_path):
+    """
+    Test that a save started while another is writing cannot be overtaken by the older snapshot.
+    """
+    path = str(tmp_path / "state.json")
+    state = StateStore(path)
+    replace = os.replace
+    threads = []
+
+    def slow_replace(source, target):
+        if not threads:
+            # Save a newer snapshot while this older one is still being written
+            state.set("count", 2)
+            threads.append(threading.Thread(target=state.save))
+            threads[0].start()
+            time.sleep(0.05)
+        replace(source, target)
+
+    mocker.patch('src.python.state_store.os.replace', side_effect=slow_replace)
+    state.set("count", 1)
+    state.save()
+    threads[0].join()
+
+    assert StateStore(path).get("count") == 2
@@ -0,0 +1,65 @@
+#  IntelliSIEM Copyright 2024, Rob Perry
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import pytest
+
+from src.python.error_handling import ConfigError
+from src.python.validation import Schema, CORRUPT_DATA, MISSING_KEYS, UNEXPECTED_TYPE
+
+SCHEMA = Schema({'id': {'required': True, 'types': ['str', 'int']}, 'type': {'types': ['str']}})
+
+
+def test_validate_batch_separates_valid_and_rejected():
+    """
+    Test that a batch is split into valid records and rejections with reasons, keeping order.
+    """
+    records = [{'id': 1}, "not a record", {'id': {'nested': True}}, {'value': 'x'}, {'id': 'b', 'type': 'IPv4'},
+               {'id': 'c', 'type': 7}]
+    result = SCHEMA.validate_batch(records)
+
+    assert result.valid == [{'id': 1}, {'id': 'b', 'type': 'IPv4'}]
+    assert [(r.error, r.reason) for r in result.rejected] == [
+        (UNEXPECTED_TYPE, "record is a str, not an object"),
+        (CORRUPT_DATA, "'id' has invalid type dict"),
+        (MISSING_KEYS, "missing required key 'id'"),
+        (CORRUPT_DATA, "'type' has invalid type int"),
+    ]
+    assert result.reject_ratio == pytest.approx(4 / 6)
+
+
+def test_validate_batch_empty():
+    """
+    Test that an empty batch has no rejections.
+    """
+    result = SCHEMA.validate_batch([])
+    assert result.valid == [] and result.rejected == []
+    assert result.reject_ratio == 0.0
+
+
+def test_check_single_record():
+    """
+    Test that check agrees with validate_batch for single records.
+    """
+    assert SCHEMA.check({'id': 'a'}) is None
+    assert SCHEMA.check({'id': 1.5}).error == CORRUPT_DATA
+    assert SCHEMA.check({}).error == MISSING_KEYS
+    assert SCHEMA.check([]).error == UNEXPECTED_TYPE
+
+
+def test_unknown_type_name():
+    """
+    Test that a schema with an unknown type name raises a ConfigError.
+    """
+    with pytest.raises(ConfigError, match="Invalid validation schema."):
+        Schema({'id': {'types': ['uuid']}})